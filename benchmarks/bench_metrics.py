@@ -0,0 +1,53 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Compare the cost of recording measurements with rotel.metrics and the
+# OpenTelemetry metrics SDK. Neither exports during the run.
+#
+#   python benchmarks/bench_metrics.py
+
+from __future__ import annotations
+
+import os
+import sys
+import timeit
+
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from opentelemetry.sdk.metrics import MeterProvider  # noqa: E402
+from opentelemetry.sdk.metrics.export import InMemoryMetricReader  # noqa: E402
+
+from rotel import metrics  # noqa: E402
+
+
+N = 200_000
+ATTRS = {"http.route": "/checkout", "http.response.status_code": 200}
+
+
+def bench(label: str, fn) -> None:
+    best = min(timeit.repeat(fn, number=N, repeat=5)) / N
+    print(f"{label:<40} {best * 1e9:8.0f} ns/op")
+
+
+def main() -> None:
+    provider = MeterProvider(metric_readers=[InMemoryMetricReader()])
+    sdk_meter = provider.get_meter("bench")
+    sdk_counter = sdk_meter.create_counter("requests")
+    sdk_histogram = sdk_meter.create_histogram("duration")
+
+    meter = metrics.get_meter("bench")
+    counter = meter.counter("requests")
+    bound_counter = counter.bind(ATTRS)
+    histogram = meter.histogram("duration")
+    bound_histogram = histogram.bind(ATTRS)
+
+    bench("sdk counter.add", lambda: sdk_counter.add(1, ATTRS))
+    bench("rotel counter.add", lambda: counter.add(1, ATTRS))
+    bench("rotel bound counter.add", lambda: bound_counter.add(1))
+    bench("sdk histogram.record", lambda: sdk_histogram.record(12.5, ATTRS))
+    bench("rotel histogram.record", lambda: histogram.record(12.5, ATTRS))
+    bench("rotel bound histogram.record", lambda: bound_histogram.record(12.5))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Measure what rotel adds to process startup: importing the package, importing
+# the client, and each phase of Client.startup_report(). Imports are timed in
+# fresh interpreters, since a second import in the same process is free. The
+# agent is only spawned when the rotel-agent binary is installed.
+#
+#   python benchmarks/bench_startup.py
+
+from __future__ import annotations
+
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+
+SRC = os.path.join(os.path.dirname(__file__), "..", "src")
+sys.path.insert(0, SRC)
+
+RUNS = 20
+# what rotel may add to the boot of a CLI tool or serverless handler, without the agent
+BUDGET_MS = 5.0
+
+IMPORT = """
+import time
+begin = time.perf_counter()
+{statement}
+print((time.perf_counter() - begin) * 1000.0)
+"""
+
+
+def fresh_import(statement: str) -> float:
+    """Best time in milliseconds of running statement in a new interpreter"""
+    env = dict(os.environ, PYTHONPATH=SRC)
+    times = []
+    for _ in range(RUNS):
+        out = subprocess.run(
+            [sys.executable, "-c", IMPORT.format(statement=statement)],
+            env=env, capture_output=True, check=True, text=True,
+        )
+        times.append(float(out.stdout))
+    return min(times)
+
+
+def report(label: str, ms: float | None) -> None:
+    print(f"{label:<40} {'-' if ms is None else f'{ms:8.3f}':>8} ms")
+
+
+def main() -> None:
+    import_ms = fresh_import("import rotel")
+    client_ms = fresh_import("import rotel; rotel.Rotel")
+    report("import rotel", import_ms)
+    report("import rotel + client", client_ms)
+
+    from rotel.agent import agent
+    from rotel.client import Client
+
+    with tempfile.TemporaryDirectory() as tmp:
+        options = {"enabled": True, "pid_file": os.path.join(tmp, "rotel-agent.pid"),
+                   "log_file": os.path.join(tmp, "rotel-agent.log")}
+        best: dict[str, float] = {}
+        for _ in range(RUNS):
+            phases = Client(**options).startup_report()
+            for phase in ("env", "validate"):
+                best[phase] = min(best.get(phase, phases[phase]), phases[phase])
+        report("options from env", best["env"])
+        report("validation", best["validate"])
+
+        spawned = None
+        if os.path.isfile(agent.agent_path):
+            client = Client(**options)
+            client.start()
+            deadline = time.monotonic() + 5
+            while client.startup_report()["ready"] is None and time.monotonic() < deadline:
+                time.sleep(0.01)
+            spawned = client.startup_report()
+            client.stop()
+            for phase in ("build_env", "spawn", "ready"):
+                report(phase, spawned[phase])
+        else:
+            print("rotel-agent is not installed, skipping build_env, spawn and ready")
+
+    total = client_ms + best["env"] + best["validate"]
+    print(f"\nin-process cost {total:.3f} ms, budget {BUDGET_MS:.1f} ms: {'ok' if total <= BUDGET_MS else 'OVER'}")
+    if spawned is not None:
+        print(f"agent ready after {spawned['total']:.3f} ms")
+
+
+if __name__ == "__main__":
+    main()
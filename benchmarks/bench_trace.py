@@ -0,0 +1,63 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Compare the cost of creating and ending spans with rotel.trace and the
+# OpenTelemetry tracing SDK. Neither exports during the run.
+#
+#   python benchmarks/bench_trace.py
+
+from __future__ import annotations
+
+import os
+import sys
+import timeit
+
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+
+from opentelemetry.sdk.trace import TracerProvider  # noqa: E402
+
+from rotel import trace  # noqa: E402
+
+
+N = 100_000
+ATTRS = {"http.route": "/checkout", "http.response.status_code": 200}
+
+
+def bench(label: str, fn) -> None:
+    best = min(timeit.repeat(fn, number=N, repeat=5)) / N
+    print(f"{label:<40} {best * 1e9:8.0f} ns/op")
+
+
+def main() -> None:
+    # no span processor, the SDK spans are created and ended but not exported
+    sdk_tracer = TracerProvider().get_tracer("bench")
+    tracer = trace.get_tracer("bench")
+    # finished spans go back to the pool without being exported
+    trace._exporter.finish = trace._release
+
+    def sdk_span():
+        with sdk_tracer.start_as_current_span("work", attributes=ATTRS):
+            pass
+
+    def rotel_span():
+        with tracer.start_span("work", ATTRS):
+            pass
+
+    def sdk_nested():
+        with sdk_tracer.start_as_current_span("outer"):
+            with sdk_tracer.start_as_current_span("inner", attributes=ATTRS):
+                pass
+
+    def rotel_nested():
+        with tracer.start_span("outer"):
+            with tracer.start_span("inner", ATTRS):
+                pass
+
+    bench("sdk start_as_current_span", sdk_span)
+    bench("rotel start_span", rotel_span)
+    bench("sdk nested spans", sdk_nested)
+    bench("rotel nested spans", rotel_nested)
+
+
+if __name__ == "__main__":
+    main()
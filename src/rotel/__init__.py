@@ -2,15 +2,52 @@
 
 from __future__ import annotations
 
-from .client import Client as Rotel
-from .config import Config, OTLPExporter, OTLPExporterEndpoint  # noqa: F401
+import sys
+import time
 
 
+_import_begin = time.perf_counter()
+
+__all__ = ["Config", "OTLPExporter", "OTLPExporterEndpoint", "Rotel", "start", "stop"]
+
+# seconds spent importing rotel, reported by Client.startup_report()
+_import_seconds = 0.0
+
+
+def _load(name: str):
+    # Client and Config pull in the agent and all option types, so they are only
+    # imported when first used
+    global _import_seconds
+    if name in globals():
+        return globals()[name]
+    begin = time.perf_counter()
+    if name == "Rotel":
+        from .client import Client as value
+    else:
+        from . import config
+
+        value = getattr(config, name)
+    globals()[name] = value
+    _import_seconds += time.perf_counter() - begin
+    return value
+
+def __getattr__(name: str):
+    if name in ("Rotel", "Config", "OTLPExporter", "OTLPExporterEndpoint"):
+        return _load(name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
 def start() -> None:
-    cl = Rotel()
+    cl = _load("Rotel")()
     cl.start()
 
 def stop() -> None:
-    cl = Rotel.get()
+    client = sys.modules.get(f"{__name__}.client")
+    if client is None:
+        # no client was created
+        return
+    cl = client.Client.get()
     if cl is not None:
         cl.stop()
+
+
+_import_seconds += time.perf_counter() - _import_begin
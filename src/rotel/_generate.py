@@ -0,0 +1,56 @@
+# SPDX-License-Identifier: Apache-2.0
+
+from __future__ import annotations
+
+import hashlib
+import os
+import stat
+import tempfile
+
+
+def processors_dir() -> str:
+    """Directory of this user's generated processor modules, private to the user"""
+    user = os.getuid() if hasattr(os, "getuid") else os.environ.get("USERNAME", "user")
+    return os.path.join(tempfile.gettempdir(), f"rotel-processors-{user}")
+
+def _private_dir(directory: str) -> None:
+    # The agent executes the modules found here, another user must not be able
+    # to create the directory first or add files to it
+    try:
+        os.mkdir(directory, 0o700)
+    except FileExistsError:
+        pass
+    st = os.lstat(directory)
+    if not stat.S_ISDIR(st.st_mode):
+        raise PermissionError(f"{directory} is not a directory")
+    if hasattr(os, "getuid"):
+        if st.st_uid != os.getuid():
+            raise PermissionError(f"{directory} is owned by another user")
+        if st.st_mode & 0o077:
+            raise PermissionError(f"{directory} is accessible by other users, expected mode 0700")
+
+def write_module(prefix: str, source: str, directory: str | None = None) -> str:
+    """Write a generated processor module and return its path
+
+    The file name is derived from the source, so every process generating the
+    same module shares a single file. The file is written on every call rather
+    than trusted when it exists. Without directory the modules go to a
+    directory only the current user can access."""
+    digest = hashlib.sha256(source.encode("utf-8")).hexdigest()[:16]
+    if directory is None:
+        directory = processors_dir()
+        _private_dir(directory)
+    else:
+        os.makedirs(directory, exist_ok=True)
+
+    path = os.path.join(directory, f"{prefix}_{digest}.py")
+    # write then rename so the agent never loads a partial file
+    fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as file:
+            file.write(source)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
+    return path
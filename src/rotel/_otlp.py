@@ -0,0 +1,543 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Minimal OTLP/HTTP protobuf encoding and transport to the local agent.
+#
+# The in-process signal handlers (logging, metrics, traces) send their data
+# straight to the agent's OTLP HTTP receiver. Encoding the handful of messages
+# they need by hand avoids depending on protobuf and the OpenTelemetry SDK, and
+# lets callers encode directly from their own compact representations.
+
+from __future__ import annotations
+
+import http.client
+import os
+import struct
+import time
+from collections.abc import Iterable, Mapping
+from typing import Any
+
+from . import exports
+
+
+DEFAULT_HTTP_ENDPOINT = "localhost:4318"
+# request size limit of the senders without a limit from the exporters, the agent's gRPC receive limit
+DEFAULT_BATCH_BYTES = 4 * 1024 * 1024
+
+# OTLP/HTTP paths
+LOGS_PATH = "/v1/logs"
+METRICS_PATH = "/v1/metrics"
+TRACES_PATH = "/v1/traces"
+
+_WIRE_VARINT = 0
+_WIRE_FIXED64 = 1
+_WIRE_LEN = 2
+_WIRE_FIXED32 = 5
+
+_pack_double = struct.Struct("<d").pack
+_pack_fixed64 = struct.Struct("<Q").pack
+_pack_fixed32 = struct.Struct("<I").pack
+
+
+#
+# Wire format
+#
+
+def varint(value: int) -> bytes:
+    if value < 0:
+        # int64 values are encoded as ten byte two's complement
+        value += 1 << 64
+    if value < 0x80:
+        return bytes((value,))
+    out = bytearray()
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+def tag(field: int, wire_type: int) -> bytes:
+    return varint((field << 3) | wire_type)
+
+def field_varint(field: int, value: int) -> bytes:
+    return tag(field, _WIRE_VARINT) + varint(value)
+
+def field_fixed64(field: int, value: int) -> bytes:
+    return tag(field, _WIRE_FIXED64) + _pack_fixed64(value & 0xFFFFFFFFFFFFFFFF)
+
+def field_fixed32(field: int, value: int) -> bytes:
+    return tag(field, _WIRE_FIXED32) + _pack_fixed32(value)
+
+def field_double(field: int, value: float) -> bytes:
+    return tag(field, _WIRE_FIXED64) + _pack_double(value)
+
+def field_bytes(field: int, value: bytes) -> bytes:
+    return tag(field, _WIRE_LEN) + varint(len(value)) + value
+
+def field_string(field: int, value: str) -> bytes:
+    return field_bytes(field, value.encode("utf-8"))
+
+def packed_fixed64(field: int, values: Iterable[int]) -> bytes:
+    return field_bytes(field, b"".join(_pack_fixed64(v) for v in values))
+
+def packed_double(field: int, values: Iterable[float]) -> bytes:
+    return field_bytes(field, b"".join(_pack_double(v) for v in values))
+
+
+#
+# opentelemetry.proto.common.v1
+#
+
+def any_value(value: Any) -> bytes:
+    if isinstance(value, str):
+        return field_string(1, value)
+    if isinstance(value, bool):
+        return field_varint(2, int(value))
+    if isinstance(value, int):
+        return field_varint(3, value)
+    if isinstance(value, float):
+        return field_double(4, value)
+    if isinstance(value, (bytes, bytearray)):
+        return field_bytes(7, bytes(value))
+    if isinstance(value, (list, tuple)):
+        return field_bytes(5, b"".join(field_bytes(1, any_value(v)) for v in value))
+    if isinstance(value, Mapping):
+        return field_bytes(6, attributes(1, value))
+    return field_string(1, str(value))
+
+def key_value(key: str, value: Any) -> bytes:
+    return field_string(1, key) + field_bytes(2, any_value(value))
+
+def attributes(field: int, attrs: Mapping[str, Any] | Iterable[tuple[str, Any]]) -> bytes:
+    """Encode attributes as repeated KeyValue in field"""
+    items = attrs.items() if isinstance(attrs, Mapping) else attrs
+    return b"".join(field_bytes(field, key_value(k, v)) for k, v in items if v is not None)
+
+def resource(attrs: Mapping[str, Any]) -> bytes:
+    return attributes(1, attrs)
+
+def scope(name: str, version: str | None = None) -> bytes:
+    out = field_string(1, name)
+    if version:
+        out += field_string(2, version)
+    return out
+
+
+#
+# opentelemetry.proto.logs.v1
+#
+
+def log_record(
+    time_unix_nano: int,
+    severity_number: int,
+    severity_text: str | None,
+    body: Any,
+    attrs: Mapping[str, Any] | None = None,
+    trace_id: bytes | None = None,
+    span_id: bytes | None = None,
+    flags: int = 0,
+    observed_time_unix_nano: int | None = None,
+) -> bytes:
+    out = field_fixed64(1, time_unix_nano) + field_varint(2, severity_number)
+    if severity_text:
+        out += field_string(3, severity_text)
+    if body is not None:
+        out += field_bytes(5, any_value(body))
+    if attrs:
+        out += attributes(6, attrs)
+    if flags:
+        out += field_fixed32(8, flags)
+    if trace_id:
+        out += field_bytes(9, trace_id)
+    if span_id:
+        out += field_bytes(10, span_id)
+    out += field_fixed64(11, observed_time_unix_nano or time_unix_nano)
+    return out
+
+def logs_request(resource_attrs: bytes, scopes: Iterable[tuple[bytes, Iterable[bytes]]]) -> bytes:
+    """Encode an ExportLogsServiceRequest from an encoded resource and (scope, records) pairs"""
+    scope_logs = b"".join(
+        field_bytes(2, field_bytes(1, encoded_scope) + b"".join(field_bytes(2, r) for r in records))
+        for encoded_scope, records in scopes
+    )
+    return field_bytes(1, field_bytes(1, resource_attrs) + scope_logs)
+
+
+#
+# opentelemetry.proto.metrics.v1
+#
+
+TEMPORALITY_DELTA = 1
+TEMPORALITY_CUMULATIVE = 2
+
+def number_data_point(attrs: bytes, start_time_unix_nano: int, time_unix_nano: int, value: float) -> bytes:
+    """Encode a NumberDataPoint, attrs are KeyValues encoded in field 7"""
+    return field_fixed64(2, start_time_unix_nano) + field_fixed64(3, time_unix_nano) + field_double(4, value) + attrs
+
+def histogram_data_point(
+    attrs: bytes,
+    start_time_unix_nano: int,
+    time_unix_nano: int,
+    bucket_counts: Iterable[int],
+    explicit_bounds: Iterable[float],
+    total: float,
+    minimum: float | None = None,
+    maximum: float | None = None,
+) -> bytes:
+    """Encode a HistogramDataPoint, attrs are KeyValues encoded in field 9"""
+    bucket_counts = list(bucket_counts)
+    out = field_fixed64(2, start_time_unix_nano) + field_fixed64(3, time_unix_nano)
+    out += field_fixed64(4, sum(bucket_counts)) + field_double(5, total)
+    out += packed_fixed64(6, bucket_counts) + packed_double(7, explicit_bounds) + attrs
+    if minimum is not None:
+        out += field_double(11, minimum)
+    if maximum is not None:
+        out += field_double(12, maximum)
+    return out
+
+def _metric(name: str, description: str | None, unit: str | None) -> bytes:
+    out = field_string(1, name)
+    if description:
+        out += field_string(2, description)
+    if unit:
+        out += field_string(3, unit)
+    return out
+
+def gauge_metric(name: str, description: str | None, unit: str | None, points: Iterable[bytes]) -> bytes:
+    return _metric(name, description, unit) + field_bytes(5, b"".join(field_bytes(1, p) for p in points))
+
+def sum_metric(
+    name: str,
+    description: str | None,
+    unit: str | None,
+    points: Iterable[bytes],
+    monotonic: bool,
+    temporality: int = TEMPORALITY_CUMULATIVE,
+) -> bytes:
+    data = b"".join(field_bytes(1, p) for p in points) + field_varint(2, temporality)
+    if monotonic:
+        data += field_varint(3, 1)
+    return _metric(name, description, unit) + field_bytes(7, data)
+
+def histogram_metric(
+    name: str,
+    description: str | None,
+    unit: str | None,
+    points: Iterable[bytes],
+    temporality: int = TEMPORALITY_CUMULATIVE,
+) -> bytes:
+    data = b"".join(field_bytes(1, p) for p in points) + field_varint(2, temporality)
+    return _metric(name, description, unit) + field_bytes(9, data)
+
+def metrics_request(resource_attrs: bytes, scopes: Iterable[tuple[bytes, Iterable[bytes]]]) -> bytes:
+    """Encode an ExportMetricsServiceRequest from an encoded resource and (scope, metrics) pairs"""
+    scope_metrics = b"".join(
+        field_bytes(2, field_bytes(1, encoded_scope) + b"".join(field_bytes(2, m) for m in metrics))
+        for encoded_scope, metrics in scopes
+    )
+    return field_bytes(1, field_bytes(1, resource_attrs) + scope_metrics)
+
+
+#
+# opentelemetry.proto.trace.v1
+#
+
+STATUS_UNSET = 0
+STATUS_OK = 1
+STATUS_ERROR = 2
+
+def span_event(time_unix_nano: int, name: str, attrs: Mapping[str, Any] | Iterable[tuple[str, Any]] | None) -> bytes:
+    out = field_fixed64(1, time_unix_nano) + field_string(2, name)
+    if attrs:
+        out += attributes(3, attrs)
+    return out
+
+def span(
+    trace_id: bytes,
+    span_id: bytes,
+    parent_span_id: bytes | None,
+    name: str,
+    kind: int,
+    start_time_unix_nano: int,
+    end_time_unix_nano: int,
+    attrs: Mapping[str, Any] | Iterable[tuple[str, Any]] | None = None,
+    events: Iterable[bytes] | None = None,
+    status_code: int = STATUS_UNSET,
+    status_message: str | None = None,
+    trace_state: str | None = None,
+    flags: int = 0,
+) -> bytes:
+    """Encode a Span, events are encoded with span_event()"""
+    out = field_bytes(1, trace_id) + field_bytes(2, span_id)
+    if trace_state:
+        out += field_string(3, trace_state)
+    if parent_span_id:
+        out += field_bytes(4, parent_span_id)
+    out += field_string(5, name) + field_varint(6, kind)
+    out += field_fixed64(7, start_time_unix_nano) + field_fixed64(8, end_time_unix_nano)
+    if attrs:
+        out += attributes(9, attrs)
+    if events:
+        out += b"".join(field_bytes(11, e) for e in events)
+    if status_code or status_message:
+        status = field_string(2, status_message) if status_message else b""
+        if status_code:
+            status += field_varint(3, status_code)
+        out += field_bytes(15, status)
+    if flags:
+        out += field_fixed32(16, flags)
+    return out
+
+def traces_request(resource_attrs: bytes, scopes: Iterable[tuple[bytes, Iterable[bytes]]]) -> bytes:
+    """Encode an ExportTraceServiceRequest from an encoded resource and (scope, spans) pairs"""
+    scope_spans = b"".join(
+        field_bytes(2, field_bytes(1, encoded_scope) + b"".join(field_bytes(2, s) for s in spans))
+        for encoded_scope, spans in scopes
+    )
+    return field_bytes(1, field_bytes(1, resource_attrs) + scope_spans)
+
+
+# most bytes a field adds around its value: a tag and a five byte length
+_FIELD_OVERHEAD = 6
+
+def split_request(
+    resource_attrs: bytes, items: list[tuple[bytes, bytes]], max_bytes: int, stats: dict[str, int], item: str,
+) -> list[tuple[list[tuple[bytes, list[bytes]]], int]]:
+    """Group encoded (scope, item) pairs into requests of at most max_bytes
+
+    Returns (scopes, count) for each request, scopes being the (scope, items)
+    pairs traces_request() and the like take. Each request beyond the first
+    counts in stats["batch_splits"]. Items too large for a request of their
+    own are left out and counted in stats[f"{item}_oversize"]."""
+    envelope = len(resource_attrs) + 3 * _FIELD_OVERHEAD
+    requests = []
+    scopes: dict[bytes, list[bytes]] = {}
+    size = envelope
+    count = 0
+    for encoded_scope, encoded in items:
+        cost = len(encoded) + _FIELD_OVERHEAD
+        if encoded_scope not in scopes:
+            cost += len(encoded_scope) + 2 * _FIELD_OVERHEAD
+        if envelope + len(encoded_scope) + 2 * _FIELD_OVERHEAD + len(encoded) + _FIELD_OVERHEAD > max_bytes:
+            stats[f"{item}_oversize"] += 1
+            continue
+        if count and size + cost > max_bytes:
+            requests.append((list(scopes.items()), count))
+            scopes = {}
+            size = envelope
+            count = 0
+            cost = len(encoded) + len(encoded_scope) + 3 * _FIELD_OVERHEAD
+        scopes.setdefault(encoded_scope, []).append(encoded)
+        size += cost
+        count += 1
+    if count:
+        requests.append((list(scopes.items()), count))
+    if len(requests) > 1:
+        stats["batch_splits"] += len(requests) - 1
+    return requests
+
+
+#
+# Resource and transport
+#
+
+def default_resource_attributes() -> dict[str, str]:
+    """Resource attributes from the standard OTEL_* environment variables"""
+    attrs = {
+        "telemetry.sdk.name": "rotel",
+        "telemetry.sdk.language": "python",
+    }
+    for pair in (os.environ.get("OTEL_RESOURCE_ATTRIBUTES") or "").split(","):
+        key, sep, value = pair.partition("=")
+        if sep and key.strip():
+            attrs[key.strip()] = value.strip()
+    service_name = os.environ.get("OTEL_SERVICE_NAME")
+    if service_name:
+        attrs["service.name"] = service_name
+    attrs.setdefault("service.name", "unknown_service")
+    return attrs
+
+def agent_http_endpoint(signal: str | None = None) -> str:
+    """host:port of the OTLP HTTP receiver of the agent started by this process
+
+    With agent groups, of the group receiving signal."""
+    from .client import Client
+
+    endpoint = None
+    client = Client.get()
+    if client is not None:
+        endpoint = client.endpoint(signal)
+    return _host_port(endpoint or os.environ.get("ROTEL_OTLP_HTTP_ENDPOINT") or DEFAULT_HTTP_ENDPOINT)
+
+def agent_trace_endpoints() -> list[str] | None:
+    """host:port of the OTLP HTTP receivers of all agent pool members when spans are routed by trace id"""
+    from .client import Client
+
+    client = Client.get()
+    if client is None or not client.config.trace_affinity():
+        return None
+    return [_host_port(endpoint) for endpoint in client.endpoints()]
+
+def agent_batch_bytes(signal: str | None = None) -> int:
+    """Largest request body the senders post to the agent for signal
+
+    Derived from the exporters of the agent started by this process, see
+    Client.batch_max_bytes(). The agent merges these requests into export
+    batches by count, so the limit does not bound what it exports."""
+    from .client import Client
+
+    client = Client.get()
+    limit = client.batch_max_bytes(signal) if client is not None else None
+    return limit or DEFAULT_BATCH_BYTES
+
+def _host_port(endpoint: str) -> str:
+    endpoint = endpoint.removeprefix("http://")
+    host, _, port = endpoint.rpartition(":")
+    if host in ("", "0.0.0.0", "[::]"):
+        host = "127.0.0.1"
+    return f"{host}:{port}"
+
+
+_PATH_SIGNALS = {TRACES_PATH: "traces", METRICS_PATH: "metrics", LOGS_PATH: "logs"}
+
+
+# OTLP/HTTP statuses telling the client to back off, RESOURCE_EXHAUSTED and UNAVAILABLE
+THROTTLED_STATUSES = frozenset((429, 502, 503, 504))
+
+
+class AgentHealth:
+    """Outcome of the requests of all in-process senders to the agent"""
+
+    def __init__(self):
+        self.ok = 0
+        self.throttled = 0
+        self.failed = 0
+        # smoothed request latency in seconds
+        self.latency = 0.0
+
+    def record(self, status: int | None, latency: float) -> None:
+        """Record a response status, None if the request failed without one"""
+        if status is not None and 200 <= status < 300:
+            self.ok += 1
+        elif status in THROTTLED_STATUSES:
+            self.throttled += 1
+        else:
+            self.failed += 1
+        self.latency = latency if not self.latency else 0.8 * self.latency + 0.2 * latency
+
+
+agent_health = AgentHealth()
+
+
+def _read_varint(data: bytes, pos: int) -> tuple[int, int]:
+    value = shift = 0
+    while True:
+        byte = data[pos]
+        pos += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, pos
+        shift += 7
+
+
+def _fields(data: bytes) -> Iterable[tuple[int, int | bytes]]:
+    # (field number, value) of a protobuf message, fixed width fields are skipped
+    pos = 0
+    while pos < len(data):
+        key, pos = _read_varint(data, pos)
+        wire_type = key & 0x7
+        if wire_type == _WIRE_VARINT:
+            value, pos = _read_varint(data, pos)
+            yield key >> 3, value
+        elif wire_type == _WIRE_LEN:
+            size, pos = _read_varint(data, pos)
+            yield key >> 3, data[pos:pos + size]
+            pos += size
+        elif wire_type == _WIRE_FIXED64:
+            pos += 8
+        elif wire_type == _WIRE_FIXED32:
+            pos += 4
+        else:
+            raise ValueError(f"unsupported wire type {wire_type}")
+
+
+def data_points(request: bytes) -> int:
+    """Data points of an encoded ExportMetricsServiceRequest"""
+    count = 0
+    for field, resource_metrics in _fields(memoryview(request)):
+        if field != 1:
+            continue
+        for field, scope_metrics in _fields(resource_metrics):
+            if field != 2:
+                continue
+            for field, metric in _fields(scope_metrics):
+                if field != 2:
+                    continue
+                for field, data in _fields(metric):
+                    # gauge, sum, histogram, exponential histogram and summary
+                    if field in (5, 7, 9, 10, 11):
+                        count += sum(1 for inner, _ in _fields(data) if inner == 1)
+    return count
+
+
+def rejected_items(response: bytes) -> int:
+    """Items rejected by an OTLP partial success, from an Export*ServiceResponse body"""
+    try:
+        for field, value in _fields(response):
+            if field == 1 and isinstance(value, bytes):
+                # rejected_spans, rejected_data_points or rejected_log_records
+                for inner, count in _fields(value):
+                    if inner == 1 and isinstance(count, int):
+                        return count
+    except (IndexError, ValueError):
+        pass
+    return 0
+
+
+class AgentConnection:
+    """Keep-alive OTLP/HTTP protobuf connection to the agent
+
+    Not thread safe, each sender thread owns its connection."""
+
+    def __init__(self, endpoint: str | None = None, timeout: float = 5.0):
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self._conn: http.client.HTTPConnection | None = None
+
+    def post(self, path: str, body: bytes, items: int = 0, signal: str | None = None) -> bool:
+        """Send body with items items to the agent, recorded in rotel.exports
+
+        signal defaults to the signal of path."""
+        signal = signal or _PATH_SIGNALS.get(path, path)
+        start = time.monotonic()
+        retries = 0
+        while True:
+            reused = self._conn is not None
+            try:
+                if self._conn is None:
+                    host, _, port = (self.endpoint or agent_http_endpoint(_PATH_SIGNALS.get(path))).rpartition(":")
+                    self._conn = http.client.HTTPConnection(host, int(port), timeout=self.timeout)
+                self._conn.request("POST", path, body, {"Content-Type": "application/x-protobuf"})
+                resp = self._conn.getresponse()
+                response = resp.read()
+                latency = time.monotonic() - start
+                agent_health.record(resp.status, latency)
+                ok = 200 <= resp.status < 300
+                exports.record_send(
+                    signal, len(body), items, latency, ok, retries,
+                    rejected_items(response) if ok and response else 0,
+                )
+                return ok
+            except (OSError, http.client.HTTPException):
+                self.close()
+                # the agent may have closed an idle kept alive connection, retry that once
+                if not reused:
+                    latency = time.monotonic() - start
+                    agent_health.record(None, latency)
+                    exports.record_send(signal, len(body), items, latency, False, retries)
+                    return False
+                retries += 1
+
+    def close(self) -> None:
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
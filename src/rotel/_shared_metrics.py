@@ -0,0 +1,480 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Cross-process aggregation of rotel.metrics through shared memory.
+#
+# Every process (for example each forked web server worker) keeps recording
+# into its own in-process arrays. Instead of exporting them, its exporter thread
+# publishes the cumulative totals into the process's own row of a shared memory
+# segment, so no two processes ever write the same memory. One process holds the
+# aggregator lease, it sums the rows of all workers and exports a single copy of
+# every series to the agent. When the lease holder dies another process takes
+# over the lease, and a row left by a dead worker is taken over by a new worker
+# as the starting point of its own totals, so cumulative values never go down.
+#
+# Segment layout:
+#
+#   header      magic, sizes, counters, aggregator lease
+#   workers     max_workers x (pid, heartbeat)
+#   directory   max_entries x (fingerprint, descriptor offset and length, value offset, stride)
+#   heap        JSON descriptors of the series: scope, name, kind, unit, bounds, attributes
+#   values      max_workers rows of capacity doubles
+#
+# Series are added to the directory under an flock, which is only taken the
+# first time a process publishes a series. No worker removes the segment when
+# it exits, not even the one that created it: Client.stop() unlinks it in the
+# process that started the agent.
+
+from __future__ import annotations
+
+import fcntl
+import hashlib
+import json
+import math
+import os
+import struct
+import sys
+import tempfile
+import time
+from array import array
+from multiprocessing import resource_tracker, shared_memory
+from typing import TYPE_CHECKING
+
+from . import _otlp
+
+
+if TYPE_CHECKING:
+    from .metrics import _Instrument
+
+
+DEFAULT_MAX_WORKERS = 64
+DEFAULT_CAPACITY = 16_384
+DEFAULT_MAX_ENTRIES = 8_192
+DEFAULT_HEAP_SIZE = 1 << 20
+
+_MAGIC = 0x524F5431 # ROT1
+_LAYOUT_VERSION = 1
+
+# magic, version, max_workers, max_entries, capacity, heap_size, n_entries, heap_used, values_used,
+# aggregator pid, aggregator heartbeat, start time
+_HEADER = struct.Struct("<IIIIIIIIIxxxxQdQ")
+# fields updated in place, each process only writes the fields it owns or holds the flock for
+_N_ENTRIES = (24, struct.Struct("<III")) # n_entries, heap_used, values_used
+_AGGREGATOR = (40, struct.Struct("<Qd")) # pid, heartbeat
+_WORKER = struct.Struct("<Qd")
+_ENTRY = struct.Struct("<QIIII")
+
+_KIND_STRIDE = {"counter": 1, "up_down_counter": 1, "gauge": 2}
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+class SharedMetrics:
+    def __init__(
+        self,
+        name: str,
+        max_workers: int = DEFAULT_MAX_WORKERS,
+        capacity: int = DEFAULT_CAPACITY,
+        max_entries: int = DEFAULT_MAX_ENTRIES,
+        heap_size: int = DEFAULT_HEAP_SIZE,
+    ):
+        self.name = name
+        self._lock_path = os.path.join(tempfile.gettempdir(), f"{name}.lock")
+        self._lock_file = open(self._lock_path, "a+b")
+
+        size = _HEADER.size + max_workers * _WORKER.size + max_entries * _ENTRY.size + heap_size
+        size = (size + 7) // 8 * 8 + max_workers * capacity * 8
+        with self._locked():
+            try:
+                self.shm = _open(name, create=True, size=size)
+                self.owner = True
+                _HEADER.pack_into(
+                    self.shm.buf, 0, _MAGIC, _LAYOUT_VERSION, max_workers, max_entries, capacity, heap_size,
+                    0, 0, 0, 0, 0.0, time.time_ns(),
+                )
+            except FileExistsError:
+                self.shm = _open(name)
+                self.owner = False
+
+        header = _HEADER.unpack_from(self.shm.buf, 0)
+        if header[0] != _MAGIC or header[1] != _LAYOUT_VERSION:
+            raise ValueError(f"shared memory segment {name} is not a rotel metrics segment")
+        self.max_workers, self.max_entries, self.capacity, self.heap_size = header[2:6]
+        self.start_time = header[11]
+
+        self._workers_off = _HEADER.size
+        self._entries_off = self._workers_off + self.max_workers * _WORKER.size
+        self._heap_off = self._entries_off + self.max_entries * _ENTRY.size
+        values_off = (self._heap_off + self.heap_size + 7) // 8 * 8
+        self._values = self.shm.buf[values_off:values_off + self.max_workers * self.capacity * 8].cast("d")
+
+        self._row: int | None = None
+        self._baseline: array | None = None
+        # (instrument id, local series index) -> value offset, None if the directory is full
+        self._offsets: dict[tuple[int, int], int | None] = {}
+        # fingerprint -> (value offset, stride) of the entries read so far
+        self._directory: dict[int, tuple[int, int]] = {}
+        self._directory_seen = 0
+        self._descriptors: dict[int, dict] = {}
+        self._gauges: dict[tuple[int, int], tuple[float, float]] = {}
+
+        self.stats = {"publishes": 0, "series_dropped": 0, "aggregations": 0}
+
+    #
+    # Locking and header access
+    #
+
+    def _locked(self):
+        return _FileLock(self._lock_file)
+
+    def _header(self) -> tuple:
+        return _HEADER.unpack_from(self.shm.buf, 0)
+
+    def _set_field(self, field: tuple[int, struct.Struct], *values) -> None:
+        offset, fmt = field
+        fmt.pack_into(self.shm.buf, offset, *values)
+
+    def _worker(self, row: int) -> tuple[int, float]:
+        return _WORKER.unpack_from(self.shm.buf, self._workers_off + row * _WORKER.size)
+
+    def _set_worker(self, row: int, pid: int, heartbeat: float) -> None:
+        _WORKER.pack_into(self.shm.buf, self._workers_off + row * _WORKER.size, pid, heartbeat)
+
+    def _row_values(self, row: int) -> memoryview:
+        return self._values[row * self.capacity:(row + 1) * self.capacity]
+
+    #
+    # Worker rows
+    #
+
+    def _acquire_row(self) -> int | None:
+        pid = os.getpid()
+        with self._locked():
+            free = dead = None
+            for row in range(self.max_workers):
+                worker_pid, heartbeat = self._worker(row)
+                if worker_pid == 0 and heartbeat == 0.0:
+                    if free is None:
+                        free = row
+                elif dead is None and (worker_pid == 0 or not _pid_alive(worker_pid)):
+                    dead = row
+            # reuse the rows of dead workers first, their totals become our baseline
+            row = dead if dead is not None else free
+            if row is None:
+                return None
+            self._baseline = array("d", self._row_values(row))
+            self._set_worker(row, pid, time.time())
+        self._row = row
+        return row
+
+    def release(self) -> None:
+        """Give up the row, its totals stay as the baseline of its next owner"""
+        if self._row is not None:
+            with self._locked():
+                self._set_worker(self._row, 0, time.time())
+            self._row = None
+
+    #
+    # Directory
+    #
+
+    def _refresh_directory(self) -> None:
+        n = self._header()[6]
+        for i in range(self._directory_seen, n):
+            fingerprint, _, _, value_off, stride = _ENTRY.unpack_from(self.shm.buf, self._entries_off + i * _ENTRY.size)
+            self._directory[fingerprint] = (value_off, stride)
+        self._directory_seen = n
+
+    def _offset(self, descriptor: dict) -> int | None:
+        encoded = json.dumps(descriptor, sort_keys=True, separators=(",", ":")).encode("utf-8")
+        fingerprint = int.from_bytes(hashlib.blake2b(encoded, digest_size=8).digest(), "little")
+        self._refresh_directory()
+        found = self._directory.get(fingerprint)
+        if found is not None:
+            return found[0]
+
+        stride = _stride(descriptor)
+        with self._locked():
+            self._refresh_directory()
+            found = self._directory.get(fingerprint)
+            if found is not None:
+                return found[0]
+            header = self._header()
+            n, heap_used, values_used = header[6:9]
+            if n >= self.max_entries or heap_used + len(encoded) > self.heap_size \
+                    or values_used + stride > self.capacity:
+                return None
+            heap_pos = self._heap_off + heap_used
+            self.shm.buf[heap_pos:heap_pos + len(encoded)] = encoded
+            _ENTRY.pack_into(
+                self.shm.buf, self._entries_off + n * _ENTRY.size,
+                fingerprint, heap_used, len(encoded), values_used, stride,
+            )
+            # publish the entry last, readers only look at the first n_entries
+            self._set_field(_N_ENTRIES, n + 1, heap_used + len(encoded), values_used + stride)
+            self._refresh_directory()
+        return values_used
+
+    #
+    # Publishing
+    #
+
+    def publish(self, instruments: list[_Instrument]) -> bool:
+        """Write this process's cumulative totals into its row"""
+        if self._row is None and self._acquire_row() is None:
+            return False
+        now = time.time()
+        out = array("d", self._baseline)
+        for instrument in instruments:
+            kind = instrument.kind
+            if kind == "gauge":
+                totals = array("d", instrument._base)
+            else:
+                totals = instrument._totals()
+            stride = instrument.stride
+            for i, attr_set in enumerate(list(instrument._series)):
+                off = self._series_offset(instrument, i, attr_set)
+                if off is None:
+                    continue
+                local = totals[i * stride:(i + 1) * stride]
+                if not local:
+                    continue
+                if kind == "gauge":
+                    self._publish_gauge(out, off, (id(instrument), i), local[0], now)
+                elif kind == "histogram":
+                    _add_histogram(out, off, local, len(instrument.bounds) + 1)
+                else:
+                    out[off] += local[0]
+        self._row_values(self._row)[:] = out
+        self._set_worker(self._row, os.getpid(), now)
+        self.stats["publishes"] += 1
+        return True
+
+    def _publish_gauge(self, out: array, off: int, key: tuple[int, int], value: float, now: float) -> None:
+        if math.isnan(value):
+            return
+        # (value, time it was first published), so the newest value of all workers wins
+        previous = self._gauges.get(key)
+        if previous is None or previous[0] != value:
+            previous = self._gauges[key] = (value, now)
+        out[off] = value
+        out[off + 1] = previous[1]
+
+    def _series_offset(self, instrument: _Instrument, i: int, attr_set) -> int | None:
+        key = id(instrument), i
+        if key in self._offsets:
+            return self._offsets[key]
+        meter = instrument.meter
+        descriptor = {
+            "scope": meter.name,
+            "version": meter.version,
+            "name": instrument.name,
+            "kind": instrument.kind,
+            "unit": instrument.unit,
+            "description": instrument.description,
+            "bounds": list(getattr(instrument, "bounds", [])),
+            "attributes": [list(kv) for kv in attr_set.items],
+        }
+        off = self._offset(descriptor)
+        if off is None:
+            self.stats["series_dropped"] += 1
+        self._offsets[key] = off
+        return off
+
+    #
+    # Aggregation
+    #
+
+    def try_lease(self, stale_after: float) -> bool:
+        """Take or renew the aggregator lease, return True if this process holds it"""
+        pid = os.getpid()
+        now = time.time()
+        header = self._header()
+        holder, heartbeat = header[9], header[10]
+        if holder == pid:
+            self._set_field(_AGGREGATOR, pid, now)
+            return True
+        if holder != 0 and _pid_alive(holder) and now - heartbeat < stale_after:
+            return False
+        with self._locked():
+            header = self._header()
+            holder, heartbeat = header[9], header[10]
+            if holder not in (0, pid) and _pid_alive(holder) and now - heartbeat < stale_after:
+                return False
+            self._set_field(_AGGREGATOR, pid, now)
+        return True
+
+    def release_lease(self) -> None:
+        with self._locked():
+            if self._header()[9] == os.getpid():
+                self._set_field(_AGGREGATOR, 0, 0.0)
+
+    def _entries(self) -> list[tuple[dict, int, int]]:
+        n = self._header()[6]
+        entries = []
+        for i in range(n):
+            _, desc_off, desc_len, value_off, stride = _ENTRY.unpack_from(self.shm.buf, self._entries_off + i * _ENTRY.size)
+            descriptor = self._descriptors.get(desc_off)
+            if descriptor is None:
+                pos = self._heap_off + desc_off
+                descriptor = self._descriptors[desc_off] = json.loads(bytes(self.shm.buf[pos:pos + desc_len]))
+            entries.append((descriptor, value_off, stride))
+        return entries
+
+    def encode(self, resource: bytes) -> bytes | None:
+        """Merge the rows of all workers into an ExportMetricsServiceRequest"""
+        rows = [
+            self._row_values(row) for row in range(self.max_workers)
+            if self._worker(row) != (0, 0.0)
+        ]
+        now = time.time_ns()
+        # (scope, version) -> metric name -> (descriptor, points)
+        scopes: dict[tuple, dict[str, tuple[dict, list[bytes]]]] = {}
+        for descriptor, off, stride in self._entries():
+            point = self._merge(descriptor, rows, off, stride, now)
+            if point is None:
+                continue
+            metrics = scopes.setdefault((descriptor["scope"], descriptor["version"]), {})
+            metrics.setdefault(descriptor["name"], (descriptor, []))[1].append(point)
+
+        encoded_scopes = []
+        for (scope_name, version), metrics in scopes.items():
+            encoded = []
+            for name, (descriptor, points) in metrics.items():
+                kind, unit, description = descriptor["kind"], descriptor["unit"], descriptor["description"]
+                if kind == "histogram":
+                    encoded.append(_otlp.histogram_metric(name, description, unit, points))
+                elif kind == "gauge":
+                    encoded.append(_otlp.gauge_metric(name, description, unit, points))
+                else:
+                    encoded.append(_otlp.sum_metric(name, description, unit, points, kind == "counter"))
+            encoded_scopes.append((_otlp.scope(scope_name, version), encoded))
+        self.stats["aggregations"] += 1
+        if not encoded_scopes:
+            return None
+        return _otlp.metrics_request(resource, encoded_scopes)
+
+    def _merge(self, descriptor: dict, rows: list[memoryview], off: int, stride: int, now: int) -> bytes | None:
+        kind = descriptor["kind"]
+        if kind == "histogram":
+            attrs = _otlp.attributes(9, [tuple(kv) for kv in descriptor["attributes"]])
+            nb = len(descriptor["bounds"]) + 1
+            counts = [0] * nb
+            total = 0.0
+            minimum, maximum = math.inf, -math.inf
+            for row in rows:
+                row_counts = row[off:off + nb]
+                if not any(row_counts):
+                    continue
+                for j, c in enumerate(row_counts):
+                    counts[j] += int(c)
+                total += row[off + nb]
+                minimum = min(minimum, row[off + nb + 1])
+                maximum = max(maximum, row[off + nb + 2])
+            if not any(counts):
+                return None
+            return _otlp.histogram_data_point(
+                attrs, self.start_time, now, counts, descriptor["bounds"], total, minimum, maximum,
+            )
+
+        attrs = _otlp.attributes(7, [tuple(kv) for kv in descriptor["attributes"]])
+        if kind == "gauge":
+            # the most recently set value of any worker
+            latest = max(rows, key=lambda row: row[off + 1], default=None)
+            if latest is None or latest[off + 1] == 0.0:
+                return None
+            return _otlp.number_data_point(attrs, self.start_time, now, latest[off])
+        return _otlp.number_data_point(attrs, self.start_time, now, sum(row[off] for row in rows))
+
+    #
+    # Lifecycle
+    #
+
+    def after_fork(self) -> None:
+        # The child gets its own row and lock file description, flocks are
+        # shared with the parent otherwise.
+        self._row = None
+        self._baseline = None
+        self._gauges = {}
+        self._offsets = {}
+        self._lock_file.close()
+        self._lock_file = open(self._lock_path, "a+b")
+        self.owner = False
+
+    def close(self) -> None:
+        # the segment outlives this process, the other workers keep using it
+        # until unlink() from the process that started the agent
+        self.release()
+        self._values.release()
+        self.shm.close()
+
+
+class _FileLock:
+    def __init__(self, file):
+        self.file = file
+
+    def __enter__(self):
+        fcntl.flock(self.file.fileno(), fcntl.LOCK_EX)
+        return self
+
+    def __exit__(self, *exc):
+        fcntl.flock(self.file.fileno(), fcntl.LOCK_UN)
+
+
+def _add_histogram(out: array, off: int, local: array, nb: int) -> None:
+    # buckets and sum add up, min and max only count for rows with measurements
+    if not any(local[:nb]):
+        return
+    had_values = any(out[off:off + nb])
+    for j in range(nb + 1):
+        out[off + j] += local[j]
+    if had_values:
+        out[off + nb + 1] = min(out[off + nb + 1], local[nb + 1])
+        out[off + nb + 2] = max(out[off + nb + 2], local[nb + 2])
+    else:
+        out[off + nb + 1] = local[nb + 1]
+        out[off + nb + 2] = local[nb + 2]
+
+
+def _stride(descriptor: dict) -> int:
+    kind = descriptor["kind"]
+    if kind == "histogram":
+        return len(descriptor["bounds"]) + 4
+    return _KIND_STRIDE[kind]
+
+
+def _open(name: str, create: bool = False, size: int = 0) -> shared_memory.SharedMemory:
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name, create=create, size=size, track=False)
+    shm = shared_memory.SharedMemory(name, create=create, size=size)
+    # Before 3.13 creating or attaching registers the segment with the resource
+    # tracker, which would unlink it when this process exits.
+    resource_tracker.unregister(shm._name, "shared_memory")
+    return shm
+
+
+def unlink(name: str) -> None:
+    """Remove the segment name, processes still attached keep their mapping"""
+    try:
+        if sys.version_info >= (3, 13):
+            shm = shared_memory.SharedMemory(name, track=False)
+        else:
+            # registered here, unregistered again by unlink()
+            shm = shared_memory.SharedMemory(name)
+    except FileNotFoundError:
+        return
+    shm.close()
+    shm.unlink()
+
+
+def segment_name(pid_file: str | None) -> str:
+    """Segment name for the agent using pid_file, so agent groups don't share series"""
+    digest = hashlib.sha256((pid_file or "").encode("utf-8")).hexdigest()[:12]
+    return f"rotel-metrics-{digest}"
@@ -4,23 +4,40 @@ from __future__ import annotations
 
 import os
 import signal
-import subprocess
 import time
-from dataclasses import dataclass
-from pathlib import Path
 
 from .config import Config
 
 
-@dataclass
+PKG_PATH = os.path.dirname(os.path.abspath(__file__))
+
+
 class Agent:
-    pkg_path: Path = Path(__file__).parent
-    agent_path: Path = pkg_path / "rotel-agent"
-    running: bool = False
-    pid_file: str = None
+    def __init__(
+        self,
+        pkg_path: str = PKG_PATH,
+        agent_path: str = os.path.join(PKG_PATH, "rotel-agent"),
+        running: bool = False,
+        pid_file: str | None = None,
+    ):
+        self.pkg_path = pkg_path
+        self.agent_path = agent_path
+        self.running = running
+        self.pid_file = pid_file
+        # seconds spent in each phase of the last start()
+        self.timings: dict[str, float] = {}
+
+    def __repr__(self) -> str:
+        return f"Agent(agent_path={self.agent_path!r}, running={self.running!r}, pid_file={self.pid_file!r})"
 
     def start(self, config: Config) -> bool:
+        # only needed once an agent is spawned
+        import subprocess
+
+        begin = time.perf_counter()
         agent_env = config.build_agent_environment()
+        spawn = time.perf_counter()
+        self.timings = {"build_env": spawn - begin}
 
         p = subprocess.Popen(
             [self.agent_path, "start", "--daemon"],
@@ -34,6 +51,8 @@ class Agent:
             p.kill()
             outs, errs = p.communicate()
         ret_code = p.returncode
+        # the agent daemonizes, so this covers its startup up to the fork
+        self.timings["spawn"] = time.perf_counter() - spawn
         if ret_code != 0:
             out = outs.decode("utf-8").strip()
             err = errs.decode("utf-8").strip()
@@ -72,5 +91,30 @@ class Agent:
                 pass # In multi-worker configs, the process may have already terminated
             except FileNotFoundError:
                 print("Unable to locate agent pid file")
+        self.running = False
+
+    def pid(self) -> int | None:
+        """Process id from the pid file of the started agent"""
+        if self.pid_file is None:
+            return None
+        try:
+            with open(self.pid_file) as file:
+                return int(file.readline())
+        except (OSError, ValueError):
+            return None
+
+    def status(self) -> dict:
+        pid = self.pid() if self.running else None
+        alive = False
+        if pid is not None:
+            try:
+                os.kill(pid, 0)
+                alive = True
+            except ProcessLookupError:
+                pass
+            except PermissionError:
+                # exists but owned by someone else, the pid was recycled
+                pass
+        return {"running": self.running, "pid": pid, "alive": alive, "pid_file": self.pid_file}
 
 agent = Agent()
@@ -0,0 +1,722 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# asyncio-native senders.
+#
+# The senders of rotel.trace, rotel.metrics and rotel.logging each drain their
+# queue from a background thread doing blocking I/O, which competes for the GIL
+# with an application running an event loop. The classes here send from tasks
+# on a loop instead, over non-blocking connections to the agent: the
+# application's loop, or a loop running in one shared thread when there is none.
+#
+# AsyncBatchProcessor is the common part: a bounded queue that never blocks
+# the producer, drained in batches by a task that encodes them and posts them
+# to the agent. When the loop shuts down, asyncio.run() cancels the task, which
+# then sends what is queued before exiting. install() switches rotel.trace and
+# rotel.metrics to it, AsyncRotelHandler is the logging handler, and
+# AsyncSpanProcessor replaces the BatchSpanProcessor of the OpenTelemetry SDK.
+#
+# The processors started before a fork are reset in the child, like the
+# threaded senders, and start again on its loop.
+
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures
+import threading
+import time
+import traceback
+from collections import deque
+from collections.abc import Callable, Sequence
+from typing import Any
+
+from . import _otlp, exports
+from . import logging as rotel_logging
+from . import metrics as rotel_metrics
+from . import trace as rotel_trace
+from .lanes import LaneQueue, sdk_span_lane
+from .pool import member_index
+
+
+DEFAULT_CAPACITY = 8192
+DEFAULT_BATCH_SIZE = 512
+DEFAULT_FLUSH_INTERVAL = 1.0
+# seconds the final drain may take when the loop shuts down
+DRAIN_TIMEOUT = 5.0
+
+
+class AsyncAgentConnection:
+    """Keep-alive OTLP/HTTP protobuf connection to the agent using asyncio streams
+
+    Use it from one task at a time."""
+
+    def __init__(self, endpoint: str | None = None, timeout: float = 5.0):
+        self.endpoint = endpoint
+        self.timeout = timeout
+        self._reader: asyncio.StreamReader | None = None
+        self._writer: asyncio.StreamWriter | None = None
+        self._host = ""
+
+    async def post(self, path: str, body: bytes, items: int = 0, signal: str | None = None) -> bool:
+        """Send body with items items to the agent, recorded in rotel.exports
+
+        signal defaults to the signal of path."""
+        signal = signal or _otlp._PATH_SIGNALS.get(path, path)
+        start = time.monotonic()
+        retries = 0
+        while True:
+            reused = self._writer is not None
+            try:
+                if self._writer is None:
+                    endpoint = self.endpoint or _otlp.agent_http_endpoint(_otlp._PATH_SIGNALS.get(path))
+                    self._host, _, port = endpoint.rpartition(":")
+                    self._reader, self._writer = await _timeout(
+                        asyncio.open_connection(self._host, int(port)), self.timeout,
+                    )
+                self._writer.write(
+                    f"POST {path} HTTP/1.1\r\nHost: {self._host}\r\nContent-Type: application/x-protobuf\r\n"
+                    f"Content-Length: {len(body)}\r\n\r\n".encode("ascii") + body
+                )
+                await self._writer.drain()
+                status, response = await _timeout(self._read_response(), self.timeout)
+                latency = time.monotonic() - start
+                _otlp.agent_health.record(status, latency)
+                ok = 200 <= status < 300
+                exports.record_send(
+                    signal, len(body), items, latency, ok, retries,
+                    _otlp.rejected_items(response) if ok and response else 0,
+                )
+                return ok
+            except (OSError, ValueError, asyncio.TimeoutError, asyncio.IncompleteReadError):
+                await self.close()
+                # the agent may have closed an idle kept alive connection, retry that once
+                if not reused:
+                    latency = time.monotonic() - start
+                    _otlp.agent_health.record(None, latency)
+                    exports.record_send(signal, len(body), items, latency, False, retries)
+                    return False
+                retries += 1
+
+    async def _read_response(self) -> tuple[int, bytes]:
+        reader = self._reader
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("connection closed by the agent")
+        version, status = status_line.split(b" ", 2)[:2]
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip().lower()
+        connection = headers.get("connection")
+        keep_alive = connection != "close" and (version == b"HTTP/1.1" or connection == "keep-alive")
+        body = b""
+        if headers.get("transfer-encoding") == "chunked":
+            while True:
+                size = int((await reader.readline()).split(b";")[0], 16)
+                body += (await reader.readexactly(size + 2))[:size]
+                if size == 0:
+                    break
+        elif "content-length" in headers:
+            body = await reader.readexactly(int(headers["content-length"]))
+        elif not keep_alive:
+            # the body ends with the connection
+            body = await reader.read()
+        if not keep_alive:
+            await self.close()
+        return int(status), body
+
+    async def close(self) -> None:
+        writer = self._writer
+        self._reader = self._writer = None
+        if writer is not None:
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+
+_loop_lock = threading.Lock()
+_loop: asyncio.AbstractEventLoop | None = None
+
+
+def loop_thread() -> asyncio.AbstractEventLoop:
+    """Event loop running in a daemon thread, shared by the processors started without a loop"""
+    global _loop
+    with _loop_lock:
+        if _loop is None or _loop.is_closed():
+            _loop = asyncio.new_event_loop()
+            threading.Thread(target=_loop.run_forever, name="rotel-aio", daemon=True).start()
+        return _loop
+
+
+def _resolve_loop(loop: asyncio.AbstractEventLoop | None) -> asyncio.AbstractEventLoop:
+    if loop is not None:
+        return loop
+    try:
+        return asyncio.get_running_loop()
+    except RuntimeError:
+        return loop_thread()
+
+
+def _spawn(loop: asyncio.AbstractEventLoop, coro: Any) -> asyncio.Future | concurrent.futures.Future:
+    # A task created right away is cancelled and awaited by asyncio.run() like the application's own tasks
+    try:
+        running = asyncio.get_running_loop()
+    except RuntimeError:
+        running = None
+    if running is loop:
+        return loop.create_task(coro)
+    return asyncio.run_coroutine_threadsafe(coro, loop)
+
+
+async def _timeout(aw: Any, timeout: float) -> Any:
+    # asyncio.wait_for() before 3.12 loses a cancellation arriving as aw completes,
+    # the drain on loop shutdown would then never run
+    if hasattr(asyncio, "timeout"):
+        async with asyncio.timeout(timeout):
+            return await aw
+    return await asyncio.wait_for(aw, timeout)
+
+
+async def _sleep(event: asyncio.Event, timeout: float) -> None:
+    # until event is set or timeout seconds have passed
+    timer = asyncio.get_running_loop().call_later(timeout, event.set)
+    try:
+        await event.wait()
+    finally:
+        timer.cancel()
+
+
+async def _wait(future: asyncio.Future | concurrent.futures.Future) -> None:
+    # until the task of a processor has ended, whether it finished or was cancelled
+    await asyncio.wait([asyncio.wrap_future(future)])
+
+
+class AsyncBatchProcessor:
+    """Bounded queue drained in batches by a task on an event loop
+
+    put() may be called from any thread and never blocks, items are dropped
+    and counted when the queue is full, or with lanes items of lower lanes
+    make room for them (rotel.lanes). encode(batch) turns each batch into
+    request bodies, with the number of items in each, that are posted to path
+    on the agent. Keep the bodies within _otlp.agent_batch_bytes(), see
+    _otlp.split_request(). Statistics are counted per item, named after item
+    ("spans_sent", ...)."""
+
+    def __init__(
+        self,
+        encode: Callable[[list[Any]], list[tuple[bytes, int]]],
+        path: str,
+        item: str = "items",
+        capacity: int = DEFAULT_CAPACITY,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+        endpoint: str | None = None,
+        loop: asyncio.AbstractEventLoop | None = None,
+        lanes: Sequence[tuple[str, int]] | None = None,
+        classify: Callable[[Any], str] | None = None,
+    ):
+        self.encode = encode
+        self.path = path
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.endpoint = endpoint
+        self.loop = loop
+        self._item = item
+        # priority lanes chosen by classify(item), see rotel.lanes
+        self.lanes = tuple(lanes) if lanes else None
+        self.classify = classify
+        self._closed = False
+        self._start_lock = threading.Lock()
+        self._future: asyncio.Future | concurrent.futures.Future | None = None
+        self._wakeup: asyncio.Event | None = None
+        self._wake_pending = False
+        self._send_lock: asyncio.Lock | None = None
+        # requests of the batch being sent and their connection, left over when sending it was cancelled
+        self._unsent: deque[tuple[bytes, int, AsyncAgentConnection]] = deque()
+        self._conn = AsyncAgentConnection(endpoint)
+        self.stats = dict.fromkeys(
+            (f"{item}_sent", f"{item}_dropped", f"{item}_failed", f"{item}_oversize", "batches_sent", "batch_splits",
+             "export_errors"), 0,
+        )
+        self._queue = self._new_queue()
+
+    def _new_queue(self) -> deque[Any] | LaneQueue:
+        return LaneQueue(self.lanes, self.stats, self._item) if self.lanes is not None else deque()
+
+    def put(self, item: Any) -> bool:
+        """Queue item, False when it was dropped"""
+        queue = self._queue
+        lane = queue.lane(self.classify(item) if self.classify else "") if self.lanes is not None else None
+        if len(queue) >= self.capacity or self._closed:
+            self.stats[f"{self._item}_dropped"] += 1
+            # with lanes, make room by dropping from the lowest lane first
+            if lane is None or self._closed or queue.evict(lane) is None:
+                if lane is not None:
+                    queue.reject(lane)
+                return False
+        if self._future is None:
+            self.start()
+        if lane is None:
+            queue.append(item)
+        else:
+            queue.put(item, lane)
+        if len(queue) >= self.batch_size:
+            self.wakeup()
+        return True
+
+    def wakeup(self) -> None:
+        """Have the task send the queued items now"""
+        if not self._wake_pending and self._wakeup is not None and self.loop is not None:
+            self._wake_pending = True
+            try:
+                self.loop.call_soon_threadsafe(self._wakeup.set)
+            except RuntimeError:
+                # the loop is closed
+                pass
+
+    def start(self) -> None:
+        with self._start_lock:
+            if self._future is None:
+                self.loop = _resolve_loop(self.loop)
+                self._wakeup = asyncio.Event()
+                self._send_lock = asyncio.Lock()
+                self._future = _spawn(self.loop, self._run())
+
+    async def _run(self) -> None:
+        try:
+            while not self._closed:
+                await _sleep(self._wakeup, self.flush_interval)
+                self._wakeup.clear()
+                self._wake_pending = False
+                await self._drain()
+        except asyncio.CancelledError:
+            # the loop is shutting down, send what is queued before the task ends
+            self._closed = True
+            # a request cut short leaves the connection unusable
+            await self._close()
+            try:
+                await _timeout(self._drain(), DRAIN_TIMEOUT)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                await self._close()
+            raise
+        await self._drain()
+        await self._close()
+
+    async def _close(self) -> None:
+        await self._conn.close()
+
+    async def _drain(self) -> None:
+        async with self._send_lock:
+            await self._post_unsent()
+            queue = self._queue
+            while queue:
+                batch = []
+                try:
+                    for _ in range(self.batch_size):
+                        batch.append(queue.popleft())
+                except IndexError:
+                    pass
+                await self._send(batch)
+
+    def _route(self, batch: list[Any]) -> list[tuple[AsyncAgentConnection, list[Any]]]:
+        # connection posting each part of batch
+        return [(self._conn, batch)]
+
+    async def _send(self, batch: list[Any]) -> None:
+        start = time.perf_counter()
+        try:
+            for conn, part in self._route(batch):
+                self._unsent.extend((body, count, conn) for body, count in self.encode(part))
+            exports.record_encode(_otlp._PATH_SIGNALS.get(self.path, self.path), time.perf_counter() - start)
+        except Exception:
+            traceback.print_exc()
+            self.stats[f"{self._item}_failed"] += len(batch)
+            return
+        await self._post_unsent()
+
+    async def _post_unsent(self) -> None:
+        unsent = self._unsent
+        while unsent:
+            body, count, conn = unsent[0]
+            # a request cut short by cancellation stays queued for the final drain
+            ok = await conn.post(self.path, body, count)
+            unsent.popleft()
+            if ok:
+                self.stats[f"{self._item}_sent"] += count
+                self.stats["batches_sent"] += 1
+            else:
+                self.stats[f"{self._item}_failed"] += count
+                self.stats["export_errors"] += 1
+
+    async def flush(self) -> None:
+        """Send the queued items, call it on the processor's loop"""
+        if self._send_lock is not None:
+            await self._drain()
+
+    async def shutdown(self) -> None:
+        """Send the queued items and stop the task, call it on the processor's loop"""
+        self._closed = True
+        future = self._future
+        if future is None:
+            return
+        self._wakeup.set()
+        await _wait(future)
+
+    def _call(self, coro_fn: Callable[[], Any], timeout: float) -> bool:
+        loop = self.loop
+        if self._future is None or loop is None or loop.is_closed():
+            return True
+        future = _spawn(loop, coro_fn())
+        if not isinstance(future, concurrent.futures.Future):
+            # waiting here would block the loop, the task runs once the caller yields
+            return False
+        try:
+            future.result(timeout)
+            return True
+        except (concurrent.futures.TimeoutError, concurrent.futures.CancelledError):
+            return False
+
+    def flush_sync(self, timeout: float = 5.0) -> bool:
+        """flush() from another thread, waiting up to timeout seconds"""
+        return self._call(self.flush, timeout)
+
+    def shutdown_sync(self, timeout: float = 5.0) -> bool:
+        """shutdown() from another thread, waiting up to timeout seconds"""
+        self._closed = True
+        return self._call(self.shutdown, timeout)
+
+    def after_fork(self) -> None:
+        # Items queued before the fork belong to the parent, which sends them.
+        # A loop thread does not survive the fork, the next start picks a loop again.
+        self._queue = self._new_queue()
+        self._closed = False
+        self._start_lock = threading.Lock()
+        self._future = None
+        self._wakeup = None
+        self._wake_pending = False
+        self._send_lock = None
+        self._unsent = deque()
+        self._conn = AsyncAgentConnection(self.endpoint)
+        if self.loop is _loop:
+            self.loop = None
+
+
+class _SpanBatchProcessor(AsyncBatchProcessor):
+    # Sends the spans of a trace to one agent pool member, like the rotel.trace sender
+    _member_conns: list[AsyncAgentConnection] | None = None
+
+    def _route(self, batch: list[Any]) -> list[tuple[AsyncAgentConnection, list[Any]]]:
+        if self.endpoint is None and self._member_conns is None:
+            endpoints = _otlp.agent_trace_endpoints()
+            if endpoints:
+                self._member_conns = [AsyncAgentConnection(endpoint) for endpoint in endpoints]
+        if not self._member_conns:
+            return [(self._conn, batch)]
+        size = len(self._member_conns)
+        parts: dict[int, list[Any]] = {}
+        for span in batch:
+            parts.setdefault(member_index(span.trace_id, size), []).append(span)
+        return [(self._member_conns[index], part) for index, part in parts.items()]
+
+    async def _close(self) -> None:
+        await super()._close()
+        for conn in self._member_conns or ():
+            await conn.close()
+
+    def after_fork(self) -> None:
+        super().after_fork()
+        self._member_conns = None
+
+
+class _ProcessorWakeup:
+    # Stands in for the threading.Event the threaded senders set when a batch is full
+    def __init__(self, processor: AsyncBatchProcessor):
+        self.processor = processor
+
+    def set(self) -> None:
+        self.processor.wakeup()
+
+
+class AsyncSpanExporter(rotel_trace._Exporter):
+    """rotel.trace sender posting from a task on an event loop, see install()
+
+    Spans of an agent pool with trace processors are routed by trace id, like
+    those of the threaded sender."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop | None = None):
+        self.processor = _SpanBatchProcessor(self._encode_batch, _otlp.TRACES_PATH, item="spans", loop=loop)
+        super().__init__()
+        self.stats = self.processor.stats
+        self._link()
+
+    # the queue settings set by trace.configure() are the processor's
+    capacity = property(lambda self: self.processor.capacity,
+                        lambda self, value: setattr(self.processor, "capacity", value))
+    batch_size = property(lambda self: self.processor.batch_size,
+                          lambda self, value: setattr(self.processor, "batch_size", value))
+    flush_interval = property(lambda self: self.processor.flush_interval,
+                              lambda self, value: setattr(self.processor, "flush_interval", value))
+
+    def _link(self) -> None:
+        # finish() appends to the processor's queue and wakes its task
+        self._queue = self.processor._queue
+        self._wakeup = _ProcessorWakeup(self.processor)
+
+    def set_lanes(self, lanes: Sequence[tuple[str, int]] | None, classify: Callable[[Any], str] | None = None) -> None:
+        super().set_lanes(lanes, classify)
+        self.processor.lanes = self.lanes
+        self.processor.classify = self.classify
+        self.processor._queue = self._queue
+
+    def _start(self) -> None:
+        self.processor.endpoint = self.processor._conn.endpoint = self.endpoint
+        self.processor.start()
+        self._thread = self.processor._future
+
+    def _encode_batch(self, batch: list[rotel_trace.Span]) -> list[tuple[bytes, int]]:
+        try:
+            return self.encode_requests(batch, self.max_batch_bytes or _otlp.agent_batch_bytes("traces"))
+        finally:
+            for span in batch:
+                rotel_trace._release(span)
+
+    def flush(self, timeout: float = 5.0) -> None:
+        self.processor.flush_sync(timeout)
+
+    def shutdown(self) -> None:
+        self._closed = True
+        self.processor.shutdown_sync()
+
+    def _after_fork(self) -> None:
+        super()._after_fork()
+        self.processor.after_fork()
+        self.stats = self.processor.stats
+        self._link()
+
+
+class AsyncMetricExporter(rotel_metrics._Exporter):
+    """rotel.metrics sender exporting from a task on an event loop every interval, see install()"""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop | None = None):
+        super().__init__()
+        self.loop = loop
+        self._aconn = AsyncAgentConnection()
+        self._future: asyncio.Future | concurrent.futures.Future | None = None
+        self._stopping = False
+        self._wakeup: asyncio.Event | None = None
+
+    def start(self) -> None:
+        with self._lock:
+            if self._future is None:
+                self.loop = _resolve_loop(self.loop)
+                self._aconn.endpoint = self.endpoint
+                self._stopping = False
+                self._wakeup = asyncio.Event()
+                self._future = _spawn(self.loop, self._run_async())
+                self._thread = self._future
+
+    async def _run_async(self) -> None:
+        try:
+            while not self._stopping:
+                await _sleep(self._wakeup, self.interval)
+                self._wakeup.clear()
+                # after the last interval as well, when stopping
+                try:
+                    await self.export_async()
+                except Exception:
+                    traceback.print_exc()
+        except asyncio.CancelledError:
+            # the loop is shutting down, export the final values
+            try:
+                await _timeout(self.export_async(), DRAIN_TIMEOUT)
+            except asyncio.TimeoutError:
+                pass
+            raise
+        finally:
+            await self._aconn.close()
+
+    async def export_async(self) -> bool:
+        self.run_callbacks()
+        with self._lock:
+            start = time.perf_counter()
+            body = self.collect()
+        if body is None:
+            return True
+        exports.record_encode("metrics", time.perf_counter() - start)
+        ok = await self._aconn.post(_otlp.METRICS_PATH, body, _otlp.data_points(body))
+        self.stats["exports" if ok else "export_errors"] += 1
+        return ok
+
+    async def _join(self) -> None:
+        self._stopping = True
+        self._wakeup.set()
+        await _wait(self._future)
+
+    def shutdown(self) -> None:
+        loop = self.loop
+        if self._future is not None and loop is not None and not loop.is_closed():
+            joined = _spawn(loop, self._join())
+            # from the loop, the task exports the final values once the caller yields
+            if isinstance(joined, concurrent.futures.Future):
+                try:
+                    joined.result(5.0)
+                except (concurrent.futures.TimeoutError, concurrent.futures.CancelledError):
+                    pass
+        if self.shared is not None:
+            self.shared.release_lease()
+            self.shared.close()
+            self.shared = None
+
+    def _after_fork(self) -> None:
+        running = self._future is not None
+        self._future = None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._aconn = AsyncAgentConnection(self.endpoint)
+        if self.loop is _loop:
+            self.loop = None
+        if self.shared is not None:
+            self.shared.after_fork()
+        if running:
+            self.start()
+
+
+def install(loop: asyncio.AbstractEventLoop | None = None, traces: bool = True, metrics: bool = True) -> None:
+    """Send rotel.trace spans and rotel.metrics from tasks on loop instead of threads
+
+    Call it before the first span or instrument, from the loop (or pass it),
+    or with no loop running to use a shared loop thread. The settings of
+    trace.configure() and metrics.configure() are kept."""
+    if traces and not isinstance(rotel_trace._exporter, AsyncSpanExporter):
+        previous = rotel_trace._exporter
+        exporter = AsyncSpanExporter(_resolve_loop(loop))
+        for name in ("capacity", "batch_size", "flush_interval", "pool_size", "max_batch_bytes", "endpoint", "resource",
+                     "sampler"):
+            setattr(exporter, name, getattr(previous, name))
+        if previous.lanes is not None:
+            exporter.set_lanes(previous.lanes, previous.classify)
+        if previous._thread is not None:
+            previous.shutdown()
+        rotel_trace._exporter = exporter
+    if metrics and not isinstance(rotel_metrics._exporter, AsyncMetricExporter):
+        previous = rotel_metrics._exporter
+        exporter = AsyncMetricExporter(_resolve_loop(loop))
+        for name in ("interval", "endpoint", "resource", "shared"):
+            setattr(exporter, name, getattr(previous, name))
+        running = previous._thread is not None
+        if running:
+            # stop the thread without closing the shared segment the new exporter takes over
+            previous._stop.set()
+            previous._thread.join(5.0)
+        rotel_metrics._exporter = exporter
+        if running:
+            exporter.start()
+
+
+class AsyncRotelHandler(rotel_logging.RotelHandler):
+    """RotelHandler sending from a task on an event loop instead of a thread"""
+
+    def __init__(self, *args: Any, loop: asyncio.AbstractEventLoop | None = None, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.processor = AsyncBatchProcessor(
+            self._encode_requests, _otlp.LOGS_PATH, item="records", capacity=self.capacity, batch_size=self.batch_size,
+            flush_interval=self.flush_interval, endpoint=self.endpoint, loop=loop, lanes=self.lanes,
+            classify=self.classify,
+        )
+        self.stats = self.processor.stats
+        self._link()
+
+    def _link(self) -> None:
+        # emit() appends to the processor's queue and wakes its task
+        self._queue = self.processor._queue
+        self._wakeup = _ProcessorWakeup(self.processor)
+
+    def _start(self) -> None:
+        self.processor.start()
+        self._thread = self.processor._future
+
+    def flush(self, timeout: float = 5.0) -> None:
+        self.processor.flush_sync(timeout)
+
+    def close(self) -> None:
+        self._closed = True
+        self.processor.shutdown_sync()
+        rotel_logging.logging.Handler.close(self)
+
+    def _after_fork(self) -> None:
+        super()._after_fork()
+        self.processor.after_fork()
+        self.stats = self.processor.stats
+        self._link()
+
+
+class AsyncSpanProcessor:
+    """OpenTelemetry SDK span processor batching spans to the agent from a task on an event loop
+
+    Use it instead of BatchSpanProcessor with an OTLP exporter:
+
+        provider.add_span_processor(AsyncSpanProcessor())
+
+    The keyword arguments are those of AsyncBatchProcessor, with lanes the
+    spans with an error status are classified in the "error" lane. Requires
+    the opentelemetry-exporter-otlp-proto-common package."""
+
+    def __init__(
+        self,
+        endpoint: str | None = None,
+        loop: asyncio.AbstractEventLoop | None = None,
+        max_batch_bytes: int | None = None,
+        **kwargs: Any,
+    ):
+        from opentelemetry.exporter.otlp.proto.common.trace_encoder import encode_spans
+
+        self._encode_spans = encode_spans
+        # request size limit, from the agent's exporters when None
+        self.max_batch_bytes = max_batch_bytes
+        kwargs.setdefault("classify", sdk_span_lane)
+        self.processor = AsyncBatchProcessor(
+            self._encode, _otlp.TRACES_PATH, item="spans", endpoint=endpoint, loop=loop, **kwargs,
+        )
+        self.stats = self.processor.stats
+
+    def _encode(self, batch: list[Any]) -> list[tuple[bytes, int]]:
+        # SDK spans are encoded as a whole, halve the batches that are too large
+        max_bytes = self.max_batch_bytes or _otlp.agent_batch_bytes("traces")
+        requests = []
+        parts = [batch]
+        while parts:
+            part = parts.pop()
+            body = self._encode_spans(part).SerializeToString()
+            if len(body) <= max_bytes:
+                requests.append((body, len(part)))
+            elif len(part) == 1:
+                self.stats["spans_oversize"] += 1
+            else:
+                self.stats["batch_splits"] += 1
+                middle = len(part) // 2
+                parts += [part[middle:], part[:middle]]
+        return requests
+
+    def on_start(self, span: Any, parent_context: Any = None) -> None:
+        pass
+
+    def _on_ending(self, span: Any) -> None:
+        # called by recent SDK versions before the span is made read-only
+        pass
+
+    def on_end(self, span: Any) -> None:
+        if span.context is not None and span.context.trace_flags.sampled:
+            self.processor.put(span)
+
+    def force_flush(self, timeout_millis: int = 30000) -> bool:
+        return self.processor.flush_sync(timeout_millis / 1000.0)
+
+    def shutdown(self) -> None:
+        self.processor.shutdown_sync()
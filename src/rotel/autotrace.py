@@ -0,0 +1,416 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Function timing with sys.monitoring (Python 3.12+).
+#
+# Decorators only reach code you own, and sys.settrace runs a Python callback
+# for every line of every function. sys.monitoring instead lets a tool ask for
+# events of single code objects: functions selected by module prefix are found
+# from a global PY_START event, whose callback returns DISABLE for every other
+# code object so it never fires for them again. Selected functions get PY_RETURN
+# as a local event, and PY_UNWIND, which can only be enabled globally, closes
+# the calls left by exceptions.
+#
+# DISABLE lasts until sys.monitoring.restart_events(), which would also bring
+# back the events disabled by every other tool, like coverage or a debugger.
+# Functions selected once their code object was disabled, by enable() or a
+# later start(), are found in their imported module instead and have PY_START
+# restored one by one: their code is instrumented again while the tool does
+# not watch PY_START. Code objects that are not reachable from their module,
+# like those of functions created at run time, are not found.
+#
+# Each call is timed with the monotonic clock on a per-thread stack and its
+# duration recorded in a rotel.metrics histogram per function. Calls that take
+# longer than the threshold also become rotel.trace spans, nested under the
+# enclosing traced call or the current span. Time spent in the callbacks is
+# measured and reported as the tool's overhead.
+#
+# Generators and coroutines are not timed: they suspend, and tasks interleaving
+# on one thread would break the call stack. On Python 3.10 and 3.11, which lack
+# sys.monitoring, start() logs an error and leaves the application untraced.
+
+from __future__ import annotations
+
+import sys
+import threading
+import time
+from collections.abc import Callable, Iterable
+from types import CodeType
+from typing import Any
+
+from . import metrics as rotel_metrics
+from . import trace as rotel_trace
+from .error import _errlog
+
+
+AVAILABLE = hasattr(sys, "monitoring")
+
+SCOPE = "rotel.autotrace"
+DEFAULT_THRESHOLD = 0.01
+# milliseconds
+DURATION_BOUNDS = (0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 25.0, 50.0, 100.0, 250.0, 500.0, 1000.0, 2500.0,
+                   5000.0, 10000.0)
+# sys.monitoring tool ids tried in order, after those of debuggers and coverage tools
+TOOL_IDS = (2, 3, 4)
+
+# CO_GENERATOR, CO_COROUTINE, CO_ITERABLE_COROUTINE and CO_ASYNC_GENERATOR
+_SUSPENDABLE = 0x20 | 0x80 | 0x100 | 0x200
+
+_monotonic_ns = time.monotonic_ns
+# tool ids used by an AutoTracer in this process, PY_START may be disabled for their code objects
+_used_tools: set[int] = set()
+
+
+class _CodeInfo:
+    __slots__ = ("name", "attributes", "histogram")
+
+    def __init__(self, code: CodeType, module: str | None, histogram: rotel_metrics.Histogram):
+        self.name = getattr(code, "co_qualname", code.co_name)
+        attrs = {"code.function": self.name, "code.namespace": module or ""}
+        self.histogram = histogram.bind(attrs)
+        self.attributes = {**attrs, "code.filepath": code.co_filename, "code.lineno": code.co_firstlineno}
+
+
+class _ThreadState:
+    __slots__ = ("stack", "calls", "spans", "overhead_ns")
+
+    def __init__(self):
+        # [code, info, start ns, span or None] of the traced calls in progress, innermost last
+        self.stack: list[list[Any]] = []
+        self.calls = 0
+        self.spans = 0
+        self.overhead_ns = 0
+
+
+def _code(target: Callable | CodeType) -> CodeType:
+    func = getattr(target, "__func__", target)
+    code = getattr(func, "__code__", func)
+    if not isinstance(code, CodeType):
+        raise TypeError(f"not a Python function or code object: {target!r}")
+    return code
+
+
+class AutoTracer:
+    """Times the calls of the functions of modules, or of single functions
+
+    modules are module name prefixes ("myapp" selects "myapp.db" too).
+    functions are Python functions, methods or code objects, or
+    "module:qualname" strings. Calls longer than threshold seconds are sent as
+    spans."""
+
+    def __init__(
+        self,
+        modules: Iterable[str] = (),
+        functions: Iterable[Callable | CodeType | str] = (),
+        threshold: float = DEFAULT_THRESHOLD,
+    ):
+        self.modules = tuple(modules)
+        self.threshold = threshold
+        self._names: set[tuple[str, str]] = set()
+        self._functions: set[CodeType] = set()
+        for function in functions:
+            if isinstance(function, str):
+                module, _, qualname = function.partition(":")
+                self._names.add((module, qualname))
+            else:
+                self._functions.add(_code(function))
+        self._disabled: set[CodeType] = set()
+        self._codes: dict[CodeType, _CodeInfo] = {}
+        self._tool: int | None = None
+
+        self._local = threading.local()
+        self._states: list[_ThreadState] = []
+        self._states_lock = threading.Lock()
+        self._started = 0
+        self._reported_ns = 0
+
+        meter = rotel_metrics.get_meter(SCOPE)
+        self._histogram = meter.histogram(
+            "autotrace.duration", unit="ms", description="Duration of the traced calls", bounds=DURATION_BOUNDS,
+        )
+        self._overhead = meter.counter(
+            "autotrace.overhead", unit="s", description="Time spent timing the traced calls",
+        )
+        self._tracer = rotel_trace.get_tracer(SCOPE)
+
+    @property
+    def running(self) -> bool:
+        return self._tool is not None
+
+    def _discover(self) -> bool:
+        # functions known only by name or module are found from PY_START
+        return bool(self.modules or self._names)
+
+    def start(self) -> bool:
+        """Start timing, False when sys.monitoring is unavailable or has no free tool id"""
+        if self._tool is not None:
+            return True
+        if not AVAILABLE:
+            _errlog("rotel.autotrace requires Python 3.12 or later, functions are not traced")
+            return False
+        monitoring = sys.monitoring
+        events = monitoring.events
+        tool = next((tool for tool in TOOL_IDS if monitoring.get_tool(tool) is None), None)
+        if tool is None:
+            _errlog("rotel.autotrace found no free sys.monitoring tool id")
+            return False
+        monitoring.use_tool_id(tool, SCOPE)
+        monitoring.register_callback(tool, events.PY_START, self._on_start)
+        monitoring.register_callback(tool, events.PY_RETURN, self._on_return)
+        monitoring.register_callback(tool, events.PY_UNWIND, self._on_unwind)
+        self._tool = tool
+        self._started = _monotonic_ns()
+        self._set_events()
+        for code in self._functions:
+            monitoring.set_local_events(tool, code, events.PY_START | events.PY_RETURN)
+        # PY_START may have been disabled for code objects by a previous start()
+        if tool in _used_tools:
+            self._restart({*self._functions, *self._module_codes(self._selected_module)})
+        _used_tools.add(tool)
+        rotel_metrics.register_callback(self._report)
+        return True
+
+    def stop(self) -> None:
+        tool, self._tool = self._tool, None
+        if tool is None:
+            return
+        monitoring = sys.monitoring
+        monitoring.set_events(tool, 0)
+        for code in {*self._codes, *self._functions}:
+            monitoring.set_local_events(tool, code, 0)
+        for event in (monitoring.events.PY_START, monitoring.events.PY_RETURN, monitoring.events.PY_UNWIND):
+            monitoring.register_callback(tool, event, None)
+        monitoring.free_tool_id(tool)
+        self._codes.clear()
+        rotel_metrics.unregister_callback(self._report)
+        self._report()
+
+    def _set_events(self) -> None:
+        events = sys.monitoring.events
+        sys.monitoring.set_events(self._tool, events.PY_UNWIND | (events.PY_START if self._discover() else 0))
+
+    def _selected_module(self, module: str) -> bool:
+        return any(module == name for name, _ in self._names) or any(
+            module == prefix or module.startswith(prefix + ".") for prefix in self.modules
+        )
+
+    def _module_codes(self, select: Callable[[str], bool]) -> set[CodeType]:
+        # code objects of the functions, methods and nested functions of the
+        # imported modules select() returns True for
+        codes = set()
+        for name, module in list(sys.modules.items()):
+            if module is None or not select(name):
+                continue
+            pending = list(vars(module).values())
+            seen = set()
+            while pending:
+                obj = pending.pop()
+                if id(obj) in seen:
+                    continue
+                seen.add(id(obj))
+                if isinstance(obj, CodeType):
+                    codes.add(obj)
+                    pending.extend(const for const in obj.co_consts if isinstance(const, CodeType))
+                elif isinstance(obj, type):
+                    if obj.__module__ == name:
+                        pending.extend(vars(obj).values())
+                elif isinstance(obj, (staticmethod, classmethod)):
+                    pending.append(obj.__func__)
+                elif isinstance(obj, property):
+                    pending.extend((obj.fget, obj.fset, obj.fdel))
+                else:
+                    code = getattr(obj, "__code__", None)
+                    if isinstance(code, CodeType):
+                        pending.append(code)
+        return codes
+
+    def _restart(self, codes: Iterable[CodeType]) -> None:
+        # Undo DISABLE of PY_START for codes only: a code object instrumented
+        # while the tool does not watch PY_START loses the disabled state, it
+        # gets PY_START back with the global or local event.
+        monitoring = sys.monitoring
+        events = monitoring.events
+        tool = self._tool
+        global_events = monitoring.get_events(tool)
+        monitoring.set_events(tool, global_events & ~events.PY_START)
+        for code in codes:
+            local = monitoring.get_local_events(tool, code)
+            # any other value instruments the code again
+            monitoring.set_local_events(tool, code, (local & ~events.PY_START) ^ events.PY_RETURN)
+            monitoring.set_local_events(tool, code, local)
+        monitoring.set_events(tool, global_events)
+
+    def enable(self, target: Callable | CodeType | str) -> None:
+        """Time the calls of target from its next call, a function, code object or "module:qualname" """
+        if isinstance(target, str):
+            module, _, qualname = target.partition(":")
+            self._names.add((module, qualname))
+            if self._tool is not None:
+                self._set_events()
+                # PY_START was disabled for the code objects seen so far
+                self._restart(
+                    code for code in self._module_codes(lambda name: name == module)
+                    if getattr(code, "co_qualname", code.co_name) == qualname
+                )
+            return
+        code = _code(target)
+        self._disabled.discard(code)
+        self._functions.add(code)
+        if self._tool is not None:
+            events = sys.monitoring.events
+            sys.monitoring.set_local_events(self._tool, code, events.PY_START | events.PY_RETURN)
+            self._restart((code,))
+
+    def disable(self, target: Callable | CodeType) -> None:
+        """Stop timing the calls of target, a function or code object, even when its module is traced"""
+        code = _code(target)
+        self._disabled.add(code)
+        self._functions.discard(code)
+        # the next PY_START disables the global event for the code object
+        self._codes.pop(code, None)
+        if self._tool is not None:
+            sys.monitoring.set_local_events(self._tool, code, 0)
+
+    def _select(self, code: CodeType) -> _CodeInfo | None:
+        if code in self._disabled or code.co_flags & _SUSPENDABLE:
+            return None
+        # the frame of the called function, from _on_start
+        module = sys._getframe(2).f_globals.get("__name__")
+        if code not in self._functions:
+            qualname = getattr(code, "co_qualname", code.co_name)
+            if (module, qualname) not in self._names and not (
+                module is not None and any(module == prefix or module.startswith(prefix + ".")
+                                           for prefix in self.modules)
+            ):
+                return None
+            sys.monitoring.set_local_events(self._tool, code, sys.monitoring.events.PY_RETURN)
+        info = self._codes[code] = _CodeInfo(code, module, self._histogram)
+        return info
+
+    def _state(self) -> _ThreadState:
+        state = self._local.state = _ThreadState()
+        with self._states_lock:
+            self._states.append(state)
+        return state
+
+    def _on_start(self, code: CodeType, offset: int) -> Any:
+        begin = _monotonic_ns()
+        info = self._codes.get(code)
+        if info is None:
+            info = self._select(code)
+            if info is None:
+                return sys.monitoring.DISABLE
+        try:
+            state = self._local.state
+        except AttributeError:
+            state = self._state()
+        # the call starts once the callback is done
+        now = _monotonic_ns()
+        state.overhead_ns += now - begin
+        state.stack.append([code, info, now, None])
+        return None
+
+    def _on_return(self, code: CodeType, offset: int, retval: Any) -> None:
+        self._end(code, None)
+
+    def _on_unwind(self, code: CodeType, offset: int, exc: BaseException) -> None:
+        # enabled for all code objects, return quickly for the untraced ones
+        if code in self._codes:
+            self._end(code, exc)
+
+    def _end(self, code: CodeType, exc: BaseException | None) -> None:
+        end = _monotonic_ns()
+        try:
+            state = self._local.state
+        except AttributeError:
+            return
+        stack = state.stack
+        # calls above it were left without an event, when their code was disabled meanwhile
+        for depth in range(len(stack) - 1, -1, -1):
+            if stack[depth][0] is code:
+                break
+        else:
+            return
+        _, info, start, span = stack[depth]
+        del stack[depth:]
+        duration = end - start
+        info.histogram.record(duration / 1e6)
+        state.calls += 1
+        if span is not None or duration >= self.threshold * 1e9:
+            if span is None:
+                span = self._new_span(info, start, stack, len(stack), rotel_trace.current_span())
+            if exc is not None:
+                span.record_exception(exc)
+            span.end_time = end
+            rotel_trace._exporter.finish(span)
+            state.spans += 1
+        state.overhead_ns += _monotonic_ns() - end
+
+    def _new_span(
+        self, info: _CodeInfo, start: int, stack: list[list[Any]], depth: int, current: rotel_trace.Span | None,
+    ) -> rotel_trace.Span:
+        # stack[:depth] are the traced calls enclosing this one. The span nests
+        # under the innermost of them unless the current span started within it,
+        # and that call's span is started now to be ended when it returns.
+        parent = None
+        if depth and (current is None or current.start < stack[depth - 1][2]):
+            outer = stack[depth - 1]
+            if outer[3] is None:
+                outer[3] = self._new_span(outer[1], outer[2], stack, depth - 1, current)
+            parent = outer[3]
+        span = self._tracer.start_span(info.name, info.attributes, parent=parent)
+        span.start = start
+        return span
+
+    def _report(self) -> None:
+        overhead_ns = sum(state.overhead_ns for state in list(self._states))
+        if overhead_ns > self._reported_ns:
+            self._overhead.add((overhead_ns - self._reported_ns) / 1e9)
+            self._reported_ns = overhead_ns
+
+    def stats(self) -> dict[str, float]:
+        """Traced functions, calls and spans, and the time spent timing them
+
+        overhead_ratio is the time spent in the callbacks relative to the time
+        since start(), all threads combined, so it can exceed 1 with many busy
+        threads. The cost of the interpreter dispatching the events is not
+        included."""
+        states = list(self._states)
+        overhead = sum(state.overhead_ns for state in states) / 1e9
+        elapsed = (_monotonic_ns() - self._started) / 1e9 if self._started else 0.0
+        return {
+            "functions": len(self._codes),
+            "calls": sum(state.calls for state in states),
+            "spans": sum(state.spans for state in states),
+            "overhead_seconds": overhead,
+            "overhead_ratio": overhead / elapsed if elapsed else 0.0,
+        }
+
+
+_autotracer: AutoTracer | None = None
+
+
+def start(
+    modules: Iterable[str] = (),
+    functions: Iterable[Callable | CodeType | str] = (),
+    threshold: float = DEFAULT_THRESHOLD,
+) -> AutoTracer | None:
+    """Start timing the functions of modules and functions, None when sys.monitoring is unavailable"""
+    global _autotracer
+    if _autotracer is not None and _autotracer.running:
+        return _autotracer
+    autotracer = AutoTracer(modules=modules, functions=functions, threshold=threshold)
+    if not autotracer.start():
+        return None
+    _autotracer = autotracer
+    return autotracer
+
+
+def stop() -> None:
+    global _autotracer
+    autotracer, _autotracer = _autotracer, None
+    if autotracer is not None:
+        autotracer.stop()
+
+
+def get_autotracer() -> AutoTracer | None:
+    return _autotracer
@@ -2,22 +2,56 @@
 
 from __future__ import annotations
 
+import os
+import threading
+import time
+
 
 try:
     from typing import Unpack
 except ImportError:
     from typing_extensions import Unpack
 
-from .agent import agent
+from .agent import Agent, agent
 from .config import Config, Options
+from .error import _errlog
+from .pool import member_endpoint, process_member
 
 
 _client: Client | None = None
 
+# status() key of the agent when no groups are configured
+DEFAULT_GROUP = "default"
+# seconds between checks for exited agents of groups and pools
+SUPERVISE_INTERVAL = 5.0
+# seconds to wait for the started agents to accept connections
+READY_TIMEOUT = 5.0
+# startup_report() phases, in order
+STARTUP_PHASES = ("import", "env", "validate", "preflight", "build_env", "spawn", "ready")
+
 class Client:
     def __init__(self, **options: Unpack[Options]):
         global _client
         self.config = Config(options)
+        # one agent per group or pool member, the shared agent is used without either
+        names = self.config.group_names()
+        if not names and self.config.pool_size() > 1:
+            names = [str(i) for i in range(self.config.pool_size())]
+        self.agents: dict[str, Agent] = {name: Agent() for name in names}
+        self.restarts: dict[str, int] = dict.fromkeys(names, 0)
+        # held while starting or stopping agents, so the supervisor does not restart an agent being stopped
+        self._agents_lock = threading.Lock()
+        self._started = False
+        # process that called start(), forked workers inherit the client
+        self._start_pid: int | None = None
+        self._supervisor: threading.Thread | None = None
+        self._stopping = threading.Event()
+        self._ready: float | None = None
+        self._preflight: float | None = None
+        # report of the exporter checks run by the last start() with preflight enabled
+        self.preflight_report: dict | None = None
+        # batch_max_bytes() per signal, asked for by the senders on every batch
+        self._batch_max_bytes: dict[str | None, int | None] = {}
 
         _client = self
 
@@ -27,8 +61,353 @@ class Client:
 
     def start(self):
         if self.config.is_active():
-            agent.start(self.config)
+            if self.config.options.get("preflight"):
+                from .preflight import describe
+
+                self.preflight_report = self.preflight()
+                if not self.preflight_report["ok"]:
+                    _errlog(f"Exporter preflight failed: {describe(self.preflight_report)}")
+                    if self.config.options.get("preflight_required"):
+                        return
+            self._started = True
+            self._start_pid = os.getpid()
+            self._ready = None
+            started = []
+            if not self.agents and agent.start(self.config):
+                started.append(self.config)
+            with self._agents_lock:
+                for name, group_agent in self.agents.items():
+                    config = self._agent_config(name)
+                    if config.is_active() and group_agent.start(config):
+                        started.append(config)
+            if started:
+                # the agents fork into the background, time them until their receivers are up
+                threading.Thread(
+                    target=self._await_ready, args=(started, time.perf_counter()), name="rotel-ready", daemon=True,
+                ).start()
+            if self.agents:
+                self._stopping.clear()
+                self._supervisor = threading.Thread(target=self._supervise, name="rotel-supervisor", daemon=True)
+                self._supervisor.start()
+            if self.config.options.get("metrics_shared_memory"):
+                from . import metrics
+                from ._shared_metrics import segment_name
+
+                metrics.enable_shared(segment_name(self.config.options.get("pid_file")))
+            if self.config.options.get("runtime_metrics"):
+                from . import runtime
+
+                runtime.start()
+            if self.config.options.get("adaptive_sampling"):
+                from . import sampling
+
+                min_ratio = self.config.options.get("adaptive_sampling_min_ratio")
+                max_ratio = self.config.options.get("adaptive_sampling_max_ratio")
+                sampling.install(
+                    min_ratio=sampling.DEFAULT_MIN_RATIO if min_ratio is None else min_ratio,
+                    max_ratio=sampling.DEFAULT_MAX_RATIO if max_ratio is None else max_ratio,
+                )
+            if self.config.options.get("profiling"):
+                from . import profiling
+
+                profiling.start(rate=self.config.options.get("profiling_rate") or profiling.DEFAULT_RATE)
+            if self.config.options.get("export_metrics"):
+                from . import exports
+
+                exports.enable_metrics()
+            if self.config.options.get("autotrace"):
+                from . import autotrace
+                from .duration import parse_duration
+
+                threshold = self.config.options.get("autotrace_threshold")
+                autotrace.start(
+                    modules=self.config.options["autotrace"],
+                    threshold=parse_duration(threshold) if threshold else autotrace.DEFAULT_THRESHOLD,
+                )
 
     def stop(self):
         if self.config.is_active():
-            agent.stop()
+            if self.config.options.get("runtime_metrics"):
+                from . import runtime
+
+                runtime.stop()
+            if self.config.options.get("profiling"):
+                from . import profiling
+
+                profiling.stop()
+            if self.config.options.get("autotrace"):
+                from . import autotrace
+
+                autotrace.stop()
+            if self.config.options.get("export_metrics"):
+                from . import exports
+
+                exports.disable_metrics()
+            self._started = False
+            if self._supervisor is not None:
+                self._stopping.set()
+                self._supervisor.join()
+                self._supervisor = None
+            if not self.agents:
+                agent.stop()
+            with self._agents_lock:
+                for group_agent in self.agents.values():
+                    if group_agent.running:
+                        group_agent.stop()
+            if self.config.options.get("metrics_shared_memory") and self._start_pid == os.getpid():
+                from ._shared_metrics import segment_name, unlink
+
+                unlink(segment_name(self.config.options.get("pid_file")))
+
+    def _await_ready(self, configs: list[Config], begin: float) -> None:
+        import socket
+
+        from ._otlp import _host_port
+
+        deadline = begin + READY_TIMEOUT
+        for config in configs:
+            endpoint = config.options.get("otlp_http_endpoint") or config.options.get("otlp_grpc_endpoint")
+            if not endpoint:
+                continue
+            host, _, port = _host_port(endpoint).rpartition(":")
+            while True:
+                try:
+                    socket.create_connection((host, int(port)), timeout=0.1).close()
+                    break
+                except OSError:
+                    if time.perf_counter() >= deadline:
+                        return
+                    time.sleep(0.002)
+        self._ready = time.perf_counter() - begin
+
+    def preflight(self) -> dict:
+        """Check that every configured exporter endpoint can be reached, see rotel.preflight
+
+        Returns {"ok": bool, "checks": [...]}, one check per endpoint with the
+        milliseconds spent resolving, connecting, in the TLS handshake and
+        waiting for the protocol answer, and on failure the stage that failed
+        and the error. The checks run concurrently within preflight_timeout."""
+        from . import preflight
+        from .duration import parse_duration
+
+        begin = time.perf_counter()
+        timeout = self.config.options.get("preflight_timeout")
+        configs = [(None, self.config)]
+        if self.config.group_names():
+            configs = [(name, self.config.group(name)) for name in self.config.group_names()]
+        targets = {}
+        for group, config in configs:
+            if not config.options.get("enabled") or config.options.get("dry_run"):
+                continue
+            exporters = config.options.get("exporters") or {}
+            if config.options.get("exporter"):
+                exporters = {"exporter": config.options["exporter"]}
+            for name, exporter in exporters.items():
+                for target in preflight.exporter_targets(name if group is None else f"{group}/{name}", exporter):
+                    # groups sharing an exporter are checked once
+                    targets.setdefault((target.kind, target.address, target.path), target)
+        report = preflight.run(
+            list(targets.values()), parse_duration(timeout) if timeout else preflight.DEFAULT_TIMEOUT,
+        )
+        self._preflight = time.perf_counter() - begin
+        return report
+
+    def startup_report(self) -> dict[str, float | None]:
+        """Milliseconds spent in each startup phase, and their total
+
+        The phases are importing rotel, resolving the options from the
+        environment, validating them, checking the exporters with preflight,
+        building the agent environment, spawning the agent until it forks into
+        the background, and waiting for its receivers to accept connections. The phases of several agent groups or
+        pool members add up, phases that did not run are None. "ready" is None
+        until the receivers are up, it is measured in the background so start()
+        does not wait for it."""
+        from . import _import_seconds
+
+        seconds: dict[str, float | None] = {
+            "import": _import_seconds,
+            "env": self.config.timings["env"],
+            "validate": self.config.timings["validate"],
+        }
+        agents = list(self.agents.values()) or [agent]
+        for phase in ("build_env", "spawn"):
+            timings = [a.timings[phase] for a in agents if phase in a.timings]
+            seconds[phase] = sum(timings) if self._started and timings else None
+        seconds["preflight"] = self._preflight
+        seconds["ready"] = self._ready
+        report = {phase: None if seconds[phase] is None else seconds[phase] * 1000.0 for phase in STARTUP_PHASES}
+        report["total"] = sum(ms for ms in report.values() if ms is not None)
+        return report
+
+    def _agent_config(self, name: str) -> Config:
+        if self.config.group_names():
+            return self.config.group(name)
+        return self.config.pool_member(int(name))
+
+    def _supervise(self) -> None:
+        while not self._stopping.wait(SUPERVISE_INTERVAL):
+            self.check_agents()
+
+    def check_agents(self) -> list[str]:
+        """Restart the started agents of groups or the pool whose process exited, return their names"""
+        restarted = []
+        for name, group_agent in self.agents.items():
+            with self._agents_lock:
+                status = group_agent.status()
+                if not status["running"] or status["alive"]:
+                    continue
+                self.restarts[name] += 1
+                if group_agent.start(self._agent_config(name)):
+                    restarted.append(name)
+        return restarted
+
+    def status(self) -> dict[str, dict]:
+        """Whether each agent is running, keyed by group name or pool index, or "default" without either"""
+        if not self.agents:
+            return {DEFAULT_GROUP: agent.status()}
+        return {
+            name: {**group_agent.status(), "restarts": self.restarts[name]}
+            for name, group_agent in self.agents.items()
+        }
+
+    def reconfigure(self, group: str, **options: Unpack[Options]) -> bool:
+        """Replace options of an agent group and restart its agent if the client is started
+
+        The other groups keep running. The previous options are kept if the new
+        ones do not validate."""
+        groups = self.config.options.get("groups") or {}
+        if group not in groups:
+            _errlog(f"Unknown agent group '{group}'")
+            return False
+        previous = groups[group]
+        groups[group] = {**previous, **options}
+        self.config.valid = self.config.validate()
+        if not self.config.valid:
+            groups[group] = previous
+            self.config.valid = self.config.validate()
+            return False
+        self._batch_max_bytes.clear()
+
+        group_agent = self.agents[group]
+        with self._agents_lock:
+            # Agent.stop() waits for the process to exit with running still set, the
+            # supervisor would take that for a crash and start a second agent
+            if group_agent.running:
+                group_agent.stop()
+            config = self.config.group(group)
+            if self._started and config.is_active():
+                return group_agent.start(config)
+        return True
+
+    def endpoint(self, signal: str | None = None, protocol: str = "http") -> str | None:
+        """OTLP receiver endpoint of the agent, or of the first agent group receiving signal
+
+        Use it to point OpenTelemetry SDK exporters at the right group, the
+        rotel logging, metrics and tracing senders are routed the same way. With
+        an agent pool it is the endpoint of the member picked for this process.
+        None for traces when the pool routes spans by trace id, a single member
+        would not see every span of a trace, use endpoints() instead."""
+        config = self.config
+        size = config.pool_size()
+        if size > 1:
+            if signal == "traces" and config.trace_affinity():
+                _errlog("Spans of the agent pool are routed by trace id, use endpoints() with PartitionedSpanExporter")
+                return None
+            endpoint = config.options.get(f"otlp_{protocol}_endpoint")
+            return member_endpoint(endpoint, process_member(size)) if endpoint else None
+        if self.agents and signal is not None:
+            name = config.group_for(signal)
+            if name is None:
+                return None
+            config = config.group(name)
+        return config.options.get(f"otlp_{protocol}_endpoint")
+
+    def endpoints(self, protocol: str = "http") -> list[str]:
+        """OTLP receiver endpoints of all agent pool members, in pool order
+
+        Pass them to rotel.pool.PartitionedSpanExporter to keep the spans of a
+        trace on one member."""
+        endpoint = self.config.options.get(f"otlp_{protocol}_endpoint")
+        if not endpoint:
+            return []
+        return [member_endpoint(endpoint, i) for i in range(self.config.pool_size())]
+
+    def batch_max_bytes(self, signal: str | None = None) -> int | None:
+        """Largest request the rotel senders send for signal, from the options of the agent group receiving it"""
+        if signal not in self._batch_max_bytes:
+            config = self.config
+            if signal is not None and config.group_names():
+                name = config.group_for(signal)
+                if name is not None:
+                    config = config.group(name)
+            self._batch_max_bytes[signal] = config.batch_max_bytes(signal)
+        return self._batch_max_bytes[signal]
+
+    def export_stats(self, signal: str | None = None) -> dict[str, dict]:
+        """Statistics of the requests of the rotel senders to the agent, keyed by signal, see rotel.exports
+
+        Counts the requests, failed requests, items, bytes, retries and items
+        rejected by the agent with a partial success, with histograms of the
+        encode time and agent latency in milliseconds and of the request sizes.
+        Pass signal for that signal only. Counted in this process."""
+        from . import exports
+
+        return exports.snapshot(signal)
+
+    def _group_config(self, group: str | None) -> Config:
+        return self.config if group is None else self.config.group(group)
+
+    def _pool_configs(self, group: str | None) -> list[Config]:
+        if group is None and self.config.pool_size() > 1:
+            return [self.config.pool_member(i) for i in range(self.config.pool_size())]
+        return [self._group_config(group)]
+
+    def processor_stats(self, group: str | None = None) -> dict[str, dict]:
+        """Latency, item and error statistics per processor, keyed by "signal/name"
+
+        Requires processors_instrument, the agent updates the statistics every
+        processors_instrument_interval. Pass group for the agent of an agent group,
+        the statistics of an agent pool are combined."""
+        from .instrument import merge_processor_stats, read_processor_stats, stats_path
+
+        stats = []
+        for config in self._pool_configs(group):
+            pid_file = config.options.get("pid_file")
+            if config.options.get("processors_instrument") and pid_file:
+                stats.append(read_processor_stats(stats_path(pid_file)))
+        return merge_processor_stats(stats)
+
+    def processor_counters(self, group: str | None = None) -> dict[str, dict]:
+        """Counters of the tail_sampling, metric_cardinality and log_dedup processors, keyed by processor type
+
+        Requires pid_file, the agent writes the counters every few seconds. The
+        metric_cardinality entry holds the estimated series per metric under
+        "cardinality". Pass group for the agent of an agent group, the counters
+        of an agent pool are added up."""
+        from .processor_counters import (
+            merge_processor_counters,
+            read_processor_counters,
+        )
+
+        counters = []
+        for config in self._pool_configs(group):
+            pid_file = config.options.get("pid_file")
+            if pid_file:
+                counters.append(read_processor_counters(pid_file))
+        return merge_processor_counters(counters)
+
+    def volume_report(self, group: str | None = None) -> dict:
+        """Items and bytes per signal, resource and attribute key counted by the volume processor
+
+        Requires dry_run or a volume processor in the processor lists. Each
+        signal's report covers the last complete window, or the window in
+        progress until the first one closes. Pass group for the agent of an
+        agent group, the reports of an agent pool are combined."""
+        from .volume import merge_volume_reports, read_volume_report, stats_prefix
+
+        reports = []
+        for config in self._pool_configs(group):
+            pid_file = config.options.get("pid_file")
+            if pid_file:
+                reports.append(read_volume_report(stats_prefix(pid_file)))
+        return merge_volume_reports(reports)
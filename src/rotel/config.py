@@ -1,9 +1,14 @@
 # SPDX-License-Identifier: Apache-2.0
 
-from __future__ import annotations
+# Unlike the other modules this one does not use postponed annotations: every
+# option TypedDict would turn its annotation strings into ForwardRefs compiled
+# at import, which made up most of the time spent importing rotel.
 
+import copy
+import json
 import os
-from typing import TypedDict, cast
+import time
+from typing import TYPE_CHECKING, TypedDict, cast
 
 
 try:
@@ -12,6 +17,15 @@ except ImportError:
     from typing_extensions import Unpack
 
 from .error import _errlog
+from .pool import member_endpoint
+from .volume import DEFAULT_WINDOW as VOLUME_WINDOW
+from .volume import stats_prefix as volume_stats_prefix
+
+
+# The modules generating processor files are imported when a feature needs
+# them, so that importing and starting rotel stays cheap without one.
+if TYPE_CHECKING:
+    from .rules import Rule
 
 
 class OTLPExporterEndpoint(TypedDict, total=False):
@@ -96,6 +110,92 @@ class KafkaExporter(TypedDict, total=False):
 class BlackholeExporter(TypedDict, total=False):
     _type: str | None # set with builder method
 
+class TailSamplingProcessor(TypedDict, total=False):
+    _type: str | None # set with builder method
+    decision_wait: str | None
+    max_traces: int | None
+    max_spans: int | None
+    decision_cache_size: int | None
+    keep_errors: bool | None
+    latency_threshold: str | None
+    attributes: dict[str, str] | None
+    sample_rate: float | None
+
+class SpanMetricsProcessor(TypedDict, total=False):
+    _type: str | None # set with builder method
+    dimensions: list[str] | None
+    histogram: str | None
+    buckets: list[float] | None
+    exponential_max_size: int | None
+    max_series: int | None
+    interval: str | None
+    temporality: str | None
+
+class MetricCardinalityProcessor(TypedDict, total=False):
+    _type: str | None # set with builder method
+    max_series: int | None
+    max_metrics: int | None
+    limits: dict[str, int] | None
+    drop_attributes: list[str] | None
+    max_sources: int | None
+
+class LogDedupProcessor(TypedDict, total=False):
+    _type: str | None # set with builder method
+    window: str | None
+    dedup: bool | None
+    rate_limit: float | None
+    burst: int | None
+    min_severity: str | int | None
+    max_fingerprints: int | None
+
+class RulesProcessor(TypedDict, total=False):
+    _type: str | None # set with builder method
+    rules: list["Rule"] | None
+    file: str | None
+
+class VolumeProcessor(TypedDict, total=False):
+    _type: str | None # set with builder method
+    window: str | None
+    interval: str | None
+    top_keys: int | None
+    resource_attribute: str | None
+
+# Built-in processors, these are shipped under rotel/processors and configured
+# with a JSON blob in the agent environment. Rules are compiled to a generated
+# module instead.
+Processor = TailSamplingProcessor | SpanMetricsProcessor | MetricCardinalityProcessor | LogDedupProcessor \
+    | RulesProcessor | VolumeProcessor
+
+PROCESSOR_SIGNALS = {
+    "tail_sampling": ("traces",),
+    "span_metrics": ("traces",),
+    "metric_cardinality": ("metrics",),
+    "log_dedup": ("logs",),
+    "rules": ("traces", "logs"),
+    "volume": ("traces", "metrics", "logs"),
+}
+
+# Duration options of the built-in processors, parsed by the agent
+PROCESSOR_DURATIONS = {
+    "tail_sampling": ("decision_wait", "latency_threshold"),
+    "span_metrics": ("interval",),
+    "log_dedup": ("window",),
+    "volume": ("window", "interval"),
+}
+
+SIGNALS = ("traces", "metrics", "logs")
+
+# Largest message the exporters accept: the default gRPC receive limit, the
+# OpenTelemetry collector's HTTP request limit and Kafka's message.max.bytes.
+# The rotel senders keep their requests to the agent below the smallest of
+# them. The agent batches by count only (batch_max_size), so its own export
+# batches are not held to these limits.
+GRPC_MAX_MESSAGE_BYTES = 4 * 1024 * 1024
+HTTP_MAX_REQUEST_BYTES = 20 * 1024 * 1024
+KAFKA_MAX_MESSAGE_BYTES = 1_000_000
+# room left for what the agent adds to a batch, such as its resource attributes
+BATCH_BYTES_HEADROOM = 0.9
+
 class Options(TypedDict, total=False):
     enabled: bool | None
     pid_file: str | None
@@ -105,11 +205,16 @@ class Options(TypedDict, total=False):
     debug_log_verbosity: str | None
     batch_max_size: int | None
     batch_timeout: str | None
+    # Request size limit of the rotel senders to the agent, derived from the exporters when unset,
+    # the agent's export batches are limited by batch_max_size alone
+    batch_max_bytes: int | None
     otlp_grpc_endpoint: str | None
     otlp_http_endpoint: str | None
     otlp_receiver_traces_disabled: bool | None
     otlp_receiver_metrics_disabled: bool | None
     otlp_receiver_logs_disabled: bool | None
+    # Signals received by the agent, all by default
+    signals: list[str] | None
     exporter: OTLPExporter | DatadogExporter | ClickhouseExporter | BlackholeExporter | None
     # Multiple exporter support
     exporters: dict[str, OTLPExporter | DatadogExporter | ClickhouseExporter | KafkaExporter | BlackholeExporter] | None
@@ -117,9 +222,40 @@ class Options(TypedDict, total=False):
     exporters_traces: list[str] | None
     exporters_logs: list[str] | None
     # Processors
-    processors_metrics: list[str] | None
-    processors_traces: list[str] | None
-    processors_logs: list[str] | None
+    processors_metrics: list[str | Processor] | None
+    processors_traces: list[str | Processor] | None
+    processors_logs: list[str | Processor] | None
+    processors_reload: bool | None
+    processors_reload_interval: str | None
+    processors_instrument: bool | None
+    processors_instrument_interval: str | None
+    # Agent groups, named sets of options overriding the ones above
+    groups: dict[str, "Options"] | None
+    # Agent pool
+    agent_pool_size: int | None
+    # Dry run
+    dry_run: bool | None
+    dry_run_window: str | None
+    # Exporter preflight checks
+    preflight: bool | None
+    preflight_timeout: str | None
+    preflight_required: bool | None
+    # In-process metrics
+    metrics_shared_memory: bool | None
+    # Python runtime metrics
+    runtime_metrics: bool | None
+    # Adaptive trace sampling
+    adaptive_sampling: bool | None
+    adaptive_sampling_min_ratio: float | None
+    adaptive_sampling_max_ratio: float | None
+    # Profiling
+    profiling: bool | None
+    profiling_rate: int | None
+    # Export requests to the agent as metrics
+    export_metrics: bool | None
+    # Function timing with sys.monitoring
+    autotrace: list[str] | None
+    autotrace_threshold: str | None
 
 class Config:
     DEFAULT_OPTIONS = Options(
@@ -131,6 +267,7 @@ class Config:
     )
 
     def __init__(self, options: Options | None = None):
+        begin = time.perf_counter()
         opts = Options()
         deep_merge_options(opts, self.DEFAULT_OPTIONS)
         deep_merge_options(opts, Config._load_options_from_env())
@@ -138,11 +275,54 @@ class Config:
             deep_merge_options(opts, options)
 
         self.options = opts
+        resolved = time.perf_counter()
         self.valid = self.validate()
+        # seconds spent resolving and validating the options, see Client.startup_report()
+        self.timings = {"env": resolved - begin, "validate": time.perf_counter() - resolved}
 
     def is_active(self) -> bool:
         return self.options["enabled"] and self.valid
 
+    def group_names(self) -> list[str]:
+        return list(self.options.get("groups") or {})
+
+    def group(self, name: str) -> "Config":
+        """Config of the agent group name
+
+        Group options replace the top-level ones. The pid and log files default to
+        the top-level ones suffixed with the group name, the receiver endpoints
+        must be set for all but one group."""
+        groups = self.options.get("groups") or {}
+        if name not in groups:
+            raise KeyError(f"unknown agent group '{name}'")
+        group_opts = groups[name]
+        opts = {k: copy.deepcopy(v) for k, v in self.options.items() if k != "groups"}
+        if "exporter" in group_opts or "exporters" in group_opts:
+            for key in ("exporter", "exporters", "exporters_traces", "exporters_metrics", "exporters_logs"):
+                opts.pop(key, None)
+        for key in ("pid_file", "log_file"):
+            if key not in group_opts and opts.get(key):
+                stem, ext = os.path.splitext(opts[key])
+                opts[key] = f"{stem}-{name}{ext}"
+        opts.update({k: copy.deepcopy(v) for k, v in group_opts.items() if v is not None})
+
+        # the top-level options already include the environment
+        config = Config.__new__(Config)
+        config.options = cast(Options, opts)
+        config.valid = config.validate()
+        return config
+
+    def group_for(self, signal: str) -> str | None:
+        """Name of the first enabled agent group receiving signal"""
+        for name in self.group_names():
+            options = self.group(name).options
+            if not options.get("enabled") or options.get(f"otlp_receiver_{signal}_disabled"):
+                continue
+            signals = options.get("signals")
+            if signals is None or signal in signals:
+                return name
+        return None
+
     @staticmethod
     def clickhouse_exporter(**options: Unpack[ClickhouseExporter]) -> ClickhouseExporter:
         """Construct a Clickhouse exporter config"""
@@ -174,8 +354,47 @@ class Config:
         options["_type"] = "blackhole"
         return options
 
+    @staticmethod
+    def tail_sampling_processor(**options: Unpack[TailSamplingProcessor]) -> TailSamplingProcessor:
+        """Construct a tail sampling processor config"""
+        options["_type"] = "tail_sampling"
+        return options
+
+    @staticmethod
+    def span_metrics_processor(**options: Unpack[SpanMetricsProcessor]) -> SpanMetricsProcessor:
+        """Construct a span metrics processor config"""
+        options["_type"] = "span_metrics"
+        return options
+
+    @staticmethod
+    def metric_cardinality_processor(**options: Unpack[MetricCardinalityProcessor]) -> MetricCardinalityProcessor:
+        """Construct a metric cardinality limiting processor config"""
+        options["_type"] = "metric_cardinality"
+        return options
+
+    @staticmethod
+    def log_dedup_processor(**options: Unpack[LogDedupProcessor]) -> LogDedupProcessor:
+        """Construct a log deduplication and rate limiting processor config"""
+        options["_type"] = "log_dedup"
+        return options
+
+    @staticmethod
+    def rules_processor(**options: Unpack[RulesProcessor]) -> RulesProcessor:
+        """Construct a processor config compiled from declarative rules"""
+        options["_type"] = "rules"
+        return options
+
+    @staticmethod
+    def volume_processor(**options: Unpack[VolumeProcessor]) -> VolumeProcessor:
+        """Construct a processor config counting items and bytes without changing the data"""
+        options["_type"] = "volume"
+        return options
+
     @staticmethod
     def _load_options_from_env() -> Options:
+        # most processes configure rotel in code, skip the lookups below when nothing is set
+        if not any(key.startswith("ROTEL_") for key in os.environ):
+            return Options()
         env = Options(
             enabled = as_bool(rotel_env("ENABLED")),
             pid_file = rotel_env("PID_FILE"),
@@ -185,14 +404,36 @@ class Config:
             debug_log_verbosity = rotel_env("DEBUG_LOG_VERBOSITY"),
             batch_max_size = as_int(rotel_env("BATCH_MAX_SIZE")),
             batch_timeout = rotel_env("BATCH_TIMEOUT"),
+            batch_max_bytes = as_int(rotel_env("BATCH_MAX_BYTES")),
             otlp_grpc_endpoint = rotel_env("OTLP_GRPC_ENDPOINT"),
             otlp_http_endpoint = rotel_env("OTLP_HTTP_ENDPOINT"),
             otlp_receiver_traces_disabled = as_bool(rotel_env("OTLP_RECEIVER_TRACES_DISABLED")),
             otlp_receiver_metrics_disabled = as_bool(rotel_env("OTLP_RECEIVER_METRICS_DISABLED")),
             otlp_receiver_logs_disabled = as_bool(rotel_env("OTLP_RECEIVER_LOGS_DISABLED")),
+            signals = as_list(rotel_env("SIGNALS")),
             processors_metrics = as_list(rotel_env("OTLP_WITH_METRICS_PROCESSOR")),
             processors_traces = as_list(rotel_env("OTLP_WITH_TRACE_PROCESSOR")),
             processors_logs = as_list(rotel_env("OTLP_WITH_LOGS_PROCESSOR")),
+            processors_reload = as_bool(rotel_env("PROCESSORS_RELOAD")),
+            processors_reload_interval = rotel_env("PROCESSORS_RELOAD_INTERVAL"),
+            processors_instrument = as_bool(rotel_env("PROCESSORS_INSTRUMENT")),
+            processors_instrument_interval = rotel_env("PROCESSORS_INSTRUMENT_INTERVAL"),
+            agent_pool_size = as_int(rotel_env("AGENT_POOL_SIZE")),
+            dry_run = as_bool(rotel_env("DRY_RUN")),
+            dry_run_window = rotel_env("DRY_RUN_WINDOW"),
+            preflight = as_bool(rotel_env("PREFLIGHT")),
+            preflight_timeout = rotel_env("PREFLIGHT_TIMEOUT"),
+            preflight_required = as_bool(rotel_env("PREFLIGHT_REQUIRED")),
+            metrics_shared_memory = as_bool(rotel_env("METRICS_SHARED_MEMORY")),
+            runtime_metrics = as_bool(rotel_env("RUNTIME_METRICS")),
+            adaptive_sampling = as_bool(rotel_env("ADAPTIVE_SAMPLING")),
+            adaptive_sampling_min_ratio = as_float(rotel_env("ADAPTIVE_SAMPLING_MIN_RATIO")),
+            adaptive_sampling_max_ratio = as_float(rotel_env("ADAPTIVE_SAMPLING_MAX_RATIO")),
+            profiling = as_bool(rotel_env("PROFILING")),
+            profiling_rate = as_int(rotel_env("PROFILING_RATE")),
+            export_metrics = as_bool(rotel_env("EXPORT_METRICS")),
+            autotrace = as_list(rotel_env("AUTOTRACE")),
+            autotrace_threshold = rotel_env("AUTOTRACE_THRESHOLD"),
         )
         exporters = as_lower(rotel_env("EXPORTERS"))
         if exporters is not None:
@@ -345,8 +586,55 @@ class Config:
                 return endpoint
         return None
 
-    def build_agent_environment(self) -> dict[str,str]:
+    def pool_size(self) -> int:
+        return self.options.get("agent_pool_size") or 1
+
+    def pool_member(self, index: int) -> "Config":
+        """Config of agent index of the agent pool
+
+        The pid and log files are suffixed with the index, the receivers listen
+        on the configured ports plus twice the index."""
+        opts = {k: copy.deepcopy(v) for k, v in self.options.items() if k != "agent_pool_size"}
+        for key in ("pid_file", "log_file"):
+            if opts.get(key):
+                stem, ext = os.path.splitext(opts[key])
+                opts[key] = f"{stem}.{index}{ext}"
+        for key in ("otlp_grpc_endpoint", "otlp_http_endpoint"):
+            if opts.get(key):
+                opts[key] = member_endpoint(opts[key], index)
+
+        config = Config.__new__(Config)
+        config.options = cast(Options, opts)
+        config.valid = config.validate()
+        return config
+
+    def trace_affinity(self) -> bool:
+        """Whether spans must be routed to pool members by trace id
+
+        Trace processors, like tail sampling, need to see every span of a trace."""
+        return self.pool_size() > 1 and bool(self.options.get("processors_traces"))
+
+    def batch_max_bytes(self, signal: str | None = None) -> int | None:
+        """Largest request the rotel senders send for signal, None without a limit
+
+        batch_max_bytes when set, otherwise a share of the smallest message
+        limit of the exporters receiving signal, see exporter_max_bytes()."""
+        if self.options.get("batch_max_bytes"):
+            return self.options["batch_max_bytes"]
+        exporters = self.options.get("exporters")
+        if exporters:
+            names = self.options.get(f"exporters_{signal}") if signal is not None else None
+            selected = [exporters[name] for name in names or exporters if name in exporters]
+        else:
+            selected = [self.options["exporter"]] if self.options.get("exporter") else []
+        limits = [limit for exporter in selected if (limit := exporter_max_bytes(exporter, signal)) is not None]
+        return int(min(limits) * BATCH_BYTES_HEADROOM) if limits else None
+
+    def build_agent_environment(self, group: str | None = None) -> dict[str,str]:
+        if group is not None:
+            return self.group(group).build_agent_environment()
         opts = self.options
+        signals = opts.get("signals")
 
         spawn_env = os.environ.copy()
         updates = {
@@ -359,16 +647,74 @@ class Config:
             "BATCH_TIMEOUT": opts.get("batch_timeout"),
             "OTLP_GRPC_ENDPOINT": opts.get("otlp_grpc_endpoint"),
             "OTLP_HTTP_ENDPOINT": opts.get("otlp_http_endpoint"),
-            "OTLP_RECEIVER_TRACES_DISABLED": opts.get("otlp_receiver_traces_disabled"),
-            "OTLP_RECEIVER_METRICS_DISABLED": opts.get("otlp_receiver_metrics_disabled"),
-            "OTLP_RECEIVER_LOGS_DISABLED": opts.get("otlp_receiver_logs_disabled"),
-            "OTLP_WITH_METRICS_PROCESSOR": opts.get("processors_metrics"),
-            "OTLP_WITH_TRACE_PROCESSOR": opts.get("processors_traces"),
-            "OTLP_WITH_LOGS_PROCESSOR": opts.get("processors_logs"),
+            "OTLP_RECEIVER_TRACES_DISABLED":
+                True if signals is not None and "traces" not in signals else opts.get("otlp_receiver_traces_disabled"),
+            "OTLP_RECEIVER_METRICS_DISABLED":
+                True if signals is not None and "metrics" not in signals else opts.get("otlp_receiver_metrics_disabled"),
+            "OTLP_RECEIVER_LOGS_DISABLED":
+                True if signals is not None and "logs" not in signals else opts.get("otlp_receiver_logs_disabled"),
         }
+        reload = None
+        if opts.get("processors_reload"):
+            from .reload import parse_interval
+
+            reload = parse_interval(opts.get("processors_reload_interval"))
+        instrument = bool(opts.get("processors_instrument"))
+        dry_run = bool(opts.get("dry_run"))
+        processors = {signal: opts.get(f"processors_{signal}") for signal in ("metrics", "traces", "logs")}
+        if dry_run:
+            # count what the exporters would receive, after the other processors. The
+            # agent has a single volume config, so a volume processor that is listed
+            # already is reused for the other signals.
+            listed = [
+                p for signal_processors in processors.values() for p in signal_processors or []
+                if not isinstance(p, str) and p.get("_type") == "volume"
+            ]
+            tap = listed[0] if listed else Config.volume_processor(window=opts.get("dry_run_window") or VOLUME_WINDOW)
+            for signal, signal_processors in processors.items():
+                if not any(not isinstance(p, str) and p.get("_type") == "volume" for p in signal_processors or []):
+                    processors[signal] = [*(signal_processors or []), tap]
+        updates.update({
+            "OTLP_WITH_METRICS_PROCESSOR":
+                _set_processors_agent_env(updates, "metrics", processors["metrics"], reload, instrument),
+            "OTLP_WITH_TRACE_PROCESSOR":
+                _set_processors_agent_env(updates, "traces", processors["traces"], reload, instrument),
+            "OTLP_WITH_LOGS_PROCESSOR":
+                _set_processors_agent_env(updates, "logs", processors["logs"], reload, instrument),
+        })
+        if "PROCESSOR_VOLUME_CONFIG" in updates and opts.get("pid_file"):
+            volume_config = json.loads(updates["PROCESSOR_VOLUME_CONFIG"])
+            volume_config["stats_prefix"] = volume_stats_prefix(opts.get("pid_file"))
+            updates["PROCESSOR_VOLUME_CONFIG"] = json.dumps(volume_config)
+        if opts.get("pid_file"):
+            from .processor_counters import PROCESSORS, counters_path
+
+            for processor_type in PROCESSORS:
+                key = f"PROCESSOR_{processor_type.upper()}_CONFIG"
+                if key in updates:
+                    processor_config = json.loads(updates[key])
+                    processor_config["stats_file"] = counters_path(opts["pid_file"], processor_type)
+                    updates[key] = json.dumps(processor_config)
+        if instrument:
+            from .instrument import DEFAULT_INTERVAL as INSTRUMENT_INTERVAL
+            from .instrument import stats_path
+            from .reload import parse_interval
+
+            pid_file = opts.get("pid_file")
+            updates["PROCESSOR_INSTRUMENT_CONFIG"] = json.dumps({
+                "stats_file": stats_path(pid_file) if pid_file else None,
+                "interval": parse_interval(opts.get("processors_instrument_interval") or INSTRUMENT_INTERVAL),
+                # self-metrics are sent to the agent's own OTLP receiver
+                "export": not opts.get("otlp_receiver_metrics_disabled"),
+            })
 
         exporters = opts.get("exporters")
-        if exporters:
+        if dry_run:
+            # nothing leaves the agent, also drop exporter lists inherited from the environment
+            for key in ("EXPORTERS", "EXPORTERS_TRACES", "EXPORTERS_METRICS", "EXPORTERS_LOGS"):
+                spawn_env.pop(rotel_expand_env_key(key), None)
+            updates["EXPORTER"] = "blackhole"
+        elif exporters:
             exporters_list = []
             for name, exporter in exporters.items():
                 exporter_type = cast(dict, exporter).get("_type")
@@ -462,13 +808,139 @@ class Config:
                     _errlog("OTLP exporter protocol must be 'grpc' or 'http'")
                     return False
 
+        for signal in ["traces", "metrics", "logs"]:
+            seen = set()
+            for processor in self.options.get(f"processors_{signal}") or []:
+                if isinstance(processor, str):
+                    continue
+                processor_type = processor.get("_type")
+                if signal not in PROCESSOR_SIGNALS.get(processor_type, ()):
+                    _errlog(f"Processor '{processor_type}' can not be used in processors_{signal}")
+                    return False
+                if processor_type in seen:
+                    _errlog(f"Processor '{processor_type}' can only be set once")
+                    return False
+                seen.add(processor_type)
+
+                for key in PROCESSOR_DURATIONS.get(processor_type, ()):
+                    if processor.get(key) is None:
+                        continue
+                    from .duration import parse_duration
+
+                    try:
+                        parse_duration(processor[key])
+                    except ValueError as e:
+                        _errlog(f"Processor '{processor_type}' {key}: {e}")
+                        return False
+
+                if processor_type == "span_metrics" and self.options.get("otlp_receiver_metrics_disabled"):
+                    _errlog("span_metrics processor requires the OTLP metrics receiver")
+                    return False
+
+                if processor_type == "rules":
+                    from .rules import validate_rules
+
+                    try:
+                        validate_rules(_processor_rules(processor), signal)
+                    except (OSError, ValueError) as e:
+                        _errlog(f"Invalid rules in processors_{signal}: {e}")
+                        return False
+
+        for interval in ["processors_reload_interval", "processors_instrument_interval", "dry_run_window",
+                         "preflight_timeout", "autotrace_threshold"]:
+            if self.options.get(interval) is None:
+                continue
+            from .duration import parse_duration
+
+            try:
+                parse_duration(self.options.get(interval))
+            except ValueError as e:
+                _errlog(f"{interval}: {e}")
+                return False
+
+        min_ratio = self.options.get("adaptive_sampling_min_ratio")
+        max_ratio = self.options.get("adaptive_sampling_max_ratio")
+        min_ratio = 0.0 if min_ratio is None else min_ratio
+        max_ratio = 1.0 if max_ratio is None else max_ratio
+        if not 0.0 <= min_ratio <= max_ratio <= 1.0:
+            _errlog("adaptive_sampling ratios must satisfy 0 <= min_ratio <= max_ratio <= 1")
+            return False
+
+        batch_max_bytes = self.options.get("batch_max_bytes")
+        if batch_max_bytes is not None and batch_max_bytes <= 0:
+            _errlog("batch_max_bytes must be positive")
+            return False
+
+        profiling_rate = self.options.get("profiling_rate")
+        if profiling_rate is not None and profiling_rate <= 0:
+            _errlog("profiling_rate must be positive")
+            return False
+
         log_format = self.options.get("log_format")
         if log_format is not None and log_format not in {'json', 'text'}:
             _errlog("log_format must be 'json' or 'text'")
             return False
 
+        signals = self.options.get("signals")
+        if signals is not None and any(signal not in SIGNALS for signal in signals):
+            _errlog("signals must be a list of traces, metrics and logs")
+            return False
+
+        pool_size = self.options.get("agent_pool_size")
+        if pool_size is not None:
+            if pool_size < 1:
+                _errlog("agent_pool_size must be positive")
+                return False
+            if pool_size > 1 and self.options.get("groups"):
+                _errlog("agent_pool_size can not be used with groups")
+                return False
+            ports = set()
+            for key in ("otlp_grpc_endpoint", "otlp_http_endpoint"):
+                try:
+                    endpoints = [member_endpoint(self.options.get(key) or "", i) for i in range(pool_size)]
+                except ValueError:
+                    _errlog(f"{key} must end with a port to use agent_pool_size")
+                    return False
+                member_ports = {endpoint.rpartition(":")[2] for endpoint in endpoints}
+                if ports & member_ports:
+                    _errlog("The gRPC and HTTP ports of the agent pool members overlap")
+                    return False
+                ports |= member_ports
+
+        groups = self.options.get("groups")
+        if groups:
+            # group name for each pid file, log file and endpoint in use
+            used = {}
+            for name in groups:
+                group = self.group(name)
+                if group.valid is False:
+                    _errlog(f"Invalid options in agent group '{name}'")
+                    return False
+                if not group.options.get("enabled"):
+                    continue
+                for key in ("pid_file", "log_file", "otlp_grpc_endpoint", "otlp_http_endpoint"):
+                    value = group.options.get(key)
+                    if (key, value) in used:
+                        _errlog(f"Agent groups '{used[(key, value)]}' and '{name}' use the same {key}")
+                        return False
+                    used[(key, value)] = name
+
         return True
 
+def exporter_max_bytes(exporter: dict, signal: str | None = None) -> int | None:
+    """Size of the largest protobuf encoded request exporter sends for signal, None without a known limit"""
+    exporter_type = exporter.get("_type") or "otlp"
+    if exporter_type == "kafka":
+        limit = exporter.get("max_message_bytes") or KAFKA_MAX_MESSAGE_BYTES
+        # JSON messages are about twice the size of the protobuf request
+        return limit // 2 if (exporter.get("format") or "protobuf") == "json" else limit
+    if exporter_type == "otlp":
+        options = {**exporter, **(exporter.get(signal) or {})} if signal is not None else exporter
+        if (options.get("protocol") or "grpc") == "grpc":
+            return GRPC_MAX_MESSAGE_BYTES
+        return HTTP_MAX_REQUEST_BYTES
+    return None
+
 def _set_exporter_agent_env(updates: dict, pfx: str | None, exporter: OTLPExporter | DatadogExporter | ClickhouseExporter | BlackholeExporter) -> None:
     exp_type = cast(dict, exporter).get("_type")
     if exp_type == "datadog":
@@ -504,6 +976,62 @@ def _set_exporter_agent_env(updates: dict, pfx: str | None, exporter: OTLPExport
     if logs is not None:
         _set_otlp_exporter_agent_env(updates, None, "LOGS", metrics)
 
+def _set_processors_agent_env(
+    updates: dict,
+    signal: str,
+    processors: list[str | Processor] | None,
+    reload: float | None = None,
+    instrument: bool = False,
+) -> list[str] | None:
+    if processors is None:
+        return None
+
+    paths = []
+    names = set()
+    for processor in processors:
+        if isinstance(processor, str):
+            name = os.path.splitext(os.path.basename(processor))[0]
+            # User processors are loaded through a shim that can swap in a new version
+            path = processor
+            if reload is not None:
+                from .reload import write_reload_shim
+
+                path = write_reload_shim(processor, signal, reload)
+        else:
+            name = processor_type = processor.get("_type")
+            if processor_type == "rules":
+                from .rules import write_rules_processor
+
+                path = write_rules_processor(_processor_rules(processor), signal)
+            else:
+                path = processor_path(processor_type)
+
+                # Processors run inside the agent, so pass their settings as a single JSON value
+                processor_config = {k: v for k, v in processor.items() if k != "_type" and v is not None}
+                updates[f"PROCESSOR_{processor_type.upper()}_CONFIG"] = json.dumps(processor_config)
+
+        if instrument:
+            # processors with the same file name are told apart by position
+            if name in names:
+                name = f"{name}#{len(paths)}"
+            names.add(name)
+            from .instrument import write_instrument_wrapper
+
+            path = write_instrument_wrapper(name, path, signal)
+        paths.append(path)
+    return paths
+
+def _processor_rules(processor: RulesProcessor) -> list["Rule"]:
+    rules = list(processor.get("rules") or [])
+    if processor.get("file"):
+        from .rules import load_rules
+
+        rules.extend(load_rules(processor["file"]))
+    return rules
+
+def processor_path(processor_type: str) -> str:
+    return os.path.join(os.path.dirname(__file__), "processors", f"{processor_type}.py")
+
 def _set_datadog_exporter_agent_env(updates: dict, pfx: str | None, exporter: DatadogExporter) -> None:
     if pfx is None:
         pfx = "DATADOG_EXPORTER_"
@@ -625,6 +1153,15 @@ def as_int(value: str | None) -> int | None:
     except ValueError:
         return None
 
+def as_float(value: str | None) -> float | None:
+    if value is None:
+        return None
+
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
 def as_bool(value: str | None) -> bool | None:
     if value is None:
         return None
@@ -0,0 +1,27 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Durations of the options, like "250ms", "5s" or "1h".
+#
+# Every duration option of Config and of the built-in processors takes the same
+# units. The processors are loaded by the agent from their file path and can not
+# import this module, each carries a copy of parse_duration() that
+# tests/test_config.py checks against this one.
+
+from __future__ import annotations
+
+import re
+
+
+UNITS = {"ns": 1e-9, "us": 1e-6, "ms": 1e-3, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+_DURATION_RE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*(ns|us|ms|s|m|h)?\s*$")
+
+
+def parse_duration(value: str | float | int) -> float:
+    """Parse a duration like "250ms" or "5s" into seconds, numbers are seconds"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    m = _DURATION_RE.match(value)
+    if m is None:
+        raise ValueError(f"invalid duration: {value}")
+    return float(m.group(1)) * UNITS[m.group(2) or "s"]
@@ -1,7 +1,12 @@
 # SPDX-License-Identifier: Apache-2.0
 
-import logging
-from logging import Logger
+from __future__ import annotations
+
+from typing import TYPE_CHECKING
+
+
+if TYPE_CHECKING:
+    from logging import Logger
 
 
 def _errlog(msg: str) -> None:
@@ -9,4 +14,7 @@ def _errlog(msg: str) -> None:
     log.error(f"{msg}")
 
 def _get_logger() -> Logger:
+    # imported on the first error, it is the largest import rotel would otherwise make
+    import logging
+
     return logging.getLogger("rotel")
@@ -0,0 +1,202 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Statistics of the requests of the in-process senders to the agent.
+#
+# The rotel.trace, rotel.logging, rotel.metrics and rotel.aio senders record
+# every request they send to the agent: how long encoding its batch took, the
+# size of the request and its number of items, how long the agent took to
+# answer, the retries on a kept alive connection closed by the agent and the
+# items the agent rejected with an OTLP partial success. Slow encodes point at
+# the application, slow answers and rejections at the agent and its exporters.
+#
+# Each thread records into its own arrays, like rotel.metrics, so recording
+# takes no lock, and snapshot() sums the arrays of all threads. enable_metrics()
+# records the same values with rotel.metrics instruments as well, to export
+# them with the application's metrics.
+
+from __future__ import annotations
+
+import os
+import threading
+from array import array
+from bisect import bisect_left
+from typing import Any
+
+
+SCOPE = "rotel.exports"
+COUNTERS = ("requests", "failed", "items", "bytes", "retries", "rejected")
+# milliseconds
+DURATION_BOUNDS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 25.0, 50.0, 100.0, 250.0, 500.0, 1000.0, 2500.0, 5000.0)
+SIZE_BOUNDS = (1024.0, 4096.0, 16384.0, 65536.0, 262144.0, 1048576.0, 4194304.0, 16777216.0)
+HISTOGRAMS = (("encode_ms", DURATION_BOUNDS), ("send_ms", DURATION_BOUNDS), ("request_bytes", SIZE_BOUNDS))
+
+
+def _layout() -> tuple[dict[str, int], int]:
+    # the values of a signal are the counters, then per histogram its bucket counts and sum
+    offsets = {}
+    width = len(COUNTERS)
+    for name, bounds in HISTOGRAMS:
+        offsets[name] = width
+        width += len(bounds) + 2
+    return offsets, width
+
+
+_OFFSETS, _WIDTH = _layout()
+_ENCODE = _OFFSETS["encode_ms"]
+_SEND = _OFFSETS["send_ms"]
+_SIZE = _OFFSETS["request_bytes"]
+
+_local = threading.local()
+# signal -> values, of every thread that recorded
+_shards: list[dict[str, array]] = []
+_shards_lock = threading.Lock()
+_instruments: _Instruments | None = None
+
+
+def _values(signal: str) -> array:
+    try:
+        shard = _local.shard
+    except AttributeError:
+        shard = _local.shard = {}
+        with _shards_lock:
+            _shards.append(shard)
+    values = shard.get(signal)
+    if values is None:
+        values = shard[signal] = array("d", bytes(8 * _WIDTH))
+    return values
+
+
+def _observe(values: array, offset: int, bounds: tuple[float, ...], value: float) -> None:
+    values[offset + bisect_left(bounds, value)] += 1
+    values[offset + len(bounds) + 1] += value
+
+
+def record_encode(signal: str, seconds: float) -> None:
+    """Record the time spent encoding a batch of signal into requests"""
+    _observe(_values(signal), _ENCODE, DURATION_BOUNDS, seconds * 1000.0)
+    if _instruments is not None:
+        _instruments.encode.record(seconds * 1000.0, {"signal": signal})
+
+
+def record_send(
+    signal: str, size: int, items: int, seconds: float, ok: bool, retries: int = 0, rejected: int = 0,
+) -> None:
+    """Record a request of size bytes and items items, answered in seconds
+
+    rejected is the number of items of a partial success, retries the number of
+    times the request was sent again."""
+    values = _values(signal)
+    values[0] += 1
+    if not ok:
+        values[1] += 1
+    values[2] += items
+    values[3] += size
+    values[4] += retries
+    values[5] += rejected
+    _observe(values, _SEND, DURATION_BOUNDS, seconds * 1000.0)
+    _observe(values, _SIZE, SIZE_BOUNDS, size)
+    if _instruments is not None:
+        _instruments.record_send(signal, size, items, seconds, ok, retries, rejected)
+
+
+def _histogram(totals: array, offset: int, bounds: tuple[float, ...]) -> dict[str, Any]:
+    counts = [int(c) for c in totals[offset:offset + len(bounds) + 1]]
+    count = sum(counts)
+    total = totals[offset + len(bounds) + 1]
+    return {"count": count, "sum": total, "mean": total / count if count else 0.0, "bounds": list(bounds),
+            "counts": counts}
+
+
+def snapshot(signal: str | None = None) -> dict[str, dict[str, Any]]:
+    """Totals since the process started (or forked), keyed by signal
+
+    Each signal has the counters of COUNTERS and the histograms of HISTOGRAMS,
+    with their count, sum, mean, bucket bounds and counts per bucket (one
+    more than the bounds). Pass signal for that signal only."""
+    with _shards_lock:
+        shards = list(_shards)
+    totals: dict[str, array] = {}
+    for shard in shards:
+        for name, values in list(shard.items()):
+            total = totals.setdefault(name, array("d", bytes(8 * _WIDTH)))
+            for i, value in enumerate(values):
+                total[i] += value
+    out = {}
+    for name, total in totals.items():
+        if signal is not None and name != signal:
+            continue
+        stats: dict[str, Any] = {counter: int(total[i]) for i, counter in enumerate(COUNTERS)}
+        for histogram, bounds in HISTOGRAMS:
+            stats[histogram] = _histogram(total, _OFFSETS[histogram], bounds)
+        out[name] = stats
+    return out
+
+
+def reset() -> None:
+    """Forget the recorded values"""
+    with _shards_lock:
+        for shard in _shards:
+            for values in shard.values():
+                for i in range(len(values)):
+                    values[i] = 0.0
+
+
+class _Instruments:
+    def __init__(self):
+        from . import metrics
+
+        meter = metrics.get_meter(SCOPE)
+        self.requests = meter.counter("rotel.export.requests", description="Requests sent to the agent")
+        self.items = meter.counter("rotel.export.items", description="Items sent to the agent")
+        self.bytes = meter.counter("rotel.export.bytes", unit="By", description="Bytes sent to the agent")
+        self.retries = meter.counter("rotel.export.retries", description="Requests sent again to the agent")
+        self.rejected = meter.counter("rotel.export.rejected", description="Items rejected by the agent")
+        self.encode = meter.histogram(
+            "rotel.export.encode.duration", unit="ms", description="Time spent encoding batches",
+            bounds=DURATION_BOUNDS,
+        )
+        self.send = meter.histogram(
+            "rotel.export.send.duration", unit="ms", description="Time until the agent answered",
+            bounds=DURATION_BOUNDS,
+        )
+        self.size = meter.histogram(
+            "rotel.export.request.size", unit="By", description="Size of the requests", bounds=SIZE_BOUNDS,
+        )
+
+    def record_send(
+        self, signal: str, size: int, items: int, seconds: float, ok: bool, retries: int, rejected: int,
+    ) -> None:
+        attrs = {"signal": signal}
+        self.requests.add(1, {"signal": signal, "outcome": "ok" if ok else "failed"})
+        self.items.add(items, attrs)
+        self.bytes.add(size, attrs)
+        if retries:
+            self.retries.add(retries, attrs)
+        if rejected:
+            self.rejected.add(rejected, attrs)
+        self.send.record(seconds * 1000.0, attrs)
+        self.size.record(size, attrs)
+
+
+def enable_metrics() -> None:
+    """Record the requests with rotel.metrics instruments too, in the rotel.exports scope"""
+    global _instruments
+    if _instruments is None:
+        _instruments = _Instruments()
+
+
+def disable_metrics() -> None:
+    global _instruments
+    _instruments = None
+
+
+def _after_fork_in_child() -> None:
+    # requests of the parent are not counted in the child
+    global _local, _shards, _shards_lock
+    _local = threading.local()
+    _shards = []
+    _shards_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
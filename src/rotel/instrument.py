@@ -0,0 +1,110 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Per-processor latency and error instrumentation.
+#
+# With processors_instrument enabled, each processor is loaded by the agent
+# through a generated wrapper module. The wrappers share the instrumentation
+# state in rotel/processors/instrument.py, which records latency histograms,
+# items in and out, errors and the slowest calls of every processor. The agent
+# writes the statistics to a file next to its pid file, read_processor_stats()
+# loads them for Client.processor_stats().
+
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+
+from ._generate import write_module
+from .reload import ENTRY_POINTS
+
+
+DEFAULT_INTERVAL = "10s"
+
+_WRAPPER = '''\
+# Generated by rotel.instrument, do not edit.
+
+import importlib.util
+import sys
+
+
+def _instrument():
+    # shared by all wrappers in the agent
+    module = sys.modules.get("rotel_processor_instrument")
+    if module is None:
+        spec = importlib.util.spec_from_file_location("rotel_processor_instrument", {instrument!r})
+        module = importlib.util.module_from_spec(spec)
+        sys.modules["rotel_processor_instrument"] = module
+        spec.loader.exec_module(module)
+    return module
+
+
+{entry} = _instrument().wrap({name!r}, {signal!r}, {target!r})
+'''
+
+
+def compile_instrument_wrapper(name: str, path: str, signal: str) -> str:
+    """Generate the source of a wrapper module instrumenting the processor at path"""
+    entry = ENTRY_POINTS.get(signal)
+    if entry is None:
+        raise ValueError(f"unknown signal {signal}")
+    instrument = str(Path(__file__).parent / "processors" / "instrument.py")
+    return _WRAPPER.format(
+        instrument=instrument, entry=entry, name=name, signal=signal, target=os.path.abspath(path)
+    )
+
+
+def write_instrument_wrapper(name: str, path: str, signal: str, directory: str | None = None) -> str:
+    """Write an instrumenting wrapper for the processor at path and return the wrapper's path"""
+    return write_module(f"instrument_{signal}", compile_instrument_wrapper(name, path, signal), directory)
+
+
+def stats_path(pid_file: str) -> str:
+    """Path of the processor statistics file of the agent using pid_file"""
+    return os.path.splitext(pid_file)[0] + ".processors.json"
+
+
+def read_processor_stats(path: str) -> dict[str, dict]:
+    """Load processor statistics written by the agent, keyed by "signal/name"
+
+    Returns an empty dict until the agent has written its first report."""
+    try:
+        with open(path, encoding="utf-8") as file:
+            data = json.load(file)
+    except FileNotFoundError:
+        return {}
+    return data.get("processors") or {}
+
+
+def merge_processor_stats(stats: list[dict[str, dict]]) -> dict[str, dict]:
+    """Combine the processor statistics of several agents, like the members of an agent pool"""
+    if len(stats) == 1:
+        return stats[0]
+    merged: dict[str, dict] = {}
+    for agent_stats in stats:
+        for key, entry in agent_stats.items():
+            into = merged.get(key)
+            if into is None:
+                merged[key] = dict(entry, slowest=list(entry.get("slowest") or []))
+                continue
+            calls = into["calls"] + entry["calls"]
+            items_in = into["items_in"] + entry["items_in"]
+            total_us = into["mean_us"] * into["calls"] + entry["mean_us"] * entry["calls"]
+            keep = max(len(into["slowest"]), len(entry.get("slowest") or []))
+            into.update(
+                calls=calls,
+                errors=into["errors"] + entry["errors"],
+                items_in=items_in,
+                items_out=into["items_out"] + entry["items_out"],
+                mean_us=total_us / calls if calls else 0.0,
+                us_per_item=total_us / items_in if items_in else 0.0,
+                max_us=max(into["max_us"], entry["max_us"]),
+                bucket_counts=[a + b for a, b in zip(into["bucket_counts"], entry["bucket_counts"])],
+                slowest=sorted(
+                    into["slowest"] + list(entry.get("slowest") or []),
+                    key=lambda s: s["duration_us"],
+                    reverse=True,
+                )[:keep],
+                last_error=into["last_error"] or entry["last_error"],
+            )
+    return merged
@@ -0,0 +1,118 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Priority lanes for the in-process senders.
+#
+# A sender's queue is bounded, and once it is full every new item is dropped,
+# so under overload an error span is as likely to be lost as a health check.
+# With lanes, each item is put in a lane chosen by a classifier when it is
+# queued, and:
+#
+#   - when the queue is full, a new item takes the place of the oldest item of
+#     the lowest lane below its own, and is dropped only when there is none
+#   - batches are filled from the lanes in proportion to their weights, with
+#     smooth weighted round robin, so a backlog of bulk items does not hold up
+#     errors and lower lanes still get their share of the requests.
+#
+# Lanes are (name, weight) pairs from the highest priority to the lowest. The
+# classifiers run on the application's threads and should stay as cheap as an
+# attribute lookup.
+
+from __future__ import annotations
+
+import logging
+from collections import deque
+from collections.abc import Sequence
+from typing import Any
+
+from . import _otlp
+
+
+DEFAULT_LANES = (("error", 8), ("high", 4), ("normal", 2), ("bulk", 1))
+
+
+class LaneQueue:
+    """Queues of items by lane, taken in proportion to the lane weights
+
+    A drop-in for the deque of a sender: popleft() and len() work the same,
+    items are added with put(item, lane). Drops are counted per lane in
+    stats[f"{item}_dropped_{lane}"]. Safe for producers on any thread with a
+    single consumer."""
+
+    def __init__(self, lanes: Sequence[tuple[str, int]], stats: dict[str, int], item: str):
+        self.lanes = tuple(lanes)
+        self.names = [name for name, _ in self.lanes]
+        self._index = {name: i for i, name in enumerate(self.names)}
+        self._weights = [weight for _, weight in self.lanes]
+        self._queues: list[deque[Any]] = [deque() for _ in self.lanes]
+        self._credits = [0] * len(self.lanes)
+        self._stats = stats
+        self._keys = [f"{item}_dropped_{name}" for name in self.names]
+        for key in self._keys:
+            stats.setdefault(key, 0)
+
+    def __len__(self) -> int:
+        return sum(len(queue) for queue in self._queues)
+
+    def lane(self, name: str) -> int:
+        """Index of lane name, the lowest lane for an unknown name"""
+        return self._index.get(name, len(self._queues) - 1)
+
+    def put(self, item: Any, lane: int) -> None:
+        self._queues[lane].append(item)
+
+    def evict(self, lane: int) -> Any | None:
+        """Drop the oldest item of the lowest lane below lane and return it, None when those lanes are empty"""
+        for index in range(len(self._queues) - 1, lane, -1):
+            try:
+                item = self._queues[index].popleft()
+            except IndexError:
+                continue
+            self._stats[self._keys[index]] += 1
+            return item
+        return None
+
+    def reject(self, lane: int) -> None:
+        """Count an item of lane dropped without being queued"""
+        self._stats[self._keys[lane]] += 1
+
+    def popleft(self) -> Any:
+        # smooth weighted round robin over the lanes holding items
+        best = -1
+        total = 0
+        credits = self._credits
+        for index, queue in enumerate(self._queues):
+            if queue:
+                credits[index] += self._weights[index]
+                total += self._weights[index]
+                if best < 0 or credits[index] > credits[best]:
+                    best = index
+        if best < 0:
+            raise IndexError("pop from an empty LaneQueue")
+        credits[best] -= total
+        return self._queues[best].popleft()
+
+    def queued(self) -> dict[str, int]:
+        """Number of items queued in each lane"""
+        return {name: len(queue) for name, queue in zip(self.names, self._queues)}
+
+
+def span_lane(span: Any) -> str:
+    """Default lane of a rotel.trace span: "error" for spans with an error status, "normal" otherwise"""
+    return "error" if span.status_code == _otlp.STATUS_ERROR else "normal"
+
+
+def record_lane(record: logging.LogRecord) -> str:
+    """Default lane of a log record: "error" from ERROR, "high" for WARNING, "bulk" below INFO"""
+    if record.levelno >= logging.ERROR:
+        return "error"
+    if record.levelno >= logging.WARNING:
+        return "high"
+    if record.levelno < logging.INFO:
+        return "bulk"
+    return "normal"
+
+
+def sdk_span_lane(span: Any) -> str:
+    """Default lane of an OpenTelemetry SDK span, "error" for spans with an error status"""
+    status = getattr(span, "status", None)
+    return "error" if status is not None and not status.is_ok else "normal"
@@ -0,0 +1,295 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Non-blocking stdlib logging handler that ships records to the agent.
+#
+# RotelHandler.emit() only appends a tuple of the record's fields to a bounded
+# deque, it takes no lock and does no formatting. A background thread drains the
+# queue in batches, formats the messages, encodes them as OTLP log records and
+# posts them to the agent's OTLP HTTP receiver. When the queue is full new
+# records are dropped and counted rather than blocking the caller, or with
+# priority lanes (rotel.lanes) records of lower lanes make room for them.
+
+from __future__ import annotations
+
+import logging
+import os
+import threading
+import time
+import traceback
+import weakref
+from collections import deque
+from collections.abc import Callable, Sequence
+from typing import Any
+
+from . import _otlp, exports
+from .lanes import DEFAULT_LANES, LaneQueue, record_lane
+
+
+DEFAULT_CAPACITY = 8192
+DEFAULT_BATCH_SIZE = 512
+DEFAULT_FLUSH_INTERVAL = 1.0
+DEFAULT_SCOPE = "rotel.logging"
+
+
+def severity_number(levelno: int) -> int:
+    """OpenTelemetry severity number for a stdlib logging level"""
+    if levelno < logging.DEBUG:
+        return 1 # TRACE
+    if levelno < logging.INFO:
+        return 5 # DEBUG
+    if levelno < logging.WARNING:
+        return 9 # INFO
+    if levelno < logging.ERROR:
+        return 13 # WARN
+    if levelno < logging.CRITICAL:
+        return 17 # ERROR
+    return 21 # FATAL
+
+
+def _span_context_getter():
+    # Trace context of the current OpenTelemetry span, if the API is installed
+    try:
+        from opentelemetry import trace
+    except ImportError:
+        return None
+    get_current_span = trace.get_current_span
+
+    def current():
+        ctx = get_current_span().get_span_context()
+        if ctx.is_valid:
+            return ctx.trace_id, ctx.span_id, ctx.trace_flags
+        return None
+
+    return current
+
+
+class RotelHandler(logging.Handler):
+    def __init__(
+        self,
+        level: int | str = logging.NOTSET,
+        capacity: int = DEFAULT_CAPACITY,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+        endpoint: str | None = None,
+        resource: dict[str, Any] | None = None,
+        capture_context: bool = True,
+        max_batch_bytes: int | None = None,
+        lanes: Sequence[tuple[str, int]] | bool | None = None,
+        classify: Callable[[logging.LogRecord], str] | None = None,
+    ):
+        super().__init__(level)
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.endpoint = endpoint
+        # request size limit, from the agent's exporters when None
+        self.max_batch_bytes = max_batch_bytes
+        # priority lanes, see rotel.lanes
+        self.lanes = tuple(DEFAULT_LANES if lanes is True else lanes) if lanes else None
+        self.classify = classify or record_lane
+
+        attrs = _otlp.default_resource_attributes()
+        attrs.update(resource or {})
+        self._resource = _otlp.resource(attrs)
+        self._context = _span_context_getter() if capture_context else None
+
+        self._thread: threading.Thread | None = None
+        self._closed = False
+        self._start_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._flush_waiters: list[threading.Event] = []
+        self._conn = _otlp.AgentConnection(endpoint)
+
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            "records_sent": 0,
+            "records_dropped": 0,
+            "records_failed": 0,
+            "records_oversize": 0,
+            "batches_sent": 0,
+            "batch_splits": 0,
+            "export_errors": 0,
+        }
+        self._queue = self._new_queue()
+        _handlers.add(self)
+
+    def handle(self, record: logging.LogRecord):
+        # Same as logging.Handler.handle() without taking the handler lock,
+        # emit() is safe to call concurrently.
+        rv = self.filter(record)
+        if isinstance(rv, logging.LogRecord):
+            record = rv
+        if rv:
+            self.emit(record)
+        return rv
+
+    def emit(self, record: logging.LogRecord) -> None:
+        queue = self._queue
+        lane = queue.lane(self.classify(record)) if self.lanes is not None else None
+        if len(queue) >= self.capacity or self._closed:
+            with self._stats_lock:
+                self.stats["records_dropped"] += 1
+            if lane is None:
+                return
+            # make room by dropping from the lowest lane first
+            if self._closed or queue.evict(lane) is None:
+                queue.reject(lane)
+                return
+        if self._thread is None:
+            self._start()
+
+        ctx = self._context() if self._context is not None else None
+        entry = (
+            record.created, record.levelno, record.levelname, record.name, record.msg, record.args,
+            record.exc_info, record.stack_info, record.pathname, record.lineno, record.funcName, record.thread, ctx,
+        )
+        if lane is None:
+            queue.append(entry)
+        else:
+            queue.put(entry, lane)
+        if len(queue) >= self.batch_size:
+            self._wakeup.set()
+
+    def flush(self, timeout: float = 5.0) -> None:
+        """Wait until the queued records have been sent"""
+        thread = self._thread
+        if thread is None or not thread.is_alive() or not self._queue:
+            return
+        done = threading.Event()
+        with self._start_lock:
+            self._flush_waiters.append(done)
+        self._wakeup.set()
+        done.wait(timeout)
+
+    def close(self) -> None:
+        self._closed = True
+        thread = self._thread
+        if thread is not None:
+            self._wakeup.set()
+            thread.join(5.0)
+        self._conn.close()
+        super().close()
+
+    def _start(self) -> None:
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="rotel-logging", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self._drain()
+        self._drain()
+
+    def _drain(self) -> None:
+        queue = self._queue
+        while queue:
+            batch = []
+            try:
+                for _ in range(self.batch_size):
+                    batch.append(queue.popleft())
+            except IndexError:
+                pass
+            self._send(batch)
+
+        with self._start_lock:
+            waiters, self._flush_waiters = self._flush_waiters, []
+        for done in waiters:
+            done.set()
+
+    def _send(self, batch: list[tuple]) -> None:
+        start = time.perf_counter()
+        try:
+            requests = self._encode_requests(batch)
+            exports.record_encode("logs", time.perf_counter() - start)
+        except Exception:
+            traceback.print_exc()
+            self.stats["records_failed"] += len(batch)
+            return
+        for body, count in requests:
+            if self._conn.post(_otlp.LOGS_PATH, body, count):
+                self.stats["records_sent"] += count
+                self.stats["batches_sent"] += 1
+            else:
+                self.stats["records_failed"] += count
+                self.stats["export_errors"] += 1
+
+    def _encode_requests(self, batch: list[tuple]) -> list[tuple[bytes, int]]:
+        # requests within the size limit, with the number of records in each
+        max_bytes = self.max_batch_bytes or _otlp.agent_batch_bytes("logs")
+        return [
+            (_otlp.logs_request(self._resource, scopes), count)
+            for scopes, count in _otlp.split_request(
+                self._resource, self._encode_records(batch), max_bytes, self.stats, "records",
+            )
+        ]
+
+    def _encode_records(self, batch: list[tuple]) -> list[tuple[bytes, bytes]]:
+        encoded = []
+        scopes: dict[str, bytes] = {}
+        for (created, levelno, levelname, name, msg, args, exc_info, stack_info,
+                pathname, lineno, func_name, thread_id, ctx) in batch:
+            message = str(msg)
+            if args:
+                try:
+                    message = message % args
+                except Exception:
+                    message = f"{message} {args!r}"
+
+            attrs = {
+                "code.filepath": pathname,
+                "code.lineno": lineno,
+                "code.function": func_name,
+                "thread.id": thread_id,
+            }
+            if exc_info and exc_info[0] is not None:
+                attrs["exception.type"] = exc_info[0].__name__
+                attrs["exception.message"] = str(exc_info[1])
+                attrs["exception.stacktrace"] = "".join(traceback.format_exception(*exc_info))
+            if stack_info:
+                attrs["code.stacktrace"] = stack_info
+
+            trace_id = span_id = None
+            flags = 0
+            if ctx is not None:
+                trace_id = ctx[0].to_bytes(16, "big")
+                span_id = ctx[1].to_bytes(8, "big")
+                flags = int(ctx[2])
+
+            name = name or DEFAULT_SCOPE
+            scope = scopes.get(name)
+            if scope is None:
+                scope = scopes[name] = _otlp.scope(name)
+            encoded.append((scope, _otlp.log_record(
+                int(created * 1e9), severity_number(levelno), levelname, message, attrs,
+                trace_id=trace_id, span_id=span_id, flags=flags,
+            )))
+        return encoded
+
+    def _new_queue(self) -> deque[tuple] | LaneQueue:
+        return LaneQueue(self.lanes, self.stats, "records") if self.lanes is not None else deque()
+
+    def _after_fork(self) -> None:
+        # Records queued before the fork belong to the parent, which sends them.
+        # The child starts over with its own thread and connection.
+        self._queue = self._new_queue()
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._flush_waiters = []
+        self._stats_lock = threading.Lock()
+        self._conn = _otlp.AgentConnection(self.endpoint)
+
+
+_handlers: weakref.WeakSet[RotelHandler] = weakref.WeakSet()
+
+
+def _after_fork_in_child() -> None:
+    for handler in list(_handlers):
+        handler._after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,588 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Low-overhead in-process metrics sent straight to the agent.
+#
+# Instruments pre-aggregate measurements in flat arrays of doubles, one slot (or
+# one run of slots for histograms) per attribute set. Attribute dicts are
+# resolved to a slot index with a single dict lookup, and the canonical form of
+# each attribute set is interned together with its OTLP encoding, so nothing is
+# allocated per measurement. Each thread writes into its own array, so no lock
+# is taken on the hot path, and the arrays of finished threads are folded into
+# a shared base. All values are cumulative: a background thread sums the arrays
+# on an interval and posts OTLP metrics to the agent's HTTP receiver.
+#
+# This works alongside the OpenTelemetry SDK, both send to the agent started by
+# Client.
+
+from __future__ import annotations
+
+import atexit
+import math
+import os
+import threading
+import time
+import traceback
+import weakref
+from array import array
+from bisect import bisect_left
+from collections.abc import Callable, Mapping, Sequence
+from typing import Any
+
+from . import _otlp, exports
+from ._shared_metrics import (
+    DEFAULT_CAPACITY,
+    DEFAULT_MAX_WORKERS,
+    SharedMetrics,
+    segment_name,
+)
+
+
+DEFAULT_INTERVAL = 10.0
+DEFAULT_MAX_SERIES = 2_000
+# same defaults as the OpenTelemetry SDK
+DEFAULT_BOUNDS = (0.0, 5.0, 10.0, 25.0, 50.0, 75.0, 100.0, 250.0, 500.0, 750.0, 1000.0, 2500.0, 5000.0, 7500.0, 10000.0)
+OVERFLOW_ATTRIBUTES = (("otel.metric.overflow", True),)
+
+# slots allocated per thread array at a time
+_GROW_SERIES = 64
+
+
+class AttributeSet:
+    """Canonical, interned attribute set with its cached OTLP encoding"""
+
+    __slots__ = ("items", "_encoded")
+
+    def __init__(self, items: tuple):
+        self.items = items
+        self._encoded: dict[int, bytes] = {}
+
+    def encoded(self, field: int) -> bytes:
+        enc = self._encoded.get(field)
+        if enc is None:
+            enc = self._encoded[field] = _otlp.attributes(field, self.items)
+        return enc
+
+
+_attribute_sets: dict[tuple, AttributeSet] = {}
+_attribute_sets_lock = threading.Lock()
+
+
+def intern_attributes(attrs: Mapping[str, Any] | None) -> AttributeSet:
+    return _intern(tuple(sorted(attrs.items())) if attrs else ())
+
+
+def _intern(items: tuple) -> AttributeSet:
+    attr_set = _attribute_sets.get(items)
+    if attr_set is None:
+        with _attribute_sets_lock:
+            attr_set = _attribute_sets.setdefault(items, AttributeSet(items))
+    return attr_set
+
+
+class _Instrument:
+    kind = ""
+    # slots per series in the value arrays
+    stride = 1
+
+    def __init__(self, meter: Meter, name: str, unit: str | None, description: str | None, max_series: int):
+        self.meter = meter
+        self.name = name
+        self.unit = unit
+        self.description = description
+        self.max_series = max_series
+        self.start_time = time.time_ns()
+
+        # reentrant, a finished thread's array may be retired from a finalizer
+        self._lock = threading.RLock()
+        # attribute dict items in call order -> series index
+        self._index: dict[tuple, int] = {}
+        # canonical attribute set -> series index
+        self._canonical: dict[tuple, int] = {}
+        self._series: list[AttributeSet] = []
+        self._overflow: int | None = None
+
+        self._local = threading.local()
+        # arrays of the live threads, and the sum of those of finished threads
+        self._shards: list[array] = []
+        self._base = array("d")
+
+    def _series_index(self, attrs: Mapping[str, Any] | None) -> int:
+        key = tuple(attrs.items()) if attrs else ()
+        idx = self._index.get(key)
+        if idx is None:
+            idx = self._register(key, attrs)
+        return idx
+
+    def _register(self, key: tuple, attrs: Mapping[str, Any] | None) -> int:
+        items = tuple(sorted(attrs.items())) if attrs else ()
+        with self._lock:
+            idx = self._canonical.get(items)
+            if idx is None:
+                if len(self._series) < self.max_series:
+                    idx = self._canonical[items] = self._new_series(_intern(items))
+                else:
+                    # extra series are merged into a single overflow series, neither
+                    # indexed nor interned so the index and the intern table stay bounded
+                    if self._overflow is None:
+                        self._overflow = self._new_series(intern_attributes(dict(OVERFLOW_ATTRIBUTES)))
+                    return self._overflow
+            self._index[key] = idx
+            return idx
+
+    def _new_series(self, attr_set: AttributeSet) -> int:
+        self._series.append(attr_set)
+        return len(self._series) - 1
+
+    def _template(self) -> list[float]:
+        return [0.0] * self.stride
+
+    def _shard(self) -> array:
+        # array of the calling thread, created on first use
+        values = array("d")
+        owner = _ShardOwner()
+        weakref.finalize(owner, self._retire, values)
+        with self._lock:
+            self._shards.append(values)
+        self._local.values = values
+        self._local.owner = owner
+        return values
+
+    def _grow(self, values: array, idx: int) -> None:
+        n = (idx // _GROW_SERIES + 1) * _GROW_SERIES - len(values) // self.stride
+        values.extend(self._template() * n)
+
+    def _retire(self, values: array) -> None:
+        # thread finished, fold its values into the base
+        with self._lock:
+            try:
+                self._shards.remove(values)
+            except ValueError:
+                return
+            if len(self._base) < len(values):
+                self._base.extend(self._template() * ((len(values) - len(self._base)) // self.stride))
+            self._fold(self._base, values)
+
+    def _fold(self, into: array, values: array) -> None:
+        for i, v in enumerate(values):
+            into[i] += v
+
+    def _totals(self) -> array:
+        with self._lock:
+            shards = list(self._shards)
+            total = array("d", self._base)
+        needed = max([len(total)] + [len(s) for s in shards])
+        if len(total) < needed:
+            total.extend(self._template() * ((needed - len(total)) // self.stride))
+        for shard in shards:
+            self._fold(total, shard)
+        return total
+
+    def _reset(self) -> None:
+        self._lock = threading.RLock()
+        self._local = threading.local()
+        self._shards = []
+        self._base = array("d")
+        self.start_time = time.time_ns()
+
+    def collect(self, now: int) -> bytes | None:
+        raise NotImplementedError
+
+
+class _ShardOwner:
+    # lives in the thread-local, finalized when the thread exits
+    __slots__ = ("__weakref__",)
+
+
+class Counter(_Instrument):
+    def __init__(self, meter: Meter, name: str, unit: str | None, description: str | None, max_series: int,
+                 monotonic: bool = True):
+        super().__init__(meter, name, unit, description, max_series)
+        self.monotonic = monotonic
+        self.kind = "counter" if monotonic else "up_down_counter"
+
+    def add(self, amount: float, attributes: Mapping[str, Any] | None = None) -> None:
+        key = tuple(attributes.items()) if attributes else ()
+        idx = self._index.get(key)
+        if idx is None:
+            idx = self._register(key, attributes)
+        try:
+            values = self._local.values
+        except AttributeError:
+            values = self._shard()
+        try:
+            values[idx] += amount
+        except IndexError:
+            self._grow(values, idx)
+            values[idx] += amount
+
+    def bind(self, attributes: Mapping[str, Any] | None = None) -> BoundCounter:
+        """Resolve the attribute set once, for the hottest call sites"""
+        return BoundCounter(self, self._series_index(attributes))
+
+    def collect(self, now: int) -> bytes | None:
+        totals = self._totals()
+        points = [
+            _otlp.number_data_point(self._series[i].encoded(7), self.start_time, now, totals[i])
+            for i in range(min(len(totals), len(self._series)))
+        ]
+        if not points:
+            return None
+        return _otlp.sum_metric(self.name, self.description, self.unit, points, self.monotonic)
+
+
+class BoundCounter:
+    __slots__ = ("_counter", "_idx")
+
+    def __init__(self, counter: Counter, idx: int):
+        self._counter = counter
+        self._idx = idx
+
+    def add(self, amount: float = 1) -> None:
+        counter = self._counter
+        try:
+            values = counter._local.values
+        except AttributeError:
+            values = counter._shard()
+        try:
+            values[self._idx] += amount
+        except IndexError:
+            counter._grow(values, self._idx)
+            values[self._idx] += amount
+
+
+class Histogram(_Instrument):
+    kind = "histogram"
+
+    def __init__(self, meter: Meter, name: str, unit: str | None, description: str | None, max_series: int,
+                 bounds: Sequence[float] = DEFAULT_BOUNDS):
+        self.bounds = list(bounds)
+        # buckets, then sum, min and max
+        self.stride = len(self.bounds) + 4
+        super().__init__(meter, name, unit, description, max_series)
+
+    def _template(self) -> list[float]:
+        return [0.0] * (len(self.bounds) + 2) + [math.inf, -math.inf]
+
+    def record(self, value: float, attributes: Mapping[str, Any] | None = None) -> None:
+        key = tuple(attributes.items()) if attributes else ()
+        idx = self._index.get(key)
+        if idx is None:
+            idx = self._register(key, attributes)
+        try:
+            values = self._local.values
+        except AttributeError:
+            values = self._shard()
+        self._record(values, idx, value)
+
+    def _record(self, values: array, idx: int, value: float) -> None:
+        nb = len(self.bounds) + 1
+        base = idx * self.stride
+        if base >= len(values):
+            self._grow(values, idx)
+        values[base + bisect_left(self.bounds, value)] += 1
+        values[base + nb] += value
+        if value < values[base + nb + 1]:
+            values[base + nb + 1] = value
+        if value > values[base + nb + 2]:
+            values[base + nb + 2] = value
+
+    def bind(self, attributes: Mapping[str, Any] | None = None) -> BoundHistogram:
+        """Resolve the attribute set once, for the hottest call sites"""
+        return BoundHistogram(self, self._series_index(attributes))
+
+    def _fold(self, into: array, values: array) -> None:
+        nb = len(self.bounds) + 1
+        for base in range(0, len(values), self.stride):
+            for i in range(base, base + nb + 1):
+                into[i] += values[i]
+            into[base + nb + 1] = min(into[base + nb + 1], values[base + nb + 1])
+            into[base + nb + 2] = max(into[base + nb + 2], values[base + nb + 2])
+
+    def collect(self, now: int) -> bytes | None:
+        totals = self._totals()
+        nb = len(self.bounds) + 1
+        points = []
+        for i in range(min(len(totals) // self.stride, len(self._series))):
+            base = i * self.stride
+            counts = [int(c) for c in totals[base:base + nb]]
+            if not any(counts):
+                continue
+            points.append(_otlp.histogram_data_point(
+                self._series[i].encoded(9), self.start_time, now, counts, self.bounds,
+                totals[base + nb], totals[base + nb + 1], totals[base + nb + 2],
+            ))
+        if not points:
+            return None
+        return _otlp.histogram_metric(self.name, self.description, self.unit, points)
+
+
+class BoundHistogram:
+    __slots__ = ("_histogram", "_idx")
+
+    def __init__(self, histogram: Histogram, idx: int):
+        self._histogram = histogram
+        self._idx = idx
+
+    def record(self, value: float) -> None:
+        histogram = self._histogram
+        try:
+            values = histogram._local.values
+        except AttributeError:
+            values = histogram._shard()
+        histogram._record(values, self._idx, value)
+
+
+class Gauge(_Instrument):
+    # Last value wins, so all threads share one array. Unset series are NaN.
+    kind = "gauge"
+
+    def _template(self) -> list[float]:
+        return [math.nan]
+
+    def set(self, value: float, attributes: Mapping[str, Any] | None = None) -> None:
+        key = tuple(attributes.items()) if attributes else ()
+        idx = self._index.get(key)
+        if idx is None:
+            idx = self._register(key, attributes)
+        try:
+            self._base[idx] = value
+        except IndexError:
+            with self._lock:
+                if idx >= len(self._base):
+                    self._grow(self._base, idx)
+            self._base[idx] = value
+
+    def collect(self, now: int) -> bytes | None:
+        values = array("d", self._base)
+        points = [
+            _otlp.number_data_point(self._series[i].encoded(7), self.start_time, now, v)
+            for i, v in enumerate(values[:len(self._series)])
+            if not math.isnan(v)
+        ]
+        if not points:
+            return None
+        return _otlp.gauge_metric(self.name, self.description, self.unit, points)
+
+
+class Meter:
+    def __init__(self, name: str, version: str | None = None, max_series: int = DEFAULT_MAX_SERIES):
+        self.name = name
+        self.version = version
+        self.max_series = max_series
+        self._scope = _otlp.scope(name, version)
+        self._lock = threading.Lock()
+        self._instruments: dict[str, _Instrument] = {}
+
+    def _instrument(self, cls, name: str, **kwargs) -> Any:
+        with self._lock:
+            instrument = self._instruments.get(name)
+            if instrument is None:
+                instrument = self._instruments[name] = cls(self, name, max_series=self.max_series, **kwargs)
+            elif type(instrument) is not cls:
+                raise ValueError(f"metric {name} is already registered as a {type(instrument).__name__}")
+        _exporter.start()
+        return instrument
+
+    def counter(self, name: str, unit: str | None = None, description: str | None = None) -> Counter:
+        return self._instrument(Counter, name, unit=unit, description=description)
+
+    def up_down_counter(self, name: str, unit: str | None = None, description: str | None = None) -> Counter:
+        return self._instrument(Counter, name, unit=unit, description=description, monotonic=False)
+
+    def histogram(self, name: str, unit: str | None = None, description: str | None = None,
+                  bounds: Sequence[float] = DEFAULT_BOUNDS) -> Histogram:
+        return self._instrument(Histogram, name, unit=unit, description=description, bounds=bounds)
+
+    def gauge(self, name: str, unit: str | None = None, description: str | None = None) -> Gauge:
+        return self._instrument(Gauge, name, unit=unit, description=description)
+
+    def instruments(self) -> list[_Instrument]:
+        with self._lock:
+            return list(self._instruments.values())
+
+    def collect(self, now: int) -> list[bytes]:
+        return [m for m in (i.collect(now) for i in self.instruments()) if m is not None]
+
+
+class _Exporter:
+    def __init__(self):
+        self.interval = DEFAULT_INTERVAL
+        self.endpoint: str | None = None
+        self.resource: dict[str, Any] = {}
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._conn = _otlp.AgentConnection()
+        # set when aggregating across processes
+        self.shared: SharedMetrics | None = None
+        self.stats = {"exports": 0, "export_errors": 0}
+
+    def start(self) -> None:
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="rotel-metrics", daemon=True)
+                    self._thread.start()
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.export()
+            except Exception:
+                traceback.print_exc()
+
+    def _resource(self) -> bytes:
+        attrs = _otlp.default_resource_attributes()
+        attrs.update(self.resource)
+        return _otlp.resource(attrs)
+
+    def encode(self) -> bytes | None:
+        now = time.time_ns()
+        with _meters_lock:
+            meters = list(_meters.values())
+        scopes = [(meter._scope, metrics) for meter in meters if (metrics := meter.collect(now))]
+        if not scopes:
+            return None
+        return _otlp.metrics_request(self._resource(), scopes)
+
+    def run_callbacks(self) -> None:
+        for callback in list(_callbacks):
+            try:
+                callback()
+            except Exception:
+                traceback.print_exc()
+
+    def collect(self) -> bytes | None:
+        """Encode the request this process exports, None when there is nothing to send, call with _lock held"""
+        shared = self.shared
+        if shared is not None:
+            with _meters_lock:
+                meters = list(_meters.values())
+            # without a free row this process exports its own series
+            if shared.publish([i for meter in meters for i in meter.instruments()]):
+                if not shared.try_lease(stale_after=3 * self.interval):
+                    return None
+                return shared.encode(self._resource())
+        return self.encode()
+
+    def export(self) -> bool:
+        self.run_callbacks()
+        with self._lock:
+            start = time.perf_counter()
+            body = self.collect()
+            if body is None:
+                return True
+            exports.record_encode("metrics", time.perf_counter() - start)
+            ok = self._conn.post(_otlp.METRICS_PATH, body, _otlp.data_points(body))
+            self.stats["exports" if ok else "export_errors"] += 1
+            return ok
+
+    def shutdown(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(5.0)
+        self.export()
+        self._conn.close()
+        if self.shared is not None:
+            self.shared.release_lease()
+            self.shared.close()
+            self.shared = None
+
+    def _after_fork(self) -> None:
+        running = self._thread is not None
+        self._thread = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._conn = _otlp.AgentConnection(self.endpoint)
+        if self.shared is not None:
+            self.shared.after_fork()
+        if running:
+            # instruments created before the fork won't start the thread again
+            self.start()
+
+
+_meters: dict[tuple[str, str | None], Meter] = {}
+_meters_lock = threading.Lock()
+_callbacks: list[Callable[[], None]] = []
+_exporter = _Exporter()
+
+
+def configure(
+    interval: float | None = None,
+    endpoint: str | None = None,
+    resource: dict[str, Any] | None = None,
+) -> None:
+    """Set the export interval in seconds, the agent endpoint and extra resource attributes"""
+    if interval is not None:
+        _exporter.interval = interval
+    if endpoint is not None:
+        _exporter.endpoint = endpoint
+        _exporter._conn = _otlp.AgentConnection(endpoint)
+    if resource is not None:
+        _exporter.resource = dict(resource)
+
+
+def register_callback(callback: Callable[[], None]) -> None:
+    """Call callback before every export, to record values that are sampled rather than measured"""
+    _callbacks.append(callback)
+
+
+def unregister_callback(callback: Callable[[], None]) -> None:
+    if callback in _callbacks:
+        _callbacks.remove(callback)
+
+
+def enable_shared(
+    name: str | None = None,
+    max_workers: int = DEFAULT_MAX_WORKERS,
+    capacity: int = DEFAULT_CAPACITY,
+) -> None:
+    """Aggregate the metrics of all processes using the shared memory segment name
+
+    Call before forking workers, or in every process. Each process publishes its
+    totals to the segment, a single process exports the merged series. Up to
+    max_workers processes and capacity values per process are supported, a
+    histogram series takes one value per bucket plus four."""
+    if _exporter.shared is not None:
+        return
+    if name is None:
+        from .client import Client
+
+        client = Client.get()
+        name = segment_name(client.config.options.get("pid_file") if client is not None else None)
+    _exporter.shared = SharedMetrics(name, max_workers=max_workers, capacity=capacity)
+    _exporter.start()
+
+
+def get_meter(name: str, version: str | None = None, max_series: int = DEFAULT_MAX_SERIES) -> Meter:
+    """Meter for an instrumentation scope, instruments are limited to max_series attribute sets"""
+    with _meters_lock:
+        meter = _meters.get((name, version))
+        if meter is None:
+            meter = _meters[(name, version)] = Meter(name, version, max_series)
+    return meter
+
+
+def flush() -> bool:
+    """Export the current values now"""
+    return _exporter.export()
+
+
+def shutdown() -> None:
+    _exporter.shutdown()
+
+
+def _after_fork_in_child() -> None:
+    # Values recorded before the fork are exported by the parent, the child
+    # starts its series from zero.
+    for meter in list(_meters.values()):
+        meter._lock = threading.Lock()
+        for instrument in list(meter._instruments.values()):
+            instrument._reset()
+    _exporter._after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+atexit.register(lambda: _exporter._thread is not None and shutdown())
@@ -0,0 +1,79 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Scale-out agent pools.
+#
+# With agent_pool_size set, Client starts that many agents, each with its own
+# pid and log files and receivers on every other port after the configured
+# ones. The agent binds its receivers itself, so instead of sharing one port
+# the senders spread the load: each process sends to the member picked by its
+# pid, and when trace processors are configured the rotel tracing senders route
+# spans by trace id, so the spans of a trace they send from any process of the
+# host reach the same agent. PartitionedSpanExporter does the same for the
+# OpenTelemetry SDK. Spans sent to a single member's endpoint, like those of
+# other services, are not routed.
+
+from __future__ import annotations
+
+import os
+from collections.abc import Callable, Sequence
+from typing import Any
+
+
+# members interleave their ports, so adjacent gRPC and HTTP ports, like the defaults, do not collide
+PORT_STRIDE = 2
+
+
+def member_endpoint(endpoint: str, index: int) -> str:
+    """Endpoint of pool member index, on the port of endpoint plus PORT_STRIDE times index"""
+    scheme, sep, rest = endpoint.rpartition("://")
+    host, _, port = rest.rpartition(":")
+    return f"{scheme}{sep}{host}:{int(port) + PORT_STRIDE * index}"
+
+
+def member_index(trace_id: int | bytes, size: int) -> int:
+    """Pool member receiving the spans of trace_id"""
+    if isinstance(trace_id, (bytes, bytearray)):
+        trace_id = int.from_bytes(trace_id, "big")
+    # the high half, samplers decide on the low one
+    return (trace_id >> 64) % size
+
+
+def process_member(size: int) -> int:
+    """Pool member this process sends its telemetry to"""
+    return os.getpid() % size
+
+
+class PartitionedSpanExporter:
+    """OpenTelemetry SDK span exporter sending each trace to one pool member
+
+    Wraps one exporter per member, created by factory(endpoint) for the OTLP
+    endpoints of Client.endpoints()."""
+
+    def __init__(self, endpoints: Sequence[str], factory: Callable[[str], Any]):
+        if not endpoints:
+            raise ValueError("no endpoints")
+        self.exporters = [factory(endpoint) for endpoint in endpoints]
+
+    def export(self, spans: Sequence[Any]) -> Any:
+        parts: dict[int, list[Any]] = {}
+        size = len(self.exporters)
+        for span in spans:
+            parts.setdefault(member_index(span.context.trace_id, size), []).append(span)
+        result = None
+        for index, part in parts.items():
+            outcome = self.exporters[index].export(part)
+            # any failure fails the export
+            if result is None or getattr(outcome, "name", None) != "SUCCESS":
+                result = outcome
+        if result is None:
+            from opentelemetry.sdk.trace.export import SpanExportResult
+
+            result = SpanExportResult.SUCCESS
+        return result
+
+    def shutdown(self) -> None:
+        for exporter in self.exporters:
+            exporter.shutdown()
+
+    def force_flush(self, timeout_millis: int = 30000) -> bool:
+        return all(exporter.force_flush(timeout_millis) for exporter in self.exporters)
@@ -0,0 +1,281 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Exporter preflight checks.
+#
+# A wrong exporter host, a TLS mismatch or an unreachable broker only shows up
+# once the agent is running, after it has queued data and retried for
+# retry_max_elapsed_time. With preflight enabled, Client.start() first checks
+# every configured exporter endpoint: it resolves the host, opens a TCP
+# connection, performs the TLS handshake with the exporter's TLS settings and
+# sends a request the service must answer:
+#
+#   otlp http     an empty export request, answered 200 by a receiver
+#   otlp grpc     the HTTP/2 connection preface, answered with SETTINGS
+#   clickhouse    GET /ping
+#   datadog       GET /api/v1/validate with the API key
+#   kafka         an ApiVersions request to each broker
+#
+# The checks run concurrently in daemon threads and all share one deadline, a
+# check still running when it passes fails at the stage it reached.
+
+from __future__ import annotations
+
+import http.client
+import socket
+import ssl
+import struct
+import threading
+import time
+from typing import Any
+from urllib.parse import urlsplit
+
+
+DEFAULT_TIMEOUT = 2.0
+
+DATADOG_HOSTS = {
+    "us1": "api.datadoghq.com",
+    "us3": "api.us3.datadoghq.com",
+    "us5": "api.us5.datadoghq.com",
+    "eu": "api.datadoghq.eu",
+    "ap1": "api.ap1.datadoghq.com",
+}
+OTLP_PATHS = {"traces": "/v1/traces", "metrics": "/v1/metrics", "logs": "/v1/logs"}
+
+_H2_PREFACE = b"PRI * HTTP/2.0\r\n\r\nSM\r\n\r\n"
+# an empty SETTINGS frame
+_H2_SETTINGS = b"\x00\x00\x00\x04\x00\x00\x00\x00\x00"
+_KAFKA_API_VERSIONS = 18
+
+
+class Target:
+    """One endpoint to check, and how to talk to it"""
+
+    def __init__(
+        self,
+        exporter: str,
+        kind: str,
+        host: str,
+        port: int,
+        tls: bool = False,
+        path: str = "/",
+        headers: dict[str, str] | None = None,
+        tls_options: dict[str, Any] | None = None,
+    ):
+        self.exporter = exporter
+        self.kind = kind
+        self.host = host
+        self.port = port
+        self.tls = tls
+        self.path = path
+        self.headers = headers or {}
+        self.tls_options = tls_options or {}
+
+    @property
+    def address(self) -> str:
+        return f"{self.host}:{self.port}"
+
+
+def _url_target(exporter: str, kind: str, url: str, default_port: int, **kwargs: Any) -> Target:
+    if "://" not in url:
+        url = "http://" + url
+    parts = urlsplit(url)
+    tls = parts.scheme == "https"
+    port = parts.port or (443 if tls else default_port)
+    return Target(exporter, kind, parts.hostname or "", port, tls=tls, path=parts.path or "/", **kwargs)
+
+
+def _tls_options(options: dict) -> dict[str, Any]:
+    return {k: options.get(k) for k in ("tls_cert_file", "tls_key_file", "tls_ca_file", "tls_skip_verify")}
+
+
+def exporter_targets(name: str, exporter: dict) -> list[Target]:
+    """Endpoints used by one exporter config, named name in the report"""
+    exporter_type = exporter.get("_type") or "otlp"
+    if exporter_type == "blackhole":
+        return []
+    if exporter_type == "datadog":
+        host = exporter.get("custom_endpoint") or f"https://{DATADOG_HOSTS.get(exporter.get('region') or 'us1')}"
+        target = _url_target(name, "datadog", host, 443, headers={"DD-API-KEY": exporter.get("api_key") or ""})
+        target.path = "/api/v1/validate"
+        return [target]
+    if exporter_type == "clickhouse":
+        target = _url_target(name, "clickhouse", exporter.get("endpoint") or "", 8123)
+        target.path = "/ping"
+        return [target]
+    if exporter_type == "kafka":
+        tls = (exporter.get("security_protocol") or "plaintext") in ("ssl", "sasl-ssl")
+        targets = []
+        for broker in exporter.get("brokers") or ["localhost:9092"]:
+            host, _, port = broker.rpartition(":")
+            targets.append(Target(name, "kafka", host, int(port), tls=tls))
+        return targets
+
+    targets = []
+    # the signal endpoints are checked as well when they are set
+    for signal, options in [(None, exporter), *((s, exporter.get(s)) for s in OTLP_PATHS)]:
+        if not options or not options.get("endpoint"):
+            continue
+        merged = options if signal is None else {**exporter, **options}
+        protocol = merged.get("protocol") or "grpc"
+        target = _url_target(
+            name if signal is None else f"{name}/{signal}",
+            f"otlp_{protocol}",
+            options["endpoint"],
+            4317 if protocol == "grpc" else 4318,
+            headers=merged.get("headers"),
+            tls_options=_tls_options(merged),
+        )
+        # TLS settings imply TLS on an endpoint without a scheme
+        target.tls = target.tls or bool(merged.get("tls_ca_file") or merged.get("tls_cert_file"))
+        if protocol == "http" and target.path in ("", "/"):
+            target.path = OTLP_PATHS[signal or "traces"]
+        targets.append(target)
+    return targets
+
+
+def _ssl_context(target: Target) -> ssl.SSLContext:
+    options = target.tls_options
+    context = ssl.create_default_context(cafile=options.get("tls_ca_file"))
+    if options.get("tls_cert_file"):
+        context.load_cert_chain(options["tls_cert_file"], options.get("tls_key_file"))
+    if options.get("tls_skip_verify"):
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    if target.kind == "otlp_grpc":
+        context.set_alpn_protocols(["h2"])
+    return context
+
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+    data = b""
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise ConnectionError("connection closed by the server")
+        data += chunk
+    return data
+
+
+def _ping(target: Target, sock: socket.socket) -> str:
+    """Send the protocol request of target and return a description of the answer, raise when it is wrong"""
+    if target.kind == "otlp_grpc":
+        if isinstance(sock, ssl.SSLSocket) and sock.selected_alpn_protocol() != "h2":
+            raise ConnectionError("server does not speak HTTP/2")
+        sock.sendall(_H2_PREFACE + _H2_SETTINGS)
+        header = _recv_exactly(sock, 9)
+        if header[3] != 0x4:
+            raise ConnectionError("server did not answer with HTTP/2 SETTINGS")
+        return "HTTP/2 SETTINGS"
+
+    if target.kind == "kafka":
+        client_id = b"rotel-preflight"
+        body = struct.pack(">hhih", _KAFKA_API_VERSIONS, 0, 1, len(client_id)) + client_id
+        sock.sendall(struct.pack(">i", len(body)) + body)
+        _, correlation_id = struct.unpack(">ii", _recv_exactly(sock, 8))
+        error_code, = struct.unpack(">h", _recv_exactly(sock, 2))
+        if correlation_id != 1:
+            raise ConnectionError("unexpected answer to Kafka ApiVersions")
+        if error_code != 0:
+            raise ConnectionError(f"Kafka ApiVersions error {error_code}")
+        return "Kafka ApiVersions"
+
+    conn = http.client.HTTPConnection(target.host, target.port)
+    conn.sock = sock
+    headers = {"Host": target.host, **target.headers}
+    if target.kind == "otlp_http":
+        # an empty export request is valid for every signal
+        conn.request("POST", target.path, body=b"", headers={**headers, "Content-Type": "application/x-protobuf"})
+    else:
+        conn.request("GET", target.path, headers=headers)
+    status = conn.getresponse().status
+    if status in (401, 403):
+        raise PermissionError(f"HTTP {status}, check the credentials")
+    if not 200 <= status < 300:
+        raise ConnectionError(f"HTTP {status}")
+    return f"HTTP {status}"
+
+
+def _connect(addresses: list, deadline: float) -> socket.socket:
+    # every address the host resolves to, like socket.create_connection
+    error: OSError | None = None
+    for family, kind, proto, _, address in addresses:
+        sock = socket.socket(family, kind, proto)
+        try:
+            sock.settimeout(max(deadline - time.monotonic(), 0.001))
+            sock.connect(address)
+            return sock
+        except OSError as e:
+            sock.close()
+            error = e
+    raise error or OSError("no address")
+
+
+def check(target: Target, deadline: float, result: dict) -> None:
+    """Run the stages of target in order, recording each one in result"""
+    sock = None
+    try:
+        result["stage"] = "dns"
+        begin = time.perf_counter()
+        addresses = socket.getaddrinfo(target.host, target.port, type=socket.SOCK_STREAM)
+        result["dns_ms"] = (time.perf_counter() - begin) * 1000.0
+
+        result["stage"] = "connect"
+        begin = time.perf_counter()
+        sock = _connect(addresses, deadline)
+        result["connect_ms"] = (time.perf_counter() - begin) * 1000.0
+
+        if target.tls:
+            result["stage"] = "tls"
+            begin = time.perf_counter()
+            sock = _ssl_context(target).wrap_socket(sock, server_hostname=target.host)
+            result["tls_ms"] = (time.perf_counter() - begin) * 1000.0
+
+        result["stage"] = "ping"
+        begin = time.perf_counter()
+        sock.settimeout(max(deadline - time.monotonic(), 0.001))
+        result["detail"] = _ping(target, sock)
+        result["ping_ms"] = (time.perf_counter() - begin) * 1000.0
+        result["stage"] = None
+        result["ok"] = True
+    except (OSError, ValueError, http.client.HTTPException, struct.error) as e:
+        # garbage answers fail the check, they must not kill the thread
+        result["error"] = str(e) or type(e).__name__
+    finally:
+        if sock is not None:
+            sock.close()
+
+
+def run(targets: list[Target], timeout: float = DEFAULT_TIMEOUT) -> dict:
+    """Check targets concurrently within timeout seconds
+
+    Returns {"ok": bool, "checks": [...]} with one entry per target giving the
+    exporter, kind and address, the milliseconds spent in each stage reached,
+    and on failure the stage that failed and why."""
+    deadline = time.monotonic() + timeout
+    checks = []
+    threads = []
+    for target in targets:
+        result = {
+            "exporter": target.exporter, "kind": target.kind, "address": target.address, "ok": False,
+            "stage": None, "error": None, "detail": None,
+            "dns_ms": None, "connect_ms": None, "tls_ms": None, "ping_ms": None,
+        }
+        checks.append(result)
+        # getaddrinfo has no timeout, daemon threads do not hold up the interpreter
+        thread = threading.Thread(target=check, args=(target, deadline, result), name="rotel-preflight", daemon=True)
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join(max(deadline - time.monotonic(), 0.0))
+    # copies, checks that timed out keep running
+    checks = [dict(result, ok=False, error="timed out") if thread.is_alive() else dict(result)
+              for thread, result in zip(threads, checks)]
+    return {"ok": all(result["ok"] for result in checks), "checks": checks}
+
+
+def describe(report: dict) -> str:
+    """One line per failed check, for the log"""
+    return "; ".join(
+        f"{c['exporter']} ({c['kind']} {c['address']}) failed at {c['stage']}: {c['error']}"
+        for c in report["checks"] if not c["ok"]
+    )
@@ -0,0 +1,61 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Counters of the built-in processors holding state inside the agent.
+#
+# The tail sampling, metric cardinality and log deduplication processors count
+# what they kept, dropped and evicted. With a pid file the agent writes those
+# counters to a JSON file per processor next to it, read_processor_counters()
+# loads them for Client.processor_counters().
+
+from __future__ import annotations
+
+import json
+import os
+
+
+PROCESSORS = ("tail_sampling", "metric_cardinality", "log_dedup")
+
+
+def counters_path(pid_file: str, processor_type: str) -> str:
+    """Path of the counters file of processor_type in the agent using pid_file"""
+    return os.path.splitext(pid_file)[0] + f".{processor_type}.json"
+
+
+def read_processor_counters(pid_file: str) -> dict[str, dict]:
+    """Load the counters written by the agent, keyed by processor type
+
+    Processors without a file, because they are not configured or the agent has
+    not written one yet, are left out."""
+    counters = {}
+    for processor_type in PROCESSORS:
+        try:
+            with open(counters_path(pid_file, processor_type), encoding="utf-8") as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            continue
+        data.pop("pid", None)
+        data.pop("time", None)
+        counters[processor_type] = data
+    return counters
+
+
+def _add(into: dict, entry: dict) -> None:
+    for key, value in entry.items():
+        if isinstance(value, dict):
+            _add(into.setdefault(key, {}), value)
+        else:
+            into[key] = into.get(key, 0) + value
+
+
+def merge_processor_counters(counters: list[dict[str, dict]]) -> dict[str, dict]:
+    """Add up the counters of several agents, like the members of an agent pool
+
+    Cardinality estimates are added up as well, a series sent to several
+    members is counted once per member."""
+    if len(counters) == 1:
+        return counters[0]
+    merged: dict[str, dict] = {}
+    for agent_counters in counters:
+        for processor_type, entry in agent_counters.items():
+            _add(merged.setdefault(processor_type, {}), entry)
+    return merged
@@ -0,0 +1,6 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Built-in processors for the rotel agent. Each module in this package is loaded
+# directly by the agent's embedded Python interpreter from its file path, so the
+# modules must be self-contained and only depend on the standard library and the
+# rotel_sdk. Configure them with the Config.*_processor() builder methods.
@@ -0,0 +1,330 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Latency and error instrumentation for processors.
+#
+# With processors_instrument enabled every processor in the processor lists is
+# loaded through a generated wrapper that calls wrap() from this module. Each
+# call records its latency in a histogram, the number of items (spans, metric
+# data points or log records) before and after the processor, and whether it
+# raised. The slowest calls are kept as samples. Periodically the statistics are
+# written to a JSON file next to the agent's pid file, where Client reads them,
+# and exported as metrics to the agent's own OTLP receiver.
+#
+# This module is loaded once per agent and shared by all wrappers, so there is a
+# single export thread no matter how many processors are instrumented.
+
+from __future__ import annotations
+
+import heapq
+import importlib.util
+import itertools
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import traceback
+import urllib.request
+
+
+DEFAULT_INTERVAL = 10.0
+DEFAULT_SLOWEST = 5
+
+# microseconds
+DURATION_BOUNDS = [10, 25, 50, 100, 250, 500, 1_000, 2_500, 5_000, 10_000, 25_000, 50_000, 100_000, 250_000, 1_000_000]
+
+CALLS_METRIC = "rotel.processor.calls"
+ERRORS_METRIC = "rotel.processor.errors"
+ITEMS_METRIC = "rotel.processor.items"
+DURATION_METRIC = "rotel.processor.duration"
+
+ENTRY_POINTS = {
+    "traces": "process_spans",
+    "metrics": "process_metrics",
+    "logs": "process_logs",
+}
+
+
+def count_spans(resource_spans) -> int:
+    return sum(len(scope_spans.spans) for scope_spans in resource_spans.scope_spans)
+
+
+def count_data_points(resource_metrics) -> int:
+    return sum(
+        len(getattr(metric.data, "data_points", None) or ())
+        for scope_metrics in resource_metrics.scope_metrics
+        for metric in scope_metrics.metrics
+    )
+
+
+def count_log_records(resource_logs) -> int:
+    return sum(len(scope_logs.log_records) for scope_logs in resource_logs.scope_logs)
+
+
+COUNTERS = {
+    "traces": count_spans,
+    "metrics": count_data_points,
+    "logs": count_log_records,
+}
+
+
+class ProcessorStats:
+    __slots__ = ("calls", "errors", "items_in", "items_out", "total_ns", "max_ns", "buckets", "slowest", "last_error")
+
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.items_in = 0
+        self.items_out = 0
+        self.total_ns = 0
+        self.max_ns = 0
+        self.buckets = [0] * (len(DURATION_BOUNDS) + 1)
+        # min-heap of (duration_ns, items_in, unix time) of the slowest calls
+        self.slowest: list[tuple[int, int, float]] = []
+        self.last_error: str | None = None
+
+    def record(self, duration_ns: int, items_in: int, items_out: int, error: BaseException | None, keep: int) -> None:
+        self.calls += 1
+        self.items_in += items_in
+        self.items_out += items_out
+        self.total_ns += duration_ns
+        if duration_ns > self.max_ns:
+            self.max_ns = duration_ns
+
+        us = duration_ns / 1_000
+        i = 0
+        for bound in DURATION_BOUNDS:
+            if us <= bound:
+                break
+            i += 1
+        self.buckets[i] += 1
+
+        if error is not None:
+            self.errors += 1
+            self.last_error = f"{type(error).__name__}: {error}"
+
+        if len(self.slowest) < keep:
+            heapq.heappush(self.slowest, (duration_ns, items_in, time.time()))
+        elif keep and duration_ns > self.slowest[0][0]:
+            heapq.heapreplace(self.slowest, (duration_ns, items_in, time.time()))
+
+    def to_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "items_in": self.items_in,
+            "items_out": self.items_out,
+            "mean_us": self.total_ns / self.calls / 1_000 if self.calls else 0.0,
+            "us_per_item": self.total_ns / self.items_in / 1_000 if self.items_in else 0.0,
+            "max_us": self.max_ns / 1_000,
+            "bounds_us": list(DURATION_BOUNDS),
+            "bucket_counts": list(self.buckets),
+            "slowest": [
+                {"duration_us": ns / 1_000, "items": items, "time": ts}
+                for ns, items, ts in sorted(self.slowest, reverse=True)
+            ],
+            "last_error": self.last_error,
+        }
+
+
+class Instrumentation:
+    def __init__(
+        self,
+        stats_file: str | None = None,
+        slowest: int = DEFAULT_SLOWEST,
+        clock=time.perf_counter_ns,
+    ):
+        self.stats_file = stats_file
+        self.slowest = slowest
+        self.clock = clock
+        self.start_time = time.time_ns()
+
+        self._lock = threading.Lock()
+        # (signal, processor name) -> stats
+        self._processors: dict[tuple[str, str], ProcessorStats] = {}
+
+    @classmethod
+    def from_config(cls, config: dict) -> Instrumentation:
+        return cls(
+            stats_file=config.get("stats_file"),
+            slowest=int(config.get("slowest", DEFAULT_SLOWEST)),
+        )
+
+    def wrap(self, name: str, signal: str, fn):
+        """Return fn instrumented as the processor name for signal"""
+        with self._lock:
+            stats = self._processors.setdefault((signal, name), ProcessorStats())
+        count = COUNTERS[signal]
+        clock = self.clock
+        lock = self._lock
+        keep = self.slowest
+
+        def instrumented(batch):
+            items_in = count(batch)
+            error = None
+            start = clock()
+            try:
+                return fn(batch)
+            except BaseException as e:
+                error = e
+                raise
+            finally:
+                duration = clock() - start
+                items_out = items_in if error is not None else count(batch)
+                with lock:
+                    stats.record(duration, items_in, items_out, error, keep)
+
+        instrumented.__name__ = getattr(fn, "__name__", ENTRY_POINTS[signal])
+        return instrumented
+
+    def snapshot(self) -> dict[str, dict]:
+        """Statistics per processor, keyed by "signal/name" """
+        with self._lock:
+            return {f"{signal}/{name}": stats.to_dict() for (signal, name), stats in self._processors.items()}
+
+    def write_stats(self) -> None:
+        if self.stats_file is None:
+            return
+        data = {"pid": os.getpid(), "time": time.time(), "processors": self.snapshot()}
+        directory = os.path.dirname(self.stats_file) or "."
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as file:
+                json.dump(data, file)
+            os.replace(tmp, self.stats_file)
+        except OSError:
+            os.unlink(tmp)
+            raise
+
+    def collect(self) -> dict | None:
+        """Build an OTLP/JSON ExportMetricsServiceRequest with cumulative totals"""
+        with self._lock:
+            if not self._processors:
+                return None
+            now = str(time.time_ns())
+            start = str(self.start_time)
+            calls, errors, items, durations = [], [], [], []
+            for (signal, name), stats in self._processors.items():
+                attrs = [_json_kv("processor", name), _json_kv("signal", signal)]
+                base = {"attributes": attrs, "startTimeUnixNano": start, "timeUnixNano": now}
+                calls.append({**base, "asInt": str(stats.calls)})
+                errors.append({**base, "asInt": str(stats.errors)})
+                for direction, value in (("in", stats.items_in), ("out", stats.items_out)):
+                    items.append({
+                        **base,
+                        "attributes": attrs + [_json_kv("direction", direction)],
+                        "asInt": str(value),
+                    })
+                durations.append({
+                    **base,
+                    "count": str(stats.calls),
+                    "sum": stats.total_ns / 1_000,
+                    "max": stats.max_ns / 1_000,
+                    "bucketCounts": [str(c) for c in stats.buckets],
+                    "explicitBounds": list(DURATION_BOUNDS),
+                })
+
+        def counter(name: str, unit: str, points: list) -> dict:
+            return {
+                "name": name,
+                "unit": unit,
+                "sum": {"dataPoints": points, "aggregationTemporality": 2, "isMonotonic": True},
+            }
+
+        return {"resourceMetrics": [{
+            "resource": {"attributes": [_json_kv("service.name", "rotel-agent")]},
+            "scopeMetrics": [{
+                "scope": {"name": "rotel.processors.instrument"},
+                "metrics": [
+                    counter(CALLS_METRIC, "{call}", calls),
+                    counter(ERRORS_METRIC, "{error}", errors),
+                    counter(ITEMS_METRIC, "{item}", items),
+                    {
+                        "name": DURATION_METRIC,
+                        "unit": "us",
+                        "histogram": {"dataPoints": durations, "aggregationTemporality": 2},
+                    },
+                ],
+            }],
+        }]}
+
+    def export(self, url: str, timeout: float = 5.0) -> None:
+        payload = self.collect()
+        if payload is None:
+            return
+        req = urllib.request.Request(
+            url,
+            data=json.dumps(payload).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        with urllib.request.urlopen(req, timeout=timeout) as resp:
+            resp.read()
+
+
+def agent_metrics_url() -> str:
+    endpoint = os.environ.get("ROTEL_OTLP_HTTP_ENDPOINT") or "localhost:4318"
+    host, _, port = endpoint.rpartition(":")
+    if host in ("", "0.0.0.0", "[::]"):
+        host = "127.0.0.1"
+    return f"http://{host}:{port}/v1/metrics"
+
+
+def _json_kv(key: str, value) -> dict:
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def _report_loop(instrumentation: Instrumentation, interval: float, url: str | None) -> None:
+    while True:
+        time.sleep(interval)
+        try:
+            instrumentation.write_stats()
+            if url is not None:
+                instrumentation.export(url)
+        except OSError:
+            traceback.print_exc()
+
+
+_instrumentation: Instrumentation | None = None
+_instrumentation_lock = threading.Lock()
+_module_ids = itertools.count()
+
+
+def get_instrumentation() -> Instrumentation:
+    global _instrumentation
+    if _instrumentation is None:
+        with _instrumentation_lock:
+            if _instrumentation is None:
+                config = json.loads(os.environ.get("ROTEL_PROCESSOR_INSTRUMENT_CONFIG") or "{}")
+                instrumentation = Instrumentation.from_config(config)
+                url = agent_metrics_url() if config.get("export", True) else None
+                thr = threading.Thread(
+                    target=_report_loop,
+                    args=(instrumentation, float(config.get("interval", DEFAULT_INTERVAL)), url),
+                    name="rotel-processor-instrument",
+                    daemon=True,
+                )
+                thr.start()
+                _instrumentation = instrumentation
+    return _instrumentation
+
+
+def wrap(name: str, signal: str, path: str):
+    """Load the processor module at path and return its instrumented entry point"""
+    entry = ENTRY_POINTS[signal]
+    module_name = f"rotel_instrumented_{signal}_{next(_module_ids)}"
+    spec = importlib.util.spec_from_file_location(module_name, path)
+    if spec is None or spec.loader is None:
+        raise ImportError(f"can not load {path}")
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[module_name] = module
+    try:
+        spec.loader.exec_module(module)
+    except BaseException:
+        del sys.modules[module_name]
+        raise
+    fn = getattr(module, entry, None)
+    if not callable(fn):
+        raise ImportError(f"{path} does not define {entry}()")
+    return get_instrumentation().wrap(name, signal, fn)
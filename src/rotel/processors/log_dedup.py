@@ -0,0 +1,362 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Log deduplication and rate limiting processor for processors_logs.
+#
+# Log records are fingerprinted by resource, severity and message template (the
+# body with numbers, hex strings and UUIDs masked out). The first record of a
+# fingerprint in each window passes through, further duplicates are suppressed,
+# optionally a per-fingerprint token bucket limits how many records pass. When
+# the window closes, the last suppressed record is released into a later batch
+# with a log.repeat_count attribute holding the number of records it stands
+# for: the next batch from the same resource, or a batch of another resource
+# left without records, under the summary's own resource. Records below
+# min_severity are dropped outright. The number of tracked fingerprints and of
+# waiting summaries is capped so memory stays bounded. The counters are written
+# to stats_file every STATS_INTERVAL seconds.
+
+from __future__ import annotations
+
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import traceback
+from collections import OrderedDict
+
+
+try:
+    from rotel_sdk.open_telemetry.common.v1 import KeyValue
+except ImportError: # outside of the agent
+    KeyValue = None
+
+
+DEFAULT_WINDOW = 10.0
+DEFAULT_MAX_FINGERPRINTS = 10_000
+# seconds between writes of the stats file
+STATS_INTERVAL = 10.0
+REPEAT_COUNT_ATTRIBUTE = "log.repeat_count"
+
+SEVERITIES = {
+    "TRACE": 1,
+    "DEBUG": 5,
+    "INFO": 9,
+    "WARN": 13,
+    "WARNING": 13,
+    "ERROR": 17,
+    "FATAL": 21,
+}
+
+_TEMPLATE_RE = re.compile(
+    r"[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}"
+    r"|0x[0-9a-fA-F]+"
+    r"|\b(?=[0-9a-fA-F]*\d)[0-9a-fA-F]{8,}\b"
+    r"|\d+(?:\.\d+)?"
+)
+
+# same units as rotel.duration, which the agent loading this file on its own can not import
+_DURATION_RE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*(ns|us|ms|s|m|h)?\s*$")
+_DURATION_UNITS = {"ns": 1e-9, "us": 1e-6, "ms": 1e-3, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def template(body: str) -> str:
+    """Mask the variable parts of a log message"""
+    return _TEMPLATE_RE.sub("<*>", body)
+
+
+class _Fingerprint:
+    __slots__ = (
+        "window_start", "active", "passed", "tokens", "refilled", "suppressed", "last", "res_key", "resource", "scope",
+    )
+
+    def __init__(self, now: float, tokens: float):
+        self.window_start = now
+        self.active = True
+        self.passed = False
+        self.tokens = tokens
+        self.refilled = now
+        self.suppressed = 0
+        # last suppressed record, released with the repeat count
+        self.last = None
+        self.res_key = None
+        self.resource = None
+        self.scope = None
+
+
+class LogDeduplicator:
+    def __init__(
+        self,
+        window: float = DEFAULT_WINDOW,
+        dedup: bool = True,
+        rate_limit: float | None = None,
+        burst: int | None = None,
+        min_severity: int = 0,
+        max_fingerprints: int = DEFAULT_MAX_FINGERPRINTS,
+        stats_file: str | None = None,
+        clock=time.monotonic,
+    ):
+        self.window = window
+        self.dedup = dedup
+        self.rate_limit = rate_limit
+        self.burst = float(burst if burst is not None else max(1.0, rate_limit or 1.0))
+        self.min_severity = min_severity
+        self.max_fingerprints = max_fingerprints
+        self.clock = clock
+
+        self.stats_file = stats_file
+        self._lock = threading.Lock()
+        self._fingerprints: OrderedDict[tuple, _Fingerprint] = OrderedDict()
+        # summaries waiting for a batch to go into, by resource key
+        self._released: dict[tuple, list] = {}
+        self._released_count = 0
+
+        self.stats = {
+            "records_received": 0,
+            "records_passed": 0,
+            "records_below_severity": 0,
+            "records_deduplicated": 0,
+            "records_rate_limited": 0,
+            "summaries_emitted": 0,
+            "summaries_dropped": 0,
+            "fingerprints_evicted": 0,
+        }
+
+    @classmethod
+    def from_config(cls, config: dict) -> LogDeduplicator:
+        rate_limit = config.get("rate_limit")
+        return cls(
+            window=parse_duration(config.get("window", DEFAULT_WINDOW)),
+            dedup=bool(config.get("dedup", True)),
+            rate_limit=None if rate_limit is None else float(rate_limit),
+            burst=config.get("burst"),
+            min_severity=parse_severity(config.get("min_severity", 0)),
+            max_fingerprints=int(config.get("max_fingerprints", DEFAULT_MAX_FINGERPRINTS)),
+            stats_file=config.get("stats_file"),
+        )
+
+    def write_stats(self) -> None:
+        """Write the counters to stats_file, read by Client.processor_counters()"""
+        if self.stats_file is None:
+            return
+        with self._lock:
+            data = {"pid": os.getpid(), "time": time.time(), **self.stats, "summaries_pending": self._released_count}
+        directory = os.path.dirname(self.stats_file) or "."
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as file:
+                json.dump(data, file)
+            os.replace(tmp, self.stats_file)
+        except OSError:
+            os.unlink(tmp)
+            raise
+
+    def process(self, resource_logs) -> None:
+        with self._lock:
+            now = self.clock()
+            resource = resource_logs.resource
+            res_key = _resource_key(resource)
+
+            for scope_logs in resource_logs.scope_logs:
+                passthrough = []
+                for record in scope_logs.log_records:
+                    self.stats["records_received"] += 1
+                    if self._admit(now, res_key, resource, scope_logs.scope, record):
+                        passthrough.append(record)
+                scope_logs.log_records = passthrough
+
+            self._close_windows(now)
+            self._inject_released(res_key, resource_logs)
+
+    def _admit(self, now: float, res_key: tuple, resource, scope, record) -> bool:
+        severity = record.severity_number
+        if severity and severity < self.min_severity:
+            self.stats["records_below_severity"] += 1
+            return False
+
+        key = (res_key, severity, template(_body_str(record.body)))
+        fp = self._fingerprints.get(key)
+        if fp is None:
+            fp = self._fingerprints[key] = _Fingerprint(now, self.burst)
+            while len(self._fingerprints) > self.max_fingerprints:
+                _, evicted = self._fingerprints.popitem(last=False)
+                self.stats["fingerprints_evicted"] += 1
+                self._release(evicted)
+        fp.active = True
+
+        if self.dedup and fp.passed:
+            self._suppress(fp, res_key, resource, scope, record)
+            self.stats["records_deduplicated"] += 1
+            return False
+
+        if self.rate_limit is not None:
+            fp.tokens = min(self.burst, fp.tokens + (now - fp.refilled) * self.rate_limit)
+            fp.refilled = now
+            if fp.tokens < 1.0:
+                self._suppress(fp, res_key, resource, scope, record)
+                self.stats["records_rate_limited"] += 1
+                return False
+            fp.tokens -= 1.0
+
+        fp.passed = True
+        self.stats["records_passed"] += 1
+        return True
+
+    def _suppress(self, fp: _Fingerprint, res_key: tuple, resource, scope, record) -> None:
+        fp.suppressed += 1
+        fp.last = record
+        fp.res_key = res_key
+        fp.resource = resource
+        fp.scope = scope
+
+    def _release(self, fp: _Fingerprint) -> None:
+        if not fp.suppressed:
+            return
+        self._released.setdefault(fp.res_key, []).append((fp.resource, fp.scope, fp.last, fp.suppressed))
+        self._released_count += 1
+        fp.suppressed = 0
+        fp.last = fp.resource = fp.scope = None
+
+        # Summaries still waiting for a batch, oldest resource first
+        while self._released_count > self.max_fingerprints:
+            key = next(iter(self._released))
+            pending = self._released[key]
+            del pending[0]
+            if not pending:
+                del self._released[key]
+            self._released_count -= 1
+            self.stats["summaries_dropped"] += 1
+
+    def _close_windows(self, now: float) -> None:
+        # Fingerprints are kept in window start order, so only the expired
+        # prefix is visited.
+        deadline = now - self.window
+        expired = []
+        for key, fp in self._fingerprints.items():
+            if fp.window_start > deadline:
+                break
+            expired.append(key)
+
+        for key in expired:
+            fp = self._fingerprints[key]
+            self._release(fp)
+            if not fp.active:
+                # idle for a whole window
+                del self._fingerprints[key]
+                continue
+            # start a new window, keeping the token bucket
+            fp.window_start = now
+            fp.active = False
+            fp.passed = False
+            self._fingerprints.move_to_end(key)
+
+    def _inject_released(self, res_key: tuple, resource_logs) -> None:
+        if not self._released or not resource_logs.scope_logs:
+            return
+        key = res_key
+        if key not in self._released:
+            # A batch left without records carries the summaries of another
+            # resource instead, whose own batches may have stopped
+            if any(scope_logs.log_records for scope_logs in resource_logs.scope_logs):
+                return
+            key = next(iter(self._released))
+        pending = self._released.pop(key)
+        self._released_count -= len(pending)
+
+        scopes = {}
+        if key == res_key:
+            for scope_logs in resource_logs.scope_logs:
+                scopes.setdefault(_scope_name(scope_logs.scope), scope_logs)
+        else:
+            resource_logs.resource = pending[0][0]
+            free = iter(resource_logs.scope_logs)
+            for _, scope, _, _ in pending:
+                name = _scope_name(scope)
+                if name in scopes:
+                    continue
+                target = next(free, None)
+                if target is None:
+                    break
+                target.scope = scope
+                scopes[name] = target
+        default_scope = resource_logs.scope_logs[0]
+
+        additions = {}
+        for _, scope, record, count in pending:
+            attrs = [kv for kv in record.attributes if kv.key != REPEAT_COUNT_ATTRIBUTE]
+            attrs.append(KeyValue.new_int_value(REPEAT_COUNT_ATTRIBUTE, count))
+            record.attributes = attrs
+            target = scopes.get(_scope_name(scope), default_scope)
+            additions.setdefault(id(target), (target, []))[1].append(record)
+        for target, records in additions.values():
+            target.log_records = list(target.log_records) + records
+        self.stats["summaries_emitted"] += len(pending)
+
+
+def parse_severity(value: str | int) -> int:
+    if isinstance(value, int):
+        return value
+    if value.isdigit():
+        return int(value)
+    return SEVERITIES[value.upper()]
+
+
+def parse_duration(value: str | float) -> float:
+    """Parse a duration like "250ms" or "5s" into seconds"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    m = _DURATION_RE.match(value)
+    if m is None:
+        raise ValueError(f"invalid duration: {value}")
+    return float(m.group(1)) * _DURATION_UNITS[m.group(2) or "s"]
+
+
+def _body_str(body) -> str:
+    value = body.value if body is not None else None
+    return "" if value is None else str(value)
+
+
+def _value_str(kv) -> str:
+    value = kv.value.value if kv.value is not None else None
+    return "" if value is None else str(value)
+
+
+def _scope_name(scope) -> str:
+    return scope.name if scope is not None else ""
+
+
+def _resource_key(resource) -> tuple:
+    if resource is None:
+        return ()
+    return tuple((kv.key, _value_str(kv)) for kv in resource.attributes)
+
+
+def _stats_loop(deduplicator: LogDeduplicator) -> None:
+    while True:
+        time.sleep(STATS_INTERVAL)
+        try:
+            deduplicator.write_stats()
+        except OSError:
+            traceback.print_exc()
+
+
+_deduplicator: LogDeduplicator | None = None
+_deduplicator_lock = threading.Lock()
+
+
+def get_deduplicator() -> LogDeduplicator:
+    global _deduplicator
+    if _deduplicator is None:
+        with _deduplicator_lock:
+            if _deduplicator is None:
+                config = json.loads(os.environ.get("ROTEL_PROCESSOR_LOG_DEDUP_CONFIG") or "{}")
+                _deduplicator = LogDeduplicator.from_config(config)
+                if _deduplicator.stats_file is not None:
+                    threading.Thread(
+                        target=_stats_loop, args=(_deduplicator,), name="rotel-log-dedup-stats", daemon=True,
+                    ).start()
+    return _deduplicator
+
+
+def process_logs(resource_logs) -> None:
+    get_deduplicator().process(resource_logs)
@@ -0,0 +1,458 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Metric cardinality limiter for processors_metrics.
+#
+# Each metric name admits up to a fixed number of distinct attribute sets
+# (series). Data points for series beyond the limit have their attributes
+# replaced with otel.metric.overflow=true and are merged into a single overflow
+# point. Configured attributes can also be dropped from every data point, points
+# that end up with identical attributes are re-aggregated. The total cardinality
+# seen per metric is estimated with a HyperLogLog sketch, and the number of
+# tracked metric names is capped, so memory stays bounded for any input. Points
+# of metric names beyond the cap are dropped, tracked names are kept for good
+# so the admitted series of a metric never change. The counters and the
+# estimates go to stats_file every STATS_INTERVAL seconds.
+#
+# Merged cumulative sums and histograms keep a running total per output series:
+# every batch adds what each merged series counted since its previous point, so
+# the totals never go down when a batch lacks some of the series. The previous
+# points of up to max_sources merged series are kept across all metrics, least
+# recently seen first out. A series whose previous point was forgotten is
+# remembered in a small bloom filter of its metric and counts as restarted: its
+# point becomes the new baseline and adds nothing, so a total can fall behind
+# but is never counted twice.
+
+from __future__ import annotations
+
+import json
+import os
+import tempfile
+import threading
+import time
+import traceback
+from collections import OrderedDict
+from math import log
+
+
+try:
+    from rotel_sdk.open_telemetry.common.v1 import KeyValue
+except ImportError: # outside of the agent
+    KeyValue = None
+
+
+DEFAULT_MAX_SERIES = 1_000
+DEFAULT_MAX_METRICS = 1_000
+DEFAULT_MAX_SOURCES = 100_000
+# seconds between writes of the stats file
+STATS_INTERVAL = 10.0
+OVERFLOW_ATTRIBUTE = "otel.metric.overflow"
+AGGREGATION_TEMPORALITY_CUMULATIVE = 2
+
+_HLL_PRECISION = 10
+_HLL_REGISTERS = 1 << _HLL_PRECISION
+_HLL_ALPHA = 0.7213 / (1 + 1.079 / _HLL_REGISTERS)
+_MASK64 = (1 << 64) - 1
+# bits of the filter of forgotten sources of a metric
+_FORGOTTEN_BITS = 1 << 13
+
+
+def _mix64(h: int) -> int:
+    # splitmix64 finalizer, spreads Python's tuple hash over all 64 bits
+    h &= _MASK64
+    h = ((h ^ (h >> 30)) * 0xBF58476D1CE4E5B9) & _MASK64
+    h = ((h ^ (h >> 27)) * 0x94D049BB133111EB) & _MASK64
+    return h ^ (h >> 31)
+
+
+class HyperLogLog:
+    __slots__ = ("registers",)
+
+    def __init__(self):
+        self.registers = bytearray(_HLL_REGISTERS)
+
+    def add(self, h: int) -> None:
+        index = h & (_HLL_REGISTERS - 1)
+        rest = h >> _HLL_PRECISION
+        rank = (64 - _HLL_PRECISION) - rest.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def estimate(self) -> int:
+        total = 0.0
+        zeros = 0
+        for r in self.registers:
+            total += 2.0 ** -r
+            if r == 0:
+                zeros += 1
+        estimate = _HLL_ALPHA * _HLL_REGISTERS * _HLL_REGISTERS / total
+        if estimate <= 2.5 * _HLL_REGISTERS and zeros:
+            # small range correction with linear counting
+            estimate = _HLL_REGISTERS * log(_HLL_REGISTERS / zeros)
+        return int(estimate)
+
+
+class _MetricState:
+    __slots__ = ("admitted", "sketch", "totals", "forgotten")
+
+    def __init__(self):
+        self.admitted: set[int] = set()
+        self.sketch = HyperLogLog()
+        # cumulative series key -> running total of the series merged into it
+        self.totals: dict[tuple, _Total] = {}
+        # bloom filter of the source series whose baseline was evicted, once one was
+        self.forgotten: bytearray | None = None
+
+    def forget(self, source: int) -> None:
+        if self.forgotten is None:
+            self.forgotten = bytearray(_FORGOTTEN_BITS // 8)
+        for bit in (source % _FORGOTTEN_BITS, (source >> 32) % _FORGOTTEN_BITS):
+            self.forgotten[bit >> 3] |= 1 << (bit & 7)
+
+    def was_forgotten(self, source: int) -> bool:
+        forgotten = self.forgotten
+        return forgotten is not None and all(
+            forgotten[bit >> 3] & (1 << (bit & 7))
+            for bit in (source % _FORGOTTEN_BITS, (source >> 32) % _FORGOTTEN_BITS)
+        )
+
+
+class _Total:
+    __slots__ = ("start", "values", "bounds", "min", "max")
+
+    def __init__(self, start: int, bounds: list | None):
+        self.start = start
+        self.values: list | None = None
+        self.bounds = bounds
+        self.min = None
+        self.max = None
+
+
+class CardinalityLimiter:
+    def __init__(
+        self,
+        max_series: int = DEFAULT_MAX_SERIES,
+        max_metrics: int = DEFAULT_MAX_METRICS,
+        limits: dict[str, int] | None = None,
+        drop_attributes: list[str] | None = None,
+        max_sources: int = DEFAULT_MAX_SOURCES,
+        stats_file: str | None = None,
+    ):
+        self.max_series = max_series
+        self.max_metrics = max_metrics
+        self.max_sources = max_sources
+        self.limits = dict(limits or {})
+        self.drop_attributes = frozenset(drop_attributes or ())
+
+        self.stats_file = stats_file
+        self._lock = threading.Lock()
+        self._metrics: OrderedDict[str, _MetricState] = OrderedDict()
+        # (metric name, source series hash) -> (start time, values) last seen of
+        # the series merged into cumulative totals, least recently seen first
+        self._baselines: OrderedDict[tuple[str, int], tuple[int, list]] = OrderedDict()
+
+        self.stats = {
+            "points_received": 0,
+            "points_overflowed": 0,
+            "points_merged": 0,
+            "attributes_dropped": 0,
+            "series_admitted": 0,
+            "points_dropped": 0,
+            "baselines_evicted": 0,
+        }
+
+    @classmethod
+    def from_config(cls, config: dict) -> CardinalityLimiter:
+        return cls(
+            max_series=int(config.get("max_series", DEFAULT_MAX_SERIES)),
+            max_metrics=int(config.get("max_metrics", DEFAULT_MAX_METRICS)),
+            limits=config.get("limits"),
+            drop_attributes=config.get("drop_attributes"),
+            max_sources=int(config.get("max_sources", DEFAULT_MAX_SOURCES)),
+            stats_file=config.get("stats_file"),
+        )
+
+    def write_stats(self) -> None:
+        """Write the counters to stats_file, read by Client.processor_counters()"""
+        if self.stats_file is None:
+            return
+        with self._lock:
+            data = {
+                "pid": os.getpid(), "time": time.time(), **self.stats,
+                "cardinality": {name: state.sketch.estimate() for name, state in self._metrics.items()},
+            }
+        directory = os.path.dirname(self.stats_file) or "."
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as file:
+                json.dump(data, file)
+            os.replace(tmp, self.stats_file)
+        except OSError:
+            os.unlink(tmp)
+            raise
+
+    def cardinality(self) -> dict[str, int]:
+        """Estimated number of distinct series seen per tracked metric"""
+        with self._lock:
+            return {name: state.sketch.estimate() for name, state in self._metrics.items()}
+
+    def process(self, resource_metrics) -> None:
+        with self._lock:
+            for scope_metrics in resource_metrics.scope_metrics:
+                for metric in scope_metrics.metrics:
+                    self._process_metric(metric)
+
+    def _state(self, name: str) -> _MetricState | None:
+        # Tracked metrics are never forgotten, forgetting one would admit a
+        # different set of its series afterwards
+        state = self._metrics.get(name)
+        if state is None and len(self._metrics) < self.max_metrics:
+            state = self._metrics[name] = _MetricState()
+        return state
+
+    def _process_metric(self, metric) -> None:
+        data = metric.data
+        points = getattr(data, "data_points", None)
+        if not points:
+            return
+
+        name = metric.name
+        state = self._state(name)
+        if state is None:
+            self.stats["points_received"] += len(points)
+            self.stats["points_dropped"] += len(points)
+            data.data_points = []
+            return
+
+        merge = _merge_fn(data, points[0])
+        # merged cumulative points must keep counting up across batches
+        cumulative = (
+            merge in (_merge_sum, _merge_histogram)
+            and getattr(data, "aggregation_temporality", None) == AGGREGATION_TEMPORALITY_CUMULATIVE
+        )
+        limit = self.limits.get(metric.name, self.max_series)
+        drop = self.drop_attributes
+
+        # series key -> (source series hash, data point, attributes rewritten), in arrival order
+        groups: dict[tuple, list] = {}
+        changed = False
+        for dp in points:
+            self.stats["points_received"] += 1
+            attrs = dp.attributes
+            rewritten = False
+            source = None
+            if drop:
+                kept = [kv for kv in attrs if kv.key not in drop]
+                if len(kept) != len(attrs):
+                    self.stats["attributes_dropped"] += len(attrs) - len(kept)
+                    if cumulative:
+                        source = _mix64(hash(tuple(sorted((kv.key, _value_str(kv)) for kv in attrs))))
+                    dp.attributes = kept
+                    attrs = kept
+                    rewritten = True
+
+            key = tuple(sorted((kv.key, _value_str(kv)) for kv in attrs))
+            h = _mix64(hash(key))
+            state.sketch.add(h)
+            if h not in state.admitted:
+                if len(state.admitted) < limit:
+                    state.admitted.add(h)
+                    self.stats["series_admitted"] += 1
+                else:
+                    self.stats["points_overflowed"] += 1
+                    key = ((OVERFLOW_ATTRIBUTE, "True"),)
+                    dp.attributes = [_overflow_kv()]
+                    rewritten = True
+            groups.setdefault(key, []).append((h if source is None else source, dp, rewritten))
+
+        out = []
+        for key, members in groups.items():
+            if cumulative and (len(members) > 1 or members[0][2] or key in state.totals):
+                out.extend(self._merge_cumulative(name, state, key, members))
+                changed = True
+            elif len(members) == 1:
+                out.append(members[0][1])
+            else:
+                changed = True
+                into = members[0][1]
+                out.append(into)
+                for _, dp, _ in members[1:]:
+                    if merge is not None and merge(into, dp):
+                        self.stats["points_merged"] += 1
+                    else:
+                        # no way to combine these points, keep both
+                        out.append(dp)
+
+        if changed:
+            data.data_points = out
+
+    def _merge_cumulative(self, name: str, state: _MetricState, key: tuple, members: list) -> list:
+        # Each batch holds the latest values of whichever series it carries, so
+        # adding them up would go down when a series is missing. The total adds
+        # what each series counted since its last point instead.
+        total = state.totals.get(key)
+        first = total is None
+        if first:
+            dp = members[0][1]
+            total = state.totals[key] = _Total(
+                min(dp.start_time_unix_nano for _, dp, _ in members), _bounds(dp),
+            )
+        into = None
+        out = []
+        for source, dp, _ in members:
+            if _bounds(dp) != total.bounds:
+                # no way to combine these points, keep it
+                out.append(dp)
+                continue
+            values = _values(dp)
+            start = dp.start_time_unix_nano
+            previous = self._baselines.pop((name, source), None)
+            if previous is None:
+                if not first and state.was_forgotten(source):
+                    # counted before its baseline was evicted, adding it again would count it twice
+                    increment = None
+                else:
+                    # a series first seen after the total started only adds what it counts from now on
+                    increment = values if first or start >= total.start else None
+            elif previous[0] != start or any(v < p for v, p in zip(values, previous[1])):
+                # the series restarted
+                increment = values
+            else:
+                increment = [v - p for v, p in zip(values, previous[1])]
+            self._baselines[(name, source)] = (start, values)
+            while len(self._baselines) > self.max_sources:
+                (evicted_name, evicted), _ = self._baselines.popitem(last=False)
+                self._metrics[evicted_name].forget(evicted)
+                self.stats["baselines_evicted"] += 1
+
+            if increment is not None:
+                if total.values is None:
+                    total.values = list(increment)
+                else:
+                    total.values = [t + i for t, i in zip(total.values, increment)]
+            elif total.values is None:
+                total.values = [0] * len(values)
+            if getattr(dp, "min", None) is not None and (total.min is None or dp.min < total.min):
+                total.min = dp.min
+            if getattr(dp, "max", None) is not None and (total.max is None or dp.max > total.max):
+                total.max = dp.max
+
+            if into is None:
+                into = dp
+                out.append(dp)
+            else:
+                into.time_unix_nano = max(into.time_unix_nano, dp.time_unix_nano)
+                self.stats["points_merged"] += 1
+        if into is not None:
+            into.start_time_unix_nano = total.start
+            _set_values(into, total)
+        return out
+
+
+def _merge_sum(into, dp) -> bool:
+    into.value = _number(into) + _number(dp)
+    into.start_time_unix_nano = min(into.start_time_unix_nano, dp.start_time_unix_nano)
+    into.time_unix_nano = max(into.time_unix_nano, dp.time_unix_nano)
+    return True
+
+
+def _merge_gauge(into, dp) -> bool:
+    # last value wins
+    if dp.time_unix_nano >= into.time_unix_nano:
+        into.value = _number(dp)
+        into.time_unix_nano = dp.time_unix_nano
+    return True
+
+
+def _merge_histogram(into, dp) -> bool:
+    if list(into.explicit_bounds) != list(dp.explicit_bounds):
+        return False
+    into.bucket_counts = [a + b for a, b in zip(into.bucket_counts, dp.bucket_counts)]
+    into.count += dp.count
+    if dp.sum is not None:
+        into.sum = (into.sum or 0.0) + dp.sum
+    if dp.min is not None and (into.min is None or dp.min < into.min):
+        into.min = dp.min
+    if dp.max is not None and (into.max is None or dp.max > into.max):
+        into.max = dp.max
+    into.start_time_unix_nano = min(into.start_time_unix_nano, dp.start_time_unix_nano)
+    into.time_unix_nano = max(into.time_unix_nano, dp.time_unix_nano)
+    return True
+
+
+def _bounds(dp) -> list | None:
+    bounds = getattr(dp, "explicit_bounds", None)
+    return None if bounds is None else list(bounds)
+
+
+def _values(dp) -> list:
+    if hasattr(dp, "bucket_counts"):
+        return [*dp.bucket_counts, dp.count, dp.sum or 0.0]
+    return [_number(dp)]
+
+
+def _set_values(dp, total: _Total) -> None:
+    values = total.values
+    if hasattr(dp, "bucket_counts"):
+        dp.bucket_counts = values[:-2]
+        dp.count = values[-2]
+        dp.sum = values[-1]
+        dp.min = total.min
+        dp.max = total.max
+    else:
+        dp.value = values[0]
+
+
+def _merge_fn(data, dp):
+    if hasattr(dp, "bucket_counts") and hasattr(dp, "explicit_bounds"):
+        return _merge_histogram
+    if hasattr(dp, "value"):
+        # Sums carry an aggregation temporality, gauges do not
+        return _merge_sum if hasattr(data, "aggregation_temporality") else _merge_gauge
+    # exponential histograms and summaries are limited but never merged
+    return None
+
+
+def _number(dp):
+    value = dp.value
+    # NumberDataPoint values may be wrapped in a oneof holder
+    return getattr(value, "value", value)
+
+
+def _value_str(kv) -> str:
+    value = kv.value.value if kv.value is not None else None
+    return "" if value is None else str(value)
+
+
+def _overflow_kv():
+    return KeyValue.new_bool_value(OVERFLOW_ATTRIBUTE, True)
+
+
+def _stats_loop(limiter: CardinalityLimiter) -> None:
+    while True:
+        time.sleep(STATS_INTERVAL)
+        try:
+            limiter.write_stats()
+        except OSError:
+            traceback.print_exc()
+
+
+_limiter: CardinalityLimiter | None = None
+_limiter_lock = threading.Lock()
+
+
+def get_limiter() -> CardinalityLimiter:
+    global _limiter
+    if _limiter is None:
+        with _limiter_lock:
+            if _limiter is None:
+                config = json.loads(os.environ.get("ROTEL_PROCESSOR_METRIC_CARDINALITY_CONFIG") or "{}")
+                _limiter = CardinalityLimiter.from_config(config)
+                if _limiter.stats_file is not None:
+                    threading.Thread(
+                        target=_stats_loop, args=(_limiter,), name="rotel-metric-cardinality-stats", daemon=True,
+                    ).start()
+    return _limiter
+
+
+def process_metrics(resource_metrics) -> None:
+    get_limiter().process(resource_metrics)
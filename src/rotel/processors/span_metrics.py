@@ -0,0 +1,390 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Span metrics processor for processors_traces.
+#
+# Aggregates every span that passes through into request rate, error rate and
+# duration (RED) metrics keyed by service, span name, span kind and status code,
+# plus any configured span attribute dimensions. The number of series is capped,
+# spans beyond the cap are folded into a single overflow series. On a fixed
+# interval the metrics are sent as OTLP/JSON to the agent's own HTTP receiver, so
+# they flow through the metrics pipeline and exporters like any other metric.
+
+from __future__ import annotations
+
+import json
+import math
+import os
+import re
+import threading
+import time
+import urllib.request
+
+
+DEFAULT_INTERVAL = 15.0
+DEFAULT_MAX_SERIES = 2_000
+DEFAULT_EXPONENTIAL_MAX_SIZE = 160
+DEFAULT_EXPONENTIAL_SCALE = 20
+# milliseconds, matches the OpenTelemetry collector spanmetrics connector
+DEFAULT_BUCKETS = [2, 4, 6, 8, 10, 50, 100, 200, 400, 800, 1000, 1400, 2000, 5000, 10_000, 15_000]
+
+CALLS_METRIC = "traces.span.metrics.calls"
+DURATION_METRIC = "traces.span.metrics.duration"
+OVERFLOW_ATTRIBUTE = "otel.metric.overflow"
+
+TEMPORALITY_DELTA = 1
+TEMPORALITY_CUMULATIVE = 2
+
+_SPAN_KINDS = {
+    0: "SPAN_KIND_UNSPECIFIED",
+    1: "SPAN_KIND_INTERNAL",
+    2: "SPAN_KIND_SERVER",
+    3: "SPAN_KIND_CLIENT",
+    4: "SPAN_KIND_PRODUCER",
+    5: "SPAN_KIND_CONSUMER",
+}
+_STATUS_CODES = {0: "STATUS_CODE_UNSET", 1: "STATUS_CODE_OK", 2: "STATUS_CODE_ERROR"}
+
+_OVERFLOW_KEY = ("", "", 0, 0, ())
+
+# same units as rotel.duration, which the agent loading this file on its own can not import
+_DURATION_RE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*(ns|us|ms|s|m|h)?\s*$")
+_DURATION_UNITS = {"ns": 1e-9, "us": 1e-6, "ms": 1e-3, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+class _ExplicitHistogram:
+    __slots__ = ("bounds", "counts", "count", "sum", "min", "max")
+
+    def __init__(self, bounds: list[float]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def record(self, value: float) -> None:
+        # linear scan is faster than bisect for the typical ~16 buckets
+        i = 0
+        for bound in self.bounds:
+            if value <= bound:
+                break
+            i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+
+    def to_json(self) -> dict:
+        return {
+            "count": str(self.count),
+            "sum": self.sum,
+            "min": self.min if self.count else 0.0,
+            "max": self.max if self.count else 0.0,
+            "bucketCounts": [str(c) for c in self.counts],
+            "explicitBounds": self.bounds,
+        }
+
+
+class _ExponentialHistogram:
+    __slots__ = ("scale", "max_size", "buckets", "lo", "hi", "zero_count", "count", "sum", "min", "max")
+
+    def __init__(self, max_size: int, scale: int = DEFAULT_EXPONENTIAL_SCALE):
+        self.scale = scale
+        self.max_size = max_size
+        self.buckets: dict[int, int] = {}
+        self.lo = None
+        self.hi = None
+        self.zero_count = 0
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def _index(self, value: float) -> int:
+        return math.ceil(math.log2(value) * (1 << self.scale)) - 1 if self.scale >= 0 \
+            else math.ceil(math.log2(value) / (1 << -self.scale)) - 1
+
+    def record(self, value: float) -> None:
+        self.count += 1
+        self.sum += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        if value <= 0:
+            self.zero_count += 1
+            return
+
+        index = self._index(value)
+        lo = index if self.lo is None or index < self.lo else self.lo
+        hi = index if self.hi is None or index > self.hi else self.hi
+        # Halve the resolution until the populated range fits in max_size buckets
+        while hi - lo + 1 > self.max_size:
+            self.scale -= 1
+            index >>= 1
+            lo >>= 1
+            hi >>= 1
+            merged: dict[int, int] = {}
+            for i, c in self.buckets.items():
+                merged[i >> 1] = merged.get(i >> 1, 0) + c
+            self.buckets = merged
+        self.lo, self.hi = lo, hi
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+
+    def to_json(self) -> dict:
+        positive = {"offset": 0, "bucketCounts": []}
+        if self.buckets:
+            positive = {
+                "offset": self.lo,
+                "bucketCounts": [str(self.buckets.get(i, 0)) for i in range(self.lo, self.hi + 1)],
+            }
+        return {
+            "count": str(self.count),
+            "sum": self.sum,
+            "min": self.min if self.count else 0.0,
+            "max": self.max if self.count else 0.0,
+            "scale": self.scale,
+            "zeroCount": str(self.zero_count),
+            "positive": positive,
+        }
+
+
+class _Series:
+    __slots__ = ("calls", "histogram")
+
+    def __init__(self, histogram):
+        self.calls = 0
+        self.histogram = histogram
+
+
+class SpanMetrics:
+    def __init__(
+        self,
+        dimensions: list[str] | None = None,
+        histogram: str = "explicit",
+        buckets: list[float] | None = None,
+        exponential_max_size: int = DEFAULT_EXPONENTIAL_MAX_SIZE,
+        max_series: int = DEFAULT_MAX_SERIES,
+        temporality: str = "cumulative",
+        clock=time.time_ns,
+    ):
+        if histogram not in ("explicit", "exponential"):
+            raise ValueError(f"unknown histogram type: {histogram}")
+        if temporality not in ("cumulative", "delta"):
+            raise ValueError(f"unknown temporality: {temporality}")
+
+        self.dimensions = list(dimensions or [])
+        self.histogram = histogram
+        self.buckets = [float(b) for b in (buckets or DEFAULT_BUCKETS)]
+        self.exponential_max_size = exponential_max_size
+        self.max_series = max_series
+        self.delta = temporality == "delta"
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._series: dict[tuple, _Series] = {}
+        self._start_time = clock()
+
+        self.stats = {
+            "spans_aggregated": 0,
+            "spans_overflowed": 0,
+            "exports": 0,
+            "export_errors": 0,
+        }
+
+    @classmethod
+    def from_config(cls, config: dict) -> SpanMetrics:
+        return cls(
+            dimensions=config.get("dimensions"),
+            histogram=config.get("histogram", "explicit"),
+            buckets=config.get("buckets"),
+            exponential_max_size=int(config.get("exponential_max_size", DEFAULT_EXPONENTIAL_MAX_SIZE)),
+            max_series=int(config.get("max_series", DEFAULT_MAX_SERIES)),
+            temporality=config.get("temporality", "cumulative"),
+        )
+
+    def _new_histogram(self):
+        if self.histogram == "exponential":
+            return _ExponentialHistogram(self.exponential_max_size)
+        return _ExplicitHistogram(self.buckets)
+
+    def process(self, resource_spans) -> None:
+        service = ""
+        if resource_spans.resource is not None:
+            for kv in resource_spans.resource.attributes:
+                if kv.key == "service.name":
+                    service = _value_str(kv)
+                    break
+
+        dimensions = self.dimensions
+        with self._lock:
+            series = self._series
+            for scope_spans in resource_spans.scope_spans:
+                for span in scope_spans.spans:
+                    status = span.status.code if span.status is not None else 0
+                    dims = ()
+                    if dimensions:
+                        attrs = {kv.key: kv for kv in span.attributes}
+                        dims = tuple(_value_str(attrs[d]) if d in attrs else "" for d in dimensions)
+
+                    key = (service, span.name, span.kind, status, dims)
+                    entry = series.get(key)
+                    if entry is None:
+                        # keep one slot free for the overflow series
+                        if len(series) >= self.max_series - 1:
+                            key = _OVERFLOW_KEY
+                            entry = series.get(key)
+                            self.stats["spans_overflowed"] += 1
+                        if entry is None:
+                            entry = series[key] = _Series(self._new_histogram())
+
+                    entry.calls += 1
+                    entry.histogram.record((span.end_time_unix_nano - span.start_time_unix_nano) / 1e6)
+                    self.stats["spans_aggregated"] += 1
+
+    def collect(self) -> dict | None:
+        """Build an OTLP/JSON ExportMetricsServiceRequest of the current series"""
+        with self._lock:
+            if not self._series:
+                return None
+            now = self.clock()
+            snapshot = self._series
+            start_time = self._start_time
+            if self.delta:
+                self._series = {}
+                self._start_time = now
+            payload = self._encode(snapshot, start_time, now)
+        return payload
+
+    def _encode(self, snapshot: dict[tuple, _Series], start_time: int, now: int) -> dict:
+        temporality = TEMPORALITY_DELTA if self.delta else TEMPORALITY_CUMULATIVE
+        by_service: dict[str, tuple[list, list]] = {}
+        for key, entry in snapshot.items():
+            service, name, kind, status, dims = key
+            if key == _OVERFLOW_KEY:
+                attrs = [_json_kv(OVERFLOW_ATTRIBUTE, True)]
+            else:
+                attrs = [
+                    _json_kv("span.name", name),
+                    _json_kv("span.kind", _SPAN_KINDS.get(kind, str(kind))),
+                    _json_kv("status.code", _STATUS_CODES.get(status, str(status))),
+                ]
+                attrs.extend(_json_kv(d, v) for d, v in zip(self.dimensions, dims) if v != "")
+
+            calls, durations = by_service.setdefault(service, ([], []))
+            base = {"attributes": attrs, "startTimeUnixNano": str(start_time), "timeUnixNano": str(now)}
+            calls.append({**base, "asInt": str(entry.calls)})
+            durations.append({**base, **entry.histogram.to_json()})
+
+        histogram_field = "exponentialHistogram" if self.histogram == "exponential" else "histogram"
+        resource_metrics = []
+        for service, (calls, durations) in by_service.items():
+            resource_attrs = [_json_kv("service.name", service)] if service else []
+            resource_metrics.append({
+                "resource": {"attributes": resource_attrs},
+                "scopeMetrics": [{
+                    "scope": {"name": "rotel.processors.span_metrics"},
+                    "metrics": [
+                        {
+                            "name": CALLS_METRIC,
+                            "unit": "{call}",
+                            "sum": {
+                                "dataPoints": calls,
+                                "aggregationTemporality": temporality,
+                                "isMonotonic": True,
+                            },
+                        },
+                        {
+                            "name": DURATION_METRIC,
+                            "unit": "ms",
+                            histogram_field: {
+                                "dataPoints": durations,
+                                "aggregationTemporality": temporality,
+                            },
+                        },
+                    ],
+                }],
+            })
+        return {"resourceMetrics": resource_metrics}
+
+    def export(self, url: str, timeout: float = 5.0) -> None:
+        payload = self.collect()
+        if payload is None:
+            return
+        req = urllib.request.Request(
+            url,
+            data=json.dumps(payload).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+            method="POST",
+        )
+        try:
+            with urllib.request.urlopen(req, timeout=timeout) as resp:
+                resp.read()
+            self.stats["exports"] += 1
+        except OSError:
+            self.stats["export_errors"] += 1
+
+
+def agent_metrics_url() -> str:
+    endpoint = os.environ.get("ROTEL_OTLP_HTTP_ENDPOINT") or "localhost:4318"
+    host, _, port = endpoint.rpartition(":")
+    if host in ("", "0.0.0.0", "[::]"):
+        host = "127.0.0.1"
+    return f"http://{host}:{port}/v1/metrics"
+
+
+def _json_kv(key: str, value) -> dict:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+def _value_str(kv) -> str:
+    value = kv.value.value if kv.value is not None else None
+    return "" if value is None else str(value)
+
+
+_span_metrics: SpanMetrics | None = None
+_span_metrics_lock = threading.Lock()
+
+
+def _export_loop(span_metrics: SpanMetrics, interval: float, url: str) -> None:
+    while True:
+        time.sleep(interval)
+        span_metrics.export(url)
+
+
+def get_span_metrics() -> SpanMetrics:
+    global _span_metrics
+    if _span_metrics is None:
+        with _span_metrics_lock:
+            if _span_metrics is None:
+                config = json.loads(os.environ.get("ROTEL_PROCESSOR_SPAN_METRICS_CONFIG") or "{}")
+                span_metrics = SpanMetrics.from_config(config)
+                interval = parse_duration(config.get("interval", DEFAULT_INTERVAL))
+                thr = threading.Thread(
+                    target=_export_loop,
+                    args=(span_metrics, interval, agent_metrics_url()),
+                    name="rotel-span-metrics",
+                    daemon=True,
+                )
+                thr.start()
+                _span_metrics = span_metrics
+    return _span_metrics
+
+
+def parse_duration(value: str | float | int) -> float:
+    """Parse a duration like "250ms" or "5s" into seconds"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    m = _DURATION_RE.match(value)
+    if m is None:
+        raise ValueError(f"invalid duration: {value}")
+    return float(m.group(1)) * _DURATION_UNITS[m.group(2) or "s"]
+
+
+def process_spans(resource_spans) -> None:
+    get_span_metrics().process(resource_spans)
@@ -0,0 +1,345 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Tail sampling processor for processors_traces.
+#
+# Spans are held back per trace ID until the trace has been quiet for the
+# decision window, then the whole trace is either released into a later batch
+# or dropped. Kept spans go into the next batch from their resource, or into a
+# batch of another resource that buffering left empty, under their own resource.
+# Memory is bounded by a hard cap on buffered traces and spans, once either cap
+# is hit the oldest trace is decided early with what has been seen so far.
+# Decisions are remembered in a bounded LRU cache so late spans of a trace
+# follow the same decision. The counters are written to stats_file every
+# STATS_INTERVAL seconds, for Client.processor_counters().
+
+from __future__ import annotations
+
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+import traceback
+from collections import OrderedDict
+
+
+STATUS_CODE_ERROR = 2
+
+DEFAULT_DECISION_WAIT = 5.0
+DEFAULT_MAX_TRACES = 10_000
+DEFAULT_MAX_SPANS = 100_000
+DEFAULT_DECISION_CACHE_SIZE = 50_000
+# seconds between writes of the stats file
+STATS_INTERVAL = 10.0
+
+# same units as rotel.duration, which the agent loading this file on its own can not import
+_DURATION_RE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*(ns|us|ms|s|m|h)?\s*$")
+_DURATION_UNITS = {"ns": 1e-9, "us": 1e-6, "ms": 1e-3, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+class _Trace:
+    __slots__ = ("first_seen", "last_seen", "spans", "min_start", "max_end", "error", "matched")
+
+    def __init__(self, now: float):
+        self.first_seen = now
+        self.last_seen = now
+        # (resource key, resource, scope, span)
+        self.spans = []
+        self.min_start = None
+        self.max_end = None
+        self.error = False
+        self.matched = False
+
+
+class TailSampler:
+    def __init__(
+        self,
+        decision_wait: float = DEFAULT_DECISION_WAIT,
+        max_traces: int = DEFAULT_MAX_TRACES,
+        max_spans: int = DEFAULT_MAX_SPANS,
+        decision_cache_size: int = DEFAULT_DECISION_CACHE_SIZE,
+        keep_errors: bool = True,
+        latency_threshold: float | None = None,
+        attributes: dict[str, str] | None = None,
+        sample_rate: float = 0.0,
+        stats_file: str | None = None,
+        clock=time.monotonic,
+    ):
+        self.decision_wait = decision_wait
+        self.max_traces = max_traces
+        self.max_spans = max_spans
+        self.decision_cache_size = decision_cache_size
+        self.keep_errors = keep_errors
+        self.latency_threshold_ns = None if latency_threshold is None else int(latency_threshold * 1e9)
+        self.attributes = {k: re.compile(v) for k, v in (attributes or {}).items()}
+        self.sample_threshold = int(max(0.0, min(1.0, sample_rate)) * (1 << 64))
+        self.clock = clock
+
+        self.stats_file = stats_file
+        self._lock = threading.Lock()
+        self._traces: OrderedDict[bytes, _Trace] = OrderedDict()
+        self._decisions: OrderedDict[bytes, bool] = OrderedDict()
+        # Spans of kept traces waiting for a batch to go into, by resource key
+        self._released: dict[tuple, list] = {}
+        # spans held in _traces and _released, and those in _released only
+        self._buffered_spans = 0
+        self._released_spans = 0
+
+        self.stats = {
+            "spans_received": 0,
+            "spans_buffered": 0,
+            "spans_sampled": 0,
+            "spans_dropped": 0,
+            "traces_sampled": 0,
+            "traces_dropped": 0,
+            "traces_evicted": 0,
+            "spans_evicted": 0,
+            "decisions_evicted": 0,
+        }
+
+    @classmethod
+    def from_config(cls, config: dict) -> TailSampler:
+        latency_threshold = config.get("latency_threshold")
+        return cls(
+            decision_wait=parse_duration(config.get("decision_wait", DEFAULT_DECISION_WAIT)),
+            max_traces=int(config.get("max_traces", DEFAULT_MAX_TRACES)),
+            max_spans=int(config.get("max_spans", DEFAULT_MAX_SPANS)),
+            decision_cache_size=int(config.get("decision_cache_size", DEFAULT_DECISION_CACHE_SIZE)),
+            keep_errors=bool(config.get("keep_errors", True)),
+            latency_threshold=None if latency_threshold is None else parse_duration(latency_threshold),
+            attributes=config.get("attributes"),
+            sample_rate=float(config.get("sample_rate", 0.0)),
+            stats_file=config.get("stats_file"),
+        )
+
+    def write_stats(self) -> None:
+        """Write the counters to stats_file, read by Client.processor_counters()"""
+        if self.stats_file is None:
+            return
+        with self._lock:
+            data = {
+                "pid": os.getpid(), "time": time.time(), **self.stats,
+                "traces_pending": len(self._traces), "spans_pending": self._buffered_spans,
+            }
+        directory = os.path.dirname(self.stats_file) or "."
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as file:
+                json.dump(data, file)
+            os.replace(tmp, self.stats_file)
+        except OSError:
+            os.unlink(tmp)
+            raise
+
+    def process(self, resource_spans) -> None:
+        with self._lock:
+            now = self.clock()
+            resource = resource_spans.resource
+            res_key = _resource_key(resource)
+
+            for scope_spans in resource_spans.scope_spans:
+                passthrough = []
+                for span in scope_spans.spans:
+                    self.stats["spans_received"] += 1
+                    decision = self._decisions.get(span.trace_id)
+                    if decision is None:
+                        self._buffer(now, res_key, resource, scope_spans.scope, span)
+                    elif decision:
+                        self._decisions.move_to_end(span.trace_id)
+                        self.stats["spans_sampled"] += 1
+                        passthrough.append(span)
+                    else:
+                        self._decisions.move_to_end(span.trace_id)
+                        self.stats["spans_dropped"] += 1
+                scope_spans.spans = passthrough
+
+            self._enforce_limits()
+            self._decide_expired(now)
+            self._inject_released(res_key, resource_spans)
+
+    def _buffer(self, now: float, res_key: tuple, resource, scope, span) -> None:
+        trace = self._traces.get(span.trace_id)
+        if trace is None:
+            trace = _Trace(now)
+            self._traces[span.trace_id] = trace
+        trace.last_seen = now
+        trace.spans.append((res_key, resource, scope, span))
+        self._buffered_spans += 1
+        self.stats["spans_buffered"] += 1
+
+        # Fold the span into the trace summary so the decision is O(1)
+        start, end = span.start_time_unix_nano, span.end_time_unix_nano
+        if trace.min_start is None or start < trace.min_start:
+            trace.min_start = start
+        if trace.max_end is None or end > trace.max_end:
+            trace.max_end = end
+        status = span.status
+        if status is not None and status.code == STATUS_CODE_ERROR:
+            trace.error = True
+        if self.attributes and not trace.matched:
+            for kv in span.attributes:
+                pattern = self.attributes.get(kv.key)
+                if pattern is not None and pattern.search(_value_str(kv)):
+                    trace.matched = True
+                    break
+
+    def _enforce_limits(self) -> None:
+        while self._traces and (
+            len(self._traces) > self.max_traces or self._buffered_spans - self._released_spans > self.max_spans
+        ):
+            trace_id, trace = self._traces.popitem(last=False)
+            self.stats["traces_evicted"] += 1
+            self._decide(trace_id, trace)
+        # Kept spans still waiting for a batch, oldest resource first
+        while self._buffered_spans > self.max_spans and self._released:
+            key = next(iter(self._released))
+            pending = self._released[key]
+            evicted = min(self._buffered_spans - self.max_spans, len(pending))
+            del pending[:evicted]
+            if not pending:
+                del self._released[key]
+            self._buffered_spans -= evicted
+            self._released_spans -= evicted
+            self.stats["spans_evicted"] += evicted
+
+    def _decide_expired(self, now: float) -> None:
+        # Traces are ordered by first span, so this only walks the expired prefix
+        # plus any traces that are still receiving spans.
+        deadline = now - self.decision_wait
+        expired = []
+        for trace_id, trace in self._traces.items():
+            if trace.first_seen > deadline:
+                break
+            if trace.last_seen <= deadline:
+                expired.append(trace_id)
+        for trace_id in expired:
+            self._decide(trace_id, self._traces.pop(trace_id))
+
+    def _decide(self, trace_id: bytes, trace: _Trace) -> None:
+        keep = self._should_keep(trace_id, trace)
+
+        self._decisions[trace_id] = keep
+        while len(self._decisions) > self.decision_cache_size:
+            self._decisions.popitem(last=False)
+            self.stats["decisions_evicted"] += 1
+
+        if not keep:
+            self.stats["traces_dropped"] += 1
+            self.stats["spans_dropped"] += len(trace.spans)
+            self._buffered_spans -= len(trace.spans)
+            return
+
+        # Released spans still count against max_spans until they are emitted
+        self.stats["traces_sampled"] += 1
+        for res_key, resource, scope, span in trace.spans:
+            self._released.setdefault(res_key, []).append((resource, scope, span))
+        self._released_spans += len(trace.spans)
+
+    def _should_keep(self, trace_id: bytes, trace: _Trace) -> bool:
+        if self.keep_errors and trace.error:
+            return True
+        if self.latency_threshold_ns is not None and trace.max_end - trace.min_start >= self.latency_threshold_ns:
+            return True
+        if trace.matched:
+            return True
+        # The low 8 bytes of W3C trace IDs are random, so this is consistent
+        # across agents that see parts of the same trace.
+        return int.from_bytes(trace_id[-8:], "big") < self.sample_threshold
+
+    def _inject_released(self, res_key: tuple, resource_spans) -> None:
+        if not self._released or not resource_spans.scope_spans:
+            return
+        key = res_key
+        if key not in self._released:
+            # A batch that buffering left empty carries the spans of another resource
+            # instead, whose own batches may have stopped
+            if any(scope_spans.spans for scope_spans in resource_spans.scope_spans):
+                return
+            key = next(iter(self._released))
+        pending = self._released.pop(key)
+
+        scopes = {}
+        if key == res_key:
+            for scope_spans in resource_spans.scope_spans:
+                scopes.setdefault(_scope_name(scope_spans.scope), scope_spans)
+        else:
+            resource_spans.resource = pending[0][0]
+            free = iter(resource_spans.scope_spans)
+            for _, scope, _ in pending:
+                name = _scope_name(scope)
+                if name in scopes:
+                    continue
+                target = next(free, None)
+                if target is None:
+                    break
+                target.scope = scope
+                scopes[name] = target
+        default_scope = resource_spans.scope_spans[0]
+
+        additions = {}
+        for _, scope, span in pending:
+            target = scopes.get(_scope_name(scope), default_scope)
+            additions.setdefault(id(target), (target, []))[1].append(span)
+        for target, spans in additions.values():
+            target.spans = list(target.spans) + spans
+
+        self._buffered_spans -= len(pending)
+        self._released_spans -= len(pending)
+        self.stats["spans_sampled"] += len(pending)
+
+
+def parse_duration(value: str | float | int) -> float:
+    """Parse a duration like "250ms" or "5s" into seconds"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    m = _DURATION_RE.match(value)
+    if m is None:
+        raise ValueError(f"invalid duration: {value}")
+    return float(m.group(1)) * _DURATION_UNITS[m.group(2) or "s"]
+
+
+def _value_str(kv) -> str:
+    value = kv.value.value if kv.value is not None else None
+    return "" if value is None else str(value)
+
+
+def _scope_name(scope) -> str:
+    return scope.name if scope is not None else ""
+
+
+def _resource_key(resource) -> tuple:
+    if resource is None:
+        return ()
+    return tuple((kv.key, _value_str(kv)) for kv in resource.attributes)
+
+
+def _stats_loop(sampler: TailSampler) -> None:
+    while True:
+        time.sleep(STATS_INTERVAL)
+        try:
+            sampler.write_stats()
+        except OSError:
+            traceback.print_exc()
+
+
+_sampler: TailSampler | None = None
+_sampler_lock = threading.Lock()
+
+
+def get_sampler() -> TailSampler:
+    global _sampler
+    if _sampler is None:
+        with _sampler_lock:
+            if _sampler is None:
+                config = json.loads(os.environ.get("ROTEL_PROCESSOR_TAIL_SAMPLING_CONFIG") or "{}")
+                _sampler = TailSampler.from_config(config)
+                if _sampler.stats_file is not None:
+                    threading.Thread(
+                        target=_stats_loop, args=(_sampler,), name="rotel-tail-sampling-stats", daemon=True,
+                    ).start()
+    return _sampler
+
+
+def process_spans(resource_spans) -> None:
+    get_sampler().process(resource_spans)
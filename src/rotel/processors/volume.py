@@ -0,0 +1,594 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Telemetry volume tap for processors_traces, processors_metrics and
+# processors_logs.
+#
+# Every batch passing through the tap is encoded as the OTLP protobuf message
+# the exporters would send, the encoded size counts as uncompressed bytes and
+# the size after gzip as compressed bytes. Items (spans, metric data points or
+# log records) and bytes are broken down by resource, keyed by one resource
+# attribute (service.name by default), and the encoded size of every attribute
+# is added to its key, so the keys dominating the payload stand out. Batches are
+# left untouched.
+#
+# Counts cover a tumbling window. The tap writes its report to a JSON file per
+# signal next to the agent's pid file every interval, holding the last complete
+# window once there is one and the window in progress before that. The sizes
+# are estimates: the agent regroups batches before exporting, and exporters
+# other than OTLP use their own encodings.
+
+from __future__ import annotations
+
+import json
+import os
+import re
+import struct
+import tempfile
+import threading
+import time
+import traceback
+import zlib
+
+
+DEFAULT_WINDOW = 60.0
+DEFAULT_INTERVAL = 10.0
+DEFAULT_TOP_KEYS = 20
+DEFAULT_RESOURCE_ATTRIBUTE = "service.name"
+# distinct resources and attribute keys tracked per window, the rest is counted as OTHER
+MAX_RESOURCES = 1_000
+MAX_KEYS = 10_000
+OTHER = "<other>"
+UNKNOWN = "<unknown>"
+
+_MASK64 = (1 << 64) - 1
+
+# same units as rotel.duration, which the agent loading this file on its own can not import
+_DURATION_RE = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*(ns|us|ms|s|m|h)?\s*$")
+_DURATION_UNITS = {"ns": 1e-9, "us": 1e-6, "ms": 1e-3, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+#
+# Protobuf wire format
+#
+
+def _varint(value: int) -> bytes:
+    value &= _MASK64
+    out = bytearray()
+    while value > 0x7F:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+    return bytes(out)
+
+
+def _tag(field: int, wire_type: int) -> bytes:
+    return _varint(field << 3 | wire_type)
+
+
+def _message(out: bytearray, field: int, payload: bytes | bytearray) -> int:
+    """Append a length delimited field and return its encoded size"""
+    start = len(out)
+    out += _tag(field, 2)
+    out += _varint(len(payload))
+    out += payload
+    return len(out) - start
+
+
+def _string(out: bytearray, field: int, value: str | bytes | None) -> None:
+    if value:
+        _message(out, field, value.encode("utf-8") if isinstance(value, str) else value)
+
+
+def _uint(out: bytearray, field: int, value: int | None) -> None:
+    if value:
+        out += _tag(field, 0)
+        out += _varint(int(value))
+
+
+def _fixed64(out: bytearray, field: int, value: int | None) -> None:
+    if value:
+        out += _tag(field, 1)
+        out += struct.pack("<Q", value & _MASK64)
+
+
+def _double(out: bytearray, field: int, value: float | None) -> None:
+    if value:
+        out += _tag(field, 1)
+        out += struct.pack("<d", value)
+
+
+def _fixed32(out: bytearray, field: int, value: int | None) -> None:
+    if value:
+        out += _tag(field, 5)
+        out += struct.pack("<I", value & 0xFFFFFFFF)
+
+
+def _unwrap(value):
+    # AnyValue holders and oneof wrappers keep the Python value in .value
+    while hasattr(value, "value") and not isinstance(value, (str, bytes, bool, int, float)):
+        value = value.value
+    return value
+
+
+class Encoder:
+    """Encode rotel_sdk batches as OTLP protobuf, charging attribute sizes to their keys"""
+
+    def __init__(self, on_attribute=None):
+        # called with (location, key, encoded size) for every attribute
+        self.on_attribute = on_attribute
+
+    def any_value(self, value) -> bytearray:
+        out = bytearray()
+        value = _unwrap(value)
+        if value is None:
+            return out
+        if isinstance(value, bool):
+            out += _tag(2, 0) + _varint(int(value))
+        elif isinstance(value, int):
+            out += _tag(3, 0) + _varint(value)
+        elif isinstance(value, float):
+            out += _tag(4, 1) + struct.pack("<d", value)
+        elif isinstance(value, str):
+            _message(out, 1, value.encode("utf-8"))
+        elif isinstance(value, (bytes, bytearray)):
+            _message(out, 7, value)
+        else:
+            values = getattr(value, "values", value)
+            inner = bytearray()
+            if values and hasattr(values[0], "key"):
+                for kv in values:
+                    _message(inner, 1, self.key_value(kv))
+                _message(out, 6, inner)
+            else:
+                for item in values or ():
+                    _message(inner, 1, self.any_value(item))
+                _message(out, 5, inner)
+        return out
+
+    def key_value(self, kv) -> bytearray:
+        out = bytearray()
+        _string(out, 1, kv.key)
+        if kv.value is not None:
+            _message(out, 2, self.any_value(kv.value))
+        return out
+
+    def attributes(self, out: bytearray, field: int, attributes, location: str) -> None:
+        on_attribute = self.on_attribute
+        for kv in attributes or ():
+            size = _message(out, field, self.key_value(kv))
+            if on_attribute is not None:
+                on_attribute(location, kv.key, size)
+
+    def resource(self, resource) -> bytearray:
+        out = bytearray()
+        if resource is not None:
+            self.attributes(out, 1, resource.attributes, "resource")
+            _uint(out, 2, getattr(resource, "dropped_attributes_count", 0))
+        return out
+
+    def scope(self, scope) -> bytearray:
+        out = bytearray()
+        if scope is not None:
+            _string(out, 1, scope.name)
+            _string(out, 2, scope.version)
+            self.attributes(out, 3, scope.attributes, "scope")
+        return out
+
+    #
+    # traces
+    #
+
+    def resource_spans(self, resource_spans) -> bytearray:
+        out = bytearray()
+        if resource_spans.resource is not None:
+            _message(out, 1, self.resource(resource_spans.resource))
+        for scope_spans in resource_spans.scope_spans:
+            inner = bytearray()
+            if scope_spans.scope is not None:
+                _message(inner, 1, self.scope(scope_spans.scope))
+            for span in scope_spans.spans:
+                _message(inner, 2, self.span(span))
+            _string(inner, 3, getattr(scope_spans, "schema_url", None))
+            _message(out, 2, inner)
+        _string(out, 3, getattr(resource_spans, "schema_url", None))
+        return out
+
+    def span(self, span) -> bytearray:
+        out = bytearray()
+        _string(out, 1, span.trace_id)
+        _string(out, 2, span.span_id)
+        _string(out, 3, getattr(span, "trace_state", None))
+        _string(out, 4, getattr(span, "parent_span_id", None))
+        _string(out, 5, span.name)
+        _uint(out, 6, _unwrap(span.kind))
+        _fixed64(out, 7, span.start_time_unix_nano)
+        _fixed64(out, 8, span.end_time_unix_nano)
+        self.attributes(out, 9, span.attributes, "span")
+        _uint(out, 10, getattr(span, "dropped_attributes_count", 0))
+        for event in getattr(span, "events", None) or ():
+            inner = bytearray()
+            _fixed64(inner, 1, event.time_unix_nano)
+            _string(inner, 2, event.name)
+            self.attributes(inner, 3, event.attributes, "event")
+            _message(out, 11, inner)
+        for link in getattr(span, "links", None) or ():
+            inner = bytearray()
+            _string(inner, 1, link.trace_id)
+            _string(inner, 2, link.span_id)
+            _string(inner, 3, getattr(link, "trace_state", None))
+            self.attributes(inner, 4, link.attributes, "link")
+            _message(out, 13, inner)
+        status = getattr(span, "status", None)
+        if status is not None:
+            inner = bytearray()
+            _string(inner, 2, status.message)
+            _uint(inner, 3, _unwrap(status.code))
+            _message(out, 15, inner)
+        return out
+
+    #
+    # metrics
+    #
+
+    def resource_metrics(self, resource_metrics) -> bytearray:
+        out = bytearray()
+        if resource_metrics.resource is not None:
+            _message(out, 1, self.resource(resource_metrics.resource))
+        for scope_metrics in resource_metrics.scope_metrics:
+            inner = bytearray()
+            if scope_metrics.scope is not None:
+                _message(inner, 1, self.scope(scope_metrics.scope))
+            for metric in scope_metrics.metrics:
+                _message(inner, 2, self.metric(metric))
+            _message(out, 2, inner)
+        return out
+
+    def metric(self, metric) -> bytearray:
+        out = bytearray()
+        _string(out, 1, metric.name)
+        _string(out, 2, metric.description)
+        _string(out, 3, metric.unit)
+        data = metric.data
+        points = getattr(data, "data_points", None) or ()
+        if not points:
+            return out
+        inner = bytearray()
+        first = points[0]
+        if hasattr(first, "quantile_values"):
+            field, encode = 11, self.summary_point
+        elif hasattr(first, "positive"):
+            field, encode = 10, self.exponential_histogram_point
+        elif hasattr(first, "bucket_counts"):
+            field, encode = 9, self.histogram_point
+        elif hasattr(data, "aggregation_temporality"):
+            field, encode = 7, self.number_point
+        else:
+            field, encode = 5, self.number_point
+        for dp in points:
+            _message(inner, 1, encode(dp))
+        _uint(inner, 2, _unwrap(getattr(data, "aggregation_temporality", 0)))
+        _uint(inner, 3, int(bool(getattr(data, "is_monotonic", False))))
+        _message(out, field, inner)
+        return out
+
+    def number_point(self, dp) -> bytearray:
+        out = bytearray()
+        self.attributes(out, 7, dp.attributes, "data_point")
+        _fixed64(out, 2, dp.start_time_unix_nano)
+        _fixed64(out, 3, dp.time_unix_nano)
+        value = _unwrap(dp.value)
+        if isinstance(value, int):
+            _fixed64(out, 6, value)
+        else:
+            _double(out, 4, value)
+        return out
+
+    def histogram_point(self, dp) -> bytearray:
+        out = bytearray()
+        self.attributes(out, 9, dp.attributes, "data_point")
+        _fixed64(out, 2, dp.start_time_unix_nano)
+        _fixed64(out, 3, dp.time_unix_nano)
+        _fixed64(out, 4, dp.count)
+        _double(out, 5, dp.sum)
+        if dp.bucket_counts:
+            _message(out, 6, struct.pack(f"<{len(dp.bucket_counts)}Q", *dp.bucket_counts))
+        if dp.explicit_bounds:
+            _message(out, 7, struct.pack(f"<{len(dp.explicit_bounds)}d", *dp.explicit_bounds))
+        _double(out, 11, getattr(dp, "min", None))
+        _double(out, 12, getattr(dp, "max", None))
+        return out
+
+    def exponential_histogram_point(self, dp) -> bytearray:
+        out = bytearray()
+        self.attributes(out, 1, dp.attributes, "data_point")
+        _fixed64(out, 2, dp.start_time_unix_nano)
+        _fixed64(out, 3, dp.time_unix_nano)
+        _fixed64(out, 4, dp.count)
+        _double(out, 5, getattr(dp, "sum", None))
+        _uint(out, 6, (dp.scale << 1) ^ (dp.scale >> 31) if dp.scale else 0)
+        _fixed64(out, 7, getattr(dp, "zero_count", 0))
+        for field, buckets in ((8, dp.positive), (9, getattr(dp, "negative", None))):
+            if buckets is None:
+                continue
+            inner = bytearray()
+            offset = buckets.offset or 0
+            _uint(inner, 1, (offset << 1) ^ (offset >> 31))
+            if buckets.bucket_counts:
+                _message(inner, 2, b"".join(_varint(c) for c in buckets.bucket_counts))
+            _message(out, field, inner)
+        _double(out, 12, getattr(dp, "min", None))
+        _double(out, 13, getattr(dp, "max", None))
+        return out
+
+    def summary_point(self, dp) -> bytearray:
+        out = bytearray()
+        self.attributes(out, 7, dp.attributes, "data_point")
+        _fixed64(out, 2, dp.start_time_unix_nano)
+        _fixed64(out, 3, dp.time_unix_nano)
+        _fixed64(out, 4, dp.count)
+        _double(out, 5, dp.sum)
+        for quantile in dp.quantile_values or ():
+            inner = bytearray()
+            _double(inner, 1, quantile.quantile)
+            _double(inner, 2, quantile.value)
+            _message(out, 6, inner)
+        return out
+
+    #
+    # logs
+    #
+
+    def resource_logs(self, resource_logs) -> bytearray:
+        out = bytearray()
+        if resource_logs.resource is not None:
+            _message(out, 1, self.resource(resource_logs.resource))
+        for scope_logs in resource_logs.scope_logs:
+            inner = bytearray()
+            if scope_logs.scope is not None:
+                _message(inner, 1, self.scope(scope_logs.scope))
+            for record in scope_logs.log_records:
+                _message(inner, 2, self.log_record(record))
+            _message(out, 2, inner)
+        return out
+
+    def log_record(self, record) -> bytearray:
+        out = bytearray()
+        _fixed64(out, 1, record.time_unix_nano)
+        _uint(out, 2, _unwrap(record.severity_number))
+        _string(out, 3, record.severity_text)
+        if record.body is not None:
+            _message(out, 5, self.any_value(record.body))
+        self.attributes(out, 6, record.attributes, "log")
+        _fixed32(out, 8, getattr(record, "flags", 0))
+        _string(out, 9, record.trace_id)
+        _string(out, 10, record.span_id)
+        _fixed64(out, 11, getattr(record, "observed_time_unix_nano", 0))
+        _string(out, 12, getattr(record, "event_name", None))
+        return out
+
+
+def count_items(signal: str, batch) -> int:
+    if signal == "traces":
+        return sum(len(scope_spans.spans) for scope_spans in batch.scope_spans)
+    if signal == "metrics":
+        return sum(
+            len(getattr(metric.data, "data_points", None) or ())
+            for scope_metrics in batch.scope_metrics
+            for metric in scope_metrics.metrics
+        )
+    return sum(len(scope_logs.log_records) for scope_logs in batch.scope_logs)
+
+
+class _Window:
+    def __init__(self, start: float):
+        self.start = start
+        self.batches = 0
+        self.items = 0
+        self.bytes = 0
+        self.compressed_bytes = 0
+        # resource -> [items, bytes]
+        self.resources: dict[str, list[int]] = {}
+        # (location, key) -> [count, bytes]
+        self.keys: dict[tuple[str, str], list[int]] = {}
+
+    def to_dict(self, signal: str, end: float, top_keys: int) -> dict:
+        elapsed = end - self.start
+        top = sorted(self.keys.items(), key=lambda item: item[1][1], reverse=True)[:top_keys]
+        return {
+            "signal": signal,
+            "start": self.start,
+            "end": end,
+            "batches": self.batches,
+            "items": self.items,
+            "bytes": self.bytes,
+            "compressed_bytes": self.compressed_bytes,
+            "compression_ratio": self.compressed_bytes / self.bytes if self.bytes else 0.0,
+            "bytes_per_item": self.bytes / self.items if self.items else 0.0,
+            "items_per_second": self.items / elapsed if elapsed > 0 else 0.0,
+            "bytes_per_second": self.bytes / elapsed if elapsed > 0 else 0.0,
+            "compressed_bytes_per_second": self.compressed_bytes / elapsed if elapsed > 0 else 0.0,
+            "resources": {
+                name: {"items": items, "bytes": size}
+                for name, (items, size) in sorted(self.resources.items(), key=lambda item: -item[1][1])
+            },
+            "attributes": [
+                {
+                    "location": location,
+                    "key": key,
+                    "count": count,
+                    "bytes": size,
+                    "share": size / self.bytes if self.bytes else 0.0,
+                }
+                for (location, key), (count, size) in top
+            ],
+        }
+
+
+class VolumeTap:
+    def __init__(
+        self,
+        signal: str,
+        window: float = DEFAULT_WINDOW,
+        top_keys: int = DEFAULT_TOP_KEYS,
+        resource_attribute: str = DEFAULT_RESOURCE_ATTRIBUTE,
+        stats_file: str | None = None,
+        clock=time.time,
+    ):
+        self.signal = signal
+        self.window = window
+        self.top_keys = top_keys
+        self.resource_attribute = resource_attribute
+        self.stats_file = stats_file
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._current = _Window(clock())
+        self._complete: dict | None = None
+        self._encoder = Encoder(self._on_attribute)
+        self._encode = {
+            "traces": self._encoder.resource_spans,
+            "metrics": self._encoder.resource_metrics,
+            "logs": self._encoder.resource_logs,
+        }[signal]
+
+    @classmethod
+    def from_config(cls, signal: str, config: dict) -> VolumeTap:
+        prefix = config.get("stats_prefix")
+        return cls(
+            signal,
+            window=parse_duration(config.get("window", DEFAULT_WINDOW)),
+            top_keys=int(config.get("top_keys", DEFAULT_TOP_KEYS)),
+            resource_attribute=config.get("resource_attribute", DEFAULT_RESOURCE_ATTRIBUTE),
+            stats_file=f"{prefix}.{signal}.json" if prefix else None,
+        )
+
+    def _on_attribute(self, location: str, key: str, size: int) -> None:
+        keys = self._current.keys
+        entry = keys.get((location, key))
+        if entry is None:
+            if len(keys) >= MAX_KEYS:
+                key = OTHER
+            entry = keys.setdefault((location, key), [0, 0])
+        entry[0] += 1
+        entry[1] += size
+
+    def _resource_name(self, resource) -> str:
+        for kv in getattr(resource, "attributes", None) or ():
+            if kv.key == self.resource_attribute:
+                value = _unwrap(kv.value)
+                return UNKNOWN if value is None else str(value)
+        return UNKNOWN
+
+    def record(self, batch) -> None:
+        with self._lock:
+            self._roll(self.clock())
+            window = self._current
+            encoded = self._encode(batch)
+            items = count_items(self.signal, batch)
+
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+            compressed = len(compressor.compress(encoded)) + len(compressor.flush())
+
+            window.batches += 1
+            window.items += items
+            window.bytes += len(encoded)
+            window.compressed_bytes += compressed
+
+            name = self._resource_name(batch.resource)
+            resource = window.resources.get(name)
+            if resource is None:
+                if len(window.resources) >= MAX_RESOURCES:
+                    name = OTHER
+                resource = window.resources.setdefault(name, [0, 0])
+            resource[0] += items
+            resource[1] += len(encoded)
+
+    def _roll(self, now: float) -> None:
+        window = self._current
+        if now - window.start < self.window:
+            return
+        self._complete = window.to_dict(self.signal, window.start + self.window, self.top_keys)
+        self._complete["complete"] = True
+        # skip windows without any batches
+        start = window.start + self.window * ((now - window.start) // self.window)
+        self._current = _Window(start)
+
+    def report(self) -> dict:
+        """The last complete window, or the window in progress before the first one closes"""
+        with self._lock:
+            now = self.clock()
+            self._roll(now)
+            if self._complete is not None:
+                return self._complete
+            report = self._current.to_dict(self.signal, now, self.top_keys)
+            report["complete"] = False
+            return report
+
+    def write_report(self) -> None:
+        if self.stats_file is None:
+            return
+        data = {"pid": os.getpid(), "time": time.time(), **self.report()}
+        directory = os.path.dirname(self.stats_file) or "."
+        fd, tmp = tempfile.mkstemp(dir=directory, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as file:
+                json.dump(data, file)
+            os.replace(tmp, self.stats_file)
+        except OSError:
+            os.unlink(tmp)
+            raise
+
+
+def parse_duration(value: str | float | int) -> float:
+    """Parse a duration like "250ms" or "5s" into seconds"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    m = _DURATION_RE.match(value)
+    if m is None:
+        raise ValueError(f"invalid duration: {value}")
+    return float(m.group(1)) * _DURATION_UNITS[m.group(2) or "s"]
+
+
+def _report_loop(tap: VolumeTap, interval: float) -> None:
+    while True:
+        time.sleep(interval)
+        try:
+            tap.write_report()
+        except OSError:
+            traceback.print_exc()
+
+
+_taps: dict[str, VolumeTap] = {}
+_taps_lock = threading.Lock()
+
+
+def get_tap(signal: str) -> VolumeTap:
+    tap = _taps.get(signal)
+    if tap is None:
+        with _taps_lock:
+            tap = _taps.get(signal)
+            if tap is None:
+                config = json.loads(os.environ.get("ROTEL_PROCESSOR_VOLUME_CONFIG") or "{}")
+                tap = VolumeTap.from_config(signal, config)
+                interval = min(tap.window, parse_duration(config.get("interval", DEFAULT_INTERVAL)))
+                thr = threading.Thread(
+                    target=_report_loop,
+                    args=(tap, interval),
+                    name=f"rotel-volume-{signal}",
+                    daemon=True,
+                )
+                thr.start()
+                _taps[signal] = tap
+    return tap
+
+
+def process_spans(resource_spans) -> None:
+    get_tap("traces").record(resource_spans)
+
+
+def process_metrics(resource_metrics) -> None:
+    get_tap("metrics").record(resource_metrics)
+
+
+def process_logs(resource_logs) -> None:
+    get_tap("logs").record(resource_logs)
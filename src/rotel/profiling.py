@@ -0,0 +1,340 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Sampling CPU profiler that ships folded stacks through the agent.
+#
+# A background thread wakes up `rate` times a second and reads the stacks of all
+# threads with sys._current_frames(). Where the platform has per-thread CPU
+# clocks, threads that used no CPU since the previous sample are skipped and each
+# sample is weighted with the CPU time the thread used, so the profile shows
+# where CPU was burned rather than where threads waited. Stacks are counted as
+# tuples of code objects per active span and only turned into folded text when
+# they are exported. Every `interval` seconds the counts are sent to the agent as
+# OTLP log records, one per stack and span, carrying the trace and span ids that
+# were active in the sampled thread.
+#
+# The sampler measures how long each sample holds the interpreter and stretches
+# the sampling period whenever that exceeds max_overhead of the elapsed time.
+
+from __future__ import annotations
+
+import os
+import sys
+import threading
+import time
+import traceback
+from typing import Any
+
+from . import _otlp
+from . import trace as rotel_trace
+
+
+DEFAULT_RATE = 100
+DEFAULT_INTERVAL = 10.0
+DEFAULT_MAX_STACKS = 10_000
+DEFAULT_MAX_DEPTH = 128
+DEFAULT_MAX_OVERHEAD = 0.01
+# longest sampling period when backing off
+MAX_PERIOD = 1.0
+
+SCOPE = "rotel.profiling"
+# folded stack of the samples that didn't fit in max_stacks
+TRUNCATED = "[truncated]"
+
+_HAS_CPU_CLOCK = hasattr(time, "pthread_getcpuclockid")
+
+# thread id -> (trace id, span id) of the current rotel.trace span
+_thread_spans: dict[int, tuple[int, int]] = {}
+# thread id -> stack of (trace id, span id) of started OpenTelemetry SDK spans
+_sdk_spans: dict[int, list[tuple[int, int]]] = {}
+
+
+def _on_activation(span: rotel_trace.Span | None) -> None:
+    if span is None:
+        _thread_spans.pop(threading.get_ident(), None)
+    else:
+        _thread_spans[threading.get_ident()] = (span.trace_id, span.span_id)
+
+
+class SpanProcessor:
+    """OpenTelemetry SDK span processor that tags samples with the SDK spans of each thread
+
+    Add it with TracerProvider.add_span_processor(). Spans are attributed to the
+    thread that started them, tasks interleaving on one event loop thread are
+    not told apart."""
+
+    def on_start(self, span: Any, parent_context: Any = None) -> None:
+        ctx = span.get_span_context()
+        _sdk_spans.setdefault(threading.get_ident(), []).append((ctx.trace_id, ctx.span_id))
+
+    def _on_ending(self, span: Any) -> None:
+        pass
+
+    def on_end(self, span: Any) -> None:
+        ctx = span.get_span_context()
+        ids = (ctx.trace_id, ctx.span_id)
+        stack = _sdk_spans.get(threading.get_ident())
+        if stack is None or ids not in stack:
+            # ended by another thread than the one that started it
+            stack = next((s for s in list(_sdk_spans.values()) if ids in s), None)
+            if stack is None:
+                return
+        stack.remove(ids)
+        if not stack:
+            for ident, s in list(_sdk_spans.items()):
+                if s is stack:
+                    _sdk_spans.pop(ident, None)
+
+    def shutdown(self) -> None:
+        pass
+
+    def force_flush(self, timeout_millis: int = 30000) -> bool:
+        return True
+
+
+def _label(code) -> str:
+    name = getattr(code, "co_qualname", code.co_name)
+    return f"{name} ({code.co_filename}:{code.co_firstlineno})"
+
+
+class Profiler:
+    def __init__(
+        self,
+        rate: int = DEFAULT_RATE,
+        interval: float = DEFAULT_INTERVAL,
+        max_stacks: int = DEFAULT_MAX_STACKS,
+        max_depth: int = DEFAULT_MAX_DEPTH,
+        max_overhead: float = DEFAULT_MAX_OVERHEAD,
+        endpoint: str | None = None,
+        resource: dict[str, Any] | None = None,
+    ):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.interval = interval
+        self.max_stacks = max_stacks
+        self.max_depth = max_depth
+        self.max_overhead = max_overhead
+        self.endpoint = endpoint
+
+        attrs = _otlp.default_resource_attributes()
+        attrs.update(resource or {})
+        self._resource = _otlp.resource(attrs)
+        # code object -> label, for the stacks of one export
+        self._labels: dict[Any, str] = {}
+
+        self._reset()
+        self.stats = {
+            "samples": 0,
+            "stacks_truncated": 0,
+            "exports": 0,
+            "export_errors": 0,
+        }
+
+    def _reset(self) -> None:
+        self.period = 1.0 / self.rate
+        self._cost = 0.0
+        # (stack of code objects from leaf to root, (trace id, span id) or None) -> [samples, cpu ns]
+        self._counts: dict[tuple, list[int]] = {}
+        self._counts_lock = threading.Lock()
+        self._window_start = time.time_ns()
+        # thread id -> CPU time at the previous sample
+        self._cpu: dict[int, int] = {}
+        self._thread: threading.Thread | None = None
+        self._stop = threading.Event()
+        self._conn = _otlp.AgentConnection(self.endpoint)
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="rotel-profiling", daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(5.0)
+        self.export()
+        self._conn.close()
+
+    def _run(self) -> None:
+        next_export = time.monotonic() + self.interval
+        while not self._stop.wait(self.period):
+            start = time.perf_counter()
+            try:
+                self.sample()
+            except Exception:
+                traceback.print_exc()
+            self._adjust(time.perf_counter() - start)
+            if time.monotonic() >= next_export:
+                self.export()
+                next_export = time.monotonic() + self.interval
+
+    def _adjust(self, cost: float) -> None:
+        # smooth the cost of a sample and keep it under max_overhead of the period
+        self._cost = cost if not self._cost else 0.8 * self._cost + 0.2 * cost
+        self.period = min(max(1.0 / self.rate, self._cost / self.max_overhead), MAX_PERIOD)
+
+    def sample(self) -> None:
+        """Record the stacks of all threads that used CPU since the previous sample"""
+        own = threading.get_ident()
+        frames = sys._current_frames()
+        previous, cpu = self._cpu, {}
+        wall_ns = int(self.period * 1e9)
+        samples = []
+        for ident, frame in frames.items():
+            if ident == own:
+                continue
+            used = wall_ns
+            if _HAS_CPU_CLOCK:
+                try:
+                    now = time.clock_gettime_ns(time.pthread_getcpuclockid(ident))
+                except OSError:
+                    continue
+                cpu[ident] = now
+                last = previous.get(ident)
+                if last is None or now <= last:
+                    continue
+                used = now - last
+
+            stack = []
+            depth = self.max_depth
+            while frame is not None and depth:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+                depth -= 1
+            span = _thread_spans.get(ident)
+            if span is None:
+                sdk = _sdk_spans.get(ident)
+                span = sdk[-1] if sdk else None
+            samples.append(((tuple(stack), span), used))
+        del frames
+        self._cpu = cpu
+
+        with self._counts_lock:
+            counts = self._counts
+            for key, used in samples:
+                entry = counts.get(key)
+                if entry is None:
+                    if len(counts) >= self.max_stacks:
+                        self.stats["stacks_truncated"] += 1
+                        key = ((), key[1])
+                        entry = counts.get(key)
+                    if entry is None:
+                        entry = counts[key] = [0, 0]
+                entry[0] += 1
+                entry[1] += used
+            self.stats["samples"] += len(samples)
+
+    def folded(self) -> dict[str, int]:
+        """CPU nanoseconds per folded stack ("root;...;leaf") since the last export"""
+        with self._counts_lock:
+            counts = list(self._counts.items())
+        out: dict[str, int] = {}
+        for (stack, _), (_, used) in counts:
+            folded = self._fold(stack)
+            out[folded] = out.get(folded, 0) + used
+        return out
+
+    def _fold(self, stack: tuple) -> str:
+        if not stack:
+            return TRUNCATED
+        labels = self._labels
+        parts = []
+        for code in reversed(stack):
+            label = labels.get(code)
+            if label is None:
+                label = labels[code] = _label(code)
+            parts.append(label)
+        return ";".join(parts)
+
+    def encode(self, counts: dict[tuple, list[int]], start: int, end: int) -> bytes | None:
+        records = []
+        for (stack, span), (samples, used) in counts.items():
+            attrs = {
+                "profile.type": "cpu" if _HAS_CPU_CLOCK else "wall",
+                "profile.samples": samples,
+                "profile.cpu_time_ns": used,
+                "profile.start_time_unix_nano": start,
+            }
+            trace_id = span_id = None
+            if span is not None:
+                trace_id = span[0].to_bytes(16, "big")
+                span_id = span[1].to_bytes(8, "big")
+            records.append(_otlp.log_record(
+                end, 9, None, self._fold(stack), attrs, trace_id=trace_id, span_id=span_id,
+            ))
+        if not records:
+            return None
+        return _otlp.logs_request(self._resource, [(_otlp.scope(SCOPE), records)])
+
+    def export(self) -> bool:
+        """Send the stacks sampled since the last export to the agent"""
+        with self._counts_lock:
+            counts, self._counts = self._counts, {}
+            start, self._window_start = self._window_start, time.time_ns()
+        body = self.encode(counts, start, self._window_start)
+        # labels of code objects no longer sampled, or collected, are not kept around
+        self._labels = {}
+        if body is None:
+            return True
+        # sent as logs, counted apart from the application's logs
+        ok = self._conn.post(_otlp.LOGS_PATH, body, len(counts), signal="profiles")
+        self.stats["exports" if ok else "export_errors"] += 1
+        return ok
+
+    def _after_fork(self) -> None:
+        # Samples taken before the fork are exported by the parent
+        running = self._thread is not None and not self._stop.is_set()
+        self._reset()
+        if running:
+            self.start()
+
+
+_profiler: Profiler | None = None
+
+
+def start(
+    rate: int = DEFAULT_RATE,
+    interval: float = DEFAULT_INTERVAL,
+    max_stacks: int = DEFAULT_MAX_STACKS,
+    max_overhead: float = DEFAULT_MAX_OVERHEAD,
+    endpoint: str | None = None,
+    resource: dict[str, Any] | None = None,
+) -> Profiler:
+    """Start sampling all threads rate times a second and export every interval seconds"""
+    global _profiler
+    if _profiler is not None and _profiler.running:
+        return _profiler
+    _profiler = Profiler(
+        rate=rate, interval=interval, max_stacks=max_stacks, max_overhead=max_overhead,
+        endpoint=endpoint, resource=resource,
+    )
+    rotel_trace._activation_hook = _on_activation
+    _profiler.start()
+    return _profiler
+
+
+def stop() -> None:
+    global _profiler
+    profiler, _profiler = _profiler, None
+    if profiler is not None:
+        rotel_trace._activation_hook = None
+        profiler.stop()
+
+
+def get_profiler() -> Profiler | None:
+    return _profiler
+
+
+def _after_fork_in_child() -> None:
+    _thread_spans.clear()
+    _sdk_spans.clear()
+    if _profiler is not None:
+        _profiler._after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
@@ -0,0 +1,159 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Hot reload for processor modules.
+#
+# With processors_reload enabled, the agent loads a generated shim module for
+# each processor file instead of the file itself. The shim imports the real
+# module once at startup and delegates every call to it. A watcher thread polls
+# the file's modification time, imports a changed file under a fresh module name
+# as a staging step and checks that it still defines the processor function.
+# Only then is the reference the shim delegates to replaced, a single assignment
+# so in-flight batches finish on the old version. A file that fails to import
+# is reported in the agent log and the previous version keeps running.
+
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+
+from ._generate import write_module
+from .duration import parse_duration
+
+
+DEFAULT_INTERVAL = 1.0
+
+ENTRY_POINTS = {
+    "traces": "process_spans",
+    "metrics": "process_metrics",
+    "logs": "process_logs",
+}
+
+_SHIM = '''\
+# Generated by rotel.reload, do not edit.
+#
+# Delegates to {target} and reloads it when the file changes.
+
+import importlib.util
+import os
+import sys
+import threading
+import time
+import traceback
+
+
+_TARGET = {target!r}
+_ENTRY = {entry!r}
+_INTERVAL = {interval!r}
+_PREFIX = {prefix!r}
+
+_lock = threading.Lock()
+_version = 0
+_module_name = None
+_mtime = None
+_current = None
+
+stats = {{"reloads": 0, "reload_failures": 0}}
+
+
+def _stage():
+    # Import the file under a fresh name, the running version is untouched
+    # until this succeeds.
+    global _version
+    _version += 1
+    name = f"{{_PREFIX}}_{{_version}}"
+    spec = importlib.util.spec_from_file_location(name, _TARGET)
+    if spec is None or spec.loader is None:
+        raise ImportError(f"can not load {{_TARGET}}")
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    try:
+        spec.loader.exec_module(module)
+        entry = getattr(module, _ENTRY, None)
+        if not callable(entry):
+            raise ImportError(f"{{_TARGET}} does not define {{_ENTRY}}()")
+    except BaseException:
+        del sys.modules[name]
+        raise
+    return name, entry
+
+
+def _swap(name, entry, mtime):
+    global _module_name, _mtime, _current
+    previous = _module_name
+    _current = entry
+    _module_name = name
+    _mtime = mtime
+    if previous is not None:
+        sys.modules.pop(previous, None)
+
+
+def check():
+    """Reload the processor if its file changed, return True if swapped"""
+    global _mtime
+    with _lock:
+        try:
+            mtime = os.stat(_TARGET).st_mtime_ns
+        except OSError:
+            # mid-replace or removed, keep the running version
+            return False
+        if mtime == _mtime:
+            return False
+        try:
+            name, entry = _stage()
+        except Exception:
+            # don't retry the same broken file on every poll
+            _mtime = mtime
+            stats["reload_failures"] += 1
+            print(f"rotel: reloading processor {{_TARGET}} failed, keeping the previous version", file=sys.stderr)
+            traceback.print_exc()
+            return False
+        _swap(name, entry, mtime)
+        stats["reloads"] += 1
+        print(f"rotel: reloaded processor {{_TARGET}}", file=sys.stderr)
+        return True
+
+
+def _watch():
+    while True:
+        time.sleep(_INTERVAL)
+        try:
+            check()
+        except Exception:
+            traceback.print_exc()
+
+
+# the initial import must succeed, errors propagate to the agent
+_swap(*_stage(), os.stat(_TARGET).st_mtime_ns)
+if _INTERVAL > 0:
+    threading.Thread(target=_watch, name="rotel-processor-reload", daemon=True).start()
+
+
+def {entry}({arg}):
+    return _current({arg})
+'''
+
+
+def compile_reload_shim(path: str, signal: str, interval: float = DEFAULT_INTERVAL) -> str:
+    """Generate the source of a shim module that reloads the processor at path"""
+    entry = ENTRY_POINTS.get(signal)
+    if entry is None:
+        raise ValueError(f"unknown signal {signal}")
+    arg = "resource_" + ("spans" if signal == "traces" else signal)
+    # module names must be unique per target, not only per shim
+    path = os.path.abspath(path)
+    digest = hashlib.sha256(path.encode("utf-8")).hexdigest()[:8]
+    prefix = "rotel_reload_" + re.sub(r"\W", "_", os.path.basename(path).removesuffix(".py")) + "_" + digest
+    return _SHIM.format(target=path, entry=entry, arg=arg, interval=float(interval), prefix=prefix)
+
+
+def write_reload_shim(path: str, signal: str, interval: float = DEFAULT_INTERVAL, directory: str | None = None) -> str:
+    """Write a reload shim for the processor at path and return the shim's path"""
+    return write_module(f"reload_{signal}", compile_reload_shim(path, signal, interval), directory)
+
+
+def parse_interval(value: str | float | None) -> float:
+    """Parse a poll interval like "500ms" or "2s" into seconds"""
+    if value is None:
+        return DEFAULT_INTERVAL
+    return parse_duration(value)
@@ -0,0 +1,258 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Compiles declarative rules into a single generated processor module.
+#
+# Rules match on the span name (or log body), span status (or log severity),
+# record attributes and resource attributes, and apply drop, set, delete, hash
+# and truncate actions. The generated module precompiles every regular
+# expression, indexes each record's attributes once and evaluates all rules in
+# one pass. Like the built-in processors it only depends on the standard library
+# and the rotel_sdk, so the agent can load it directly.
+
+from __future__ import annotations
+
+import json
+import re
+from typing import TypedDict
+
+from ._generate import write_module
+
+
+class RuleMatch(TypedDict, total=False):
+    name: str | None
+    status: str | None
+    min_severity: str | int | None
+    attributes: dict[str, str] | None
+    resource: dict[str, str] | None
+
+class RuleAction(TypedDict, total=False):
+    action: str
+    key: str | None
+    value: str | int | float | bool | None
+    length: int | None
+
+class Rule(TypedDict, total=False):
+    name: str | None
+    match: RuleMatch | None
+    actions: list[RuleAction]
+
+
+ACTIONS = {"drop", "set", "delete", "hash", "truncate"}
+STATUS_CODES = {"unset": 0, "ok": 1, "error": 2}
+SEVERITIES = {"trace": 1, "debug": 5, "info": 9, "warn": 13, "warning": 13, "error": 17, "fatal": 21}
+
+_HEADER = '''\
+# Generated by rotel.rules, do not edit.
+
+import hashlib
+import re
+
+try:
+    from rotel_sdk.open_telemetry.common.v1 import KeyValue
+except ImportError:
+    KeyValue = None
+
+
+def _str(kv):
+    if kv is None or kv.value is None or kv.value.value is None:
+        return None
+    return str(kv.value.value)
+
+
+def _kv(key, value):
+    if isinstance(value, bool):
+        return KeyValue.new_bool_value(key, value)
+    if isinstance(value, int):
+        return KeyValue.new_int_value(key, value)
+    if isinstance(value, float):
+        return KeyValue.new_double_value(key, value)
+    return KeyValue.new_string_value(key, value)
+
+
+def _hash(kv):
+    value = _str(kv)
+    if value is None:
+        return kv
+    return KeyValue.new_string_value(kv.key, hashlib.sha256(value.encode("utf-8")).hexdigest())
+
+
+def _truncate(kv, length):
+    value = kv.value.value if kv.value is not None else None
+    if not isinstance(value, str) or len(value) <= length:
+        return kv
+    return KeyValue.new_string_value(kv.key, value[:length])
+'''
+
+
+def load_rules(path: str) -> list[Rule]:
+    """Load a list of rules from a JSON file"""
+    with open(path, encoding="utf-8") as file:
+        rules = json.load(file)
+    if not isinstance(rules, list):
+        raise ValueError(f"rules file {path} must contain a list of rules")
+    return rules
+
+
+def validate_rules(rules: list[Rule], signal: str) -> None:
+    """Raise ValueError if any rule is invalid for the signal"""
+    for i, rule in enumerate(rules):
+        label = rule.get("name") or f"#{i}"
+        match = rule.get("match") or {}
+        for key in match:
+            if key not in RuleMatch.__annotations__:
+                raise ValueError(f"rule {label}: unknown match field '{key}'")
+        if signal == "logs" and match.get("status") is not None:
+            raise ValueError(f"rule {label}: status only applies to traces, use min_severity")
+        if signal == "traces" and match.get("min_severity") is not None:
+            raise ValueError(f"rule {label}: min_severity only applies to logs")
+        if match.get("status") is not None and str(match["status"]).lower() not in STATUS_CODES:
+            raise ValueError(f"rule {label}: status must be one of unset, ok, error")
+        if match.get("min_severity") is not None:
+            _severity(match["min_severity"], label)
+        patterns = [match.get("name")] + list((match.get("attributes") or {}).values()) \
+            + list((match.get("resource") or {}).values())
+        for pattern in patterns:
+            if pattern is not None:
+                try:
+                    re.compile(pattern)
+                except re.error as e:
+                    raise ValueError(f"rule {label}: invalid regular expression '{pattern}': {e}") from e
+
+        actions = rule.get("actions")
+        if not actions:
+            raise ValueError(f"rule {label}: at least one action is required")
+        for action in actions:
+            name = action.get("action")
+            if name not in ACTIONS:
+                raise ValueError(f"rule {label}: unknown action '{name}'")
+            if name != "drop" and not action.get("key"):
+                raise ValueError(f"rule {label}: action '{name}' requires a key")
+            if name == "set" and action.get("value") is None:
+                raise ValueError(f"rule {label}: action 'set' requires a value")
+            if name == "truncate" and not isinstance(action.get("length"), int):
+                raise ValueError(f"rule {label}: action 'truncate' requires an integer length")
+
+
+def compile_rules(rules: list[Rule], signal: str) -> str:
+    """Generate the source of a processor module for traces or logs"""
+    if signal not in ("traces", "logs"):
+        raise ValueError(f"rules are not supported for {signal}")
+    validate_rules(rules, signal)
+
+    consts: list[str] = []
+    body: list[str] = []
+
+    def regex(pattern: str) -> str:
+        name = f"_RE_{len(consts)}"
+        consts.append(f"{name} = re.compile({pattern!r})")
+        return name
+
+    uses_resource = any((r.get("match") or {}).get("resource") for r in rules)
+    uses_attrs = any(
+        (r.get("match") or {}).get("attributes") or any(a["action"] != "drop" for a in r["actions"])
+        for r in rules
+    )
+
+    for i, rule in enumerate(rules):
+        match = rule.get("match") or {}
+        conds = []
+        if match.get("name") is not None:
+            field = "record.name" if signal == "traces" else "_str_body(record)"
+            conds.append(f"{regex(match['name'])}.search({field}) is not None")
+        if match.get("status") is not None:
+            code = STATUS_CODES[str(match["status"]).lower()]
+            conds.append(f"(record.status.code if record.status is not None else 0) == {code}")
+        if match.get("min_severity") is not None:
+            conds.append(f"record.severity_number >= {_severity(match['min_severity'], i)}")
+        for key, pattern in (match.get("attributes") or {}).items():
+            conds.append(f"_match(attrs.get({key!r}), {regex(pattern)})")
+        for key, pattern in (match.get("resource") or {}).items():
+            conds.append(f"_match(res.get({key!r}), {regex(pattern)})")
+
+        # repr escapes every line break, so a name cannot end the comment
+        body.append(f"    # rule {str(rule.get('name') or i)!r}")
+        indent = "    "
+        if conds:
+            body.append(f"    if {' and '.join(conds)}:")
+            indent = "        "
+        for action in rule["actions"]:
+            name = action["action"]
+            key = action.get("key")
+            if name == "drop":
+                body.append(f"{indent}return False")
+                break
+            if name == "set":
+                body.append(f"{indent}attrs[{key!r}] = _kv({key!r}, {action['value']!r})")
+                body.append(f"{indent}dirty = True")
+            elif name == "delete":
+                body.append(f"{indent}if attrs.pop({key!r}, None) is not None:")
+                body.append(f"{indent}    dirty = True")
+            elif name == "hash":
+                body.append(f"{indent}if {key!r} in attrs:")
+                body.append(f"{indent}    attrs[{key!r}] = _hash(attrs[{key!r}])")
+                body.append(f"{indent}    dirty = True")
+            elif name == "truncate":
+                body.append(f"{indent}if {key!r} in attrs:")
+                body.append(f"{indent}    attrs[{key!r}] = _truncate(attrs[{key!r}], {action['length']!r})")
+                body.append(f"{indent}    dirty = True")
+
+    if signal == "traces":
+        container, items, entry = "scope_spans", "spans", "process_spans(resource_spans)"
+        resource_arg = "resource_spans"
+    else:
+        container, items, entry = "scope_logs", "log_records", "process_logs(resource_logs)"
+        resource_arg = "resource_logs"
+
+    lines = [_HEADER]
+    lines.append('''
+def _match(kv, pattern):
+    value = _str(kv)
+    return value is not None and pattern.search(value) is not None
+
+
+def _str_body(record):
+    value = record.body.value if record.body is not None else None
+    return "" if value is None else str(value)
+''')
+    lines.extend(consts)
+    lines.append("")
+    lines.append("")
+    lines.append("def _apply(record, res):")
+    if uses_attrs:
+        # index the attributes once for all rules
+        lines.append("    attrs = {kv.key: kv for kv in record.attributes}")
+        lines.append("    dirty = False")
+    lines.extend(body)
+    if uses_attrs:
+        lines.append("    if dirty:")
+        lines.append("        record.attributes = list(attrs.values())")
+    lines.append("    return True")
+    lines.append("")
+    lines.append("")
+    lines.append(f"def {entry}:")
+    if uses_resource:
+        lines.append(f"    resource = {resource_arg}.resource")
+        lines.append("    res = {kv.key: kv for kv in resource.attributes} if resource is not None else {}")
+    else:
+        lines.append("    res = None")
+    lines.append(f"    for container in {resource_arg}.{container}:")
+    lines.append(f"        records = container.{items}")
+    lines.append("        kept = [record for record in records if _apply(record, res)]")
+    lines.append("        if len(kept) != len(records):")
+    lines.append(f"            container.{items} = kept")
+    lines.append("")
+    return "\n".join(lines)
+
+
+def write_rules_processor(rules: list[Rule], signal: str, directory: str | None = None) -> str:
+    """Compile rules to a processor module file and return its path"""
+    return write_module(f"rules_{signal}", compile_rules(rules, signal), directory)
+
+
+def _severity(value: str | int, label) -> int:
+    if isinstance(value, int):
+        return value
+    severity = SEVERITIES.get(str(value).lower())
+    if severity is None:
+        raise ValueError(f"rule {label}: unknown severity '{value}'")
+    return severity
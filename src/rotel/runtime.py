@@ -0,0 +1,200 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Python runtime metrics recorded with rotel.metrics.
+#
+# Garbage collections are timed from gc.callbacks, so they cost two clock reads
+# per collection and nothing in between. Event loop lag is measured by a timer
+# callback rescheduled on the loop every interval, recording how late it runs.
+# Threads, memory, file descriptors and CPU time are sampled once per metrics
+# export by a callback on the metrics exporter thread, so an idle process pays
+# nothing beyond the export itself.
+
+from __future__ import annotations
+
+import asyncio
+import gc
+import os
+import sys
+import threading
+import time
+
+from . import metrics
+
+
+SCOPE = "rotel.runtime"
+DEFAULT_LOOP_INTERVAL = 0.5
+
+# milliseconds
+PAUSE_BOUNDS = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 25.0, 50.0, 100.0, 250.0, 500.0, 1000.0)
+LAG_BOUNDS = (1.0, 2.5, 5.0, 10.0, 25.0, 50.0, 100.0, 250.0, 500.0, 1000.0, 2500.0, 5000.0)
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+
+
+def _rss_bytes() -> int | None:
+    try:
+        with open("/proc/self/statm", "rb") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # peak rather than current resident size, in KiB except on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss if sys.platform == "darwin" else rss * 1024
+
+
+def _open_fds() -> int | None:
+    for path in ("/proc/self/fd", "/dev/fd"):
+        try:
+            return len(os.listdir(path))
+        except OSError:
+            continue
+    return None
+
+
+class _Collector:
+    def __init__(self):
+        meter = metrics.get_meter(SCOPE)
+        self.gc_collections = meter.counter(
+            "python.gc.collections", unit="{collection}", description="Garbage collections by generation")
+        self.gc_collected = meter.counter(
+            "python.gc.collected_objects", unit="{object}", description="Objects freed by the garbage collector")
+        self.gc_uncollectable = meter.counter(
+            "python.gc.uncollectable_objects", unit="{object}", description="Objects the collector could not free")
+        self.gc_pause = meter.histogram(
+            "python.gc.pause", unit="ms", description="Duration of garbage collections", bounds=PAUSE_BOUNDS)
+        self.gc_count = meter.gauge(
+            "python.gc.count", unit="{object}", description="Allocations counted towards the next collection")
+        self.loop_lag = meter.histogram(
+            "python.asyncio.loop.lag", unit="ms", description="Delay of timer callbacks on the event loop",
+            bounds=LAG_BOUNDS)
+        self.threads = meter.gauge("process.thread.count", unit="{thread}", description="Python threads")
+        self.memory = meter.gauge("process.memory.usage", unit="By", description="Resident set size")
+        self.fds = meter.gauge(
+            "process.open_file_descriptor.count", unit="{file_descriptor}", description="Open file descriptors")
+        self.cpu_time = meter.counter("process.cpu.time", unit="s", description="CPU time used by the process")
+
+        # one bound series per generation, collections only do array updates
+        self._by_generation = [
+            (
+                self.gc_collections.bind({"python.gc.generation": g}),
+                self.gc_collected.bind({"python.gc.generation": g}),
+                self.gc_uncollectable.bind({"python.gc.generation": g}),
+                self.gc_pause.bind({"python.gc.generation": g}),
+            )
+            for g in range(3)
+        ]
+        self._gc_start = 0.0
+        self._cpu = os.times()
+
+    def on_gc(self, phase: str, info: dict) -> None:
+        if phase == "start":
+            self._gc_start = time.perf_counter()
+            return
+        generation = info.get("generation", 0)
+        if not 0 <= generation < 3:
+            return
+        collections, collected, uncollectable, pause = self._by_generation[generation]
+        pause.record((time.perf_counter() - self._gc_start) * 1000.0)
+        collections.add(1)
+        if info.get("collected"):
+            collected.add(info["collected"])
+        if info.get("uncollectable"):
+            uncollectable.add(info["uncollectable"])
+
+    def sample(self) -> None:
+        for generation, count in enumerate(gc.get_count()):
+            self.gc_count.set(count, {"python.gc.generation": generation})
+        self.threads.set(threading.active_count())
+        rss = _rss_bytes()
+        if rss is not None:
+            self.memory.set(rss)
+        fds = _open_fds()
+        if fds is not None:
+            self.fds.set(fds)
+        cpu, previous = os.times(), self._cpu
+        self._cpu = cpu
+        self.cpu_time.add(cpu.user - previous.user, {"cpu.mode": "user"})
+        self.cpu_time.add(cpu.system - previous.system, {"cpu.mode": "system"})
+
+
+class _LoopMonitor:
+    def __init__(self, loop: asyncio.AbstractEventLoop, interval: float, histogram: metrics.Histogram):
+        self.loop = loop
+        self.interval = interval
+        self._record = histogram.bind().record
+        self._expected = 0.0
+        self._handle: asyncio.TimerHandle | None = None
+        self._stopped = False
+
+    def schedule(self) -> None:
+        if self._stopped or self.loop.is_closed():
+            return
+        self._expected = self.loop.time() + self.interval
+        self._handle = self.loop.call_at(self._expected, self._tick)
+
+    def _tick(self) -> None:
+        self._record(max(self.loop.time() - self._expected, 0.0) * 1000.0)
+        self.schedule()
+
+    def stop(self) -> None:
+        self._stopped = True
+        if self._handle is not None:
+            self._handle.cancel()
+
+
+_collector: _Collector | None = None
+_monitors: list[_LoopMonitor] = []
+_lock = threading.Lock()
+
+
+def start() -> None:
+    """Start recording runtime metrics, and event loop lag of the running loop if there is one"""
+    global _collector
+    with _lock:
+        if _collector is not None:
+            return
+        _collector = _Collector()
+        gc.callbacks.append(_collector.on_gc)
+        metrics.register_callback(_collector.sample)
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return
+    monitor_event_loop()
+
+
+def stop() -> None:
+    global _collector
+    with _lock:
+        collector, _collector = _collector, None
+        monitors = list(_monitors)
+        _monitors.clear()
+    if collector is not None:
+        if collector.on_gc in gc.callbacks:
+            gc.callbacks.remove(collector.on_gc)
+        metrics.unregister_callback(collector.sample)
+    for monitor in monitors:
+        if monitor.loop.is_closed():
+            continue
+        monitor.loop.call_soon_threadsafe(monitor.stop)
+
+
+def monitor_event_loop(loop: asyncio.AbstractEventLoop | None = None, interval: float = DEFAULT_LOOP_INTERVAL) -> None:
+    """Record the lag of loop, the running loop by default, every interval seconds
+
+    Call it from the loop, for example in an application startup hook, or pass
+    the loop from another thread."""
+    if _collector is None:
+        start()
+    if loop is None:
+        loop = asyncio.get_running_loop()
+    with _lock:
+        if _collector is None or any(m.loop is loop for m in _monitors):
+            return
+        monitor = _LoopMonitor(loop, interval, _collector.loop_lag)
+        _monitors.append(monitor)
+    loop.call_soon_threadsafe(monitor.schedule)
@@ -0,0 +1,253 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Adaptive trace sampling driven by agent backpressure.
+#
+# The sampler keeps a sampling ratio between min_ratio and max_ratio. Once per
+# interval it looks at how the agent answered since the previous check:
+# throttling responses (429, 503), failed requests or a request latency above
+# target_latency halve the ratio, and healthy intervals raise it by step. The
+# responses come from the senders in this package (rotel.trace, rotel.metrics,
+# rotel.logging, rotel.profiling) and from OpenTelemetry SDK exporters wrapped
+# with observe_exporter().
+#
+# Decisions are derived from the trace id, like the SDK's TraceIdRatioBased
+# sampler, and child spans follow their parent. Spans of dropped traces are
+# still recorded, so the ones ending with an error status can be exported.
+
+from __future__ import annotations
+
+import threading
+import time
+import traceback
+from collections import deque
+from collections.abc import Callable, Sequence
+from typing import Any
+
+from . import _otlp
+
+
+DEFAULT_MIN_RATIO = 0.01
+DEFAULT_MAX_RATIO = 1.0
+DEFAULT_INTERVAL = 1.0
+DEFAULT_TARGET_LATENCY = 0.5
+DEFAULT_STEP = 0.05
+# factor applied to the ratio under backpressure
+DECREASE = 0.5
+
+_TRACE_ID_MASK = (1 << 64) - 1
+
+
+class AdaptiveSampler:
+    """Trace sampler adjusting its ratio to the backpressure of the agent
+
+    Pass it to rotel.trace with trace.configure(sampler=...) or to the
+    OpenTelemetry SDK as TracerProvider(sampler=...)."""
+
+    def __init__(
+        self,
+        min_ratio: float = DEFAULT_MIN_RATIO,
+        max_ratio: float = DEFAULT_MAX_RATIO,
+        interval: float = DEFAULT_INTERVAL,
+        target_latency: float = DEFAULT_TARGET_LATENCY,
+        step: float = DEFAULT_STEP,
+        keep_errors: bool = True,
+        health: _otlp.AgentHealth | None = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        if not 0.0 <= min_ratio <= max_ratio <= 1.0:
+            raise ValueError("ratios must satisfy 0 <= min_ratio <= max_ratio <= 1")
+        self.min_ratio = min_ratio
+        self.max_ratio = max_ratio
+        self.interval = interval
+        self.target_latency = target_latency
+        self.step = step
+        self.keep_errors = keep_errors
+        self._health = health or _otlp.agent_health
+        self._clock = clock
+
+        self._set_ratio(max_ratio)
+        self._seen = self._counts()
+        self._next_update = clock() + interval
+        self._lock = threading.Lock()
+        self.stats = {"decreases": 0, "increases": 0}
+
+    def _set_ratio(self, ratio: float) -> None:
+        self.ratio = ratio
+        self._threshold = int(ratio * (1 << 64))
+
+    def _counts(self) -> tuple[int, int, int]:
+        health = self._health
+        return health.ok, health.throttled, health.failed
+
+    def sample(self, trace_id: int) -> bool:
+        """Whether to keep the trace with trace_id"""
+        if self._clock() >= self._next_update:
+            self.update()
+        return (trace_id & _TRACE_ID_MASK) < self._threshold
+
+    def update(self) -> None:
+        """Adjust the ratio to the agent responses since the previous update"""
+        if not self._lock.acquire(blocking=False):
+            return
+        try:
+            now = self._clock()
+            if now < self._next_update:
+                return
+            self._next_update = now + self.interval
+            counts = self._counts()
+            ok, throttled, failed = (c - s for c, s in zip(counts, self._seen))
+            self._seen = counts
+            slow = bool(ok) and self._health.latency > self.target_latency
+            if throttled or failed or slow:
+                ratio = max(self.min_ratio, self.ratio * DECREASE)
+                if ratio < self.ratio:
+                    self.stats["decreases"] += 1
+                self._set_ratio(ratio)
+            elif ok and self.ratio < self.max_ratio:
+                self.stats["increases"] += 1
+                self._set_ratio(min(self.max_ratio, self.ratio + self.step))
+        finally:
+            self._lock.release()
+
+    #
+    # opentelemetry.sdk.trace.sampling.Sampler
+    #
+
+    def should_sample(
+        self,
+        parent_context: Any,
+        trace_id: int,
+        name: str,
+        kind: Any = None,
+        attributes: Any = None,
+        links: Sequence[Any] | None = None,
+        trace_state: Any = None,
+    ) -> Any:
+        from opentelemetry import trace as trace_api
+        from opentelemetry.sdk.trace.sampling import Decision, SamplingResult
+
+        parent = trace_api.get_current_span(parent_context).get_span_context()
+        if parent.is_valid:
+            sampled = parent.trace_flags.sampled
+        else:
+            sampled = self.sample(trace_id)
+        if sampled:
+            decision = Decision.RECORD_AND_SAMPLE
+        else:
+            # recorded so ErrorSpanProcessor can export the ones that fail
+            decision = Decision.RECORD_ONLY if self.keep_errors else Decision.DROP
+        return SamplingResult(
+            decision, attributes if decision != Decision.DROP else None,
+            parent.trace_state if parent.is_valid else None,
+        )
+
+    def get_description(self) -> str:
+        return f"AdaptiveSampler{{{self.min_ratio},{self.max_ratio}}}"
+
+
+class ErrorSpanProcessor:
+    """OpenTelemetry SDK span processor exporting the error spans of dropped traces
+
+    The SDK's batch processor only exports sampled spans. Add this processor
+    next to it, with an exporter to the agent, to also keep the spans that
+    AdaptiveSampler recorded without sampling and that end with an error."""
+
+    def __init__(self, exporter: Any, capacity: int = 2048, batch_size: int = 128, flush_interval: float = 1.0):
+        self.exporter = exporter
+        self.capacity = capacity
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._queue: deque = deque()
+        self._thread: threading.Thread | None = None
+        self._start_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._closed = False
+        self.stats = {"spans_exported": 0, "spans_dropped": 0}
+
+    def on_start(self, span: Any, parent_context: Any = None) -> None:
+        pass
+
+    def _on_ending(self, span: Any) -> None:
+        pass
+
+    def on_end(self, span: Any) -> None:
+        if span.context.trace_flags.sampled or span.status.status_code.name != "ERROR":
+            return
+        if len(self._queue) >= self.capacity or self._closed:
+            self.stats["spans_dropped"] += 1
+            return
+        if self._thread is None:
+            with self._start_lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="rotel-error-spans", daemon=True)
+                    self._thread.start()
+        self._queue.append(span)
+
+    def _run(self) -> None:
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self._drain()
+        self._drain()
+
+    def _drain(self) -> None:
+        queue = self._queue
+        while queue:
+            batch = []
+            try:
+                for _ in range(self.batch_size):
+                    batch.append(queue.popleft())
+            except IndexError:
+                pass
+            try:
+                self.exporter.export(batch)
+                self.stats["spans_exported"] += len(batch)
+            except Exception:
+                traceback.print_exc()
+
+    def shutdown(self) -> None:
+        self._closed = True
+        if self._thread is not None:
+            self._wakeup.set()
+            self._thread.join(5.0)
+
+    def force_flush(self, timeout_millis: int = 30000) -> bool:
+        self._wakeup.set()
+        return True
+
+
+def observe_exporter(exporter: Any) -> Any:
+    """Count the results of an OpenTelemetry SDK exporter sending to the agent as agent health"""
+    export = exporter.export
+
+    def observed(batch):
+        start = time.monotonic()
+        result = export(batch)
+        status = 200 if getattr(result, "name", None) == "SUCCESS" else None
+        _otlp.agent_health.record(status, time.monotonic() - start)
+        return result
+
+    exporter.export = observed
+    return exporter
+
+
+_sampler: AdaptiveSampler | None = None
+
+
+def install(
+    min_ratio: float = DEFAULT_MIN_RATIO,
+    max_ratio: float = DEFAULT_MAX_RATIO,
+    **kwargs: Any,
+) -> AdaptiveSampler:
+    """Create the process wide adaptive sampler and use it for rotel.trace"""
+    from . import trace
+
+    global _sampler
+    _sampler = AdaptiveSampler(min_ratio, max_ratio, **kwargs)
+    trace.configure(sampler=_sampler)
+    return _sampler
+
+
+def get_sampler() -> AdaptiveSampler | None:
+    """The sampler created by install() or the adaptive_sampling option, to pass to TracerProvider"""
+    return _sampler
@@ -0,0 +1,586 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Low-overhead tracing for hot code paths.
+#
+# Spans are small __slots__ objects reused from a pool. Starting one reads the
+# monotonic clock, draws random ids and looks up the parent in a context
+# variable, and ending one appends it to a bounded queue, in priority lanes
+# when they are configured (rotel.lanes). Attributes are kept as given and
+# nothing is encoded until a background thread drains the queue, encodes the
+# finished spans straight into an OTLP protobuf request for the agent and
+# returns them to the pool.
+#
+# Spans nest under the current OpenTelemetry SDK span when the API is
+# installed, and trace context is propagated with W3C traceparent headers.
+
+from __future__ import annotations
+
+import atexit
+import os
+import random
+import threading
+import time
+import traceback
+from collections import deque
+from collections.abc import Callable, Mapping, MutableMapping, Sequence
+from contextvars import ContextVar, Token
+from typing import TYPE_CHECKING, Any, NamedTuple
+
+from . import _otlp, exports
+from .lanes import DEFAULT_LANES, LaneQueue, span_lane
+from .pool import member_index
+
+
+if TYPE_CHECKING:
+    from .sampling import AdaptiveSampler
+
+
+DEFAULT_CAPACITY = 8192
+DEFAULT_BATCH_SIZE = 512
+DEFAULT_FLUSH_INTERVAL = 1.0
+DEFAULT_POOL_SIZE = 4096
+
+# SpanKind
+INTERNAL = 1
+SERVER = 2
+CLIENT = 3
+PRODUCER = 4
+CONSUMER = 5
+
+FLAG_SAMPLED = 0x01
+
+_monotonic_ns = time.monotonic_ns
+_getrandbits = random.getrandbits
+# wall clock time at monotonic zero, spans are timed with the monotonic clock
+_epoch_ns = time.time_ns() - time.monotonic_ns()
+
+
+class SpanContext(NamedTuple):
+    trace_id: int
+    span_id: int
+    flags: int = FLAG_SAMPLED
+    trace_state: str | None = None
+
+    @property
+    def sampled(self) -> bool:
+        return bool(self.flags & FLAG_SAMPLED)
+
+
+def _sdk_span_getter():
+    # Current OpenTelemetry span, if the API is installed
+    try:
+        from opentelemetry import trace
+    except ImportError:
+        return None
+    return trace.get_current_span
+
+
+_sdk_current_span = _sdk_span_getter()
+_current: ContextVar[Span | None] = ContextVar("rotel_current_span", default=None)
+# called with the new current span of the thread when a with block is entered or left, see rotel.profiling
+_activation_hook: Callable[[Span | None], None] | None = None
+
+
+class Span:
+    """A span, started with Tracer.start_span()
+
+    Spans are reused once exported, don't keep references to a span after
+    calling end() or leaving its with block."""
+
+    __slots__ = (
+        "tracer", "trace_id", "span_id", "parent_id", "flags", "trace_state", "name", "kind",
+        "start", "end_time", "attributes", "events", "status_code", "status_message",
+        "_attributes_owned", "_sdk_parent", "_token",
+    )
+
+    def __init__(self):
+        self.attributes: Mapping[str, Any] | None = None
+        self.events: list[tuple[int, str, Mapping[str, Any] | None]] | None = None
+        self._token: Token | None = None
+
+    def __enter__(self) -> Span:
+        self._token = _current.set(self)
+        if _activation_hook is not None:
+            _activation_hook(self)
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc is not None:
+            self.record_exception(exc)
+        if self._token is not None:
+            _current.reset(self._token)
+            self._token = None
+            if _activation_hook is not None:
+                _activation_hook(_current.get())
+        self.end()
+
+    @property
+    def is_recording(self) -> bool:
+        return bool(self.flags & FLAG_SAMPLED) and not self.end_time
+
+    def get_span_context(self) -> SpanContext:
+        return SpanContext(self.trace_id, self.span_id, self.flags, self.trace_state)
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        if not self._attributes_owned:
+            # attributes passed to start_span() are copied on the first write
+            self.attributes = dict(self.attributes or ())
+            self._attributes_owned = True
+        self.attributes[key] = value
+
+    def set_attributes(self, attributes: Mapping[str, Any]) -> None:
+        for key, value in attributes.items():
+            self.set_attribute(key, value)
+
+    def add_event(self, name: str, attributes: Mapping[str, Any] | None = None) -> None:
+        if self.events is None:
+            self.events = []
+        self.events.append((_monotonic_ns(), name, attributes))
+
+    def set_status(self, code: int, message: str | None = None) -> None:
+        self.status_code = code
+        self.status_message = message
+
+    def record_exception(self, exc: BaseException) -> None:
+        self.set_status(_otlp.STATUS_ERROR, f"{type(exc).__name__}: {exc}")
+        self.add_event("exception", {
+            "exception.type": type(exc).__name__,
+            "exception.message": str(exc),
+            "exception.stacktrace": "".join(traceback.format_exception(type(exc), exc, exc.__traceback__)),
+        })
+
+    def end(self) -> None:
+        if self.end_time:
+            return
+        self.end_time = _monotonic_ns()
+        _exporter.finish(self)
+
+
+class Tracer:
+    def __init__(self, name: str, version: str | None = None):
+        self.name = name
+        self.version = version
+        self._scope = _otlp.scope(name, version)
+
+    def start_span(
+        self,
+        name: str,
+        attributes: Mapping[str, Any] | None = None,
+        kind: int = INTERNAL,
+        parent: Span | SpanContext | None = None,
+    ) -> Span:
+        """Start a span, use it in a with block to make it the current span
+
+        The parent defaults to the current rotel span, or the current
+        OpenTelemetry SDK span if that was started more recently. attributes
+        are not copied, don't modify them afterwards."""
+        try:
+            span = _pool.pop()
+        except IndexError:
+            span = Span()
+
+        sdk_parent = None
+        if parent is None:
+            parent = _current.get()
+            if _sdk_current_span is not None:
+                sdk_parent = _sdk_current_span()
+                if parent is None or sdk_parent is not parent._sdk_parent:
+                    ctx = sdk_parent.get_span_context()
+                    if ctx.is_valid:
+                        parent = SpanContext(
+                            ctx.trace_id, ctx.span_id, ctx.trace_flags,
+                            ctx.trace_state.to_header() if ctx.trace_state else None,
+                        )
+
+        if parent is None:
+            span.trace_id = trace_id = _getrandbits(128) or 1
+            span.parent_id = 0
+            sampler = _exporter.sampler
+            span.flags = FLAG_SAMPLED if sampler is None or sampler.sample(trace_id) else 0
+            span.trace_state = None
+        else:
+            span.trace_id = parent.trace_id
+            span.parent_id = parent.span_id
+            span.flags = parent.flags
+            span.trace_state = parent.trace_state
+        span.span_id = _getrandbits(64) or 1
+        span.tracer = self
+        span.name = name
+        span.kind = kind
+        span.attributes = attributes
+        span._attributes_owned = False
+        span.status_code = _otlp.STATUS_UNSET
+        span.status_message = None
+        span._sdk_parent = sdk_parent
+        span.end_time = 0
+        span.start = _monotonic_ns()
+        return span
+
+
+def _release(span: Span) -> None:
+    if len(_pool) < _exporter.pool_size:
+        span.tracer = span.attributes = span.events = span._sdk_parent = span._token = None
+        _pool.append(span)
+
+
+_pool: list[Span] = []
+
+
+class _Exporter:
+    def __init__(self):
+        self.capacity = DEFAULT_CAPACITY
+        self.batch_size = DEFAULT_BATCH_SIZE
+        self.flush_interval = DEFAULT_FLUSH_INTERVAL
+        self.pool_size = DEFAULT_POOL_SIZE
+        # request size limit, from the agent's exporters when None
+        self.max_batch_bytes: int | None = None
+        # priority lanes, see rotel.lanes
+        self.lanes: tuple[tuple[str, int], ...] | None = None
+        self.classify: Callable[[Span], str] = span_lane
+        self.endpoint: str | None = None
+        self.resource: dict[str, Any] = {}
+        # decides on root spans, all traces are kept without one
+        self.sampler: AdaptiveSampler | None = None
+
+        self._queue: deque[Span] = deque()
+        self._thread: threading.Thread | None = None
+        self._closed = False
+        self._start_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._flush_waiters: list[threading.Event] = []
+        self._conn = _otlp.AgentConnection()
+        # one connection per agent pool member when spans are routed by trace id
+        self._member_conns: list[_otlp.AgentConnection] | None = None
+
+        self._stats_lock = threading.Lock()
+        self.stats = {
+            "spans_sent": 0,
+            "spans_dropped": 0,
+            "spans_failed": 0,
+            "spans_oversize": 0,
+            "batches_sent": 0,
+            "batch_splits": 0,
+            "export_errors": 0,
+        }
+
+    def finish(self, span: Span) -> None:
+        if not span.flags & FLAG_SAMPLED:
+            # the sampler may keep the error spans of dropped traces
+            sampler = self.sampler
+            if sampler is None or not sampler.keep_errors or span.status_code != _otlp.STATUS_ERROR:
+                _release(span)
+                return
+        queue = self._queue
+        if self.lanes is not None:
+            self._finish_in_lane(span, queue)
+            return
+        if len(queue) >= self.capacity or self._closed:
+            with self._stats_lock:
+                self.stats["spans_dropped"] += 1
+            _release(span)
+            return
+        if self._thread is None:
+            self._start()
+        queue.append(span)
+        if len(queue) >= self.batch_size:
+            self._wakeup.set()
+
+    def _finish_in_lane(self, span: Span, queue: LaneQueue) -> None:
+        lane = queue.lane(self.classify(span))
+        if len(queue) >= self.capacity or self._closed:
+            # make room by dropping from the lowest lane first
+            evicted = None if self._closed else queue.evict(lane)
+            with self._stats_lock:
+                self.stats["spans_dropped"] += 1
+            if evicted is None:
+                queue.reject(lane)
+                _release(span)
+                return
+            _release(evicted)
+        if self._thread is None:
+            self._start()
+        queue.put(span, lane)
+        if len(queue) >= self.batch_size:
+            self._wakeup.set()
+
+    def set_lanes(self, lanes: Sequence[tuple[str, int]] | None, classify: Callable[[Span], str] | None = None) -> None:
+        """Queue spans in priority lanes chosen by classify(span), or in a single queue with lanes None"""
+        self.lanes = tuple(lanes) if lanes else None
+        self.classify = classify or span_lane
+        previous, self._queue = self._queue, self._new_queue()
+        # spans queued until now go to their lane
+        while previous:
+            try:
+                span = previous.popleft()
+            except IndexError:
+                break
+            if self.lanes is not None:
+                self._queue.put(span, self._queue.lane(self.classify(span)))
+            else:
+                self._queue.append(span)
+
+    def _new_queue(self) -> deque[Span] | LaneQueue:
+        return LaneQueue(self.lanes, self.stats, "spans") if self.lanes is not None else deque()
+
+    def flush(self, timeout: float = 5.0) -> None:
+        thread = self._thread
+        # wait even with an empty queue, the last batch may still be in flight
+        if thread is None or not thread.is_alive():
+            return
+        done = threading.Event()
+        with self._start_lock:
+            self._flush_waiters.append(done)
+        self._wakeup.set()
+        done.wait(timeout)
+
+    def shutdown(self) -> None:
+        self._closed = True
+        thread = self._thread
+        if thread is not None:
+            self._wakeup.set()
+            thread.join(5.0)
+        self._conn.close()
+
+    def _start(self) -> None:
+        with self._start_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="rotel-trace", daemon=True)
+                self._thread.start()
+
+    def _run(self) -> None:
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self._drain()
+        self._drain()
+
+    def _drain(self) -> None:
+        queue = self._queue
+        while queue:
+            batch = []
+            try:
+                for _ in range(self.batch_size):
+                    batch.append(queue.popleft())
+            except IndexError:
+                pass
+            self._send(batch)
+
+        with self._start_lock:
+            waiters, self._flush_waiters = self._flush_waiters, []
+        for done in waiters:
+            done.set()
+
+    def _send(self, batch: list[Span]) -> None:
+        if self.endpoint is None and self._member_conns is None:
+            endpoints = _otlp.agent_trace_endpoints()
+            if endpoints:
+                self._member_conns = [_otlp.AgentConnection(endpoint) for endpoint in endpoints]
+        if self._member_conns:
+            # every span of a trace goes to the same agent
+            size = len(self._member_conns)
+            parts: dict[int, list[Span]] = {}
+            for span in batch:
+                parts.setdefault(member_index(span.trace_id, size), []).append(span)
+            for index, part in parts.items():
+                self._post(self._member_conns[index], part)
+        else:
+            self._post(self._conn, batch)
+
+    def _post(self, conn: _otlp.AgentConnection, batch: list[Span]) -> None:
+        start = time.perf_counter()
+        try:
+            requests = self.encode_requests(batch, self.max_batch_bytes or _otlp.agent_batch_bytes("traces"))
+            exports.record_encode("traces", time.perf_counter() - start)
+        except Exception:
+            traceback.print_exc()
+            self.stats["spans_failed"] += len(batch)
+            return
+        finally:
+            for span in batch:
+                _release(span)
+        for body, count in requests:
+            if conn.post(_otlp.TRACES_PATH, body, count):
+                self.stats["spans_sent"] += count
+                self.stats["batches_sent"] += 1
+            else:
+                self.stats["spans_failed"] += count
+                self.stats["export_errors"] += 1
+
+    def encode_spans(self, batch: list[Span]) -> list[tuple[bytes, bytes]]:
+        """(scope, span) pairs of the encoded spans of batch"""
+        encoded = []
+        epoch = _epoch_ns
+        for span in batch:
+            events = None
+            if span.events:
+                events = [_otlp.span_event(epoch + t, name, attrs) for t, name, attrs in span.events]
+            encoded.append((span.tracer._scope, _otlp.span(
+                span.trace_id.to_bytes(16, "big"),
+                span.span_id.to_bytes(8, "big"),
+                span.parent_id.to_bytes(8, "big") if span.parent_id else None,
+                span.name,
+                span.kind,
+                epoch + span.start,
+                epoch + span.end_time,
+                span.attributes,
+                events,
+                span.status_code,
+                span.status_message,
+                span.trace_state,
+                span.flags,
+            )))
+        return encoded
+
+    def encode(self, batch: list[Span]) -> bytes:
+        scopes: dict[bytes, list[bytes]] = {}
+        for scope, span in self.encode_spans(batch):
+            scopes.setdefault(scope, []).append(span)
+        return _otlp.traces_request(self._resource(), scopes.items())
+
+    def encode_requests(self, batch: list[Span], max_bytes: int) -> list[tuple[bytes, int]]:
+        """Requests of at most max_bytes sending batch, with the number of spans in each"""
+        resource = self._resource()
+        return [
+            (_otlp.traces_request(resource, scopes), count)
+            for scopes, count in _otlp.split_request(resource, self.encode_spans(batch), max_bytes, self.stats, "spans")
+        ]
+
+    def _resource(self) -> bytes:
+        attrs = _otlp.default_resource_attributes()
+        attrs.update(self.resource)
+        return _otlp.resource(attrs)
+
+    def _after_fork(self) -> None:
+        # Spans queued before the fork belong to the parent, which sends them.
+        self._queue = self._new_queue()
+        self._thread = None
+        self._closed = False
+        self._start_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._flush_waiters = []
+        self._stats_lock = threading.Lock()
+        self._conn = _otlp.AgentConnection(self.endpoint)
+        self._member_conns = None
+
+
+_tracers: dict[tuple[str, str | None], Tracer] = {}
+_tracers_lock = threading.Lock()
+_exporter = _Exporter()
+
+
+def configure(
+    capacity: int | None = None,
+    batch_size: int | None = None,
+    flush_interval: float | None = None,
+    pool_size: int | None = None,
+    endpoint: str | None = None,
+    resource: dict[str, Any] | None = None,
+    sampler: AdaptiveSampler | None = None,
+    max_batch_bytes: int | None = None,
+    lanes: Sequence[tuple[str, int]] | bool | None = None,
+    classify: Callable[[Span], str] | None = None,
+) -> None:
+    """Set the queue capacity, batching, request size limit, span pool size, agent endpoint, resource and sampler
+
+    lanes queues spans in priority lanes, True for rotel.lanes.DEFAULT_LANES
+    and False for a single queue, classify(span) chooses the lane of a span."""
+    if capacity is not None:
+        _exporter.capacity = capacity
+    if batch_size is not None:
+        _exporter.batch_size = batch_size
+    if flush_interval is not None:
+        _exporter.flush_interval = flush_interval
+    if pool_size is not None:
+        _exporter.pool_size = pool_size
+    if endpoint is not None:
+        _exporter.endpoint = endpoint
+        _exporter._conn = _otlp.AgentConnection(endpoint)
+    if resource is not None:
+        _exporter.resource = dict(resource)
+    if sampler is not None:
+        _exporter.sampler = sampler
+    if max_batch_bytes is not None:
+        _exporter.max_batch_bytes = max_batch_bytes
+    if lanes is not None or classify is not None:
+        if lanes is None:
+            lanes = _exporter.lanes
+        _exporter.set_lanes(DEFAULT_LANES if lanes is True else lanes or None, classify or _exporter.classify)
+
+
+def get_tracer(name: str, version: str | None = None) -> Tracer:
+    """Tracer for an instrumentation scope"""
+    with _tracers_lock:
+        tracer = _tracers.get((name, version))
+        if tracer is None:
+            tracer = _tracers[(name, version)] = Tracer(name, version)
+    return tracer
+
+
+def current_span() -> Span | None:
+    return _current.get()
+
+
+def stats() -> dict[str, int]:
+    return dict(_exporter.stats)
+
+
+def flush(timeout: float = 5.0) -> None:
+    """Wait until the finished spans have been sent"""
+    _exporter.flush(timeout)
+
+
+def shutdown() -> None:
+    _exporter.shutdown()
+
+
+#
+# W3C trace context
+#
+
+def format_traceparent(ctx: SpanContext) -> str:
+    return f"00-{ctx.trace_id:032x}-{ctx.span_id:016x}-{ctx.flags & 0xFF:02x}"
+
+
+def parse_traceparent(value: str, trace_state: str | None = None) -> SpanContext | None:
+    parts = value.strip().split("-")
+    if len(parts) < 4 or len(parts[0]) != 2 or parts[0] == "ff" or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    if parts[0] == "00" and len(parts) != 4:
+        return None
+    try:
+        trace_id, span_id, flags = int(parts[1], 16), int(parts[2], 16), int(parts[3][:2], 16)
+    except ValueError:
+        return None
+    if not trace_id or not span_id:
+        return None
+    return SpanContext(trace_id, span_id, flags, trace_state or None)
+
+
+def inject(carrier: MutableMapping[str, str], span: Span | SpanContext | None = None) -> None:
+    """Set the traceparent and tracestate headers for span, the current span by default"""
+    if span is None:
+        span = _current.get()
+        if span is None:
+            return
+    ctx = span.get_span_context() if isinstance(span, Span) else span
+    carrier["traceparent"] = format_traceparent(ctx)
+    if ctx.trace_state:
+        carrier["tracestate"] = ctx.trace_state
+
+
+def extract(carrier: Mapping[str, str]) -> SpanContext | None:
+    """Remote parent from traceparent and tracestate headers, pass it as start_span(parent=...)"""
+    value = carrier.get("traceparent")
+    if value is None:
+        return None
+    return parse_traceparent(value, carrier.get("tracestate"))
+
+
+def _after_fork_in_child() -> None:
+    _exporter._after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork_in_child)
+
+atexit.register(lambda: _exporter._thread is not None and shutdown())
@@ -0,0 +1,472 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Batch and compression tuner.
+#
+#   python -m rotel.tune [--workload FILE] [--latency 20ms] [--rate 50000] ...
+#
+# Replays a trace workload through the agent, once per combination of
+# batch_max_size, batch_timeout and exporter compression, against a local
+# OTLP/HTTP stand-in for the exporter endpoint that can add latency to every
+# request. Each span is moved to start at the moment it is sent, keeping its
+# duration, so the stand-in measures how long spans take to cross the agent. Each trial reports
+# the throughput, the p50/p99 latency and the CPU time of the agent; the
+# recommendation is printed as Options for rotel.Rotel(**options), with the
+# trials and the ones no other trial beats on all three.
+#
+# Workloads are synthetic, or captured ExportTraceServiceRequest bodies each
+# prefixed with its length as a 4 byte big-endian integer, see write_workload().
+# The Kafka exporter settings are not searched, that needs a real broker.
+
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import socket
+import struct
+import sys
+import tempfile
+import threading
+import time
+import zlib
+from collections.abc import Iterable, Sequence
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from itertools import product
+
+from . import _otlp
+from .agent import Agent
+from .config import Config, Options
+from .duration import parse_duration
+
+
+DEFAULT_SPACE = {
+    "batch_max_size": [512, 2048, 8192],
+    "batch_timeout": ["50ms", "200ms", "1s"],
+    "compression": ["none", "gzip"],
+}
+OBJECTIVES = ("balanced", "throughput", "latency", "cpu")
+# balanced picks the lowest latency within this share of the best throughput
+BALANCED_THROUGHPUT = 0.95
+TRIAL_TIMEOUT = 30.0
+
+_U32 = struct.Struct(">I")
+_FIXED64 = struct.Struct("<Q")
+
+
+#
+# Workloads
+#
+
+def synthetic_workload(batches: int = 200, spans_per_batch: int = 50) -> list[bytes]:
+    """ExportTraceServiceRequest bodies of spans with the attributes of a typical HTTP server span"""
+    resource = _otlp.resource({"service.name": "rotel-tune"})
+    scope = _otlp.scope("rotel.tune")
+    now = time.time_ns()
+    bodies = []
+    for b in range(batches):
+        spans = []
+        for i in range(spans_per_batch):
+            n = b * spans_per_batch + i
+            spans.append(_otlp.span(
+                (n + 1).to_bytes(16, "big"), (n + 1).to_bytes(8, "big"), None, "GET /api/orders/{id}", 2,
+                now, now + 1_500_000,
+                {"http.request.method": "GET", "http.route": "/api/orders/{id}", "url.path": f"/api/orders/{n}",
+                 "http.response.status_code": 200, "server.address": "orders.internal", "user_agent.original":
+                 "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko)"},
+            ))
+        bodies.append(_otlp.traces_request(resource, [(scope, spans)]))
+    return bodies
+
+
+def write_workload(path: str, bodies: Iterable[bytes]) -> None:
+    """Write ExportTraceServiceRequest bodies in the format read by read_workload()"""
+    with open(path, "wb") as file:
+        for body in bodies:
+            file.write(_U32.pack(len(body)) + body)
+
+
+def read_workload(path: str) -> list[bytes]:
+    with open(path, "rb") as file:
+        data = file.read()
+    bodies = []
+    offset = 0
+    while offset < len(data):
+        size, = _U32.unpack_from(data, offset)
+        bodies.append(data[offset + 4:offset + 4 + size])
+        offset += 4 + size
+    return bodies
+
+
+def _varint(data: bytes | bytearray, offset: int) -> tuple[int, int]:
+    value = shift = 0
+    while True:
+        byte = data[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            return value, offset
+        shift += 7
+
+
+def _fields(data: bytes | bytearray, start: int, end: int) -> Iterable[tuple[int, int, int, int]]:
+    """(field, wire type, value offset, value end) of the fields of a message"""
+    offset = start
+    while offset < end:
+        key, offset = _varint(data, offset)
+        wire_type = key & 7
+        if wire_type == 0:
+            _, value_end = _varint(data, offset)
+        elif wire_type == 1:
+            value_end = offset + 8
+        elif wire_type == 2:
+            size, offset = _varint(data, offset)
+            value_end = offset + size
+        elif wire_type == 5:
+            value_end = offset + 4
+        else:
+            raise ValueError(f"unsupported wire type {wire_type}")
+        yield key >> 3, wire_type, offset, value_end
+        offset = value_end
+
+
+def span_start_offsets(body: bytes | bytearray) -> list[int]:
+    """Offsets of the start_time_unix_nano values of the spans of an ExportTraceServiceRequest"""
+    return [start for start, _ in span_time_offsets(body)]
+
+
+def span_time_offsets(body: bytes | bytearray) -> list[tuple[int, int | None]]:
+    """Offsets of the start_time_unix_nano and end_time_unix_nano values of the spans of an ExportTraceServiceRequest
+
+    The end offset is None for a span without an end time."""
+    offsets = []
+    for field, _, rs_start, rs_end in _fields(body, 0, len(body)):
+        if field != 1:
+            continue
+        for field, _, ss_start, ss_end in _fields(body, rs_start, rs_end):
+            if field != 2:
+                continue
+            for field, _, span_start, span_end in _fields(body, ss_start, ss_end):
+                if field != 2:
+                    continue
+                start = end = None
+                for field, wire_type, value, _ in _fields(body, span_start, span_end):
+                    if field == 7 and wire_type == 1:
+                        start = value
+                    elif field == 8 and wire_type == 1:
+                        end = value
+                if start is not None:
+                    offsets.append((start, end))
+    return offsets
+
+
+def stamp_spans(body: bytearray, offsets: Iterable[tuple[int, int | None]], start: int) -> None:
+    """Move the spans of body at offsets, see span_time_offsets(), to start at start keeping their duration"""
+    for start_offset, end_offset in offsets:
+        if end_offset is not None:
+            duration = _FIXED64.unpack_from(body, end_offset)[0] - _FIXED64.unpack_from(body, start_offset)[0]
+            _FIXED64.pack_into(body, end_offset, start + max(duration, 0))
+        _FIXED64.pack_into(body, start_offset, start)
+
+
+#
+# Exporter stand-in
+#
+
+class StandIn:
+    """OTLP/HTTP endpoint recording when each span arrives, answering after latency seconds"""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.reset()
+        stand_in = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                received = time.time_ns()
+                body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                stand_in.record(body, self.headers.get("Content-Encoding"), received)
+                if stand_in.latency:
+                    time.sleep(stand_in.latency)
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-protobuf")
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, name="rotel-tune-stand-in", daemon=True).start()
+
+    @property
+    def endpoint(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def reset(self) -> None:
+        with self.lock:
+            self.requests = 0
+            self.bytes = 0
+            self.latencies: list[int] = []
+            self.last = 0
+
+    def record(self, body: bytes, encoding: str | None, received: int) -> None:
+        wire_size = len(body)
+        if encoding == "gzip":
+            body = zlib.decompress(body, 31)
+        latencies = [received - _FIXED64.unpack_from(body, offset)[0] for offset in span_start_offsets(body)]
+        with self.lock:
+            self.requests += 1
+            self.bytes += wire_size
+            self.latencies.extend(latencies)
+            self.last = max(self.last, received)
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+#
+# Trials
+#
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _cpu_seconds(pid: int | None) -> float | None:
+    """User and system CPU time of a process, from /proc"""
+    if pid is None:
+        return None
+    try:
+        with open(f"/proc/{pid}/stat") as file:
+            # the command name may contain spaces, the fields follow its closing parenthesis
+            fields = file.read().rpartition(")")[2].split()
+        return (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _wait_ready(endpoint: str, timeout: float) -> bool:
+    host, _, port = endpoint.rpartition(":")
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((host, int(port)), timeout=0.1).close()
+            return True
+        except OSError:
+            time.sleep(0.01)
+    return False
+
+
+def _percentile(values: Sequence[int], q: float) -> float | None:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(int(q * len(ordered)), len(ordered) - 1)] / 1e6
+
+
+def trial_options(params: dict, endpoint: str) -> Options:
+    """Options setting the tuned parameters, with an OTLP exporter to endpoint"""
+    return Options(
+        batch_max_size=params["batch_max_size"],
+        batch_timeout=params["batch_timeout"],
+        exporter=Config.otlp_exporter(endpoint=endpoint, protocol="http", compression=params["compression"]),
+    )
+
+
+def run_trial(
+    workload: Sequence[bytes],
+    params: dict,
+    stand_in: StandIn,
+    rate: float = 0.0,
+    timeout: float = TRIAL_TIMEOUT,
+) -> dict:
+    """Send workload through an agent configured with params, at rate spans per second or as fast as possible"""
+    offsets = [span_time_offsets(body) for body in workload]
+    total = sum(len(o) for o in offsets)
+    stand_in.reset()
+    agent = Agent()
+    with tempfile.TemporaryDirectory() as tmp:
+        http_endpoint = f"127.0.0.1:{_free_port()}"
+        config = Config(Options(
+            enabled=True,
+            pid_file=os.path.join(tmp, "rotel-agent.pid"),
+            log_file=os.path.join(tmp, "rotel-agent.log"),
+            otlp_grpc_endpoint=f"127.0.0.1:{_free_port()}",
+            otlp_http_endpoint=http_endpoint,
+            **trial_options(params, stand_in.endpoint),
+        ))
+        if not config.is_active():
+            raise ValueError(f"invalid parameters {params}")
+        if not agent.start(config) or not _wait_ready(http_endpoint, 5.0):
+            raise RuntimeError("the agent did not start, see its log")
+        try:
+            pid = agent.pid()
+            cpu_before = _cpu_seconds(pid)
+            conn = _otlp.AgentConnection(http_endpoint)
+            begin = time.time_ns()
+            sent = 0
+            for body, body_offsets in zip(workload, offsets):
+                if rate:
+                    # pace to the rate, sleeping off any lead
+                    ahead = begin + sent / rate * 1e9 - time.time_ns()
+                    if ahead > 0:
+                        time.sleep(ahead / 1e9)
+                body = bytearray(body)
+                stamp_spans(body, body_offsets, time.time_ns())
+                conn.post(_otlp.TRACES_PATH, bytes(body))
+                sent += len(body_offsets)
+            conn.close()
+            deadline = time.monotonic() + timeout
+            while len(stand_in.latencies) < total and time.monotonic() < deadline:
+                time.sleep(0.01)
+            cpu_after = _cpu_seconds(pid)
+        finally:
+            agent.stop()
+
+    with stand_in.lock:
+        latencies = list(stand_in.latencies)
+        elapsed = (stand_in.last - begin) / 1e9 if stand_in.last else 0.0
+        exported_bytes = stand_in.bytes
+        requests = stand_in.requests
+    cpu = cpu_after - cpu_before if cpu_before is not None and cpu_after is not None else None
+    return {
+        **params,
+        "items": len(latencies),
+        "complete": len(latencies) >= total,
+        "throughput": len(latencies) / elapsed if elapsed > 0 else 0.0,
+        "latency_p50_ms": _percentile(latencies, 0.5),
+        "latency_p99_ms": _percentile(latencies, 0.99),
+        "cpu_seconds": cpu,
+        "cpu_us_per_item": cpu / len(latencies) * 1e6 if cpu is not None and latencies else None,
+        "requests": requests,
+        "bytes": exported_bytes,
+    }
+
+
+def search(
+    workload: Sequence[bytes],
+    space: dict[str, list] | None = None,
+    latency: float = 0.0,
+    rate: float = 0.0,
+    timeout: float = TRIAL_TIMEOUT,
+) -> list[dict]:
+    """Run a trial for every combination of the parameters in space"""
+    space = {**DEFAULT_SPACE, **(space or {})}
+    stand_in = StandIn(latency)
+    try:
+        return [
+            run_trial(workload, dict(zip(space, values)), stand_in, rate=rate, timeout=timeout)
+            for values in product(*space.values())
+        ]
+    finally:
+        stand_in.close()
+
+
+#
+# Recommendation
+#
+
+def _costs(trial: dict) -> tuple[float, float, float]:
+    # lower is better for each
+    cpu = trial["cpu_us_per_item"]
+    return -trial["throughput"], trial["latency_p99_ms"], 0.0 if cpu is None else cpu
+
+
+def pareto(trials: Sequence[dict]) -> list[dict]:
+    """Complete trials that no other one matches or beats on throughput, p99 latency and CPU at once"""
+    complete = [t for t in trials if t["complete"] and t["items"]]
+    front = []
+    for trial in complete:
+        costs = _costs(trial)
+        dominated = any(
+            other is not trial and all(o <= c for o, c in zip(_costs(other), costs)) and _costs(other) != costs
+            for other in complete
+        )
+        if not dominated:
+            front.append(trial)
+    return front
+
+
+def recommend(trials: Sequence[dict], objective: str = "balanced") -> dict | None:
+    """Best complete trial for objective, one of OBJECTIVES"""
+    front = pareto(trials)
+    if not front:
+        return None
+    if objective == "throughput":
+        return max(front, key=lambda t: t["throughput"])
+    if objective == "latency":
+        return min(front, key=lambda t: t["latency_p99_ms"])
+    if objective == "cpu":
+        return min(front, key=lambda t: _costs(t)[2])
+    best = max(t["throughput"] for t in front)
+    fast = [t for t in front if t["throughput"] >= BALANCED_THROUGHPUT * best]
+    return min(fast, key=lambda t: (t["latency_p99_ms"], _costs(t)[2]))
+
+
+def recommended_options(trial: dict, endpoint: str | None = None) -> Options:
+    """Options of trial, with the exporter endpoint set when given"""
+    options = trial_options(trial, endpoint or "")
+    if endpoint is None:
+        del options["exporter"]["endpoint"]
+    del options["exporter"]["protocol"]
+    # the same validation as rotel.Rotel(**options)
+    if not Config(Options(enabled=True, **options)).valid:
+        raise ValueError(f"invalid recommendation {options}")
+    return options
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m rotel.tune",
+        description="Replay a trace workload through the agent and recommend batch and compression options.",
+    )
+    parser.add_argument("--workload", help="captured workload file, synthetic spans by default")
+    parser.add_argument("--batches", type=int, default=200, help="synthetic workload requests")
+    parser.add_argument("--spans-per-batch", type=int, default=50, help="spans in each synthetic request")
+    parser.add_argument("--latency", default="0ms", help="latency added to each export request, like 20ms")
+    parser.add_argument("--rate", type=float, default=0.0, help="spans per second to send, 0 for as fast as possible")
+    parser.add_argument("--batch-max-size", type=int, nargs="+", default=DEFAULT_SPACE["batch_max_size"])
+    parser.add_argument("--batch-timeout", nargs="+", default=DEFAULT_SPACE["batch_timeout"])
+    parser.add_argument("--compression", nargs="+", default=DEFAULT_SPACE["compression"])
+    parser.add_argument("--objective", choices=OBJECTIVES, default="balanced")
+    parser.add_argument("--endpoint", help="exporter endpoint to put in the recommended options")
+    parser.add_argument("--timeout", type=float, default=TRIAL_TIMEOUT, help="seconds to wait for each trial")
+    parser.add_argument("--output", help="write the result to this file instead of stdout")
+    args = parser.parse_args(argv)
+
+    if not os.path.isfile(Agent().agent_path):
+        print("rotel-agent is not installed, the tuner needs it", file=sys.stderr)
+        return 1
+    workload = read_workload(args.workload) if args.workload else synthetic_workload(args.batches, args.spans_per_batch)
+    space = {
+        "batch_max_size": args.batch_max_size,
+        "batch_timeout": args.batch_timeout,
+        "compression": args.compression,
+    }
+    trials = search(workload, space, latency=parse_duration(args.latency), rate=args.rate, timeout=args.timeout)
+    best = recommend(trials, args.objective)
+    result = {
+        "objective": args.objective,
+        "recommended": recommended_options(best, args.endpoint) if best else None,
+        "trial": best,
+        "pareto": pareto(trials),
+        "trials": trials,
+    }
+    output = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(output + "\n")
+    else:
+        print(output)
+    return 0 if best else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,88 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Telemetry volume reports.
+#
+# The volume processor (rotel/processors/volume.py) counts the items and bytes
+# passing through it and writes a report per signal next to the agent's pid
+# file. With dry_run enabled the tap ends every processor list and the agent
+# exports to the blackhole exporter, so the reports tell what an exporter would
+# have sent. read_volume_report() loads them for Client.volume_report().
+
+from __future__ import annotations
+
+import json
+import os
+
+
+SIGNALS = ("traces", "metrics", "logs")
+DEFAULT_WINDOW = "60s"
+
+
+def stats_prefix(pid_file: str) -> str:
+    """Prefix of the volume report files of the agent using pid_file"""
+    return os.path.splitext(pid_file)[0] + ".volume"
+
+
+def _totals(signals: dict[str, dict]) -> dict:
+    return {
+        key: sum(report.get(key, 0) for report in signals.values())
+        for key in ("items", "bytes", "compressed_bytes", "bytes_per_second", "compressed_bytes_per_second")
+    }
+
+
+def read_volume_report(prefix: str) -> dict:
+    """Load the volume reports written by the agent, keyed by signal, and their totals
+
+    Signals without a report, because the agent has not written one yet or saw
+    no data for them, are left out."""
+    signals = {}
+    for signal in SIGNALS:
+        try:
+            with open(f"{prefix}.{signal}.json", encoding="utf-8") as file:
+                signals[signal] = json.load(file)
+        except FileNotFoundError:
+            continue
+    return {"signals": signals, "totals": _totals(signals)}
+
+
+def merge_volume_reports(reports: list[dict]) -> dict:
+    """Combine the volume reports of several agents, like the members of an agent pool"""
+    if len(reports) == 1:
+        return reports[0]
+    signals: dict[str, dict] = {}
+    for report in reports:
+        for signal, entry in report["signals"].items():
+            into = signals.get(signal)
+            if into is None:
+                signals[signal] = dict(
+                    entry,
+                    resources={k: dict(v) for k, v in entry["resources"].items()},
+                    attributes=[dict(a) for a in entry["attributes"]],
+                )
+                continue
+            for key in ("batches", "items", "bytes", "compressed_bytes",
+                        "items_per_second", "bytes_per_second", "compressed_bytes_per_second"):
+                into[key] += entry[key]
+            into["start"] = min(into["start"], entry["start"])
+            into["end"] = max(into["end"], entry["end"])
+            into["complete"] = into["complete"] and entry["complete"]
+            for name, resource in entry["resources"].items():
+                merged = into["resources"].setdefault(name, {"items": 0, "bytes": 0})
+                merged["items"] += resource["items"]
+                merged["bytes"] += resource["bytes"]
+            top_keys = max(len(into["attributes"]), len(entry["attributes"]))
+            attributes = {(a["location"], a["key"]): a for a in into["attributes"]}
+            for attribute in entry["attributes"]:
+                merged = attributes.setdefault(
+                    (attribute["location"], attribute["key"]), dict(attribute, count=0, bytes=0))
+                merged["count"] += attribute["count"]
+                merged["bytes"] += attribute["bytes"]
+            into["attributes"] = sorted(attributes.values(), key=lambda a: a["bytes"], reverse=True)[:top_keys]
+
+    for entry in signals.values():
+        size = entry["bytes"]
+        entry["compression_ratio"] = entry["compressed_bytes"] / size if size else 0.0
+        entry["bytes_per_item"] = size / entry["items"] if entry["items"] else 0.0
+        for attribute in entry["attributes"]:
+            attribute["share"] = attribute["bytes"] / size if size else 0.0
+    return {"signals": signals, "totals": _totals(signals)}
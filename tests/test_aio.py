@@ -0,0 +1,123 @@
+# SPDX-License-Identifier: Apache-2.0
+
+from __future__ import annotations
+
+import asyncio
+import logging
+import socket
+
+import pytest
+
+from src.rotel import aio, exports, metrics, trace
+from tests.utils_server import MockServer, mock_server  # noqa: F401
+
+
+trace_service_pb2 = pytest.importorskip("opentelemetry.proto.collector.trace.v1.trace_service_pb2")
+
+
+def sent_spans(path: str = "/v1/traces") -> list[str]:
+    names = []
+    for request in MockServer.tracker.get_requests():
+        if request.path == path:
+            req = trace_service_pb2.ExportTraceServiceRequest()
+            req.ParseFromString(request.body)
+            names += [s.name for rs in req.resource_spans for ss in rs.scope_spans for s in ss.spans]
+    return names
+
+def test_aio_connection(mock_server):  # noqa: F811
+    MockServer.reset_count()
+    host, port = mock_server.address()
+
+    async def post():
+        conn = aio.AsyncAgentConnection(f"{host}:{port}")
+        results = [await conn.post("/v1/logs", b""), await conn.post("/v1/logs", b"")]
+        await conn.close()
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        closed = sock.getsockname()[1]
+        sock.close()
+        return results, await aio.AsyncAgentConnection(f"127.0.0.1:{closed}").post("/v1/logs", b"")
+
+    assert asyncio.run(post()) == ([True, True], False)
+    assert MockServer.tracker.get_count() == 2
+
+def test_aio_spans_drained_on_loop_shutdown(mock_server, monkeypatch):  # noqa: F811
+    MockServer.reset_count()
+    host, port = mock_server.address()
+    exporter = aio.AsyncSpanExporter()
+    exporter.endpoint = f"{host}:{port}"
+    # only the final drain sends
+    exporter.flush_interval = 60.0
+    monkeypatch.setattr(trace, "_exporter", exporter)
+
+    async def main():
+        tracer = trace.get_tracer("test.aio")
+        for i in range(3):
+            with tracer.start_span(f"span {i}"):
+                await asyncio.sleep(0)
+        assert exporter.processor.loop is asyncio.get_running_loop()
+
+    asyncio.run(main())
+    assert sorted(sent_spans()) == ["span 0", "span 1", "span 2"]
+    assert trace.stats()["spans_sent"] == 3
+
+def test_aio_processor_bounded_queue():
+    batches = []
+    processor = aio.AsyncBatchProcessor(
+        lambda batch: batches.append(batch) or [], "/v1/logs", item="records", capacity=2, batch_size=2,
+    )
+
+    async def main():
+        assert [processor.put(i) for i in range(3)] == [True, True, False]
+        await processor.flush()
+
+    asyncio.run(main())
+    # encode returned no requests, nothing was posted
+    assert batches == [[0, 1]]
+    assert processor.stats["records_dropped"] == 1
+    assert processor.stats["records_sent"] == 0
+    assert not processor.put(3)
+
+def test_aio_logs_and_metrics(mock_server, monkeypatch):  # noqa: F811
+    MockServer.reset_count()
+    host, port = mock_server.address()
+    handler = aio.AsyncRotelHandler(endpoint=f"{host}:{port}", batch_size=2)
+    logger = logging.getLogger("test.aio")
+    logger.handlers = [handler]
+    logger.propagate = False
+    exporter = aio.AsyncMetricExporter()
+    exporter.endpoint = f"{host}:{port}"
+    monkeypatch.setattr(metrics, "_exporter", exporter)
+    exports.reset()
+
+    async def main():
+        for i in range(3):
+            logger.warning("message %d", i)
+        metrics.get_meter("test.aio").counter("requests").add(1)
+        exporter.start()
+        await asyncio.sleep(0)
+        exporter.shutdown()
+
+    asyncio.run(main())
+    handler.close()
+    assert handler.stats["records_sent"] == 3
+    assert handler.stats["batches_sent"] == 2
+    assert exporter.stats["exports"] == 1
+    assert exports.snapshot("metrics")["metrics"]["items"] >= 1
+    assert {r.path for r in MockServer.tracker.get_requests()} == {"/v1/logs", "/v1/metrics"}
+
+def test_aio_sdk_span_processor(mock_server):  # noqa: F811
+    sdk_trace = pytest.importorskip("opentelemetry.sdk.trace")
+    MockServer.reset_count()
+    host, port = mock_server.address()
+    processor = aio.AsyncSpanProcessor(endpoint=f"{host}:{port}")
+    provider = sdk_trace.TracerProvider()
+    provider.add_span_processor(processor)
+
+    with provider.get_tracer("test.aio").start_as_current_span("sdk span"):
+        pass
+    # without a running loop the spans are sent from the rotel loop thread
+    assert processor.processor.loop is aio.loop_thread()
+    assert processor.force_flush()
+    assert sent_spans() == ["sdk span"]
+    provider.shutdown()
@@ -0,0 +1,124 @@
+# SPDX-License-Identifier: Apache-2.0
+
+from __future__ import annotations
+
+import logging
+import sys
+import time
+
+import pytest
+
+from src.rotel import autotrace, trace
+from src.rotel.config import Config
+
+
+requires_monitoring = pytest.mark.skipif(not autotrace.AVAILABLE, reason="sys.monitoring requires Python 3.12")
+
+
+def fast() -> int:
+    return 1
+
+def slow() -> None:
+    time.sleep(0.02)
+
+def outer() -> None:
+    fast()
+    slow()
+
+def numbers():
+    yield from range(2)
+
+def fails() -> None:
+    time.sleep(0.02)
+    raise ValueError("failed")
+
+@pytest.fixture
+def finished(monkeypatch):
+    spans = []
+    monkeypatch.setattr(trace._exporter, "finish", spans.append)
+    yield spans
+    autotrace.stop()
+
+@requires_monitoring
+def test_autotrace_spans_over_threshold(finished):
+    tracer = autotrace.start(functions=[fast, slow, outer, fails], threshold=0.01)
+    with trace.get_tracer("test.autotrace").start_span("request") as request:
+        outer()
+    with pytest.raises(ValueError):
+        fails()
+
+    # fast() is timed but too quick for a span, slow() nests under outer()
+    assert [s.name for s in finished] == ["slow", "outer", "request", "fails"]
+    slow_span, outer_span, _, fails_span = finished
+    assert slow_span.parent_id == outer_span.span_id
+    assert outer_span.parent_id == request.span_id
+    assert slow_span.end_time - slow_span.start >= 20_000_000
+    assert fails_span.status_code == 2
+    assert outer_span.attributes["code.namespace"] == __name__
+    stats = tracer.stats()
+    assert stats["calls"] == 4
+    assert stats["spans"] == 3
+    assert stats["overhead_seconds"] > 0
+
+@requires_monitoring
+def test_autotrace_modules_and_disable(finished):
+    tracer = autotrace.start(modules=[__name__], threshold=10.0)
+    tracer.disable(fast)
+    outer()
+    assert tracer.stats()["calls"] == 2
+    tracer.enable(fast)
+    fast()
+    assert tracer.stats()["calls"] == 3
+    # generators are not timed
+    assert list(numbers()) == [0, 1]
+    assert finished == []
+
+@requires_monitoring
+def test_autotrace_keeps_other_tools_disabled(finished, monkeypatch):
+    def restart_events():
+        raise AssertionError("restart_events() brings back the events disabled by every tool")
+
+    monkeypatch.setattr(sys.monitoring, "restart_events", restart_events)
+    events = sys.monitoring.events
+    seen = []
+
+    def on_start(code, offset):
+        seen.append(code)
+        return sys.monitoring.DISABLE
+
+    # a coverage tool seeing each function once
+    sys.monitoring.use_tool_id(sys.monitoring.COVERAGE_ID, "test")
+    sys.monitoring.register_callback(sys.monitoring.COVERAGE_ID, events.PY_START, on_start)
+    sys.monitoring.set_events(sys.monitoring.COVERAGE_ID, events.PY_START)
+    try:
+        autotrace.start(modules=["myapp"])
+        outer()
+        autotrace.stop()
+        # fast() and outer() were disabled by the first start()
+        tracer = autotrace.start(functions=[f"{__name__}:fast"], threshold=10.0)
+        outer()
+        assert tracer.stats()["calls"] == 1
+        tracer.enable(f"{__name__}:outer")
+        outer()
+        assert tracer.stats()["calls"] == 3
+    finally:
+        sys.monitoring.set_events(sys.monitoring.COVERAGE_ID, 0)
+        sys.monitoring.register_callback(sys.monitoring.COVERAGE_ID, events.PY_START, None)
+        sys.monitoring.free_tool_id(sys.monitoring.COVERAGE_ID)
+    assert seen.count(fast.__code__) == 1
+    assert seen.count(outer.__code__) == 1
+
+def test_autotrace_unavailable(caplog, monkeypatch):
+    monkeypatch.setattr(autotrace, "AVAILABLE", False)
+    with caplog.at_level(logging.ERROR, logger="rotel"):
+        assert autotrace.start(modules=["myapp"]) is None
+    assert "Python 3.12" in caplog.text
+    assert autotrace.get_autotracer() is None
+
+def test_autotrace_config(monkeypatch):
+    monkeypatch.setenv("ROTEL_AUTOTRACE", "myapp,vendor.client")
+    monkeypatch.setenv("ROTEL_AUTOTRACE_THRESHOLD", "5ms")
+    config = Config(dict(enabled=True))
+    assert config.options["autotrace"] == ["myapp", "vendor.client"]
+    assert config.options["autotrace_threshold"] == "5ms"
+    assert Config(dict(enabled=True, autotrace=["myapp"], autotrace_threshold="soon")).validate() is False
@@ -4,8 +4,12 @@ from __future__ import annotations
 
 import os
 
+import pytest
+
 from rotel.client import Client as Rotel
+from src.rotel import duration
 from src.rotel.config import Config, Options, OTLPExporterEndpoint
+from src.rotel.processors import log_dedup, span_metrics, tail_sampling, volume
 
 
 def test_defaults():
@@ -363,3 +367,41 @@ def test_config_validation():
         )
     ))
     assert not cfg.is_active()
+
+def test_config_durations():
+    # every duration option takes the same units
+    assert Config(Options(enabled = True, dry_run = True, dry_run_window = "1h")).is_active()
+    assert Config(Options(enabled = True, autotrace = ["myapp"], autotrace_threshold = "500us")).is_active()
+    assert Config(Options(enabled = True, preflight_timeout = "1500ms")).is_active()
+    assert not Config(Options(enabled = True, dry_run = True, dry_run_window = "1d")).is_active()
+    assert Config(Options(
+        enabled = True, processors_traces = [Config.tail_sampling_processor(decision_wait = "2h")],
+    )).is_active()
+    assert not Config(Options(
+        enabled = True, processors_logs = [Config.log_dedup_processor(window = "soon")],
+    )).is_active()
+
+    # the processors carry a copy of the parser
+    values = ["250ns", "500us", "1.5ms", "2s", "3m", "1h", "7", 4, 0.5]
+    for processor in (log_dedup, span_metrics, tail_sampling, volume):
+        assert [processor.parse_duration(v) for v in values] == [duration.parse_duration(v) for v in values]
+        with pytest.raises(ValueError):
+            processor.parse_duration("1d")
+    assert duration.parse_duration("1h") == 3600.0
+    assert duration.parse_duration("500us") == pytest.approx(0.0005)
+
+def test_config_batch_max_bytes():
+    exporters = {
+        "kafka": Config.kafka_exporter(brokers = ["kafka:9092"], max_message_bytes = 2_000_000, format = "json"),
+        "otlp": Config.otlp_exporter(endpoint = "collector:4317"),
+        "http": Config.otlp_exporter(endpoint = "collector:4318", protocol = "http"),
+    }
+    cfg = Config(Options(enabled = True, exporters = exporters, exporters_traces = ["http"],
+                         exporters_logs = ["http", "kafka"]))
+    assert cfg.batch_max_bytes("traces") == int(20 * 1024 * 1024 * 0.9)
+    assert cfg.batch_max_bytes("logs") == 900_000
+    # all exporters receive metrics
+    assert cfg.batch_max_bytes("metrics") == 900_000
+    assert Config(Options(enabled = True, exporter = Config.blackhole_exporter())).batch_max_bytes() is None
+    assert Config(Options(enabled = True, exporters = exporters, batch_max_bytes = 65536)).batch_max_bytes() == 65536
+    assert not Config(Options(enabled = True, batch_max_bytes = 0)).is_active()
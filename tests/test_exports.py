@@ -0,0 +1,122 @@
+# SPDX-License-Identifier: Apache-2.0
+
+from __future__ import annotations
+
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from src.rotel import _otlp, exports, metrics, trace
+from src.rotel.client import Client
+from tests.utils_server import MockServer, mock_server  # noqa: F401
+
+
+class PartialSuccess(BaseHTTPRequestHandler):
+    # rejected_spans = 2
+    body = _otlp.field_bytes(1, _otlp.field_varint(1, 2) + _otlp.field_string(2, "span too large"))
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-protobuf")
+        self.send_header("Content-Length", str(len(self.body)))
+        self.end_headers()
+        self.wfile.write(self.body)
+
+    def log_message(self, format, *args):
+        pass
+
+def test_exports_record_and_snapshot():
+    exports.reset()
+    exports.record_encode("logs", 0.002)
+    exports.record_send("logs", 2000, 10, 0.004, True)
+    exports.record_send("logs", 500, 5, 0.1, False, retries=1)
+    exports.record_send("logs", 100, 1, 0.001, True, rejected=1)
+
+    stats = exports.snapshot("logs")["logs"]
+    assert {counter: stats[counter] for counter in exports.COUNTERS} == {
+        "requests": 3, "failed": 1, "items": 16, "bytes": 2600, "retries": 1, "rejected": 1,
+    }
+    assert stats["encode_ms"]["count"] == 1
+    assert stats["encode_ms"]["sum"] == 2.0
+    send = stats["send_ms"]
+    assert send["count"] == 3
+    assert sum(send["counts"]) == 3
+    assert len(send["counts"]) == len(send["bounds"]) + 1
+    assert stats["request_bytes"]["mean"] == 2600 / 3
+    assert Client().export_stats("logs") == exports.snapshot("logs")
+
+def test_exports_rejected_items():
+    assert _otlp.rejected_items(PartialSuccess.body) == 2
+    assert _otlp.rejected_items(b"") == 0
+    assert _otlp.rejected_items(b"\xff") == 0
+
+def test_exports_partial_success():
+    server = HTTPServer(("127.0.0.1", 0), PartialSuccess)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        exports.reset()
+        host, port = server.server_address
+        conn = _otlp.AgentConnection(f"{host}:{port}")
+        assert conn.post(_otlp.TRACES_PATH, b"spans", 5)
+        conn.close()
+    finally:
+        server.shutdown()
+    stats = exports.snapshot("traces")["traces"]
+    assert (stats["requests"], stats["items"], stats["bytes"], stats["rejected"]) == (1, 5, 5, 2)
+
+def test_exports_trace_sender(mock_server, monkeypatch):  # noqa: F811
+    host, port = mock_server.address()
+    monkeypatch.setattr(trace._exporter, "_conn", _otlp.AgentConnection(f"{host}:{port}"))
+    monkeypatch.setattr(trace._exporter, "stats", dict.fromkeys(trace._exporter.stats, 0))
+    MockServer.reset_count()
+    exports.reset()
+    tracer = trace.get_tracer("test.exports")
+    for _ in range(3):
+        with tracer.start_span("op"):
+            pass
+    trace.flush()
+
+    stats = exports.snapshot("traces")["traces"]
+    assert stats["items"] == 3
+    assert stats["failed"] == 0
+    assert stats["encode_ms"]["count"] >= 1
+    assert stats["bytes"] == sum(len(r.body) for r in MockServer.tracker.get_requests())
+
+def test_exports_metric_data_points(mock_server, monkeypatch):  # noqa: F811
+    metrics_service_pb2 = pytest.importorskip("opentelemetry.proto.collector.metrics.v1.metrics_service_pb2")
+    host, port = mock_server.address()
+    exporter = metrics._Exporter()
+    exporter._conn = _otlp.AgentConnection(f"{host}:{port}")
+    monkeypatch.setattr(metrics, "_exporter", exporter)
+    meter = metrics.get_meter("test.exports.points")
+    meter.counter("requests").add(1, {"route": "/a"})
+    meter.counter("requests").add(1, {"route": "/b"})
+    meter.histogram("latency").record(5.0)
+    MockServer.reset_count()
+    exports.reset()
+    assert exporter.export()
+    exporter._conn.close()
+
+    req = metrics_service_pb2.ExportMetricsServiceRequest.FromString(MockServer.tracker.get_requests()[-1].body)
+    points = sum(
+        len(m.sum.data_points) + len(m.gauge.data_points) + len(m.histogram.data_points)
+        for rm in req.resource_metrics for sm in rm.scope_metrics for m in sm.metrics
+    )
+    assert points >= 3
+    assert exports.snapshot("metrics")["metrics"]["items"] == points
+
+def test_exports_as_metrics(monkeypatch):
+    monkeypatch.setattr(exports, "_instruments", None)
+    exports.enable_metrics()
+    exports.record_send("logs", 100, 4, 0.001, True, rejected=1)
+    exports.disable_metrics()
+    exports.record_send("logs", 100, 4, 0.001, True)
+
+    meter = metrics.get_meter(exports.SCOPE)
+    instruments = {instrument.name: instrument for instrument in meter.instruments()}
+    assert instruments["rotel.export.items"]._totals()[0] == 4
+    assert instruments["rotel.export.rejected"]._totals()[0] == 1
+    assert instruments["rotel.export.send.duration"].collect(0) is not None
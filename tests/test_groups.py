@@ -0,0 +1,147 @@
+# SPDX-License-Identifier: Apache-2.0
+
+from __future__ import annotations
+
+import threading
+import time
+
+from src.rotel import _otlp
+from src.rotel.client import Client
+from src.rotel.config import Config
+
+
+def group_options(tmp_path) -> dict:
+    return {
+        "enabled": True,
+        "pid_file": str(tmp_path / "rotel-agent.pid"),
+        "log_file": str(tmp_path / "rotel-agent.log"),
+        "exporter": Config.otlp_exporter(endpoint="http://collector:4317"),
+        "batch_max_size": 512,
+        "groups": {
+            "traces": {
+                "signals": ["traces"],
+                "processors_traces": [Config.tail_sampling_processor()],
+            },
+            "logs": {
+                "signals": ["logs", "metrics"],
+                "otlp_grpc_endpoint": "localhost:5317",
+                "otlp_http_endpoint": "localhost:5318",
+                "exporter": Config.clickhouse_exporter(endpoint="http://clickhouse:8123"),
+            },
+        },
+    }
+
+def test_groups_config(tmp_path):
+    cfg = Config(group_options(tmp_path))
+    assert cfg.is_active()
+    assert cfg.group_names() == ["traces", "logs"]
+
+    traces = cfg.group("traces")
+    assert traces.options["pid_file"] == str(tmp_path / "rotel-agent-traces.pid")
+    assert traces.options["log_file"] == str(tmp_path / "rotel-agent-traces.log")
+    assert traces.options["otlp_grpc_endpoint"] == "localhost:4317"
+    assert traces.options["exporter"]["endpoint"] == "http://collector:4317"
+    assert "groups" not in traces.options
+
+    env = cfg.build_agent_environment("traces")
+    assert env["ROTEL_PID_FILE"] == str(tmp_path / "rotel-agent-traces.pid")
+    assert env["ROTEL_BATCH_MAX_SIZE"] == "512"
+    assert env["ROTEL_OTLP_RECEIVER_METRICS_DISABLED"] == "true"
+    assert env["ROTEL_OTLP_RECEIVER_LOGS_DISABLED"] == "true"
+    assert "ROTEL_OTLP_RECEIVER_TRACES_DISABLED" not in env
+    assert env["ROTEL_OTLP_WITH_TRACE_PROCESSOR"].endswith("tail_sampling.py")
+
+    env = cfg.build_agent_environment("logs")
+    assert env["ROTEL_OTLP_HTTP_ENDPOINT"] == "localhost:5318"
+    assert env["ROTEL_OTLP_RECEIVER_TRACES_DISABLED"] == "true"
+    assert "ROTEL_OTLP_RECEIVER_LOGS_DISABLED" not in env
+    # the group's exporter replaces the top-level one
+    assert env["ROTEL_EXPORTER"] == "clickhouse"
+    assert env["ROTEL_CLICKHOUSE_EXPORTER_ENDPOINT"] == "http://clickhouse:8123"
+    assert "ROTEL_OTLP_EXPORTER_ENDPOINT" not in env
+    assert "ROTEL_OTLP_WITH_TRACE_PROCESSOR" not in env
+
+def test_groups_validation(tmp_path):
+    opts = group_options(tmp_path)
+    del opts["groups"]["logs"]["otlp_http_endpoint"]
+    assert not Config(opts).is_active()
+
+    opts = group_options(tmp_path)
+    opts["groups"]["logs"]["pid_file"] = opts["groups"]["traces"]["pid_file"] = "/tmp/same.pid"
+    assert not Config(opts).is_active()
+
+    opts = group_options(tmp_path)
+    opts["groups"]["logs"]["signals"] = ["events"]
+    assert not Config(opts).is_active()
+
+    opts = group_options(tmp_path)
+    opts["groups"]["logs"]["exporter"] = Config.clickhouse_exporter()
+    assert not Config(opts).is_active()
+
+    # disabled groups do not claim their ports
+    opts = group_options(tmp_path)
+    opts["groups"]["logs"] = {"enabled": False}
+    assert Config(opts).is_active()
+
+def test_groups_routing(tmp_path, monkeypatch):
+    client = Client(**group_options(tmp_path))
+    assert client.endpoint("traces") == "localhost:4318"
+    assert client.endpoint("logs") == "localhost:5318"
+    assert client.endpoint("metrics", protocol="grpc") == "localhost:5317"
+
+    assert _otlp.agent_http_endpoint("logs") == "localhost:5318"
+    assert _otlp.agent_http_endpoint("traces") == "localhost:4318"
+
+    client.config.options["groups"]["logs"]["enabled"] = False
+    assert client.endpoint("logs") is None
+    monkeypatch.delenv("ROTEL_OTLP_HTTP_ENDPOINT", raising=False)
+    assert _otlp.agent_http_endpoint("logs") == "localhost:4318"
+
+def test_groups_reconfigure(tmp_path):
+    client = Client(**group_options(tmp_path))
+    assert set(client.status()) == {"traces", "logs"}
+    assert client.status()["logs"]["running"] is False
+
+    assert client.reconfigure("logs", batch_max_size=2048)
+    assert client.config.group("logs").options["batch_max_size"] == 2048
+    assert client.config.group("traces").options["batch_max_size"] == 512
+
+    # invalid options are rejected and the previous ones kept
+    assert not client.reconfigure("logs", otlp_http_endpoint="localhost:4318")
+    assert client.config.group("logs").options["otlp_http_endpoint"] == "localhost:5318"
+    assert client.config.is_active()
+    assert not client.reconfigure("unknown", batch_max_size=1)
+
+    assert set(Client(enabled=True).status()) == {"default"}
+
+def test_groups_reconfigure_is_not_restarted_by_supervisor(tmp_path):
+    client = Client(**group_options(tmp_path))
+    client._started = True
+
+    class SlowAgent:
+        running = True
+        alive = True
+        starts = 0
+
+        def status(self):
+            return {"running": self.running, "alive": self.alive}
+
+        def stop(self):
+            # the process exited, Agent.stop() is still waiting for it
+            self.alive = False
+            time.sleep(0.2)
+            self.running = False
+
+        def start(self, config):
+            self.starts += 1
+            self.running = self.alive = True
+            return True
+
+    client.agents = {"traces": SlowAgent(), "logs": SlowAgent()}
+    reconfigure = threading.Thread(target=client.reconfigure, args=("logs",), kwargs={"batch_max_size": 2048})
+    reconfigure.start()
+    time.sleep(0.05)
+    assert client.check_agents() == []
+    reconfigure.join()
+    assert client.agents["logs"].starts == 1
+    assert client.restarts["logs"] == 0
@@ -0,0 +1,143 @@
+# SPDX-License-Identifier: Apache-2.0
+
+from __future__ import annotations
+
+import importlib.util
+import json
+import os
+import sys
+
+import pytest
+
+from src.rotel.client import Client
+from src.rotel.config import Config
+from src.rotel.instrument import (
+    read_processor_stats,
+    stats_path,
+    write_instrument_wrapper,
+)
+from src.rotel.processors.instrument import Instrumentation
+from tests.utils_clock import FakeClock
+from tests.utils_sdk import Span, all_spans, resource_spans
+
+
+def drop_odd(resource_spans):
+    for scope_spans in resource_spans.scope_spans:
+        scope_spans.spans = scope_spans.spans[::2]
+
+def spans(n: int):
+    return resource_spans([Span(bytes([i + 1]) * 16, name=f"span {i}") for i in range(n)])
+
+def test_instrument_records_calls():
+    clock = FakeClock(now=0)
+    instrumentation = Instrumentation(slowest=2, clock=clock)
+    process = instrumentation.wrap("drop_odd", "traces", drop_odd)
+
+    for n, step in [(4, 20_000), (10, 3_000_000), (1, 40_000)]:
+        clock.step = step
+        rs = spans(n)
+        process(rs)
+    assert len(all_spans(rs)) == 1
+
+    stats = instrumentation.snapshot()["traces/drop_odd"]
+    assert stats["calls"] == 3
+    assert stats["errors"] == 0
+    assert stats["items_in"] == 15
+    assert stats["items_out"] == 2 + 5 + 1
+    assert stats["max_us"] == 3_000
+    assert stats["us_per_item"] == pytest.approx(3_060 / 15)
+    assert sum(stats["bucket_counts"]) == 3
+    # 20us and 40us land in the 25us and 50us buckets, 3ms in the 5ms bucket
+    assert stats["bucket_counts"][1] == 1 and stats["bucket_counts"][2] == 1 and stats["bucket_counts"][8] == 1
+    assert [s["duration_us"] for s in stats["slowest"]] == [3_000, 40]
+    assert stats["slowest"][0]["items"] == 10
+
+def test_instrument_records_errors():
+    instrumentation = Instrumentation()
+
+    def failing(resource_spans):
+        raise ValueError("bad span")
+
+    process = instrumentation.wrap("failing", "traces", failing)
+    with pytest.raises(ValueError):
+        process(spans(3))
+
+    stats = instrumentation.snapshot()["traces/failing"]
+    assert stats["calls"] == 1
+    assert stats["errors"] == 1
+    assert stats["items_out"] == 3
+    assert stats["last_error"] == "ValueError: bad span"
+
+def test_instrument_metrics_payload():
+    instrumentation = Instrumentation()
+    assert instrumentation.collect() is None
+
+    instrumentation.wrap("drop_odd", "traces", drop_odd)(spans(4))
+    payload = instrumentation.collect()
+    metrics = {m["name"]: m for m in payload["resourceMetrics"][0]["scopeMetrics"][0]["metrics"]}
+    assert metrics["rotel.processor.calls"]["sum"]["dataPoints"][0]["asInt"] == "1"
+    items = metrics["rotel.processor.items"]["sum"]["dataPoints"]
+    assert [p["asInt"] for p in items] == ["4", "2"]
+    duration = metrics["rotel.processor.duration"]["histogram"]["dataPoints"][0]
+    assert duration["count"] == "1"
+    assert {"key": "processor", "value": {"stringValue": "drop_odd"}} in duration["attributes"]
+
+def test_instrument_wrapper(tmp_path, monkeypatch):
+    target = tmp_path / "my_processor.py"
+    target.write_text("def process_spans(resource_spans):\n    resource_spans.scope_spans[0].spans = []\n")
+    stats_file = tmp_path / "rotel-agent.processors.json"
+    monkeypatch.setenv("ROTEL_PROCESSOR_INSTRUMENT_CONFIG", json.dumps({
+        "stats_file": str(stats_file),
+        "interval": 3600,
+        "export": False,
+    }))
+    monkeypatch.delitem(sys.modules, "rotel_processor_instrument", raising=False)
+
+    path = write_instrument_wrapper("my_processor", str(target), "traces", str(tmp_path))
+    spec = importlib.util.spec_from_file_location("instrument_under_test", path)
+    module = importlib.util.module_from_spec(spec)
+    try:
+        spec.loader.exec_module(module)
+        rs = spans(2)
+        module.process_spans(rs)
+        assert all_spans(rs) == []
+
+        assert read_processor_stats(str(stats_file)) == {}
+        sys.modules["rotel_processor_instrument"].get_instrumentation().write_stats()
+    finally:
+        sys.modules.pop("rotel_processor_instrument", None)
+
+    stats = read_processor_stats(str(stats_file))
+    assert stats["traces/my_processor"]["items_in"] == 2
+    assert stats["traces/my_processor"]["items_out"] == 0
+
+def test_instrument_config(tmp_path):
+    pid_file = str(tmp_path / "agent.pid")
+    opts = {
+        "enabled": True,
+        "pid_file": pid_file,
+        "processors_traces": ["/path/to/sampler.py", Config.tail_sampling_processor(), "/other/sampler.py"],
+        "processors_instrument": True,
+        "processors_instrument_interval": "5s",
+    }
+    cfg = Config(opts)
+    assert cfg.is_active()
+
+    agent = cfg.build_agent_environment()
+    traces = agent["ROTEL_OTLP_WITH_TRACE_PROCESSOR"].split(",")
+    assert all(os.path.basename(p).startswith("instrument_traces_") for p in traces)
+    sources = [open(p).read() for p in traces]
+    assert "wrap('sampler', 'traces', '/path/to/sampler.py')" in sources[0]
+    assert "'tail_sampling'" in sources[1] and "tail_sampling.py" in sources[1]
+    assert "wrap('sampler#2', 'traces', '/other/sampler.py')" in sources[2]
+
+    instrument = json.loads(agent["ROTEL_PROCESSOR_INSTRUMENT_CONFIG"])
+    assert instrument == {"stats_file": str(tmp_path / "agent.processors.json"), "interval": 5.0, "export": True}
+
+    client = Client(**opts)
+    assert client.processor_stats() == {}
+    with open(stats_path(pid_file), "w") as file:
+        json.dump({"pid": 1, "time": 0, "processors": {"traces/sampler": {"calls": 3}}}, file)
+    assert client.processor_stats() == {"traces/sampler": {"calls": 3}}
+
+    assert not Config({"enabled": True, "processors_instrument_interval": "often"}).is_active()
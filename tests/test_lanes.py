@@ -0,0 +1,102 @@
+# SPDX-License-Identifier: Apache-2.0
+
+from __future__ import annotations
+
+import asyncio
+import logging
+
+from src.rotel import _otlp, aio, trace
+from src.rotel.lanes import DEFAULT_LANES, LaneQueue, record_lane
+from src.rotel.logging import RotelHandler
+
+
+def test_lanes_weighted_order():
+    stats = {}
+    queue = LaneQueue([("high", 2), ("low", 1)], stats, "items")
+    for i in range(4):
+        queue.put(f"high {i}", queue.lane("high"))
+        queue.put(f"low {i}", queue.lane("unknown"))
+    assert queue.queued() == {"high": 4, "low": 4}
+    order = [queue.popleft() for _ in range(len(queue))]
+    # two high items for each low one, then the rest of the low lane
+    assert order == ["high 0", "low 0", "high 1", "high 2", "low 1", "high 3", "low 2", "low 3"]
+    assert stats == {"items_dropped_high": 0, "items_dropped_low": 0}
+
+def test_lanes_evict_lowest_lane():
+    stats = {}
+    queue = LaneQueue(DEFAULT_LANES, stats, "items")
+    queue.put("normal", queue.lane("normal"))
+    queue.put("bulk", queue.lane("bulk"))
+    assert queue.evict(queue.lane("error")) == "bulk"
+    assert queue.evict(queue.lane("error")) == "normal"
+    assert queue.evict(queue.lane("error")) is None
+    queue.put("high", queue.lane("high"))
+    # an item never makes room in its own lane or above
+    assert queue.evict(queue.lane("high")) is None
+    queue.reject(queue.lane("high"))
+    assert stats == {"items_dropped_error": 0, "items_dropped_high": 1, "items_dropped_normal": 1,
+                     "items_dropped_bulk": 1}
+
+def test_lanes_logging_keeps_errors_when_full():
+    handler = RotelHandler(capacity=2, lanes=True)
+    handler._start = lambda: None
+    logger = logging.getLogger("test.lanes")
+    logger.handlers = [handler]
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+
+    logger.debug("debug")
+    logger.info("info")
+    logger.error("error 1")
+    logger.error("error 2")
+    logger.error("error 3")
+    assert [entry[4] for entry in handler._queue._queues[handler._queue.lane("error")]] == ["error 1", "error 2"]
+    assert len(handler._queue) == 2
+    assert handler.stats["records_dropped"] == 3
+    assert handler.stats["records_dropped_bulk"] == 1
+    assert handler.stats["records_dropped_normal"] == 1
+    assert handler.stats["records_dropped_error"] == 1
+    assert record_lane(logging.makeLogRecord({"levelno": logging.WARNING})) == "high"
+
+def test_lanes_trace_keeps_errors_when_full(monkeypatch):
+    exporter = trace._Exporter()
+    exporter._start = lambda: None
+    exporter.capacity = 2
+    monkeypatch.setattr(trace, "_exporter", exporter)
+    tracer = trace.get_tracer("test.lanes")
+    with tracer.start_span("queued before"):
+        pass
+    trace.configure(lanes=True)
+    assert exporter._queue.queued()["normal"] == 1
+
+    with tracer.start_span("normal"):
+        pass
+    with tracer.start_span("failed") as span:
+        span.set_status(_otlp.STATUS_ERROR)
+    assert len(exporter._queue) == 2
+    assert exporter._queue.popleft().name == "failed"
+    assert exporter._queue.popleft().name == "normal"
+    assert exporter.stats["spans_dropped"] == 1
+    assert exporter.stats["spans_dropped_normal"] == 1
+
+    trace.configure(lanes=False)
+    assert exporter.lanes is None
+    assert len(exporter._queue) == 0
+
+def test_lanes_async_processor():
+    batches = []
+    processor = aio.AsyncBatchProcessor(
+        lambda batch: batches.append(batch) or [], "/v1/logs", item="records", capacity=2, batch_size=4,
+        lanes=DEFAULT_LANES, classify=lambda item: item.split()[0],
+    )
+
+    async def main():
+        assert [processor.put(item) for item in ("bulk 0", "normal 0", "error 0", "bulk 1")] == [
+            True, True, True, False,
+        ]
+        await processor.flush()
+
+    asyncio.run(main())
+    assert batches == [["error 0", "normal 0"]]
+    assert processor.stats["records_dropped"] == 2
+    assert processor.stats["records_dropped_bulk"] == 2
@@ -0,0 +1,151 @@
+# SPDX-License-Identifier: Apache-2.0
+
+from __future__ import annotations
+
+import json
+
+import pytest
+
+from src.rotel.client import Client
+from src.rotel.config import Config
+from src.rotel.processors import log_dedup
+from src.rotel.processors.log_dedup import (
+    REPEAT_COUNT_ATTRIBUTE,
+    LogDeduplicator,
+    parse_severity,
+    template,
+)
+from tests.utils_clock import FakeClock
+from tests.utils_sdk import KeyValue, all_records, kv, log, resource_logs
+
+
+@pytest.fixture(autouse=True)
+def sdk_key_value(monkeypatch):
+    monkeypatch.setattr(log_dedup, "KeyValue", KeyValue)
+
+def repeat_count(record) -> int | None:
+    for a in record.attributes:
+        if a.key == REPEAT_COUNT_ATTRIBUTE:
+            return a.value.value
+    return None
+
+def test_template():
+    assert template("user 1234 failed in 0.53s") == "user <*> failed in <*>s"
+    assert template("req 3f2a9c1e-5b6d-4e7f-8a9b-0c1d2e3f4a5b at 0xdeadbeef") == "req <*> at <*>"
+    assert template("hash a1b2c3d4e5f6 for deadline") == "hash <*> for deadline"
+
+def test_log_dedup_collapses_duplicates():
+    clock = FakeClock()
+    dedup = LogDeduplicator(window=10.0, clock=clock)
+
+    rl = resource_logs([log(f"connection {n} refused", 17) for n in range(1000)] + [log("other")])
+    dedup.process(rl)
+    records = all_records(rl)
+    assert [r.body.value for r in records] == ["connection 0 refused", "other"]
+    assert dedup.stats["records_deduplicated"] == 999
+
+    clock.now += 11
+    rl = resource_logs([])
+    dedup.process(rl)
+    [summary] = all_records(rl)
+    assert summary.body.value == "connection 999 refused"
+    assert repeat_count(summary) == 999
+
+    # a new window lets the next record through again
+    rl = resource_logs([log("connection 5 refused", 17)])
+    dedup.process(rl)
+    assert len(all_records(rl)) == 1
+
+def test_log_dedup_severity_and_resource_split_fingerprints():
+    dedup = LogDeduplicator()
+    rl = resource_logs([log("boom", 17), log("boom", 13), log("debug noise", 5)])
+    dedup.process(rl)
+    assert len(all_records(rl)) == 3
+
+    rl = resource_logs([log("boom", 17)], service="other")
+    dedup.process(rl)
+    assert len(all_records(rl)) == 1
+
+def test_log_dedup_min_severity():
+    dedup = LogDeduplicator(min_severity=parse_severity("warn"))
+    rl = resource_logs([log("a", 5), log("b", 9), log("c", 13), log("d", 0)])
+    dedup.process(rl)
+    assert [r.body.value for r in all_records(rl)] == ["c", "d"]
+    assert dedup.stats["records_below_severity"] == 2
+
+def test_log_dedup_rate_limit():
+    clock = FakeClock()
+    dedup = LogDeduplicator(window=60.0, dedup=False, rate_limit=10, burst=5, clock=clock)
+
+    rl = resource_logs([log("hot loop") for _ in range(100)])
+    dedup.process(rl)
+    assert len(all_records(rl)) == 5
+
+    clock.now += 1
+    rl = resource_logs([log("hot loop") for _ in range(100)])
+    dedup.process(rl)
+    assert len(all_records(rl)) == 5
+    assert dedup.stats["records_rate_limited"] == 190
+
+def test_log_dedup_memory_is_bounded():
+    dedup = LogDeduplicator(max_fingerprints=50)
+    for n in range(1000):
+        word = "".join(chr(ord("g") + int(d)) for d in str(n))
+        dedup.process(resource_logs([log(f"unique message {word}", 9)]))
+        assert len(dedup._fingerprints) <= 50
+    assert dedup.stats["fingerprints_evicted"] > 0
+
+def test_log_dedup_releases_summaries_of_a_quiet_resource():
+    clock = FakeClock()
+    dedup = LogDeduplicator(window=10.0, clock=clock)
+
+    # a logs a burst and goes quiet, b keeps logging
+    quiet = resource_logs([log("disk full", 17)] * 3, service="a")
+    quiet.scope_logs[0].scope.name = "db"
+    dedup.process(quiet)
+    clock.now += 11
+    busy = resource_logs([log("retrying")], service="b")
+    dedup.process(busy)
+    assert [r.body.value for r in all_records(busy)] == ["retrying"]
+
+    # a batch of b left without records takes the summary, under a
+    carrier = resource_logs([log("retrying")], service="b")
+    dedup.process(carrier)
+    assert carrier.resource.attributes == [kv("service.name", "a")]
+    assert [sl.scope.name for sl in carrier.scope_logs] == ["db"]
+    [summary] = all_records(carrier)
+    assert (summary.body.value, repeat_count(summary)) == ("disk full", 2)
+    assert dedup.stats["summaries_emitted"] == 1
+
+def test_log_dedup_waiting_summaries_are_bounded():
+    dedup = LogDeduplicator(max_fingerprints=5)
+    # every resource repeats itself once and never sends again, no batch is left empty
+    for n in range(100):
+        dedup.process(resource_logs([log("boom"), log("boom")], service=f"s{n}"))
+        assert dedup._released_count <= 5
+    assert dedup.stats["summaries_dropped"] == 100 - 5 - 5
+    assert dedup.stats["summaries_emitted"] == 0
+
+def test_log_dedup_config():
+    cfg = Config({
+        "enabled": True,
+        "processors_logs": [Config.log_dedup_processor(window="5s", min_severity="info", rate_limit=100)],
+    })
+    assert cfg.is_active()
+
+    agent = cfg.build_agent_environment()
+    assert agent["ROTEL_OTLP_WITH_LOGS_PROCESSOR"].endswith("processors/log_dedup.py")
+    dedup = LogDeduplicator.from_config(json.loads(agent["ROTEL_PROCESSOR_LOG_DEDUP_CONFIG"]))
+    assert dedup.window == 5.0
+    assert dedup.min_severity == 9
+
+def test_log_dedup_counters(tmp_path):
+    opts = dict(enabled=True, pid_file=str(tmp_path / "agent.pid"), processors_logs=[Config.log_dedup_processor()])
+    agent = Config(opts).build_agent_environment()
+    dedup = LogDeduplicator.from_config(json.loads(agent["ROTEL_PROCESSOR_LOG_DEDUP_CONFIG"]))
+    dedup.process(resource_logs([log("disk full")] * 3))
+    dedup.write_stats()
+
+    counters = Client(**opts).processor_counters()
+    assert list(counters) == ["log_dedup"]
+    assert (counters["log_dedup"]["records_received"], counters["log_dedup"]["records_deduplicated"]) == (3, 2)
@@ -0,0 +1,113 @@
+# SPDX-License-Identifier: Apache-2.0
+
+from __future__ import annotations
+
+import logging
+
+import pytest
+
+from src.rotel import logging as rotel_logging
+from src.rotel.logging import RotelHandler, severity_number
+from tests.utils_server import MockServer, mock_server  # noqa: F401
+
+
+logs_service_pb2 = pytest.importorskip("opentelemetry.proto.collector.logs.v1.logs_service_pb2")
+
+
+def decode(body: bytes):
+    req = logs_service_pb2.ExportLogsServiceRequest()
+    req.ParseFromString(body)
+    return req
+
+def make_logger(handler: RotelHandler, name: str = "test.rotel") -> logging.Logger:
+    logger = logging.getLogger(name)
+    logger.handlers = [handler]
+    logger.propagate = False
+    logger.setLevel(logging.DEBUG)
+    return logger
+
+def test_logging_severity():
+    assert [severity_number(lvl) for lvl in (5, 10, 20, 30, 40, 50)] == [1, 5, 9, 13, 17, 21]
+
+def test_logging_encode():
+    handler = RotelHandler(resource={"service.name": "checkout"}, capture_context=False)
+    handler._start = lambda: None
+    logger = make_logger(handler)
+
+    logger.info("order %s placed", 42)
+    try:
+        raise ValueError("bad order")
+    except ValueError:
+        logger.exception("failed")
+    [(body, _)] = handler._encode_requests(list(handler._queue))
+    req = decode(body)
+
+    rl = req.resource_logs[0]
+    assert {kv.key: kv.value.string_value for kv in rl.resource.attributes}["service.name"] == "checkout"
+    assert rl.scope_logs[0].scope.name == "test.rotel"
+    info, error = rl.scope_logs[0].log_records
+    assert info.body.string_value == "order 42 placed"
+    assert info.severity_number == 9
+    assert info.severity_text == "INFO"
+    assert info.time_unix_nano > 0
+    attrs = {kv.key: kv.value for kv in error.attributes}
+    assert error.severity_number == 17
+    assert attrs["exception.type"].string_value == "ValueError"
+    assert "bad order" in attrs["exception.stacktrace"].string_value
+    assert attrs["code.function"].string_value == "test_logging_encode"
+
+def test_logging_trace_context():
+    trace = pytest.importorskip("opentelemetry.trace")
+    handler = RotelHandler()
+    handler._start = lambda: None
+    logger = make_logger(handler)
+
+    ctx = trace.SpanContext(trace_id=0x1234, span_id=0x56, is_remote=False, trace_flags=trace.TraceFlags(1))
+    with trace.use_span(trace.NonRecordingSpan(ctx)):
+        logger.warning("inside span")
+    [(body, _)] = handler._encode_requests(list(handler._queue))
+    record = decode(body).resource_logs[0].scope_logs[0].log_records[0]
+    assert record.trace_id == (0x1234).to_bytes(16, "big")
+    assert record.span_id == (0x56).to_bytes(8, "big")
+    assert record.flags == 1
+
+def test_logging_drops_when_full():
+    handler = RotelHandler(capacity=2)
+    handler._start = lambda: None
+    logger = make_logger(handler)
+
+    for i in range(5):
+        logger.info("message %d", i)
+    assert len(handler._queue) == 2
+    assert handler.stats["records_dropped"] == 3
+
+def test_logging_sends_to_agent(mock_server):  # noqa: F811
+    host, port = mock_server.address()
+    handler = RotelHandler(endpoint=f"{host}:{port}", batch_size=2)
+    logger = make_logger(handler)
+    for i in range(5):
+        logger.info("message %d", i)
+    handler.flush()
+    handler.close()
+
+    requests = MockServer.tracker.get_requests()
+    assert {r.path for r in requests} == {"/v1/logs"}
+    assert requests[0].headers["Content-Type"] == "application/x-protobuf"
+    bodies = [
+        r.body.string_value
+        for req in requests
+        for r in decode(req.body).resource_logs[0].scope_logs[0].log_records
+    ]
+    assert bodies == [f"message {i}" for i in range(5)]
+    assert handler.stats["records_sent"] == 5
+    assert handler.stats["records_failed"] == 0
+
+def test_logging_after_fork():
+    handler = RotelHandler()
+    handler._start = lambda: None
+    make_logger(handler).info("before fork")
+    assert len(handler._queue) == 1
+
+    rotel_logging._after_fork_in_child()
+    assert len(handler._queue) == 0
+    assert handler._thread is None
@@ -0,0 +1,203 @@
+# SPDX-License-Identifier: Apache-2.0
+
+from __future__ import annotations
+
+import json
+
+import pytest
+
+from src.rotel.client import Client
+from src.rotel.config import Config
+from src.rotel.processors import metric_cardinality
+from src.rotel.processors.metric_cardinality import (
+    OVERFLOW_ATTRIBUTE,
+    CardinalityLimiter,
+    HyperLogLog,
+    _mix64,
+)
+from tests.utils_sdk import (
+    Gauge,
+    Histogram,
+    HistogramDataPoint,
+    KeyValue,
+    Metric,
+    NumberDataPoint,
+    Sum,
+    kv,
+    resource_metrics,
+)
+
+
+@pytest.fixture(autouse=True)
+def sdk_key_value(monkeypatch):
+    monkeypatch.setattr(metric_cardinality, "KeyValue", KeyValue)
+
+def attrs_of(dp) -> dict:
+    return {a.key: a.value.value for a in dp.attributes}
+
+def test_cardinality_overflow_series():
+    limiter = CardinalityLimiter(max_series=3)
+    points = [NumberDataPoint([kv("user.id", str(n))], 0, n, 1) for n in range(10)]
+    metric = Metric("requests", Sum(points))
+    limiter.process(resource_metrics([metric]))
+
+    out = metric.data.data_points
+    assert len(out) == 4
+    overflow = [dp for dp in out if attrs_of(dp).get(OVERFLOW_ATTRIBUTE)]
+    assert len(overflow) == 1
+    assert overflow[0].value == 7
+    assert limiter.stats["points_overflowed"] == 7
+
+    # admitted series keep passing in later batches
+    metric = Metric("requests", Sum([NumberDataPoint([kv("user.id", "1")], 0, 20, 5)]))
+    limiter.process(resource_metrics([metric]))
+    assert attrs_of(metric.data.data_points[0]) == {"user.id": "1"}
+
+def test_cardinality_drop_attributes_reaggregates():
+    limiter = CardinalityLimiter(drop_attributes=["url"])
+    sum_metric = Metric("hits", Sum([
+        NumberDataPoint([kv("url", "/a"), kv("code", "200")], 10, 20, 2),
+        NumberDataPoint([kv("url", "/b"), kv("code", "200")], 5, 30, 3),
+        NumberDataPoint([kv("url", "/c"), kv("code", "500")], 10, 20, 1),
+    ]))
+    gauge_metric = Metric("temp", Gauge([
+        NumberDataPoint([kv("url", "/a")], 0, 20, 1.5),
+        NumberDataPoint([kv("url", "/b")], 0, 10, 9.0),
+    ]))
+    hist_metric = Metric("latency", Histogram([
+        HistogramDataPoint([kv("url", "/a")], 0, 10, 2, 3.0, [1, 1, 0], [1.0, 2.0], 1.0, 2.0),
+        HistogramDataPoint([kv("url", "/b")], 0, 10, 1, 5.0, [0, 0, 1], [1.0, 2.0], 5.0, 5.0),
+    ]))
+    limiter.process(resource_metrics([sum_metric, gauge_metric, hist_metric]))
+
+    sums = {attrs_of(dp)["code"]: dp for dp in sum_metric.data.data_points}
+    assert sums["200"].value == 5
+    assert sums["200"].start_time_unix_nano == 5
+    assert sums["200"].time_unix_nano == 30
+    assert sums["500"].value == 1
+
+    assert len(gauge_metric.data.data_points) == 1
+    assert gauge_metric.data.data_points[0].value == 1.5
+
+    [hist] = hist_metric.data.data_points
+    assert hist.bucket_counts == [1, 1, 1]
+    assert hist.count == 3
+    assert hist.sum == 8.0
+    assert (hist.min, hist.max) == (1.0, 5.0)
+    assert limiter.stats["attributes_dropped"] == 7
+
+def test_cardinality_memory_is_bounded():
+    limiter = CardinalityLimiter(max_series=5, max_metrics=10)
+    for m in range(100):
+        points = [NumberDataPoint([kv("id", str(n))], 0, 0, 1) for n in range(50)]
+        limiter.process(resource_metrics([Metric(f"metric.{m}", Sum(points))]))
+
+    assert len(limiter._metrics) == 10
+    assert all(len(state.admitted) == 5 for state in limiter._metrics.values())
+    assert limiter.stats["points_dropped"] == 90 * 50
+    assert len(limiter._baselines) == 10 * 45
+
+def test_cardinality_admission_is_stable():
+    limiter = CardinalityLimiter(max_series=2, max_metrics=2)
+
+    def batch(ids):
+        return resource_metrics([
+            Metric("requests", Sum([NumberDataPoint([kv("id", i)], 0, 0, 1) for i in ids])),
+            Metric("other", Sum([NumberDataPoint([], 0, 0, 1)])),
+        ])
+
+    limiter.process(batch(["a", "b"]))
+    limiter.process(resource_metrics([Metric("third", Sum([NumberDataPoint([], 0, 0, 1)]))]))
+
+    rm = batch(["c", "a", "b"])
+    limiter.process(rm)
+    points = rm.scope_metrics[0].metrics[0].data.data_points
+    assert [attrs_of(dp) for dp in points] == [{OVERFLOW_ATTRIBUTE: True}, {"id": "a"}, {"id": "b"}]
+
+def test_cardinality_cumulative_overflow_never_goes_down():
+    limiter = CardinalityLimiter(max_series=1)
+    totals = []
+    # cumulative counters of three series, the batches carry some of them
+    for batch in ({"a": 1, "b": 5, "c": 2}, {"a": 2, "b": 6}, {"a": 3, "c": 4}, {"b": 9, "c": 4}):
+        metric = Metric("hits", Sum([NumberDataPoint([kv("id", i)], 0, 0, v) for i, v in batch.items()]))
+        limiter.process(resource_metrics([metric]))
+        totals.append([dp.value for dp in metric.data.data_points if attrs_of(dp).get(OVERFLOW_ATTRIBUTE)])
+    # b and c overflow: 5 + 2, then b +1, then c +2, then b +3
+    assert totals == [[7], [8], [10], [13]]
+
+    # deltas are still merged per batch
+    metric = Metric("hits.delta", Sum([NumberDataPoint([kv("id", i)], 0, 0, 1) for i in "abc"], 1))
+    limiter.process(resource_metrics([metric]))
+    assert [dp.value for dp in metric.data.data_points] == [1, 2]
+
+def test_cardinality_cumulative_merges_are_stable_across_batches():
+    # steady cumulative counters keep the same merged totals batch after batch
+    overflow = CardinalityLimiter(max_series=2)
+    dropped = CardinalityLimiter(drop_attributes=["url"])
+    forgetful = CardinalityLimiter(max_series=2, max_sources=3)
+    totals: dict[str, list] = {"overflow": [], "dropped": [], "forgetful": []}
+    for _ in range(5):
+        for name, limiter in (("overflow", overflow), ("forgetful", forgetful)):
+            metric = Metric("hits", Sum([NumberDataPoint([kv("id", str(i))], 0, 0, 2) for i in range(6)]))
+            limiter.process(resource_metrics([metric]))
+            totals[name] += [dp.value for dp in metric.data.data_points if attrs_of(dp).get(OVERFLOW_ATTRIBUTE)]
+        metric = Metric("hits", Sum([NumberDataPoint([kv("url", f"/{i}")], 0, 0, 4) for i in range(5)]))
+        dropped.process(resource_metrics([metric]))
+        totals["dropped"] += [dp.value for dp in metric.data.data_points]
+
+    assert totals["overflow"] == [8] * 5
+    assert totals["dropped"] == [20] * 5
+    # evicted baselines count as restarted series, the total never grows from them
+    assert totals["forgetful"] == [8] * 5
+    assert forgetful.stats["baselines_evicted"] > 0
+
+    # counting on adds the increments, an evicted series only counts from its next point
+    for limiter, expected in ((overflow, 12), (forgetful, 8)):
+        metric = Metric("hits", Sum([NumberDataPoint([kv("id", str(i))], 0, 0, 3) for i in range(6)]))
+        limiter.process(resource_metrics([metric]))
+        assert [dp.value for dp in metric.data.data_points if attrs_of(dp).get(OVERFLOW_ATTRIBUTE)] == [expected]
+
+def test_cardinality_per_metric_limits_and_estimate():
+    limiter = CardinalityLimiter(max_series=1000, limits={"small": 2})
+    limiter.process(resource_metrics([
+        Metric("small", Sum([NumberDataPoint([kv("id", str(n))], 0, 0, 1) for n in range(5)])),
+        Metric("big", Sum([NumberDataPoint([kv("id", str(n))], 0, 0, 1) for n in range(5000)])),
+    ]))
+    assert limiter.stats["points_overflowed"] == 3 + 4000
+
+    estimate = limiter.cardinality()["big"]
+    assert 4500 < estimate < 5500
+
+def test_hyperloglog_small_range():
+    hll = HyperLogLog()
+    for n in range(100):
+        hll.add(_mix64(hash(("k", str(n)))))
+    assert 90 <= hll.estimate() <= 110
+
+def test_metric_cardinality_config():
+    cfg = Config({
+        "enabled": True,
+        "processors_metrics": [Config.metric_cardinality_processor(max_series=500, drop_attributes=["user.id"])],
+    })
+    assert cfg.is_active()
+
+    agent = cfg.build_agent_environment()
+    assert agent["ROTEL_OTLP_WITH_METRICS_PROCESSOR"].endswith("processors/metric_cardinality.py")
+    config = json.loads(agent["ROTEL_PROCESSOR_METRIC_CARDINALITY_CONFIG"])
+    assert CardinalityLimiter.from_config(config).max_series == 500
+
+def test_metric_cardinality_counters(tmp_path):
+    opts = dict(
+        enabled=True, pid_file=str(tmp_path / "agent.pid"),
+        processors_metrics=[Config.metric_cardinality_processor(max_series=2)],
+    )
+    agent = Config(opts).build_agent_environment()
+    limiter = CardinalityLimiter.from_config(json.loads(agent["ROTEL_PROCESSOR_METRIC_CARDINALITY_CONFIG"]))
+    limiter.process(resource_metrics([
+        Metric("requests", Sum([NumberDataPoint([kv("id", str(n))], 0, 0, 1) for n in range(5)])),
+    ]))
+    limiter.write_stats()
+
+    counters = Client(**opts).processor_counters()["metric_cardinality"]
+    assert counters["points_overflowed"] == 3
+    assert counters["cardinality"] == limiter.cardinality() == {"requests": 5}
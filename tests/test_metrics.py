@@ -0,0 +1,135 @@
+# SPDX-License-Identifier: Apache-2.0
+
+from __future__ import annotations
+
+import gc
+import threading
+
+import pytest
+
+from src.rotel import metrics
+from tests.utils_server import MockServer, mock_server  # noqa: F401
+
+
+metrics_service_pb2 = pytest.importorskip("opentelemetry.proto.collector.metrics.v1.metrics_service_pb2")
+
+
+def decode(body: bytes):
+    req = metrics_service_pb2.ExportMetricsServiceRequest()
+    req.ParseFromString(body)
+    return req
+
+def collected(meter: metrics.Meter) -> dict:
+    scopes = [(meter._scope, meter.collect(1_000))]
+    req = decode(metrics._otlp.metrics_request(b"", scopes))
+    return {m.name: m for m in req.resource_metrics[0].scope_metrics[0].metrics}
+
+def attrs_of(point) -> dict:
+    return {kv.key: kv.value.string_value or kv.value.bool_value for kv in point.attributes}
+
+def test_metrics_counter():
+    meter = metrics.get_meter("test.counter")
+    requests = meter.counter("requests", unit="{request}")
+    assert meter.counter("requests") is requests
+    with pytest.raises(ValueError):
+        meter.gauge("requests")
+
+    def work():
+        bound = requests.bind({"route": "/b"})
+        for _ in range(1000):
+            requests.add(1, {"route": "/a", "code": 200})
+            # attribute order does not create a new series
+            requests.add(1, {"code": 200, "route": "/a"})
+            bound.add()
+
+    threads = [threading.Thread(target=work) for _ in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    metric = collected(meter)["requests"]
+    assert metric.unit == "{request}"
+    assert metric.sum.is_monotonic
+    assert metric.sum.aggregation_temporality == 2
+    values = {attrs_of(p)["route"]: p.as_double for p in metric.sum.data_points}
+    assert values == {"/a": 8000, "/b": 4000}
+
+def test_metrics_finished_threads_are_folded():
+    meter = metrics.get_meter("test.retire")
+    counter = meter.counter("work")
+
+    for _ in range(3):
+        t = threading.Thread(target=lambda: counter.add(5, {"k": "v"}))
+        t.start()
+        t.join()
+    gc.collect()
+
+    assert counter._shards == []
+    assert collected(meter)["work"].sum.data_points[0].as_double == 15
+
+def test_metrics_histogram():
+    meter = metrics.get_meter("test.histogram")
+    latency = meter.histogram("latency", unit="ms", bounds=[10, 100])
+    for value in (5, 10, 50, 500):
+        latency.record(value, {"route": "/a"})
+    latency.bind({"route": "/b"}).record(1)
+
+    points = {attrs_of(p)["route"]: p for p in collected(meter)["latency"].histogram.data_points}
+    a = points["/a"]
+    assert list(a.bucket_counts) == [2, 1, 1]
+    assert list(a.explicit_bounds) == [10, 100]
+    assert a.count == 4
+    assert a.sum == 565
+    assert (a.min, a.max) == (5, 500)
+    assert points["/b"].count == 1
+
+def test_metrics_gauge():
+    meter = metrics.get_meter("test.gauge")
+    depth = meter.gauge("queue.depth")
+    depth.set(3, {"queue": "a"})
+    depth.set(7, {"queue": "a"})
+    depth.set(1, {"queue": "b"})
+
+    values = {attrs_of(p)["queue"]: p.as_double for p in collected(meter)["queue.depth"].gauge.data_points}
+    assert values == {"a": 7, "b": 1}
+
+def test_metrics_max_series():
+    meter = metrics.get_meter("test.overflow", max_series=3)
+    counter = meter.counter("by_user")
+    interned = len(metrics._attribute_sets)
+    for user in range(10):
+        counter.add(1, {"user": str(user)})
+    # only the admitted series and the overflow series are interned
+    assert len(metrics._attribute_sets) <= interned + 4
+
+    points = collected(meter)["by_user"].sum.data_points
+    assert len(points) == 4
+    overflow = [p for p in points if attrs_of(p) == {"otel.metric.overflow": True}]
+    assert overflow[0].as_double == 7
+    assert len(counter._index) == 3
+
+def test_metrics_export(mock_server, monkeypatch):  # noqa: F811
+    host, port = mock_server.address()
+    monkeypatch.setattr(metrics._exporter, "_conn", metrics._otlp.AgentConnection(f"{host}:{port}"))
+    monkeypatch.setattr(metrics._exporter, "resource", {"service.name": "checkout"})
+    meter = metrics.get_meter("test.export", "1.0")
+    meter.counter("exported").add(2)
+
+    assert metrics.flush()
+    req = decode(MockServer.tracker.get_requests()[-1].body)
+    resource = {kv.key: kv.value.string_value for kv in req.resource_metrics[0].resource.attributes}
+    assert resource["service.name"] == "checkout"
+    scopes = {s.scope.name: s for s in req.resource_metrics[0].scope_metrics}
+    assert scopes["test.export"].scope.version == "1.0"
+    assert scopes["test.export"].metrics[0].sum.data_points[0].as_double == 2
+
+def test_metrics_after_fork():
+    meter = metrics.get_meter("test.fork")
+    counter = meter.counter("forked")
+    counter.add(1)
+
+    metrics._after_fork_in_child()
+    assert collected(meter) == {}
+    counter.add(1)
+    assert collected(meter)["forked"].sum.data_points[0].as_double == 1
@@ -0,0 +1,58 @@
+# SPDX-License-Identifier: Apache-2.0
+
+from __future__ import annotations
+
+import pytest
+
+from src.rotel import _otlp
+
+
+common_pb2 = pytest.importorskip("opentelemetry.proto.common.v1.common_pb2")
+
+
+def test_otlp_any_value():
+    value = common_pb2.AnyValue()
+    value.ParseFromString(_otlp.any_value({"a": [1, -2, 3.5], "b": True, "c": b"\x00\x01", "d": "x"}))
+    kvs = {kv.key: kv.value for kv in value.kvlist_value.values}
+    assert [v.int_value or v.double_value for v in kvs["a"].array_value.values] == [1, -2, 3.5]
+    assert kvs["b"].bool_value is True
+    assert kvs["c"].bytes_value == b"\x00\x01"
+    assert kvs["d"].string_value == "x"
+
+def test_otlp_varint():
+    assert _otlp.varint(0) == b"\x00"
+    assert _otlp.varint(300) == b"\xac\x02"
+    assert len(_otlp.varint(-1)) == 10
+
+def test_otlp_attributes_skip_none():
+    kv = common_pb2.KeyValueList()
+    kv.ParseFromString(_otlp.attributes(1, {"a": 1, "b": None}))
+    assert [v.key for v in kv.values] == ["a"]
+
+def test_otlp_agent_endpoint(monkeypatch):
+    monkeypatch.setenv("ROTEL_OTLP_HTTP_ENDPOINT", "0.0.0.0:14318")
+    monkeypatch.setattr("src.rotel.client._client", None)
+    assert _otlp.agent_http_endpoint() == "127.0.0.1:14318"
+
+def test_otlp_resource_from_env(monkeypatch):
+    monkeypatch.setenv("OTEL_RESOURCE_ATTRIBUTES", "deployment.environment=prod, service.name=a")
+    monkeypatch.setenv("OTEL_SERVICE_NAME", "checkout")
+    attrs = _otlp.default_resource_attributes()
+    assert attrs["service.name"] == "checkout"
+    assert attrs["deployment.environment"] == "prod"
+
+def test_otlp_split_request():
+    stats = {"spans_oversize": 0, "batch_splits": 0}
+    resource = _otlp.resource({"service.name": "a"})
+    a, b = _otlp.scope("a"), _otlp.scope("b")
+    items = [(a, b"x" * 100), (b, b"y" * 100), (a, b"z" * 100), (a, b"big" * 100), (b, b"w" * 10)]
+    requests = _otlp.split_request(resource, items, 250, stats, "spans")
+    assert [count for _, count in requests] == [1, 1, 2]
+    assert requests[2][0] == [(a, [b"z" * 100]), (b, [b"w" * 10])]
+    for scopes, _ in requests:
+        assert len(_otlp.traces_request(resource, scopes)) <= 250
+    assert stats == {"spans_oversize": 1, "batch_splits": 2}
+
+    stats = {"spans_oversize": 0, "batch_splits": 0}
+    assert len(_otlp.split_request(resource, items, 10_000, stats, "spans")) == 1
+    assert stats["batch_splits"] == 0
@@ -0,0 +1,185 @@
+# SPDX-License-Identifier: Apache-2.0
+
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+
+import pytest
+
+from src.rotel import _otlp, aio
+from src.rotel import client as client_module
+from src.rotel import trace
+from src.rotel.client import Client
+from src.rotel.config import Config
+from src.rotel.pool import PartitionedSpanExporter, member_endpoint, member_index
+
+
+trace_service_pb2 = pytest.importorskip("opentelemetry.proto.collector.trace.v1.trace_service_pb2")
+
+
+def pool_options(tmp_path, **options) -> dict:
+    return {
+        "enabled": True,
+        "pid_file": str(tmp_path / "rotel-agent.pid"),
+        "log_file": str(tmp_path / "rotel-agent.log"),
+        "agent_pool_size": 3,
+        **options,
+    }
+
+def test_pool_member_config(tmp_path):
+    cfg = Config(pool_options(tmp_path))
+    assert cfg.is_active()
+    assert cfg.pool_size() == 3
+
+    member = cfg.pool_member(2)
+    assert member.options["pid_file"] == str(tmp_path / "rotel-agent.2.pid")
+    assert member.options["log_file"] == str(tmp_path / "rotel-agent.2.log")
+    env = member.build_agent_environment()
+    assert env["ROTEL_OTLP_GRPC_ENDPOINT"] == "localhost:4321"
+    assert env["ROTEL_OTLP_HTTP_ENDPOINT"] == "localhost:4322"
+    assert "ROTEL_AGENT_POOL_SIZE" not in env
+
+    assert member_endpoint("http://0.0.0.0:4318", 1) == "http://0.0.0.0:4320"
+    assert not Config(pool_options(tmp_path, otlp_http_endpoint="localhost:4319")).is_active()
+    assert not Config(pool_options(tmp_path, agent_pool_size=0)).is_active()
+    assert not Config(pool_options(tmp_path, otlp_http_endpoint="localhost")).is_active()
+    assert not Config(pool_options(tmp_path, groups={"logs": {"signals": ["logs"]}})).is_active()
+
+    # trace processors need every span of a trace on one member
+    assert not cfg.trace_affinity()
+    assert Config(pool_options(tmp_path, processors_traces=[Config.tail_sampling_processor()])).trace_affinity()
+
+def test_pool_client(tmp_path):
+    client = Client(**pool_options(tmp_path))
+    assert list(client.agents) == ["0", "1", "2"]
+    assert client.endpoints("grpc") == ["localhost:4317", "localhost:4319", "localhost:4321"]
+    assert client.endpoint("logs") == f"localhost:{4318 + 2 * (os.getpid() % 3)}"
+    assert set(client.status()) == {"0", "1", "2"}
+
+    class FakeAgent:
+        def __init__(self, alive):
+            self.alive = alive
+            self.started = []
+
+        def status(self):
+            return {"running": True, "alive": self.alive}
+
+        def start(self, config):
+            self.started.append(config.options["pid_file"])
+            return True
+
+    client.agents = {"0": FakeAgent(True), "1": FakeAgent(False), "2": FakeAgent(True)}
+    assert client.check_agents() == ["1"]
+    assert client.agents["1"].started == [str(tmp_path / "rotel-agent.1.pid")]
+    assert client.restarts == {"0": 0, "1": 1, "2": 0}
+
+def test_pool_stats_are_combined(tmp_path):
+    client = Client(**pool_options(tmp_path, processors_instrument=True))
+    for i, (calls, mean_us, max_us) in enumerate([(2, 10.0, 30.0), (6, 30.0, 90.0)]):
+        with open(str(tmp_path / f"rotel-agent.{i}.processors.json"), "w") as file:
+            json.dump({"processors": {"traces/sampler": {
+                "calls": calls, "errors": i, "items_in": calls * 10, "items_out": calls,
+                "mean_us": mean_us, "us_per_item": mean_us / 10, "max_us": max_us,
+                "bounds_us": [10, 100], "bucket_counts": [calls, 0, 0],
+                "slowest": [{"duration_us": max_us, "items": 10, "time": 0}], "last_error": None,
+            }}}, file)
+
+    stats = client.processor_stats()["traces/sampler"]
+    assert stats["calls"] == 8
+    assert stats["errors"] == 1
+    assert stats["items_in"] == 80
+    assert stats["mean_us"] == pytest.approx(25.0)
+    assert stats["us_per_item"] == pytest.approx(2.5)
+    assert stats["max_us"] == 90.0
+    assert stats["bucket_counts"] == [8, 0, 0]
+    assert [s["duration_us"] for s in stats["slowest"]] == [90.0]
+
+def test_pool_trace_affinity(tmp_path, monkeypatch):
+    # restored with the other attributes after the test
+    monkeypatch.setattr(client_module, "_client", None)
+    client = Client(**pool_options(tmp_path, processors_traces=[Config.tail_sampling_processor()]))
+    # one member would miss the spans of its traces on the others
+    assert client.endpoint("traces") is None
+    assert client.endpoint("logs") is not None
+    sent: dict[str, list[bytes]] = {}
+
+    def post(self, path, body, items=0):
+        spans = [s for rs in trace_service_pb2.ExportTraceServiceRequest.FromString(body).resource_spans
+                 for ss in rs.scope_spans for s in ss.spans]
+        sent.setdefault(self.endpoint, []).extend(s.trace_id for s in spans)
+        return True
+
+    monkeypatch.setattr(_otlp.AgentConnection, "post", post)
+    monkeypatch.setattr(trace._exporter, "_member_conns", None)
+    monkeypatch.setattr(trace._exporter, "stats", dict.fromkeys(trace._exporter.stats, 0))
+    tracer = trace.get_tracer("test.pool")
+    batch = []
+    for i in range(30):
+        span = tracer.start_span(f"span {i}")
+        span.trace_id = (i % 10 + 1) << 64 | 5
+        span.end_time = span.start
+        batch.append(span)
+    trace._exporter._send(batch)
+
+    assert sorted(sent) == ["localhost:4318", "localhost:4320", "localhost:4322"]
+    for endpoint, trace_ids in sent.items():
+        for trace_id in trace_ids:
+            assert endpoint == f"localhost:{4318 + 2 * member_index(trace_id, 3)}"
+    assert sum(len(ids) for ids in sent.values()) == 30
+
+def test_pool_async_trace_affinity(tmp_path, monkeypatch):
+    monkeypatch.setattr(client_module, "_client", None)
+    Client(**pool_options(tmp_path, processors_traces=[Config.tail_sampling_processor()]))
+    sent: dict[str, list[bytes]] = {}
+
+    async def post(self, path, body, items=0):
+        spans = [s for rs in trace_service_pb2.ExportTraceServiceRequest.FromString(body).resource_spans
+                 for ss in rs.scope_spans for s in ss.spans]
+        sent.setdefault(self.endpoint, []).extend(s.trace_id for s in spans)
+        return True
+
+    monkeypatch.setattr(aio.AsyncAgentConnection, "post", post)
+    exporter = aio.AsyncSpanExporter()
+    tracer = trace.get_tracer("test.pool")
+    batch = []
+    for i in range(30):
+        span = tracer.start_span(f"span {i}")
+        span.trace_id = (i % 10 + 1) << 64 | 5
+        span.end_time = span.start
+        batch.append(span)
+
+    asyncio.run(exporter.processor._send(batch))
+    assert sorted(sent) == ["localhost:4318", "localhost:4320", "localhost:4322"]
+    for endpoint, trace_ids in sent.items():
+        for trace_id in trace_ids:
+            assert endpoint == f"localhost:{4318 + 2 * member_index(trace_id, 3)}"
+    assert sum(len(ids) for ids in sent.values()) == 30
+
+def test_pool_partitioned_span_exporter():
+    sdk_trace = pytest.importorskip("opentelemetry.sdk.trace")
+    from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+    from opentelemetry.sdk.trace.export.in_memory_span_exporter import (
+        InMemorySpanExporter,
+    )
+
+    exporters = {}
+    partitioned = PartitionedSpanExporter(
+        ["localhost:4317", "localhost:4318"],
+        lambda endpoint: exporters.setdefault(endpoint, InMemorySpanExporter()),
+    )
+    provider = sdk_trace.TracerProvider()
+    provider.add_span_processor(SimpleSpanProcessor(partitioned))
+    tracer = provider.get_tracer("sdk")
+    for _ in range(20):
+        with tracer.start_as_current_span("root"):
+            with tracer.start_as_current_span("child"):
+                pass
+    provider.shutdown()
+
+    for index, exporter in enumerate(exporters.values()):
+        spans = exporter.get_finished_spans()
+        assert spans
+        assert all(member_index(s.context.trace_id, 2) == index for s in spans)
+    assert sum(len(e.get_finished_spans()) for e in exporters.values()) == 40
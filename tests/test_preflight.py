@@ -0,0 +1,181 @@
+# SPDX-License-Identifier: Apache-2.0
+
+from __future__ import annotations
+
+import socket
+import struct
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from src.rotel import client as client_module
+from src.rotel import preflight
+from src.rotel.client import Client
+from src.rotel.config import Config
+
+
+class Handler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self.send_response(200 if self.path == "/v1/traces" else 404)
+        self.end_headers()
+
+    def do_GET(self):
+        self.send_response(200 if self.path == "/ping" else 404)
+        self.end_headers()
+        self.wfile.write(b"Ok.\n")
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve_once(answer) -> int:
+    """Listen on a free port and answer one connection with answer(conn)"""
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen()
+
+    def accept():
+        conn, _ = listener.accept()
+        with conn:
+            answer(conn)
+        listener.close()
+
+    threading.Thread(target=accept, daemon=True).start()
+    return listener.getsockname()[1]
+
+def h2_server(conn):
+    conn.recv(len(preflight._H2_PREFACE) + 9)
+    conn.sendall(preflight._H2_SETTINGS)
+
+def kafka_server(conn):
+    size, = struct.unpack(">i", conn.recv(4))
+    request = conn.recv(size)
+    correlation_id, = struct.unpack(">i", request[4:8])
+    body = struct.pack(">ih", correlation_id, 0) + struct.pack(">i", 0)
+    conn.sendall(struct.pack(">i", len(body)) + body)
+
+def closed_port() -> int:
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    return port
+
+@pytest.fixture
+def http_port():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield server.server_address[1]
+    server.shutdown()
+
+def test_preflight_targets():
+    targets = preflight.exporter_targets("otlp", Config.otlp_exporter(
+        endpoint="https://collector:4317",
+        traces={"endpoint": "http://traces:4318", "protocol": "http"},
+    ))
+    assert [(t.exporter, t.kind, t.address, t.tls, t.path) for t in targets] == [
+        ("otlp", "otlp_grpc", "collector:4317", True, "/"),
+        ("otlp/traces", "otlp_http", "traces:4318", False, "/v1/traces"),
+    ]
+    datadog, = preflight.exporter_targets("dd", Config.datadog_exporter(region="eu", api_key="key"))
+    assert (datadog.address, datadog.tls, datadog.headers) == ("api.datadoghq.eu:443", True, {"DD-API-KEY": "key"})
+    clickhouse, = preflight.exporter_targets("ch", Config.clickhouse_exporter(endpoint="http://clickhouse"))
+    assert (clickhouse.address, clickhouse.path) == ("clickhouse:8123", "/ping")
+    brokers = preflight.exporter_targets("kafka", Config.kafka_exporter(brokers=["a:9092", "b:9093"]))
+    assert [t.address for t in brokers] == ["a:9092", "b:9093"]
+    assert preflight.exporter_targets("none", Config.blackhole_exporter()) == []
+
+def test_preflight_run(http_port):
+    targets = [
+        preflight.Target("otlp", "otlp_http", "127.0.0.1", http_port, path="/v1/traces"),
+        preflight.Target("wrong-path", "otlp_http", "127.0.0.1", http_port, path="/v1/trace"),
+        preflight.Target("clickhouse", "clickhouse", "127.0.0.1", http_port, path="/ping"),
+        preflight.Target("grpc", "otlp_grpc", "127.0.0.1", serve_once(h2_server)),
+        preflight.Target("kafka", "kafka", "127.0.0.1", serve_once(kafka_server)),
+        preflight.Target("down", "otlp_grpc", "127.0.0.1", closed_port()),
+        # an HTTP server does not speak gRPC
+        preflight.Target("not-grpc", "otlp_grpc", "127.0.0.1", http_port),
+    ]
+    report = preflight.run(targets, timeout=2.0)
+    assert not report["ok"]
+    checks = {c["exporter"]: c for c in report["checks"]}
+    for name in ("otlp", "clickhouse", "grpc", "kafka"):
+        assert checks[name]["ok"], checks[name]
+        assert checks[name]["ping_ms"] is not None
+    assert checks["otlp"]["detail"] == "HTTP 200"
+    assert checks["grpc"]["detail"] == "HTTP/2 SETTINGS"
+    assert (checks["wrong-path"]["stage"], checks["wrong-path"]["error"]) == ("ping", "HTTP 404")
+    assert checks["down"]["stage"] == "connect"
+    assert checks["not-grpc"]["stage"] == "ping"
+    assert "down (otlp_grpc" in preflight.describe(report)
+
+def test_preflight_timeout():
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen()
+    # accepted by the kernel but never answered
+    report = preflight.run([preflight.Target("slow", "kafka", "127.0.0.1", listener.getsockname()[1])], timeout=0.2)
+    listener.close()
+    check, = report["checks"]
+    assert not check["ok"]
+    assert check["stage"] == "ping"
+
+def test_preflight_client(monkeypatch, http_port):
+    started = []
+
+    class FakeAgent:
+        def __init__(self):
+            self.timings = {}
+
+        def start(self, config):
+            started.append(config)
+            return True
+
+    monkeypatch.setattr(client_module, "agent", FakeAgent())
+    exporters = {
+        "up": Config.otlp_exporter(endpoint=f"http://127.0.0.1:{http_port}", protocol="http"),
+        "down": Config.clickhouse_exporter(endpoint=f"http://127.0.0.1:{closed_port()}"),
+    }
+    client = Client(enabled=True, exporters=exporters, exporters_traces=["up", "down"],
+                    preflight=True, preflight_timeout="1s", preflight_required=True)
+    client.start()
+    assert started == []
+    assert [c["ok"] for c in client.preflight_report["checks"]] == [True, False]
+    assert client.startup_report()["preflight"] > 0
+
+    client.config.options["preflight_required"] = False
+    client.start()
+    assert len(started) == 1
+
+    assert not Config({"enabled": True, "preflight_timeout": "later"}).is_active()
+
+def test_preflight_bad_answers():
+    def garbage(conn):
+        conn.recv(4096)
+        conn.sendall(b"\x00\x01 not http\r\n\r\n")
+
+    def short_kafka(conn):
+        conn.recv(4096)
+        # a size and correlation id, then an error code cut short
+        conn.sendall(struct.pack(">ii", 6, 1) + b"\x00")
+
+    report = preflight.run([
+        preflight.Target("garbage", "clickhouse", "127.0.0.1", serve_once(garbage), path="/ping"),
+        preflight.Target("short", "kafka", "127.0.0.1", serve_once(short_kafka)),
+    ], timeout=2.0)
+    for check in report["checks"]:
+        assert (check["ok"], check["stage"]) == (False, "ping"), check
+        assert check["error"]
+
+def test_preflight_tries_every_address(monkeypatch, http_port):
+    resolve = socket.getaddrinfo
+
+    def getaddrinfo(host, port, *args, **kwargs):
+        # the first address refuses the connection
+        return resolve(host, closed_port(), *args, **kwargs) + resolve(host, port, *args, **kwargs)
+
+    monkeypatch.setattr(preflight.socket, "getaddrinfo", getaddrinfo)
+    report = preflight.run([preflight.Target("otlp", "otlp_http", "127.0.0.1", http_port, path="/v1/traces")])
+    assert report["ok"], report
@@ -0,0 +1,152 @@
+# SPDX-License-Identifier: Apache-2.0
+
+from __future__ import annotations
+
+import threading
+import time
+
+import pytest
+
+from src.rotel import _otlp, exports, profiling, trace
+from src.rotel.config import Config
+from tests.utils_server import MockServer, mock_server  # noqa: F401
+
+
+logs_service_pb2 = pytest.importorskip("opentelemetry.proto.collector.logs.v1.logs_service_pb2")
+
+
+def decode(body: bytes):
+    req = logs_service_pb2.ExportLogsServiceRequest()
+    req.ParseFromString(body)
+    return req
+
+def burn_cpu(stop: threading.Event) -> None:
+    while not stop.is_set():
+        sum(i * i for i in range(1000))
+
+def run_sampled(profiler: profiling.Profiler, target, samples: int = 20) -> None:
+    stop = threading.Event()
+    thread = threading.Thread(target=target, args=(stop,))
+    thread.start()
+    try:
+        for _ in range(samples):
+            profiler.sample()
+            time.sleep(0.005)
+    finally:
+        stop.set()
+        thread.join()
+
+def idle(stop: threading.Event) -> None:
+    stop.wait()
+
+def test_profiling_samples_busy_threads():
+    profiler = profiling.Profiler(rate=200)
+    sleeper_stop = threading.Event()
+    sleeper = threading.Thread(target=idle, args=(sleeper_stop,))
+    sleeper.start()
+    try:
+        run_sampled(profiler, burn_cpu)
+    finally:
+        sleeper_stop.set()
+        sleeper.join()
+
+    folded = profiler.folded()
+    burning = [stack for stack in folded if "burn_cpu" in stack]
+    assert burning
+    # folded stacks run from the root to the leaf
+    assert burning[0].split(";")[0].startswith("Thread._bootstrap")
+    if profiling._HAS_CPU_CLOCK:
+        # threads of other tests may wake up, only this test's idle thread is known to sleep
+        assert not any("idle (" in stack for stack in folded)
+        assert sum(folded[s] for s in burning) > 0
+
+def test_profiling_tags_samples_with_spans():
+    profiler = profiling.Profiler(rate=200)
+    tracer = trace.get_tracer("test.profiling")
+    spans = []
+
+    def traced(stop):
+        with tracer.start_span("hot loop") as span:
+            spans.append((span.trace_id, span.span_id))
+            burn_cpu(stop)
+
+    trace._activation_hook = profiling._on_activation
+    try:
+        run_sampled(profiler, traced)
+    finally:
+        trace._activation_hook = None
+
+    body = profiler.encode(profiler._counts, 1, 2)
+    records = decode(body).resource_logs[0].scope_logs[0].log_records
+    trace_id, span_id = spans[0]
+    tagged = [r for r in records if "burn_cpu" in r.body.string_value]
+    assert tagged
+    assert all(r.trace_id == trace_id.to_bytes(16, "big") for r in tagged)
+    assert all(r.span_id == span_id.to_bytes(8, "big") for r in tagged)
+    attrs = {kv.key: kv.value for kv in tagged[0].attributes}
+    assert attrs["profile.samples"].int_value >= 1
+    # the span ended with the thread
+    assert not profiling._thread_spans
+
+def test_profiling_sdk_span_processor():
+    sdk_trace = pytest.importorskip("opentelemetry.sdk.trace")
+    provider = sdk_trace.TracerProvider()
+    provider.add_span_processor(profiling.SpanProcessor())
+    sdk_tracer = provider.get_tracer("sdk")
+
+    with sdk_tracer.start_as_current_span("outer") as outer:
+        with sdk_tracer.start_as_current_span("inner") as inner:
+            assert profiling._sdk_spans[threading.get_ident()][-1][1] == inner.get_span_context().span_id
+        assert profiling._sdk_spans[threading.get_ident()][-1][1] == outer.get_span_context().span_id
+    assert threading.get_ident() not in profiling._sdk_spans
+
+def test_profiling_bounds_overhead():
+    profiler = profiling.Profiler(rate=100, max_overhead=0.01)
+    assert profiler.period == 0.01
+    # a sample holding the interpreter for 1ms allows at most 10 samples a second
+    for _ in range(20):
+        profiler._adjust(0.001)
+    assert profiler.period == pytest.approx(0.1, rel=0.01)
+    for _ in range(50):
+        profiler._adjust(0.00001)
+    assert profiler.period == 0.01
+    profiler._adjust(1.0)
+    assert profiler.period == profiling.MAX_PERIOD
+
+def test_profiling_max_stacks():
+    profiler = profiling.Profiler(max_stacks=1)
+
+    def a(stop):
+        burn_cpu(stop)
+
+    def b(stop):
+        burn_cpu(stop)
+
+    run_sampled(profiler, a, samples=5)
+    run_sampled(profiler, b, samples=5)
+    if profiling._HAS_CPU_CLOCK:
+        assert profiling.TRUNCATED in profiler.folded()
+        assert profiler.stats["stacks_truncated"] > 0
+
+def test_profiling_export(mock_server):  # noqa: F811
+    host, port = mock_server.address()
+    profiler = profiling.Profiler(rate=200, endpoint=f"{host}:{port}", resource={"service.name": "profiled"})
+    run_sampled(profiler, burn_cpu)
+    exports.reset()
+    assert profiler.export()
+    # counted apart from the application's logs
+    assert exports.snapshot("profiles")["profiles"]["items"] >= 1
+    assert exports.snapshot("logs").get("logs", {"requests": 0})["requests"] == 0
+    assert profiler._counts == {}
+    assert profiler._labels == {}
+
+    request = MockServer.tracker.get_requests()[-1]
+    assert request.path == _otlp.LOGS_PATH
+    req = decode(request.body)
+    resource = {kv.key: kv.value.string_value for kv in req.resource_logs[0].resource.attributes}
+    assert resource["service.name"] == "profiled"
+    assert req.resource_logs[0].scope_logs[0].scope.name == profiling.SCOPE
+
+def test_profiling_options():
+    assert Config(dict(enabled=True, profiling=True, profiling_rate=0)).validate() is False
+    assert Config(dict(enabled=True, profiling=True, profiling_rate=50)).validate() is True
@@ -0,0 +1,106 @@
+# SPDX-License-Identifier: Apache-2.0
+
+from __future__ import annotations
+
+import importlib.util
+import os
+
+import pytest
+
+from src.rotel.config import Config
+from src.rotel.reload import parse_interval, write_reload_shim
+from tests.utils_sdk import Span, all_spans, resource_spans
+
+
+PROCESSOR = '''
+def process_spans(resource_spans):
+    for scope_spans in resource_spans.scope_spans:
+        for span in scope_spans.spans:
+            span.name = {name!r}
+'''
+
+
+def write_processor(path, source: str, mtime: int) -> None:
+    path.write_text(source)
+    # editors can save twice within the timestamp granularity, pin it
+    os.utime(path, ns=(mtime, mtime))
+
+def load_shim(path: str):
+    spec = importlib.util.spec_from_file_location("reload_under_test", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+def span_names(shim) -> list[str]:
+    rs = resource_spans([Span(b"\x01" * 16, name="original")])
+    shim.process_spans(rs)
+    return [s.name for s in all_spans(rs)]
+
+def test_reload_swaps_processor(tmp_path):
+    target = tmp_path / "processor.py"
+    write_processor(target, PROCESSOR.format(name="v1"), 1_000_000_000)
+    shim = load_shim(write_reload_shim(str(target), "traces", 0, str(tmp_path / "shims")))
+    assert span_names(shim) == ["v1"]
+
+    # unchanged file is not re-imported
+    assert not shim.check()
+
+    write_processor(target, PROCESSOR.format(name="v2"), 2_000_000_000)
+    assert shim.check()
+    assert span_names(shim) == ["v2"]
+    assert shim.stats == {"reloads": 1, "reload_failures": 0}
+
+def test_reload_keeps_previous_version(tmp_path):
+    target = tmp_path / "processor.py"
+    write_processor(target, PROCESSOR.format(name="v1"), 1_000_000_000)
+    shim = load_shim(write_reload_shim(str(target), "traces", 0, str(tmp_path)))
+
+    write_processor(target, "def process_spans(resource_spans):\n    return (", 2_000_000_000)
+    assert not shim.check()
+    assert span_names(shim) == ["v1"]
+
+    # a module without the entry point is rejected as well
+    write_processor(target, "def process_logs(resource_logs):\n    pass\n", 3_000_000_000)
+    assert not shim.check()
+    assert span_names(shim) == ["v1"]
+    assert shim.stats["reload_failures"] == 2
+
+    # the failing version is not retried until the file changes again
+    assert not shim.check()
+    write_processor(target, PROCESSOR.format(name="v3"), 4_000_000_000)
+    assert shim.check()
+    assert span_names(shim) == ["v3"]
+
+def test_reload_initial_import_fails(tmp_path):
+    target = tmp_path / "processor.py"
+    write_processor(target, "x = 1\n", 1_000_000_000)
+    with pytest.raises(ImportError, match="process_spans"):
+        load_shim(write_reload_shim(str(target), "traces", 0, str(tmp_path)))
+
+def test_reload_config(tmp_path):
+    target = tmp_path / "processor.py"
+    write_processor(target, PROCESSOR.format(name="v1"), 1_000_000_000)
+
+    cfg = Config({
+        "enabled": True,
+        "processors_traces": [str(target), Config.tail_sampling_processor()],
+        "processors_reload": True,
+        "processors_reload_interval": "250ms",
+    })
+    assert cfg.is_active()
+
+    agent = cfg.build_agent_environment()
+    traces = agent["ROTEL_OTLP_WITH_TRACE_PROCESSOR"].split(",")
+    assert os.path.basename(traces[0]).startswith("reload_traces_")
+    shim = open(traces[0]).read()
+    assert repr(str(target)) in shim
+    assert "_INTERVAL = 0.25" in shim
+    # built-in processors keep their state and are not wrapped
+    assert traces[1].endswith("tail_sampling.py")
+
+    agent = Config({"enabled": True, "processors_traces": [str(target)]}).build_agent_environment()
+    assert agent["ROTEL_OTLP_WITH_TRACE_PROCESSOR"] == str(target)
+
+    assert not Config({"enabled": True, "processors_reload_interval": "soon"}).is_active()
+    assert parse_interval(None) == 1.0
+    assert parse_interval("2m") == 120.0
@@ -0,0 +1,164 @@
+# SPDX-License-Identifier: Apache-2.0
+
+from __future__ import annotations
+
+import hashlib
+import importlib.util
+import json
+import os
+
+import pytest
+
+from src.rotel import _generate
+from src.rotel.config import Config
+from src.rotel.rules import compile_rules, validate_rules, write_rules_processor
+from tests.utils_sdk import (
+    KeyValue,
+    Span,
+    Status,
+    all_records,
+    all_spans,
+    kv,
+    log,
+    resource_logs,
+    resource_spans,
+)
+
+
+def load_processor(path: str):
+    spec = importlib.util.spec_from_file_location("rules_under_test", path)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    module.KeyValue = KeyValue
+    return module
+
+def attrs_of(record) -> dict:
+    return {a.key: a.value.value for a in record.attributes}
+
+def test_rules_traces(tmp_path):
+    rules = [
+        {"name": "drop health checks", "match": {"name": "^GET /health"}, "actions": [{"action": "drop"}]},
+        {"match": {"status": "error"}, "actions": [{"action": "set", "key": "alert", "value": True}]},
+        {
+            "match": {"attributes": {"http.url": "token="}, "resource": {"deployment.environment": "^prod$"}},
+            "actions": [{"action": "hash", "key": "http.url"}, {"action": "delete", "key": "user.email"}],
+        },
+        {"actions": [{"action": "truncate", "key": "db.statement", "length": 8}]},
+    ]
+    module = load_processor(write_rules_processor(rules, "traces", str(tmp_path)))
+
+    url = "https://example.com/?token=secret"
+    rs = resource_spans([
+        Span(b"\x01" * 16, name="GET /health"),
+        Span(b"\x02" * 16, name="GET /checkout", status=Status(2),
+             attributes=[kv("http.url", url), kv("user.email", "a@example.com"), kv("db.statement", "SELECT * FROM t")]),
+        Span(b"\x03" * 16, name="GET /other", attributes=[kv("http.url", url)]),
+    ])
+    rs.resource.attributes.append(kv("deployment.environment", "prod"))
+    module.process_spans(rs)
+
+    spans = all_spans(rs)
+    assert [s.name for s in spans] == ["GET /checkout", "GET /other"]
+    assert attrs_of(spans[0]) == {
+        "http.url": hashlib.sha256(url.encode()).hexdigest(),
+        "db.statement": "SELECT *",
+        "alert": True,
+    }
+    assert "alert" not in attrs_of(spans[1])
+
+def test_rules_resource_mismatch(tmp_path):
+    rules = [{"match": {"resource": {"service.name": "^billing$"}}, "actions": [{"action": "drop"}]}]
+    module = load_processor(write_rules_processor(rules, "traces", str(tmp_path)))
+
+    rs = resource_spans([Span(b"\x01" * 16)], service="checkout")
+    module.process_spans(rs)
+    assert len(all_spans(rs)) == 1
+
+    rs = resource_spans([Span(b"\x01" * 16)], service="billing")
+    module.process_spans(rs)
+    assert all_spans(rs) == []
+
+def test_rules_logs(tmp_path):
+    rules = [
+        {"match": {"name": "heartbeat"}, "actions": [{"action": "drop"}]},
+        {"match": {"min_severity": "error"}, "actions": [{"action": "set", "key": "page", "value": "oncall"}]},
+    ]
+    module = load_processor(write_rules_processor(rules, "logs", str(tmp_path)))
+
+    rl = resource_logs([log("heartbeat ok"), log("disk full", 17), log("user login", 9)])
+    module.process_logs(rl)
+    records = all_records(rl)
+    assert [r.body.value for r in records] == ["disk full", "user login"]
+    assert attrs_of(records[0]) == {"page": "oncall"}
+    assert attrs_of(records[1]) == {}
+
+def test_rules_file_is_shared(tmp_path):
+    rules = [{"match": {"name": "x"}, "actions": [{"action": "drop"}]}]
+    a = write_rules_processor(rules, "traces", str(tmp_path))
+    b = write_rules_processor(rules, "traces", str(tmp_path))
+    assert a == b
+    assert os.listdir(tmp_path) == [os.path.basename(a)]
+
+def test_rules_validation():
+    with pytest.raises(ValueError, match="unknown action"):
+        validate_rules([{"actions": [{"action": "explode"}]}], "traces")
+    with pytest.raises(ValueError, match="requires a key"):
+        validate_rules([{"actions": [{"action": "delete"}]}], "traces")
+    with pytest.raises(ValueError, match="invalid regular expression"):
+        validate_rules([{"match": {"name": "("}, "actions": [{"action": "drop"}]}], "traces")
+    with pytest.raises(ValueError, match="status only applies"):
+        validate_rules([{"match": {"status": "error"}, "actions": [{"action": "drop"}]}], "logs")
+    with pytest.raises(ValueError):
+        compile_rules([{"actions": [{"action": "drop"}]}], "metrics")
+
+def test_rules_config(tmp_path):
+    rules_file = tmp_path / "rules.json"
+    rules_file.write_text(json.dumps([{"match": {"name": "^GET /health"}, "actions": [{"action": "drop"}]}]))
+
+    cfg = Config({
+        "enabled": True,
+        "processors_traces": [Config.rules_processor(file=str(rules_file)), "/path/to/custom.py"],
+        "processors_logs": [Config.rules_processor(rules=[{"actions": [{"action": "delete", "key": "password"}]}])],
+    })
+    assert cfg.is_active()
+
+    agent = cfg.build_agent_environment()
+    traces = agent["ROTEL_OTLP_WITH_TRACE_PROCESSOR"].split(",")
+    assert os.path.basename(traces[0]).startswith("rules_traces_")
+    assert traces[1] == "/path/to/custom.py"
+    assert "def process_spans" in open(traces[0]).read()
+    assert "def process_logs" in open(agent["ROTEL_OTLP_WITH_LOGS_PROCESSOR"]).read()
+
+    cfg = Config({
+        "enabled": True,
+        "processors_traces": [Config.rules_processor(rules=[{"actions": [{"action": "set", "key": "a"}]}])],
+    })
+    assert not cfg.is_active()
+
+    cfg = Config({
+        "enabled": True,
+        "processors_metrics": [Config.rules_processor(rules=[{"actions": [{"action": "drop"}]}])],
+    })
+    assert not cfg.is_active()
+
+def test_rules_private_directory(tmp_path, monkeypatch):
+    directory = tmp_path / "rotel-processors"
+    monkeypatch.setattr(_generate, "processors_dir", lambda: str(directory))
+    rules = [{"match": {"name": "x"}, "actions": [{"action": "drop"}]}]
+    path = write_rules_processor(rules, "traces")
+    assert os.stat(directory).st_mode & 0o777 == 0o700
+
+    # a file planted under the expected name is replaced, not executed
+    with open(path, "w") as file:
+        file.write("raise SystemExit('planted')\n")
+    assert write_rules_processor(rules, "traces") == path
+    load_processor(path)
+
+    os.chmod(directory, 0o777)
+    with pytest.raises(PermissionError, match="0700"):
+        write_rules_processor(rules, "traces")
+
+def test_rules_name_cannot_inject_code(tmp_path):
+    for brk in ("\n", "\r", "\r\n", "\x0b", "\x0c", "\x1c", "\x85", "\u2028"):
+        rules = [{"name": f"x{brk}raise SystemExit('injected')", "actions": [{"action": "drop"}]}]
+        load_processor(write_rules_processor(rules, "traces", str(tmp_path)))
@@ -0,0 +1,87 @@
+# SPDX-License-Identifier: Apache-2.0
+
+from __future__ import annotations
+
+import asyncio
+import gc
+import os
+import time
+
+import pytest
+
+from src.rotel import metrics, runtime
+from src.rotel.config import Config
+
+
+metrics_service_pb2 = pytest.importorskip("opentelemetry.proto.collector.metrics.v1.metrics_service_pb2")
+
+
+def collected() -> dict:
+    meter = metrics.get_meter(runtime.SCOPE)
+    req = metrics_service_pb2.ExportMetricsServiceRequest()
+    req.ParseFromString(metrics._otlp.metrics_request(b"", [(meter._scope, meter.collect(1_000))]))
+    return {m.name: m for m in req.resource_metrics[0].scope_metrics[0].metrics}
+
+@pytest.fixture
+def runtime_metrics():
+    runtime.start()
+    yield runtime._collector
+    runtime.stop()
+
+def test_runtime_gc_metrics(runtime_metrics):
+    def collections() -> dict[int, float]:
+        metric = collected().get("python.gc.collections")
+        if metric is None:
+            return {}
+        return {p.attributes[0].value.int_value: p.as_double for p in metric.sum.data_points}
+
+    assert runtime_metrics.on_gc in gc.callbacks
+    before = collections()
+    gc.collect()
+
+    assert collections()[2] == before.get(2, 0) + 1
+    pauses = {p.attributes[0].value.int_value: p for p in collected()["python.gc.pause"].histogram.data_points}
+    assert pauses[2].count >= 1
+    assert pauses[2].sum > 0
+
+def test_runtime_sampled_metrics(runtime_metrics):
+    busy_until = time.process_time() + 0.05
+    while time.process_time() < busy_until:
+        pass
+    # sampled by the metrics exporter before each export
+    assert runtime_metrics.sample in metrics._callbacks
+    runtime_metrics.sample()
+
+    result = collected()
+    assert result["process.thread.count"].gauge.data_points[0].as_double >= 1
+    assert result["process.memory.usage"].gauge.data_points[0].as_double > 0
+    if os.path.isdir("/proc/self/fd"):
+        assert result["process.open_file_descriptor.count"].gauge.data_points[0].as_double > 0
+    cpu = {p.attributes[0].value.string_value: p.as_double for p in result["process.cpu.time"].sum.data_points}
+    assert cpu["user"] + cpu["system"] > 0
+    assert len(result["python.gc.count"].gauge.data_points) == 3
+
+def test_runtime_event_loop_lag(runtime_metrics):
+    async def main():
+        runtime.monitor_event_loop(interval=0.01)
+        await asyncio.sleep(0.03)
+        # block the loop
+        time.sleep(0.1)
+        await asyncio.sleep(0.03)
+
+    asyncio.run(main())
+    point = collected()["python.asyncio.loop.lag"].histogram.data_points[0]
+    assert point.count >= 2
+    assert point.max >= 50
+
+def test_runtime_stop():
+    runtime.start()
+    collector = runtime._collector
+    runtime.stop()
+    assert collector.on_gc not in gc.callbacks
+    assert collector.sample not in metrics._callbacks
+    assert runtime._collector is None
+
+def test_runtime_option(monkeypatch):
+    monkeypatch.setenv("ROTEL_RUNTIME_METRICS", "true")
+    assert Config().options["runtime_metrics"] is True
@@ -0,0 +1,148 @@
+# SPDX-License-Identifier: Apache-2.0
+
+from __future__ import annotations
+
+from collections import deque
+
+import pytest
+
+from src.rotel import _otlp, sampling, trace
+from src.rotel.config import Config
+from tests.utils_clock import FakeClock
+
+
+def make_sampler(**kwargs) -> tuple[sampling.AdaptiveSampler, _otlp.AgentHealth, FakeClock]:
+    health, clock = _otlp.AgentHealth(), FakeClock(now=0.0)
+    return sampling.AdaptiveSampler(health=health, clock=clock, **kwargs), health, clock
+
+def test_sampling_follows_backpressure():
+    sampler, health, clock = make_sampler(min_ratio=0.1, max_ratio=0.8, step=0.2)
+    assert sampler.ratio == 0.8
+
+    health.record(200, 0.01)
+    health.record(429, 0.01)
+    clock.now += 1
+    sampler.update()
+    assert sampler.ratio == 0.4
+
+    # responses within the interval only count at the next update
+    health.record(503, 0.01)
+    sampler.update()
+    assert sampler.ratio == 0.4
+    for _ in range(3):
+        clock.now += 1
+        health.record(None, 0.01)
+        sampler.update()
+    assert sampler.ratio == 0.1
+
+    health.record(200, 0.01)
+    clock.now += 1
+    sampler.update()
+    assert sampler.ratio == pytest.approx(0.3)
+    for _ in range(5):
+        health.record(200, 0.01)
+        clock.now += 1
+        sampler.update()
+    assert sampler.ratio == 0.8
+    assert sampler.stats == {"decreases": 3, "increases": 4}
+
+def test_sampling_slow_agent():
+    sampler, health, clock = make_sampler(target_latency=0.1)
+    for _ in range(10):
+        health.record(200, 2.0)
+    clock.now += 1
+    sampler.update()
+    assert sampler.ratio == 0.5
+    # an idle interval leaves the ratio alone
+    clock.now += 1
+    sampler.update()
+    assert sampler.ratio == 0.5
+
+def test_sampling_decision_from_trace_id():
+    sampler, _, _ = make_sampler(min_ratio=0.5, max_ratio=0.5)
+    assert sampler.sample((1 << 64) + 1)
+    assert sampler.sample((1 << 63) - 1)
+    assert not sampler.sample(1 << 63)
+    sampler, _, _ = make_sampler(min_ratio=0.0, max_ratio=0.0)
+    assert not sampler.sample(0)
+    with pytest.raises(ValueError):
+        sampling.AdaptiveSampler(min_ratio=0.5, max_ratio=0.2)
+
+def test_sampling_rotel_trace_keeps_errors(monkeypatch):
+    sampler, _, _ = make_sampler(min_ratio=0.0, max_ratio=0.0)
+    monkeypatch.setattr(trace._exporter, "sampler", sampler)
+    monkeypatch.setattr(trace._exporter, "_queue", deque())
+    monkeypatch.setattr(trace._exporter, "_start", lambda: None)
+    tracer = trace.get_tracer("test.sampling")
+
+    with tracer.start_span("dropped") as span:
+        assert not span.is_recording
+        with tracer.start_span("child") as child:
+            assert child.flags == 0
+    assert len(trace._exporter._queue) == 0
+
+    with pytest.raises(RuntimeError):
+        with tracer.start_span("failed"):
+            raise RuntimeError("boom")
+    assert [s.name for s in trace._exporter._queue] == ["failed"]
+
+    sampler.keep_errors = False
+    with pytest.raises(RuntimeError):
+        with tracer.start_span("failed"):
+            raise RuntimeError("boom")
+    assert len(trace._exporter._queue) == 1
+
+def test_sampling_sdk_keeps_errors():
+    sdk_trace = pytest.importorskip("opentelemetry.sdk.trace")
+    from opentelemetry.sdk.trace.export import SimpleSpanProcessor
+    from opentelemetry.sdk.trace.export.in_memory_span_exporter import (
+        InMemorySpanExporter,
+    )
+    from opentelemetry.trace import Status, StatusCode
+
+    sampler, _, _ = make_sampler(min_ratio=0.0, max_ratio=0.0)
+    sampled_exporter, error_exporter = InMemorySpanExporter(), InMemorySpanExporter()
+    error_spans = sampling.ErrorSpanProcessor(error_exporter, flush_interval=0.01)
+    provider = sdk_trace.TracerProvider(sampler=sampler)
+    provider.add_span_processor(SimpleSpanProcessor(sampled_exporter))
+    provider.add_span_processor(error_spans)
+    tracer = provider.get_tracer("sdk")
+
+    with tracer.start_as_current_span("ok"):
+        pass
+    with tracer.start_as_current_span("failed") as span:
+        span.set_status(Status(StatusCode.ERROR))
+    error_spans.shutdown()
+
+    assert sampled_exporter.get_finished_spans() == ()
+    assert [s.name for s in error_exporter.get_finished_spans()] == ["failed"]
+    assert sampler.get_description() == "AdaptiveSampler{0.0,0.0}"
+
+def test_sampling_observes_agent_responses(monkeypatch):
+    health = _otlp.AgentHealth()
+    monkeypatch.setattr(_otlp, "agent_health", health)
+
+    conn = _otlp.AgentConnection("127.0.0.1:1", timeout=0.5)
+    assert not conn.post(_otlp.TRACES_PATH, b"")
+    assert health.failed == 1
+
+    class Result:
+        def __init__(self, name):
+            self.name = name
+
+    class Exporter:
+        def __init__(self):
+            self.results = [Result("SUCCESS"), Result("FAILURE")]
+
+        def export(self, batch):
+            return self.results.pop(0)
+
+    exporter = sampling.observe_exporter(Exporter())
+    assert exporter.export([]).name == "SUCCESS"
+    exporter.export([])
+    assert (health.ok, health.failed) == (1, 2)
+
+def test_sampling_options():
+    assert Config(dict(enabled=True, adaptive_sampling=True, adaptive_sampling_min_ratio=0.5,
+                       adaptive_sampling_max_ratio=0.2)).validate() is False
+    assert Config(dict(enabled=True, adaptive_sampling=True, adaptive_sampling_min_ratio=0.05)).validate() is True
@@ -0,0 +1,181 @@
+# SPDX-License-Identifier: Apache-2.0
+
+from __future__ import annotations
+
+import os
+import subprocess
+import sys
+import time
+import uuid
+
+import pytest
+
+from src.rotel import _otlp, metrics
+from src.rotel._shared_metrics import _AGGREGATOR, SharedMetrics, segment_name, unlink
+
+
+metrics_service_pb2 = pytest.importorskip("opentelemetry.proto.collector.metrics.v1.metrics_service_pb2")
+
+
+@pytest.fixture
+def segment():
+    name = f"rotel-test-{uuid.uuid4().hex[:12]}"
+    handles = []
+
+    def attach(**kwargs) -> SharedMetrics:
+        handles.append(SharedMetrics(name, max_workers=4, capacity=64, max_entries=32, heap_size=8192, **kwargs))
+        return handles[-1]
+
+    attach.name = name
+    yield attach
+    for handle in handles:
+        handle.close()
+    unlink(name)
+    os.unlink(handles[0]._lock_path)
+
+def merged(shared: SharedMetrics) -> dict:
+    req = metrics_service_pb2.ExportMetricsServiceRequest()
+    req.ParseFromString(shared.encode(_otlp.resource({"service.name": "test"})))
+    return {m.name: m for sm in req.resource_metrics[0].scope_metrics for m in sm.metrics}
+
+def dead_pid() -> int:
+    proc = subprocess.Popen([sys.executable, "-c", "pass"])
+    proc.wait()
+    return proc.pid
+
+def test_shared_metrics_merge_workers(segment):
+    first, second = segment(), segment()
+    workers = []
+    for shared, n in [(first, 1), (second, 2)]:
+        meter = metrics.Meter("test.shared")
+        requests = meter.counter("requests")
+        latency = meter.histogram("latency", bounds=[10, 100])
+        queue = meter.up_down_counter("queue")
+        requests.add(n, {"route": "/a"})
+        requests.add(10 * n, {"route": "/b"})
+        latency.record(5 * n)
+        latency.record(50 * n)
+        queue.add(-n)
+        assert shared.publish(meter.instruments())
+        workers.append(meter)
+
+    assert first._row != second._row
+    result = merged(first)
+    values = {p.attributes[0].value.string_value: p.as_double for p in result["requests"].sum.data_points}
+    assert values == {"/a": 3, "/b": 30}
+    assert result["requests"].sum.is_monotonic
+    assert not result["queue"].sum.is_monotonic
+    assert result["queue"].sum.data_points[0].as_double == -3
+
+    point = result["latency"].histogram.data_points[0]
+    assert list(point.bucket_counts) == [2, 2, 0]
+    assert point.sum == 165
+    assert point.min == 5
+    assert point.max == 100
+
+    # publishing again replaces the row instead of adding to it
+    workers[0].instruments()[0].add(1, {"route": "/a"})
+    first.publish(workers[0].instruments())
+    result = merged(second)
+    values = {p.attributes[0].value.string_value: p.as_double for p in result["requests"].sum.data_points}
+    assert values == {"/a": 4, "/b": 30}
+
+def test_shared_metrics_gauge_latest_wins(segment):
+    first, second = segment(), segment()
+    meters = [metrics.Meter("test.gauge"), metrics.Meter("test.gauge")]
+    gauges = [meter.gauge("temperature") for meter in meters]
+
+    gauges[0].set(20)
+    first.publish(meters[0].instruments())
+    gauges[1].set(30)
+    second.publish(meters[1].instruments())
+    assert merged(first)["temperature"].gauge.data_points[0].as_double == 30
+
+    # an unchanged value keeps its original time, so a newer value elsewhere still wins
+    gauges[0].set(40)
+    first.publish(meters[0].instruments())
+    second.publish(meters[1].instruments())
+    assert merged(first)["temperature"].gauge.data_points[0].as_double == 40
+
+def test_shared_metrics_dead_worker_row_is_baseline(segment):
+    first = segment()
+    meter = metrics.Meter("test.dead")
+    meter.counter("jobs").add(5)
+    first.publish(meter.instruments())
+    # the worker exits without releasing its row
+    first._set_worker(first._row, dead_pid(), 1.0)
+    first._row = None
+
+    second = segment()
+    meter = metrics.Meter("test.dead")
+    meter.counter("jobs").add(2)
+    second.publish(meter.instruments())
+    assert merged(second)["jobs"].sum.data_points[0].as_double == 7
+    assert [second._worker(row)[0] for row in range(second.max_workers)].count(0) == 3
+
+def test_shared_metrics_lease(segment):
+    first, second = segment(), segment()
+    assert first.try_lease(stale_after=30)
+    # same pid in this test, fake a live holder in another process
+    proc = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(30)"])
+    try:
+        first._set_field(_AGGREGATOR, proc.pid, time.time())
+        assert not second.try_lease(stale_after=30)
+    finally:
+        proc.kill()
+        proc.wait()
+    # the holder died, the lease is taken over
+    assert second.try_lease(stale_after=30)
+    second.release_lease()
+    assert first._header()[9] == 0
+
+def test_shared_metrics_segment_name():
+    assert segment_name("/tmp/a.pid") == segment_name("/tmp/a.pid")
+    assert segment_name("/tmp/a.pid") != segment_name("/tmp/b.pid")
+    assert segment_name(None).startswith("rotel-metrics-")
+
+@pytest.mark.skipif(not hasattr(os, "fork"), reason="requires fork")
+def test_shared_metrics_forked_workers(segment):
+    shared = segment()
+    pids = []
+    for n in range(3):
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                shared.after_fork()
+                meter = metrics.Meter("test.fork")
+                meter.counter("forked").add(n + 1)
+                code = 0 if shared.publish(meter.instruments()) else 1
+                shared.release()
+            finally:
+                os._exit(code)
+        pids.append(pid)
+    for pid in pids:
+        assert os.waitpid(pid, 0)[1] == 0
+    assert merged(shared)["forked"].sum.data_points[0].as_double == 6
+
+def test_shared_metrics_creator_exits(segment):
+    # the first worker creates the segment, publishes and is recycled
+    code = (
+        "import sys\n"
+        "from src.rotel import metrics\n"
+        "from src.rotel._shared_metrics import SharedMetrics\n"
+        "shared = SharedMetrics(sys.argv[1], max_workers=4, capacity=64, max_entries=32, heap_size=8192)\n"
+        "assert shared.owner\n"
+        "meter = metrics.Meter('test.creator')\n"
+        "meter.counter('served').add(5)\n"
+        "assert shared.publish(meter.instruments())\n"
+        "shared.close()\n"
+    )
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run([sys.executable, "-c", code, segment.name], cwd=root, check=True)
+
+    # the other workers and their replacements keep using the same segment
+    worker = segment()
+    assert not worker.owner
+    meter = metrics.Meter("test.creator")
+    meter.counter("served").add(2)
+    assert worker.publish(meter.instruments())
+    assert merged(worker)["served"].sum.data_points[0].as_double == 7
+    assert not segment().owner
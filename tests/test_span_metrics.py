@@ -0,0 +1,123 @@
+# SPDX-License-Identifier: Apache-2.0
+
+from __future__ import annotations
+
+import json
+import os
+
+from src.rotel.config import Config
+from src.rotel.processors.span_metrics import (
+    CALLS_METRIC,
+    DURATION_METRIC,
+    OVERFLOW_ATTRIBUTE,
+    SpanMetrics,
+    agent_metrics_url,
+)
+from tests.utils_sdk import Span, Status, kv, resource_spans
+
+
+def span(name: str, duration_ms: float, error: bool = False, **attrs) -> Span:
+    return Span(
+        trace_id=b"\x01" * 16,
+        name=name,
+        kind=2,
+        start_time_unix_nano=0,
+        end_time_unix_nano=int(duration_ms * 1_000_000),
+        status=Status(2) if error else None,
+        attributes=[kv(k, v) for k, v in attrs.items()],
+    )
+
+def metrics_by_name(payload: dict) -> dict:
+    # merges data points across resources
+    out = {}
+    for rm in payload["resourceMetrics"]:
+        for sm in rm["scopeMetrics"]:
+            for metric in sm["metrics"]:
+                if metric["name"] not in out:
+                    out[metric["name"]] = metric
+                    continue
+                for kind in ("sum", "histogram", "exponentialHistogram"):
+                    if kind in metric:
+                        out[metric["name"]][kind]["dataPoints"].extend(metric[kind]["dataPoints"])
+    return out
+
+def attrs_of(dp: dict) -> dict:
+    return {a["key"]: list(a["value"].values())[0] for a in dp["attributes"]}
+
+def test_span_metrics_red():
+    sm = SpanMetrics(buckets=[10, 100])
+    sm.process(resource_spans([span("GET /", 5), span("GET /", 50), span("GET /", 500, error=True)]))
+
+    payload = sm.collect()
+    rm = payload["resourceMetrics"][0]
+    assert rm["resource"]["attributes"] == [{"key": "service.name", "value": {"stringValue": "svc"}}]
+
+    metrics = metrics_by_name(payload)
+    calls = {attrs_of(dp)["status.code"]: int(dp["asInt"]) for dp in metrics[CALLS_METRIC]["sum"]["dataPoints"]}
+    assert calls == {"STATUS_CODE_UNSET": 2, "STATUS_CODE_ERROR": 1}
+
+    hist = [dp for dp in metrics[DURATION_METRIC]["histogram"]["dataPoints"]
+            if attrs_of(dp)["status.code"] == "STATUS_CODE_UNSET"][0]
+    assert hist["bucketCounts"] == ["1", "1", "0"]
+    assert hist["sum"] == 55.0
+    assert attrs_of(hist)["span.kind"] == "SPAN_KIND_SERVER"
+
+    # cumulative keeps counting
+    sm.process(resource_spans([span("GET /", 5)]))
+    metrics = metrics_by_name(sm.collect())
+    assert sum(int(dp["asInt"]) for dp in metrics[CALLS_METRIC]["sum"]["dataPoints"]) == 4
+
+def test_span_metrics_delta_and_dimensions():
+    sm = SpanMetrics(dimensions=["http.route"], temporality="delta")
+    sm.process(resource_spans([span("handler", 1, **{"http.route": "/a"}), span("handler", 1, **{"http.route": "/b"})]))
+
+    metrics = metrics_by_name(sm.collect())
+    routes = sorted(attrs_of(dp)["http.route"] for dp in metrics[CALLS_METRIC]["sum"]["dataPoints"])
+    assert routes == ["/a", "/b"]
+    assert metrics[CALLS_METRIC]["sum"]["aggregationTemporality"] == 1
+
+    assert sm.collect() is None
+
+def test_span_metrics_cardinality_cap():
+    sm = SpanMetrics(dimensions=["user.id"], max_series=10)
+    sm.process(resource_spans([span("op", 1, **{"user.id": str(n)}) for n in range(1000)]))
+
+    metrics = metrics_by_name(sm.collect())
+    points = metrics[CALLS_METRIC]["sum"]["dataPoints"]
+    assert len(points) == 10
+    overflow = [dp for dp in points if attrs_of(dp).get(OVERFLOW_ATTRIBUTE)]
+    assert int(overflow[0]["asInt"]) == 991
+    assert sm.stats["spans_overflowed"] == 991
+    assert len(sm._series) == 10
+
+def test_span_metrics_exponential_histogram():
+    sm = SpanMetrics(histogram="exponential", exponential_max_size=20)
+    sm.process(resource_spans([span("op", ms) for ms in (0.01, 1, 10, 100, 1000, 100_000)]))
+
+    metrics = metrics_by_name(sm.collect())
+    dp = metrics[DURATION_METRIC]["exponentialHistogram"]["dataPoints"][0]
+    assert dp["count"] == "6"
+    assert len(dp["positive"]["bucketCounts"]) <= 20
+    assert sum(int(c) for c in dp["positive"]["bucketCounts"]) == 6
+
+def test_span_metrics_agent_url():
+    os.environ["ROTEL_OTLP_HTTP_ENDPOINT"] = "0.0.0.0:5318"
+    assert agent_metrics_url() == "http://127.0.0.1:5318/v1/metrics"
+
+def test_span_metrics_config():
+    cfg = Config({
+        "enabled": True,
+        "processors_traces": [Config.span_metrics_processor(dimensions=["http.route"], interval="10s")],
+    })
+    assert cfg.is_active()
+
+    agent = cfg.build_agent_environment()
+    assert agent["ROTEL_OTLP_WITH_TRACE_PROCESSOR"].endswith("processors/span_metrics.py")
+    assert json.loads(agent["ROTEL_PROCESSOR_SPAN_METRICS_CONFIG"]) == {"dimensions": ["http.route"], "interval": "10s"}
+
+    cfg = Config({
+        "enabled": True,
+        "otlp_receiver_metrics_disabled": True,
+        "processors_traces": [Config.span_metrics_processor()],
+    })
+    assert not cfg.is_active()
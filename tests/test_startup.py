@@ -0,0 +1,67 @@
+# SPDX-License-Identifier: Apache-2.0
+
+from __future__ import annotations
+
+import os
+import socket
+import subprocess
+import sys
+import time
+
+from src.rotel import client as client_module
+from src.rotel.client import STARTUP_PHASES, Client
+
+
+ROOT = os.path.join(os.path.dirname(__file__), "..")
+
+
+def test_import_is_lazy():
+    code = (
+        "import sys, src.rotel as rotel\n"
+        "assert not [m for m in sys.modules if m.startswith('src.rotel.')], sorted(sys.modules)\n"
+        "assert rotel.Config.__name__ == 'Config'\n"
+        "assert 'src.rotel.client' not in sys.modules\n"
+        "assert rotel.Rotel.__name__ == 'Client'\n"
+        "assert 'src.rotel.instrument' not in sys.modules and 'src.rotel.rules' not in sys.modules\n"
+        "assert rotel._import_seconds > 0\n"
+    )
+    subprocess.run([sys.executable, "-c", code], cwd=ROOT, check=True)
+
+def test_startup_report_before_start():
+    report = Client(enabled=True).startup_report()
+    assert list(report) == [*STARTUP_PHASES, "total"]
+    assert report["env"] >= 0 and report["validate"] >= 0
+    assert report["build_env"] is None and report["spawn"] is None and report["ready"] is None
+    assert report["total"] == sum(report[phase] for phase in ("import", "env", "validate"))
+
+def test_startup_report_phases(tmp_path, monkeypatch):
+    listener = socket.socket()
+    listener.bind(("127.0.0.1", 0))
+    listener.listen()
+    port = listener.getsockname()[1]
+
+    class FakeAgent:
+        def __init__(self):
+            self.timings = {}
+
+        def start(self, config):
+            config.build_agent_environment()
+            self.timings = {"build_env": 0.001, "spawn": 0.004}
+            return True
+
+        def stop(self):
+            pass
+
+    monkeypatch.setattr(client_module, "agent", FakeAgent())
+    client = Client(enabled=True, pid_file=str(tmp_path / "agent.pid"), otlp_http_endpoint=f"localhost:{port}")
+    client.start()
+    deadline = time.monotonic() + 5
+    while client.startup_report()["ready"] is None and time.monotonic() < deadline:
+        time.sleep(0.01)
+    listener.close()
+
+    report = client.startup_report()
+    assert report["build_env"] == 1.0
+    assert report["spawn"] == 4.0
+    assert report["ready"] is not None
+    assert report["total"] >= 5.0
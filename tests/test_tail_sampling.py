@@ -0,0 +1,183 @@
+# SPDX-License-Identifier: Apache-2.0
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+
+from src.rotel.client import Client
+from src.rotel.config import Config
+from src.rotel.processor_counters import counters_path
+from src.rotel.processors.tail_sampling import TailSampler, parse_duration
+from tests.utils_clock import FakeClock
+from tests.utils_sdk import Span, Status, all_spans, kv, resource_spans
+
+
+def trace_id(n: int) -> bytes:
+    return n.to_bytes(16, "big")
+
+def span(n: int, duration_ms: int = 1, error: bool = False, **attrs) -> Span:
+    return Span(
+        trace_id=trace_id(n),
+        start_time_unix_nano=0,
+        end_time_unix_nano=duration_ms * 1_000_000,
+        status=Status(2) if error else None,
+        attributes=[kv(k, v) for k, v in attrs.items()],
+    )
+
+def test_parse_duration():
+    assert parse_duration("250ms") == 0.25
+    assert parse_duration("5s") == 5.0
+    assert parse_duration("1m") == 60.0
+    assert parse_duration(2) == 2.0
+
+def test_tail_sampling_keeps_errors_and_slow_traces():
+    clock = FakeClock()
+    sampler = TailSampler(decision_wait=1.0, latency_threshold=0.5, clock=clock)
+
+    rs = resource_spans([span(1), span(2, error=True), span(3, duration_ms=900), span(1)])
+    sampler.process(rs)
+    assert all_spans(rs) == []
+
+    clock.now += 2
+    rs = resource_spans([])
+    sampler.process(rs)
+    released = all_spans(rs)
+    assert sorted(s.trace_id for s in released) == [trace_id(2), trace_id(3)]
+    assert sampler.stats["traces_sampled"] == 2
+    assert sampler.stats["traces_dropped"] == 1
+    assert sampler.stats["spans_dropped"] == 2
+
+    # late spans follow the cached decision
+    rs = resource_spans([span(1), span(2)])
+    sampler.process(rs)
+    assert [s.trace_id for s in all_spans(rs)] == [trace_id(2)]
+
+def test_tail_sampling_attribute_rules():
+    clock = FakeClock()
+    sampler = TailSampler(decision_wait=1.0, attributes={"http.route": "^/checkout"}, clock=clock)
+
+    sampler.process(resource_spans([span(1, **{"http.route": "/checkout/cart"}), span(2, **{"http.route": "/health"})]))
+    clock.now += 2
+    rs = resource_spans([])
+    sampler.process(rs)
+    assert [s.trace_id for s in all_spans(rs)] == [trace_id(1)]
+
+def test_tail_sampling_probabilistic_baseline_is_consistent():
+    a = TailSampler(decision_wait=0, sample_rate=0.5)
+    b = TailSampler(decision_wait=0, sample_rate=0.5)
+    for sampler in (a, b):
+        for n in range(200):
+            sampler.process(resource_spans([Span(trace_id=hashlib.sha256(str(n).encode()).digest()[:16])]))
+    assert a.stats == b.stats
+    assert 0 < a.stats["traces_sampled"] < 200
+
+def test_tail_sampling_memory_is_bounded():
+    clock = FakeClock()
+    sampler = TailSampler(decision_wait=60.0, max_traces=100, max_spans=150, keep_errors=False, clock=clock)
+
+    for n in range(10_000):
+        sampler.process(resource_spans([span(n), span(n)]))
+        assert len(sampler._traces) <= 100
+        assert sampler._buffered_spans <= 150
+
+    assert sampler.stats["traces_evicted"] >= 10_000 - 100
+    assert sampler.stats["spans_received"] == 20_000
+
+def test_tail_sampling_memory_is_bounded_with_kept_traces():
+    clock = FakeClock()
+    sampler = TailSampler(decision_wait=60.0, max_traces=100, max_spans=150, keep_errors=True, clock=clock)
+
+    sampler.process(resource_spans([span(0, error=True)]))
+    clock.now += 61
+    sampler.process(resource_spans([]))
+
+    # every trace is kept, and its resource never sends another batch to release it into, nor does any
+    # batch end up empty, they all carry a late span of the first trace
+    for n in range(1, 10_000):
+        batch = [span(n, error=True), span(n, error=True), span(0, error=True)]
+        sampler.process(resource_spans(batch, service=f"s{n}"))
+        assert len(sampler._traces) <= 100
+        assert sampler._buffered_spans <= 150
+        assert sum(len(pending) for pending in sampler._released.values()) <= 150
+
+    assert sampler.stats["traces_sampled"] >= 10_000 - 100
+    assert sampler.stats["spans_evicted"] > 0
+
+def test_tail_sampling_releases_into_matching_resource():
+    clock = FakeClock()
+    sampler = TailSampler(decision_wait=1.0, clock=clock)
+
+    sampler.process(resource_spans([span(1, error=True)], service="a"))
+    sampler.process(resource_spans([span(2, error=True)], service="b"))
+    clock.now += 2
+    sampler.process(resource_spans([span(3)], service="b"))
+    # b's batch still carries its own late span, so it can not take a's
+    other = resource_spans([span(2)], service="b")
+    sampler.process(other)
+    assert [s.trace_id for s in all_spans(other)] == [trace_id(2)]
+
+    same = resource_spans([], service="a")
+    sampler.process(same)
+    assert [s.trace_id for s in all_spans(same)] == [trace_id(1)]
+
+def test_tail_sampling_releases_spans_of_a_quiet_resource():
+    clock = FakeClock()
+    sampler = TailSampler(decision_wait=1.0, clock=clock)
+
+    # a sends one kept trace and goes quiet, b keeps sending new traces
+    sampler.process(resource_spans([span(1, error=True), span(1)], service="a", scope="db"))
+    clock.now += 2
+    carrier = resource_spans([span(2)], service="b", scope="http")
+    sampler.process(carrier)
+
+    assert carrier.resource.attributes == [kv("service.name", "a")]
+    assert [ss.scope.name for ss in carrier.scope_spans] == ["db"]
+    assert [s.trace_id for s in all_spans(carrier)] == [trace_id(1), trace_id(1)]
+    assert sampler.stats["spans_sampled"] == 2
+    assert (sampler._buffered_spans, sampler._released_spans) == (1, 0)
+
+def test_tail_sampling_config():
+    cfg = Config({
+        "enabled": True,
+        "processors_traces": [
+            "/path/to/custom.py",
+            Config.tail_sampling_processor(decision_wait="10s", latency_threshold="500ms", sample_rate=0.1),
+        ],
+    })
+    assert cfg.is_active()
+
+    agent = cfg.build_agent_environment()
+    paths = agent["ROTEL_OTLP_WITH_TRACE_PROCESSOR"].split(",")
+    assert paths[0] == "/path/to/custom.py"
+    assert paths[1].endswith("processors/tail_sampling.py")
+    assert os.path.exists(paths[1])
+
+    config = json.loads(agent["ROTEL_PROCESSOR_TAIL_SAMPLING_CONFIG"])
+    assert config == {
+        "decision_wait": "10s", "latency_threshold": "500ms", "sample_rate": 0.1,
+        "stats_file": counters_path(cfg.options["pid_file"], "tail_sampling"),
+    }
+    sampler = TailSampler.from_config(config)
+    assert sampler.decision_wait == 10.0
+
+    # tail sampling only applies to traces
+    cfg = Config({
+        "enabled": True,
+        "processors_logs": [Config.tail_sampling_processor()],
+    })
+    assert not cfg.is_active()
+
+def test_tail_sampling_counters(tmp_path):
+    opts = dict(enabled=True, pid_file=str(tmp_path / "agent.pid"), processors_traces=[Config.tail_sampling_processor()])
+    client = Client(**opts)
+    agent = Config(opts).build_agent_environment()
+    sampler = TailSampler.from_config(json.loads(agent["ROTEL_PROCESSOR_TAIL_SAMPLING_CONFIG"]))
+    sampler.process(resource_spans([span(1), span(2)]))
+    assert client.processor_counters() == {}
+
+    sampler.write_stats()
+    counters = client.processor_counters()["tail_sampling"]
+    assert counters["spans_received"] == 2
+    assert (counters["traces_pending"], counters["spans_pending"]) == (2, 2)
@@ -0,0 +1,154 @@
+# SPDX-License-Identifier: Apache-2.0
+
+from __future__ import annotations
+
+import pytest
+
+from src.rotel import _otlp, trace
+from tests.utils_server import MockServer, mock_server  # noqa: F401
+
+
+trace_service_pb2 = pytest.importorskip("opentelemetry.proto.collector.trace.v1.trace_service_pb2")
+
+
+def decode(body: bytes):
+    req = trace_service_pb2.ExportTraceServiceRequest()
+    req.ParseFromString(body)
+    return req
+
+def encoded(spans: list[trace.Span]) -> dict:
+    req = decode(trace._exporter.encode(spans))
+    return {s.name: s for ss in req.resource_spans[0].scope_spans for s in ss.spans}
+
+@pytest.fixture
+def finished(monkeypatch):
+    spans = []
+    monkeypatch.setattr(trace._exporter, "finish", spans.append)
+    return spans
+
+def test_trace_nesting(finished):
+    tracer = trace.get_tracer("test.trace", "1.0")
+    assert trace.get_tracer("test.trace", "1.0") is tracer
+
+    with tracer.start_span("outer", {"route": "/a"}, kind=trace.SERVER) as outer:
+        assert trace.current_span() is outer
+        with tracer.start_span("inner") as inner:
+            inner.set_attribute("rows", 3)
+            inner.add_event("cache.miss", {"key": "k"})
+        assert trace.current_span() is outer
+    assert trace.current_span() is None
+
+    spans = encoded(finished)
+    assert spans["inner"].trace_id == spans["outer"].trace_id
+    assert spans["inner"].parent_span_id == spans["outer"].span_id
+    assert spans["outer"].parent_span_id == b""
+    assert spans["outer"].kind == trace.SERVER
+    assert spans["outer"].flags == trace.FLAG_SAMPLED
+    assert {kv.key: kv.value.int_value for kv in spans["inner"].attributes} == {"rows": 3}
+    assert spans["inner"].events[0].name == "cache.miss"
+    assert spans["outer"].start_time_unix_nano <= spans["inner"].start_time_unix_nano
+    assert spans["inner"].end_time_unix_nano <= spans["outer"].end_time_unix_nano
+
+def test_trace_exception_sets_error(finished):
+    tracer = trace.get_tracer("test.trace")
+    with pytest.raises(ValueError):
+        with tracer.start_span("fails"):
+            raise ValueError("bad input")
+
+    span = encoded(finished)["fails"]
+    assert span.status.code == _otlp.STATUS_ERROR
+    assert span.status.message == "ValueError: bad input"
+    event = span.events[0]
+    assert event.name == "exception"
+    assert {kv.key: kv.value.string_value for kv in event.attributes}["exception.type"] == "ValueError"
+
+def test_trace_nests_under_sdk_spans(finished):
+    sdk_trace = pytest.importorskip("opentelemetry.sdk.trace")
+    sdk_tracer = sdk_trace.TracerProvider().get_tracer("sdk")
+    tracer = trace.get_tracer("test.trace")
+
+    with sdk_tracer.start_as_current_span("sdk.outer") as sdk_outer:
+        with tracer.start_span("rotel.outer") as outer:
+            with sdk_tracer.start_as_current_span("sdk.inner") as sdk_inner:
+                with tracer.start_span("rotel.inner") as inner:
+                    pass
+            # the SDK span ended, back to the rotel parent
+            with tracer.start_span("rotel.sibling") as sibling:
+                pass
+
+    outer_ctx = sdk_outer.get_span_context()
+    assert outer.trace_id == outer_ctx.trace_id
+    assert outer.parent_id == outer_ctx.span_id
+    assert inner.trace_id == outer_ctx.trace_id
+    assert inner.parent_id == sdk_inner.get_span_context().span_id
+    assert sibling.parent_id == outer.span_id
+
+def test_trace_w3c_context(finished):
+    tracer = trace.get_tracer("test.trace")
+    parent = trace.extract({
+        "traceparent": "00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331-01",
+        "tracestate": "vendor=value",
+    })
+    assert parent == trace.SpanContext(0x0af7651916cd43dd8448eb211c80319c, 0xb7ad6b7169203331, 1, "vendor=value")
+
+    with tracer.start_span("handler", parent=parent, kind=trace.SERVER):
+        headers = {}
+        trace.inject(headers)
+    span = finished[0]
+    assert headers["traceparent"] == f"00-0af7651916cd43dd8448eb211c80319c-{span.span_id:016x}-01"
+    assert headers["tracestate"] == "vendor=value"
+
+    assert trace.extract({}) is None
+    assert trace.parse_traceparent("00-00000000000000000000000000000000-b7ad6b7169203331-01") is None
+    assert trace.parse_traceparent("00-0af7651916cd43dd8448eb211c80319c-b7ad6b7169203331") is None
+
+def test_trace_unsampled_spans_are_not_exported():
+    tracer = trace.get_tracer("test.trace")
+    queued = len(trace._exporter._queue)
+    parent = trace.SpanContext(1, 2, flags=0)
+    with tracer.start_span("dropped", parent=parent) as span:
+        assert not span.is_recording
+        with tracer.start_span("child") as child:
+            assert child.trace_id == 1
+    assert len(trace._exporter._queue) == queued
+    # both spans went back to the pool
+    assert trace._pool[-2:] == [child, span]
+    assert tracer.start_span("reused") is span
+
+def test_trace_export(mock_server, monkeypatch):  # noqa: F811
+    host, port = mock_server.address()
+    monkeypatch.setattr(trace._exporter, "_conn", _otlp.AgentConnection(f"{host}:{port}"))
+    monkeypatch.setattr(trace._exporter, "resource", {"service.name": "checkout"})
+    tracer = trace.get_tracer("test.export")
+    for i in range(3):
+        with tracer.start_span("op", {"i": i}):
+            pass
+    trace.flush()
+
+    request = MockServer.tracker.get_requests()[-1]
+    assert request.path == _otlp.TRACES_PATH
+    req = decode(request.body)
+    resource = {kv.key: kv.value.string_value for kv in req.resource_spans[0].resource.attributes}
+    assert resource["service.name"] == "checkout"
+    scope_spans = req.resource_spans[0].scope_spans[0]
+    assert scope_spans.scope.name == "test.export"
+    assert [s.attributes[0].value.int_value for s in scope_spans.spans] == [0, 1, 2]
+    assert trace.stats()["spans_sent"] == 3
+
+def test_trace_export_splits_by_size(mock_server, monkeypatch):  # noqa: F811
+    MockServer.reset_count()
+    host, port = mock_server.address()
+    monkeypatch.setattr(trace._exporter, "_conn", _otlp.AgentConnection(f"{host}:{port}"))
+    monkeypatch.setattr(trace._exporter, "max_batch_bytes", 4096)
+    monkeypatch.setattr(trace._exporter, "stats", dict.fromkeys(trace._exporter.stats, 0))
+    tracer = trace.get_tracer("test.split")
+    for size in (1000, 1000, 1000, 1000, 10_000):
+        with tracer.start_span("op", {"payload": "x" * size}):
+            pass
+    trace.flush()
+
+    bodies = [r.body for r in MockServer.tracker.get_requests()]
+    assert [len(decode(body).resource_spans[0].scope_spans[0].spans) for body in bodies] == [3, 1]
+    assert all(len(body) <= 4096 for body in bodies)
+    stats = trace.stats()
+    assert (stats["spans_sent"], stats["batch_splits"], stats["spans_oversize"]) == (4, 1, 1)
@@ -0,0 +1,84 @@
+# SPDX-License-Identifier: Apache-2.0
+
+from __future__ import annotations
+
+import gzip
+import http.client
+import time
+
+import pytest
+
+from src.rotel import tune
+
+
+def trial(**result) -> dict:
+    return {
+        "batch_max_size": 512, "batch_timeout": "200ms", "compression": "gzip", "items": 100, "complete": True,
+        "throughput": 1000.0, "latency_p50_ms": 5.0, "latency_p99_ms": 10.0, "cpu_us_per_item": 20.0,
+        **result,
+    }
+
+def test_tune_workload(tmp_path):
+    trace_service_pb2 = pytest.importorskip("opentelemetry.proto.collector.trace.v1.trace_service_pb2")
+    bodies = tune.synthetic_workload(batches=3, spans_per_batch=4)
+    path = str(tmp_path / "workload.bin")
+    tune.write_workload(path, bodies)
+    assert tune.read_workload(path) == bodies
+
+    body = bytearray(bodies[1])
+    offsets = tune.span_start_offsets(body)
+    assert len(offsets) == 4
+    for i, offset in enumerate(offsets):
+        tune._FIXED64.pack_into(body, offset, i + 1)
+    request = trace_service_pb2.ExportTraceServiceRequest.FromString(bytes(body))
+    assert [s.start_time_unix_nano for s in request.resource_spans[0].scope_spans[0].spans] == [1, 2, 3, 4]
+
+    # sent spans keep their duration, the end never precedes the start
+    body = bytearray(bodies[2])
+    tune.stamp_spans(body, tune.span_time_offsets(body), 10**19)
+    spans = trace_service_pb2.ExportTraceServiceRequest.FromString(bytes(body)).resource_spans[0].scope_spans[0].spans
+    assert [s.start_time_unix_nano for s in spans] == [10**19] * 4
+    assert [s.end_time_unix_nano for s in spans] == [10**19 + 1_500_000] * 4
+
+def test_tune_stand_in():
+    stand_in = tune.StandIn()
+    body = bytearray(tune.synthetic_workload(batches=1, spans_per_batch=5)[0])
+    sent = time.time_ns()
+    for offset in tune.span_start_offsets(body):
+        tune._FIXED64.pack_into(body, offset, sent)
+    compressed = gzip.compress(bytes(body))
+
+    host, _, port = stand_in.endpoint.removeprefix("http://").rpartition(":")
+    conn = http.client.HTTPConnection(host, int(port))
+    conn.request("POST", "/v1/traces", compressed, {"Content-Encoding": "gzip"})
+    assert conn.getresponse().status == 200
+    conn.close()
+    stand_in.close()
+
+    assert stand_in.requests == 1
+    assert stand_in.bytes == len(compressed)
+    assert len(stand_in.latencies) == 5
+    assert all(0 <= latency < 5e9 for latency in stand_in.latencies)
+
+def test_tune_recommend():
+    fast = trial(batch_max_size=8192, throughput=5000.0, latency_p99_ms=80.0)
+    quick = trial(batch_max_size=2048, throughput=4900.0, latency_p99_ms=20.0)
+    lean = trial(compression="none", throughput=3000.0, latency_p99_ms=15.0, cpu_us_per_item=5.0)
+    worse = trial(throughput=2000.0, latency_p99_ms=30.0, cpu_us_per_item=30.0)
+    incomplete = trial(complete=False, throughput=9000.0, latency_p99_ms=1.0)
+    trials = [fast, quick, lean, worse, incomplete]
+
+    assert tune.pareto(trials) == [fast, quick, lean]
+    assert tune.recommend(trials) is quick
+    assert tune.recommend(trials, "throughput") is fast
+    assert tune.recommend(trials, "latency") is lean
+    assert tune.recommend(trials, "cpu") is lean
+    assert tune.recommend([incomplete]) is None
+
+    options = tune.recommended_options(quick, endpoint="https://collector:4317")
+    assert options == {
+        "batch_max_size": 2048,
+        "batch_timeout": "200ms",
+        "exporter": {"_type": "otlp", "endpoint": "https://collector:4317", "compression": "gzip"},
+    }
+    assert "endpoint" not in tune.recommended_options(quick)["exporter"]
@@ -0,0 +1,195 @@
+# SPDX-License-Identifier: Apache-2.0
+
+from __future__ import annotations
+
+import json
+
+import pytest
+
+from src.rotel.client import Client
+from src.rotel.config import Config
+from src.rotel.processors.volume import Encoder, VolumeTap
+from src.rotel.volume import stats_prefix
+from tests.utils_clock import FakeClock
+from tests.utils_sdk import (
+    AnyValue,
+    Histogram,
+    HistogramDataPoint,
+    Metric,
+    NumberDataPoint,
+    Span,
+    Status,
+    Sum,
+    kv,
+    log,
+    resource_logs,
+    resource_metrics,
+    resource_spans,
+)
+
+
+def spans(n: int, service: str = "svc", url: str = "https://example.com/") -> object:
+    return resource_spans([
+        Span(
+            bytes([i + 1]) * 16,
+            span_id=bytes([i + 1]) * 8,
+            name="GET /",
+            start_time_unix_nano=1_700_000_000_000_000_000 + i,
+            end_time_unix_nano=1_700_000_000_000_500_000 + i,
+            attributes=[kv("http.url", url + "x" * 200), kv("http.status_code", 200), kv("cached", False)],
+            status=Status(2, "failed"),
+        )
+        for i in range(n)
+    ], service=service)
+
+def test_volume_encoding_matches_otlp():
+    trace_pb2 = pytest.importorskip("opentelemetry.proto.trace.v1.trace_pb2")
+    metrics_pb2 = pytest.importorskip("opentelemetry.proto.metrics.v1.metrics_pb2")
+    logs_pb2 = pytest.importorskip("opentelemetry.proto.logs.v1.logs_pb2")
+    encoder = Encoder()
+
+    rs = trace_pb2.ResourceSpans()
+    rs.ParseFromString(bytes(encoder.resource_spans(spans(2))))
+    span = rs.scope_spans[0].spans[1]
+    assert span.trace_id == b"\x02" * 16
+    assert span.attributes[0].value.string_value.startswith("https://example.com/")
+    assert span.attributes[1].value.int_value == 200
+    assert span.status.code == 2 and span.status.message == "failed"
+    assert rs.resource.attributes[0].value.string_value == "svc"
+    assert rs.ByteSize() == len(encoder.resource_spans(spans(2)))
+
+    batch = resource_metrics([
+        Metric("requests", Sum([NumberDataPoint([kv("route", "/")], 1, 2, 7)])),
+        Metric("latency", Histogram([
+            HistogramDataPoint([kv("route", "/")], 1, 2, count=3, sum=1.5,
+                               bucket_counts=[1, 2, 0], explicit_bounds=[0.5, 1.0], max=0.9),
+        ])),
+    ])
+    rm = metrics_pb2.ResourceMetrics()
+    rm.ParseFromString(bytes(encoder.resource_metrics(batch)))
+    requests, latency = rm.scope_metrics[0].metrics
+    assert requests.sum.data_points[0].as_int == 7
+    assert requests.sum.is_monotonic and requests.sum.aggregation_temporality == 2
+    assert list(latency.histogram.data_points[0].bucket_counts) == [1, 2, 0]
+    assert list(latency.histogram.data_points[0].explicit_bounds) == [0.5, 1.0]
+    assert latency.histogram.data_points[0].max == 0.9
+
+    rl = logs_pb2.ResourceLogs()
+    rl.ParseFromString(bytes(encoder.resource_logs(resource_logs([log("hello", user="bob")]))))
+    record = rl.scope_logs[0].log_records[0]
+    assert record.body.string_value == "hello"
+    assert record.severity_number == 9
+    assert record.attributes[0].key == "user"
+
+def test_volume_tap_counts():
+    clock = FakeClock()
+    tap = VolumeTap("traces", window=60, top_keys=2, clock=clock)
+    tap.record(spans(3, service="api"))
+    tap.record(spans(1, service="worker"))
+    clock.now += 10
+
+    report = tap.report()
+    assert report["complete"] is False
+    assert report["batches"] == 2
+    assert report["items"] == 4
+    encoded = len(Encoder().resource_spans(spans(3, service="api")))
+    assert report["resources"]["api"] == {"items": 3, "bytes": encoded}
+    assert report["resources"]["worker"]["items"] == 1
+    assert report["bytes"] == encoded + report["resources"]["worker"]["bytes"]
+    # repeated urls compress well
+    assert 0 < report["compressed_bytes"] < report["bytes"]
+    assert report["items_per_second"] == pytest.approx(0.4)
+
+    top = report["attributes"]
+    assert [(a["location"], a["key"]) for a in top] == [("span", "http.url"), ("span", "http.status_code")]
+    assert top[0]["count"] == 4
+    assert top[0]["share"] > 0.5
+
+def test_volume_tap_window():
+    clock = FakeClock()
+    tap = VolumeTap("logs", window=60, clock=clock)
+    tap.record(resource_logs([log("a"), log("b")]))
+    clock.now += 61
+    tap.record(resource_logs([log("c")]))
+
+    report = tap.report()
+    assert report["complete"] is True
+    assert report["items"] == 2
+    assert report["end"] - report["start"] == 60
+
+    clock.now += 150
+    report = tap.report()
+    assert report["items"] == 1
+    assert report["start"] == 1060.0
+    # idle windows are reported empty
+    clock.now += 60
+    report = tap.report()
+    assert report["items"] == 0
+    assert report["start"] == 1180.0
+
+def test_volume_tap_resource_attribute():
+    tap = VolumeTap("metrics", resource_attribute="host.name")
+    batch = resource_metrics([Metric("up", Sum([NumberDataPoint(value=AnyValue(1.0))]))])
+    batch.resource.attributes.append(kv("host.name", "web-1"))
+    tap.record(batch)
+    report = tap.report()
+    assert list(report["resources"]) == ["web-1"]
+    assert report["items"] == 1
+
+def test_volume_dry_run_config(tmp_path, monkeypatch):
+    monkeypatch.setenv("ROTEL_EXPORTERS", "otlp")
+    monkeypatch.setenv("ROTEL_EXPORTERS_TRACES", "otlp")
+    pid_file = str(tmp_path / "agent.pid")
+    opts = {
+        "enabled": True,
+        "pid_file": pid_file,
+        "processors_logs": [Config.log_dedup_processor()],
+        "processors_metrics": [Config.volume_processor(top_keys=5)],
+        "dry_run": True,
+        "dry_run_window": "5m",
+    }
+    cfg = Config(opts)
+    assert cfg.is_active()
+
+    agent = cfg.build_agent_environment()
+    assert agent["ROTEL_EXPORTER"] == "blackhole"
+    assert "ROTEL_EXPORTERS" not in agent and "ROTEL_EXPORTERS_TRACES" not in agent
+    assert "ROTEL_EXPORTER_OTLP_ENDPOINT" not in agent
+    logs = agent["ROTEL_OTLP_WITH_LOGS_PROCESSOR"].split(",")
+    assert [p.rsplit("/", 1)[-1] for p in logs] == ["log_dedup.py", "volume.py"]
+    # a volume processor in the list is used as is
+    assert agent["ROTEL_OTLP_WITH_METRICS_PROCESSOR"].endswith("volume.py")
+    assert json.loads(agent["ROTEL_PROCESSOR_VOLUME_CONFIG"]) == {
+        "top_keys": 5,
+        "stats_prefix": str(tmp_path / "agent.volume"),
+    }
+
+    opts["processors_metrics"] = None
+    agent = Config(opts).build_agent_environment()
+    assert json.loads(agent["ROTEL_PROCESSOR_VOLUME_CONFIG"])["window"] == "5m"
+
+    assert not Config({"enabled": True, "dry_run": True, "dry_run_window": "soon"}).is_active()
+
+def test_volume_report(tmp_path):
+    pid_file = str(tmp_path / "agent.pid")
+    client = Client(enabled=True, pid_file=pid_file, dry_run=True)
+    assert client.volume_report()["signals"] == {}
+
+    prefix = stats_prefix(pid_file)
+    for signal in ("traces", "logs"):
+        tap = VolumeTap(signal, stats_file=f"{prefix}.{signal}.json")
+        tap.record(spans(2) if signal == "traces" else resource_logs([log("x")]))
+        tap.write_report()
+
+    report = client.volume_report()
+    assert set(report["signals"]) == {"traces", "logs"}
+    assert report["signals"]["traces"]["items"] == 2
+    assert report["totals"]["items"] == 3
+    assert report["totals"]["bytes"] == sum(r["bytes"] for r in report["signals"].values())
+
+def test_volume_option_env(monkeypatch):
+    monkeypatch.setenv("ROTEL_DRY_RUN", "true")
+    monkeypatch.setenv("ROTEL_DRY_RUN_WINDOW", "30s")
+    options = Config().options
+    assert options["dry_run"] is True
+    assert options["dry_run_window"] == "30s"
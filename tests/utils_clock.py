@@ -0,0 +1,17 @@
+# SPDX-License-Identifier: Apache-2.0
+
+from __future__ import annotations
+
+
+class FakeClock:
+    """Clock for the processors and samplers taking a clock callable
+
+    Returns now, after adding step to it on every call."""
+
+    def __init__(self, now: float = 1000.0, step: float = 0):
+        self.now = now
+        self.step = step
+
+    def __call__(self) -> float:
+        self.now += self.step
+        return self.now
@@ -0,0 +1,175 @@
+# SPDX-License-Identifier: Apache-2.0
+
+# Minimal stand-ins for the rotel_sdk types, which are only available inside the
+# agent's embedded interpreter.
+
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Any
+
+
+@dataclass
+class AnyValue:
+    value: Any = None
+
+@dataclass
+class KeyValue:
+    key: str
+    value: AnyValue | None = None
+
+    @staticmethod
+    def new_string_value(key: str, value: str) -> KeyValue:
+        return KeyValue(key, AnyValue(value))
+
+    @staticmethod
+    def new_bool_value(key: str, value: bool) -> KeyValue:
+        return KeyValue(key, AnyValue(value))
+
+    @staticmethod
+    def new_int_value(key: str, value: int) -> KeyValue:
+        return KeyValue(key, AnyValue(value))
+
+    @staticmethod
+    def new_double_value(key: str, value: float) -> KeyValue:
+        return KeyValue(key, AnyValue(value))
+
+@dataclass
+class InstrumentationScope:
+    name: str = ""
+    version: str = ""
+    attributes: list[KeyValue] = field(default_factory=list)
+
+@dataclass
+class Resource:
+    attributes: list[KeyValue] = field(default_factory=list)
+
+@dataclass
+class Status:
+    code: int = 0
+    message: str = ""
+
+@dataclass
+class Span:
+    trace_id: bytes
+    span_id: bytes = b"\x00" * 8
+    name: str = "span"
+    kind: int = 1
+    start_time_unix_nano: int = 0
+    end_time_unix_nano: int = 0
+    attributes: list[KeyValue] = field(default_factory=list)
+    status: Status | None = None
+
+@dataclass
+class ScopeSpans:
+    scope: InstrumentationScope | None = None
+    spans: list[Span] = field(default_factory=list)
+
+@dataclass
+class ResourceSpans:
+    resource: Resource | None = None
+    scope_spans: list[ScopeSpans] = field(default_factory=list)
+
+
+def kv(key: str, value: Any) -> KeyValue:
+    return KeyValue(key, AnyValue(value))
+
+def resource_spans(spans: list[Span], service: str = "svc", scope: str = "test") -> ResourceSpans:
+    return ResourceSpans(
+        resource=Resource([kv("service.name", service)]),
+        scope_spans=[ScopeSpans(InstrumentationScope(scope), spans)],
+    )
+
+def all_spans(rs: ResourceSpans) -> list[Span]:
+    return [span for ss in rs.scope_spans for span in ss.spans]
+
+@dataclass
+class NumberDataPoint:
+    attributes: list[KeyValue] = field(default_factory=list)
+    start_time_unix_nano: int = 0
+    time_unix_nano: int = 0
+    value: float = 0
+
+@dataclass
+class HistogramDataPoint:
+    attributes: list[KeyValue] = field(default_factory=list)
+    start_time_unix_nano: int = 0
+    time_unix_nano: int = 0
+    count: int = 0
+    sum: float | None = None
+    bucket_counts: list[int] = field(default_factory=list)
+    explicit_bounds: list[float] = field(default_factory=list)
+    min: float | None = None
+    max: float | None = None
+
+@dataclass
+class Gauge:
+    data_points: list[NumberDataPoint] = field(default_factory=list)
+
+@dataclass
+class Sum:
+    data_points: list[NumberDataPoint] = field(default_factory=list)
+    aggregation_temporality: int = 2
+    is_monotonic: bool = True
+
+@dataclass
+class Histogram:
+    data_points: list[HistogramDataPoint] = field(default_factory=list)
+    aggregation_temporality: int = 2
+
+@dataclass
+class Metric:
+    name: str
+    data: Any = None
+    description: str = ""
+    unit: str = ""
+
+@dataclass
+class ScopeMetrics:
+    scope: InstrumentationScope | None = None
+    metrics: list[Metric] = field(default_factory=list)
+
+@dataclass
+class ResourceMetrics:
+    resource: Resource | None = None
+    scope_metrics: list[ScopeMetrics] = field(default_factory=list)
+
+
+def resource_metrics(metrics: list[Metric], service: str = "svc") -> ResourceMetrics:
+    return ResourceMetrics(
+        resource=Resource([kv("service.name", service)]),
+        scope_metrics=[ScopeMetrics(InstrumentationScope("test"), metrics)],
+    )
+
+@dataclass
+class LogRecord:
+    body: AnyValue | None = None
+    severity_number: int = 0
+    severity_text: str = ""
+    time_unix_nano: int = 0
+    attributes: list[KeyValue] = field(default_factory=list)
+    trace_id: bytes = b""
+    span_id: bytes = b""
+
+@dataclass
+class ScopeLogs:
+    scope: InstrumentationScope | None = None
+    log_records: list[LogRecord] = field(default_factory=list)
+
+@dataclass
+class ResourceLogs:
+    resource: Resource | None = None
+    scope_logs: list[ScopeLogs] = field(default_factory=list)
+
+
+def log(body: str, severity: int = 9, **attrs) -> LogRecord:
+    return LogRecord(AnyValue(body), severity, attributes=[kv(k, v) for k, v in attrs.items()])
+
+def resource_logs(records: list[LogRecord], service: str = "svc") -> ResourceLogs:
+    return ResourceLogs(
+        resource=Resource([kv("service.name", service)]),
+        scope_logs=[ScopeLogs(InstrumentationScope("test"), records)],
+    )
+
+def all_records(rl: ResourceLogs) -> list[LogRecord]:
+    return [record for sl in rl.scope_logs for record in sl.log_records]
@@ -12,10 +12,12 @@ import pytest
 class Request:
     path: str
     headers: Message
+    body: bytes
 
-    def __init__(self, path: str, headers : Message):
+    def __init__(self, path: str, headers : Message, body: bytes = b""):
         self.path = path
         self.headers = headers
+        self.body = body
 
 class RequestTracker:
     _requests: list[Request]
@@ -43,8 +45,9 @@ class MockServer(BaseHTTPRequestHandler):
         cls.tracker.reset()
 
     def do_POST(self):
-        if self.path == '/v1/traces':
-            req = Request(self.path, self.headers)
+        if self.path in ('/v1/traces', '/v1/metrics', '/v1/logs'):
+            body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            req = Request(self.path, self.headers, body)
             self.tracker.add(req)
             self.send_response(200)
         elif self.path == '/api/v0.2/traces': # datadog